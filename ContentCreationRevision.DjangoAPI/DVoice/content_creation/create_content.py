@@ -9,12 +9,15 @@ from utilities.openai_utils.process_prompt import _get_prompt_sections
 from DVoice.prompt.prompt_actions import rewrite_query_core_action
 from DVoice.utilities.llm_and_embeddings_utils import answer_query_from_retrieval_results
 from collections import defaultdict
-from typing import Dict, List, Any
+from utilities.instrumentation import record_span
+from django.conf import settings
+from typing import Dict, List, Any, Optional, Callable
 
 def generate_dvoice_response_no_context(TOKEN,
                                         query: str,
                                         branding_requirements_message: str,
-                                        target_language: str) -> str:
+                                        target_language: str,
+                                        on_paragraph: Optional[Callable[[str], None]] = None) -> str:
     """
     Generates a response to a query without context, based on branding requirements and the target language.
  
@@ -23,6 +26,9 @@ def generate_dvoice_response_no_context(TOKEN,
         query (str): The query for which the response needs to be generated.
         branding_requirements_message (str): The branding guidelines that the content should adhere to.
         target_language (str): The target language for the response (e.g., "EN" for English, "FR" for French).
+        on_paragraph (Optional[Callable[[str], None]]): Streams the generation and is called with each paragraph as
+                                                        soon as it is generated (ie `IncrementalReviser.add_paragraph`).
+                                                        Defaults to None.
     
     Returns:
         response (str): The generated response content in the target language.
@@ -45,7 +51,8 @@ def generate_dvoice_response_no_context(TOKEN,
                                                      query, 
                                                      client, 
                                                      AZURE_OPENAI_MODEL_NAME,
-                                                     response_format=None)
+                                                     response_format=None,
+                                                     on_paragraph=on_paragraph)
         response = response[0].choices[0].message.content
     except Exception as e:
         # Log the initial error and attempt a second call
@@ -56,7 +63,8 @@ def generate_dvoice_response_no_context(TOKEN,
                                                          query, 
                                                          client, 
                                                          AZURE_OPENAI_MODEL_NAME,
-                                                         response_format=None)
+                                                         response_format=None,
+                                                         on_paragraph=on_paragraph)
             response = response[0].choices[0].message.content
         except Exception as e:
             # Log the failure and return a message indicating failure
@@ -66,13 +74,37 @@ def generate_dvoice_response_no_context(TOKEN,
 
     return response
 
+def _store_missing_documents(chroma_db,
+                             embedding_client,
+                             lists_of_chunks: Dict[str, List[Dict[str, Any]]],
+                             doc_hashes: Dict[str, str]) -> int:
+    """
+    Embeds and stores the files not in the vector db yet, without evicting the other files of the job.
+
+    Returns:
+        int: The number of files embedded.
+    """
+    from utilities.vector_index import chunk_columns
+    stored_doc_hashes = chroma_db.stored_documents(doc_hashes.values())
+    data_to_embed = defaultdict(list, {title: chunks for title, chunks in lists_of_chunks.items()
+                                       if doc_hashes[title] not in stored_doc_hashes})
+    if data_to_embed:
+        # Generate embeddings for the files not stored yet
+        data_to_embed = generate_embeddings_for_list_of_chunks(embedding_client,
+                                                               data_to_embed)
+        # Collect the chunks in columns once (their embeddings in one float32 array) and bulk insert them in the vector db
+        chroma_db.add_chunks(chunk_columns(data_to_embed, doc_hashes), keep_documents=doc_hashes.values())
+    return len(data_to_embed)
+
+
 def conduct_retrieval_based_content_generation(TOKEN,
                                                concatenated_data: Dict[str, List[Any]],
                                                necessary_input_files: List[str],
                                                query_new: str,
                                                branding_requirements_message: str,
                                                language_of_output: Dict[str, str],
-                                               chroma_db) -> str:
+                                               chroma_db,
+                                               on_paragraph: Optional[Callable[[str], None]] = None) -> str:
     """
     Conducts retrieval-based content generation by querying relevant documents, generating embeddings, and 
     creating content based on the retrieved sections, customized according to branding requirements.
@@ -85,7 +117,10 @@ def conduct_retrieval_based_content_generation(TOKEN,
         query_new (str): The new query for which the content needs to be generated.
         branding_requirements_message (str): The branding guidelines to apply when generating content.
         language_of_output (dict): A dictionary specifying the target language of the output content (e.g., {"language": ["EN"]}).
-        chroma_db: A ChromaDB instance used to store and retrieve document embeddings.
+        chroma_db: A ChromaDB instance used to store and retrieve document embeddings (utilities/chromadb.py), the
+                   files it already stores are not embedded again.
+        on_paragraph (Optional[Callable[[str], None]]): Streams the answer and is called with each paragraph as soon
+                                                        as it is generated. Defaults to None.
  
     Returns:
         Generated Content (str): The generated content based on the query and retrieved document sections.
@@ -97,41 +132,33 @@ def conduct_retrieval_based_content_generation(TOKEN,
     - chromadb==0.4.18
 
     """
-    import pandas as pd
+    from utilities.vector_index import document_hash
+    from utilities.hybrid_retrieval import hybrid_retrieve
     # Filter the concatenated data to only include necessary files
     filtered_concatenated_data = defaultdict(list, {k: concatenated_data[k] for k 
                                                     in necessary_input_files if k in concatenated_data})
-
+    # Identify each file by the hash of its chunks, the files already stored in the vector db are not embedded again
+    doc_hashes = {title: document_hash(chunks) for title, chunks in filtered_concatenated_data.items()}
     # Instantiate the embedding client using the provided authentication token
     embedding_client = instantiate_azure_openai_embedding_client(TOKEN)
-    # Generate embeddings for the filtered concatenated data
-    filtered_concatenated_data = generate_embeddings_for_list_of_chunks(embedding_client,
-                                                                        filtered_concatenated_data)
-    # Convert the filtered data into a pandas DataFrame (ChromaDB expects this format)                      
-    df = pd.DataFrame()
-    for key, list_of_dicts in filtered_concatenated_data.items():
-        for record in list_of_dicts:
-            df = df._append(record, ignore_index=True)
-    ## df output is like below:
-    ## >>> df.columns Index(['title', 'id', 'text', 'n_tokens', 'embedding'], dtype='object')
-    ##                                         title  ...                                          embedding
-    # 0   Oil and Gas_Spotlight article_ENs v1.docx  ...  [-0.004101620055735111, 0.006374916061758995, ...
-    # 1  Economic outlook_FY25_Q1_EN_V2_EDR3 v3.pdf  ...  [0.02570480853319168, 0.023818789049983025, 0....
-    # 2  Economic outlook_FY25_Q1_EN_V2_EDR3 v3.pdf  ...  [-0.002787482226267457, 0.011028803884983063, ...
-    # 3  Economic outlook_FY25_Q1_EN_V2_EDR3 v3.pdf  ...  [-0.023517558351159096, 0.013963138684630394, ...
-    # 4  Economic outlook_FY25_Q1_EN_V2_EDR3 v3.pdf  ...  [0.040555957704782486, -0.010706204921007156, ...
-    # 5  Economic outlook_FY25_Q1_EN_V2_EDR3 v3.pdf  ...  [-0.014108720235526562, 0.028466932475566864, ...
-    # 6  Economic outlook_FY25_Q1_EN_V2_EDR3 v3.pdf  ...  [0.033635213971138, -0.007610759232193232, 0.0...
-    # 7  Economic outlook_FY25_Q1_EN_V2_EDR3 v3.pdf  ...  [-0.0050654630176723, 2.2156358681968413e-05, ...
-    
-    # Add the DataFrame to the ChromaDB for document retrieval
-    chroma_db.add_document(df)
+    embedded_files = _store_missing_documents(chroma_db, embedding_client, filtered_concatenated_data, doc_hashes)
+    record_span("retrieve.vector_store_reuse", 0.0, "Files of the retrieval found in the vector db of the user",
+                reused_files=len(filtered_concatenated_data) - embedded_files, embedded_files=embedded_files)
     # Rewrite the query for core action (possibly applying additional transformations or checks)
     core_query = rewrite_query_core_action(TOKEN, query_new)
     # Generate the embedding for the query
     query_embedding = generate_embeddings(embedding_client, core_query)
-    # Retrieve the most relevant documents based on the query embedding
-    retrieval_results = chroma_db.get_docs(query_embedding) ## get closest docs retrieval
+    # Another job of the user may have evicted a reused file of the persistent collection meanwhile: check again and
+    # query under the collection lock, only the files evicted are embedded again (an in memory collection is the job's own)
+    with chroma_db.lock:
+        if chroma_db.persistent:
+            _store_missing_documents(chroma_db, embedding_client, filtered_concatenated_data, doc_hashes)
+        # Retrieve the most relevant documents based on the query embedding
+        if settings.HYBRID_RETRIEVAL_ENABLED:
+            # Fuse the closest sections with the BM25 ranking of the chunks of the files, then keep fewer, diverse sections within a token budget
+            retrieval_results = hybrid_retrieve(core_query, query_embedding, filtered_concatenated_data, chroma_db, list(doc_hashes.values()))
+        else:
+            retrieval_results = chroma_db.get_docs(query_embedding, list(doc_hashes.values())) ## get closest docs retrieval, among the files of this job only
     
     # Get the sections of the retrieved documents to be used in the prompt
     chosen_sections, titles, context_sections =_get_prompt_sections(retrieval_results, SELECTED_MODEL)
@@ -140,9 +167,10 @@ def conduct_retrieval_based_content_generation(TOKEN,
                                                             chosen_sections,
                                                             branding_requirements_message,
                                                             language_of_output["language"][0], 
-                                                            TOKEN)
-    chroma_db.delete_collection()
-    # Delete the collection from the ChromaDB (cleanup after retrieval)
-    print("deleted collection for vector db chroma dab")
+                                                            TOKEN,
+                                                            on_paragraph)
+    # Release the ChromaDB: an in memory collection is deleted, the persistent collection of the user is kept
+    chroma_db.release()
+    print("released the vector db chroma db")
     return generated_content
             
\ No newline at end of file
@@ -1,6 +1,7 @@
 import concurrent.futures
 from utilities.openai_utils.process_prompt import answer_query_with_summarization
 from DVoice.utilities.settings import SELECTED_MODEL
+from utilities.instrumentation import with_current_context
 from typing import Dict, Any, List
 
 
@@ -33,7 +34,7 @@ def create_doc_summary(concatenated_data: Dict[str, Any],
     ## summarization at chunk level -  distilled content
     with concurrent.futures.ThreadPoolExecutor() as executor:
         # Prepare the futures
-        futures = {executor.submit(answer_query_with_summarization, data, query, SELECTED_MODEL,
+        futures = {executor.submit(with_current_context(answer_query_with_summarization), data, query, SELECTED_MODEL,
                                    summarization_at_chunk_level=hard_compression): \
                                    title for title, data in concatenated_data.items()}
         # Process the completed futures
@@ -0,0 +1,169 @@
+import time
+import asyncio
+import logging
+import threading
+from concurrent.futures import Executor, Future
+
+from DVoice.utilities.settings import CHUNK_SIZE, AZURE_OPENAI_MODEL
+from DVoice.utilities.llm_and_embeddings_utils import count_tokens, ParagraphAssembler
+from DVoice.utilities.chunking import chunk_classification
+from DVoice.content_revision.revision import apply_guideline_revisions_to_docs, reconstruct_revised_chunks_into_file
+from utilities.instrumentation import stage, record_span, with_current_context
+
+from typing import Callable, List, Optional
+
+## LOGGING CAPABILITIES
+
+logger = logging.getLogger(__name__)
+
+
+def _is_table(paragraph: str) -> bool:
+    """
+    Same rule as `chunk_into_cohesive_paragraphs`: a block starting or ending with a bar and having 4+ bars.
+    """
+    return ("|" in paragraph[0:4] or "|" in paragraph[-4:]) and paragraph.count("|") >= 4
+
+
+def split_into_paragraphs(content: str) -> List[str]:
+    """
+    Splits a complete text into the paragraphs a `ParagraphAssembler` would have emitted while streaming it.
+    """
+    paragraphs = []
+    assembler = ParagraphAssembler(paragraphs.append)
+    assembler.feed(content)
+    assembler.close()
+    return paragraphs
+
+
+class IncrementalReviser:
+    """
+    Revises generated content while it is still being generated.
+
+    The paragraphs of a streamed completion (see `ParagraphAssembler`) are grouped into chunks of about
+    CHUNK_SIZE tokens, with the rules of the cohesive chunking (tables in their own chunk, a heading stays with the
+    paragraph that follows it), and each chunk is classified and revised as per the Content guidelines on the
+    executor as soon as it is complete. The first chunks are revised while the end of the output is generated,
+    instead of waiting for the whole output before chunking, classifying and revising it.
+
+    With `target_language`, each chunk is first translated into the other official language, the translation of
+    the generated content then also starts with its first paragraphs.
+
+    Example:
+        ```python
+        reviser = IncrementalReviser(TOKEN, "output.docx", executor)
+        content = generate_dvoice_response_no_context(TOKEN, query, branding, "EN", on_paragraph=reviser.add_paragraph)
+        revised_content = reviser.result(content)
+        ```
+    """
+    def __init__(self,
+                 TOKEN,
+                 source: str,
+                 executor: Executor,
+                 target_language: Optional[str] = None,
+                 progress_callback: Optional[Callable[[int, int], None]] = None) -> None:
+        """
+        Args:
+            TOKEN (Azure Access Token): The token used for the LLM calls.
+            source (str): The name of the output file, the source of the chunks.
+            executor (Executor): The executor the chunks are revised on, shared by the revisers of a job.
+            target_language (Optional[str]): "EN" or "FR" to translate each chunk before revising it. Defaults to None.
+            progress_callback (Optional[Callable[[int, int], None]]): Called with (revised chunks, chunks so far) each
+                                                                      time a chunk is revised. Defaults to None.
+        """
+        self.token = TOKEN
+        self.source = source
+        self.target_language = target_language
+        self.progress_callback = progress_callback
+        self._executor = executor
+        self._lock = threading.Lock()
+        self._received: List[str] = [] # every paragraph received, to check them against the final content
+        self._pending: List[str] = [] # paragraphs of the chunk being filled
+        self._pending_tokens = 0
+        self._futures: List[Future] = []
+        self._revised_count = 0
+
+    def add_paragraph(self, paragraph: str) -> None:
+        """
+        Adds a generated paragraph, the chunk it completes is submitted for revision. Does not block.
+        """
+        self._received.append(paragraph)
+        if _is_table(paragraph):
+            self._submit_pending()
+            self._submit([paragraph])
+            return
+        self._pending.append(paragraph)
+        self._pending_tokens += count_tokens(paragraph, 0, AZURE_OPENAI_MODEL)[0]
+        if self._pending_tokens >= CHUNK_SIZE and not paragraph.lstrip().startswith("#"):
+            self._submit_pending()
+
+    def _submit_pending(self) -> None:
+        if self._pending:
+            self._submit(self._pending)
+        self._pending, self._pending_tokens = [], 0
+
+    def _submit(self, paragraphs: List[str]) -> None:
+        self._futures.append(self._executor.submit(with_current_context(self._revise_chunk), "\n\n".join(paragraphs)))
+
+    def _revise_chunk(self, chunk: str) -> str:
+        """
+        Translates (if asked), classifies and revises one chunk, returns its revised text.
+        """
+        if self.target_language:
+            from DVoice.prompt.prompt_actions import translate_identical_alternative_language
+            chunk = translate_identical_alternative_language(self.token, chunk, self.target_language)
+        with stage("classify"):
+            file_chunks_classification_repo = chunk_classification({self.source: [chunk]}, self.token)
+        with stage("revise"):
+            revised_document_chunks = asyncio.run(apply_guideline_revisions_to_docs(file_chunks_classification_repo,
+                                                                                    "",    # no additional instructions to the application of the revision guideline
+                                                                                    False, # no additional style modification
+                                                                                    self.token))
+            revised_chunk = reconstruct_revised_chunks_into_file(revised_document_chunks).get(self.source, "")
+        with self._lock:
+            self._revised_count += 1
+            revised_count, chunk_count = self._revised_count, len(self._futures)
+        if self.progress_callback:
+            self.progress_callback(revised_count, chunk_count)
+        return revised_chunk
+
+    def result(self, content: str) -> str:
+        """
+        Submits the last chunk and waits for every chunk to be revised.
+
+        Args:
+            content (str): The complete generated content. When the paragraphs received do not add up to it (ie
+                           the generation failed midway and was retried, so the first attempt's paragraphs were
+                           received too), the chunks already submitted are dropped and the content is revised again
+                           from its paragraphs.
+
+        Returns:
+            revised_content (str): The revised content, chunks in generation order.
+        """
+        start_time = time.time()
+        paragraphs = split_into_paragraphs(content)
+        if paragraphs != self._received:
+            logger.info(f"Streamed paragraphs of {self.source} do not match the final content "
+                        f"({len(self._received)} received, {len(paragraphs)} in the content), revising it again")
+            for future in self._futures:
+                future.cancel()
+            self._received, self._pending, self._pending_tokens, self._futures = [], [], 0, []
+            for paragraph in paragraphs:
+                self.add_paragraph(paragraph)
+        self._submit_pending()
+        revised_content = "".join(future.result() for future in self._futures)
+        record_span("revise.incremental_wait", time.time() - start_time,
+                    "Wait for the chunks still being revised once the generation is complete",
+                    number_chunks=len(self._futures))
+
+        return revised_content
+
+
+def broadcast_paragraphs(revisers: List[IncrementalReviser]) -> Callable[[str], None]:
+    """
+    Returns an `on_paragraph` callback handing each paragraph to every reviser (ie the reviser of the generated
+    content and the one translating it into the other official language).
+    """
+    def on_paragraph(paragraph: str) -> None:
+        for reviser in revisers:
+            reviser.add_paragraph(paragraph)
+    return on_paragraph
@@ -1,9 +1,12 @@
 import time
 import asyncio
+import threading
 from pathlib import Path
 # from DVoice.utilities.settings import AZURE_OPENAI_MODEL_NAME
 # from DVoice.utilities.llms_utils import generate_response_from_text_input
-from DVoice.utilities.llm_and_embeddings_utils import instantiate_azure_chat_openai
+from DVoice.utilities.llm_and_embeddings_utils import instantiate_azure_chat_openai, count_tokens, count_tokens_for_list_of_chunks
+from DVoice.utilities.settings import AZURE_OPENAI_MODEL, MAX_TOKEN_COMPLETION, ESTIMATED_STRUCTURED_OUTPUT_OVERHEAD_TOKENS
+from DVoice.utilities.settings import ESTIMATED_CLASSIFICATION_COMPLETION_TOKENS, ESTIMATED_EXPLANATION_COMPLETION_TOKENS
 from DVoice.utilities.llm_structured_output import LayoutParser
 from DVoice.utilities.llm_structured_output import Guideline1Parser, Guideline2Parser, Guideline3Parser, Guideline4Parser
 from DVoice.utilities.llm_structured_output import GuidelinesWithAdditionalUserInstructionsParser
@@ -14,19 +17,53 @@ from DVoice.prompt.prompt_repo import OUTPUT_AFTER_FIRST_REVISION_PROMPT, GUIDEL
 from DVoice.prompt.prompt_repo import OUTPUT_AFTER_SECOND_REVISION_PROMPT, GUIDELINE_REFERRING_TO_EFFECTIVE_WRITING_PROMPT
 from DVoice.prompt.prompt_repo import OUTPUT_AFTER_THIRD_REVISION_PROMPT, OUTPUT_AFTER_FOURTH_REVISION_PROMPT
 from DVoice.prompt.prompt_repo import OUTPUT_AFTER_FIFTH_REVISION_PROMPT
+from DVoice.prompt.prompt_repo import OUTPUT_AFTER_FUSED_REVISION_PROMPT, OUTPUT_AFTER_FUSED_REVISION_WITH_ADDITIONAL_INSTRUCTIONS_PROMPT
 from DVoice.prompt.prompt_repo import  GUIDELINE_REFERRING_TO_EDITORIAL_STYLE_GUIDE_PROMPT
+from DVoice.prompt.prompt_repo import CHUNK_CLASSIFICATION_PROMPT, COMPARE_ORIGINAL_VS_NEW_TEXT_PROMPT
 from DVoice.prompt.model_persona_repo import MODEL_PERSONA_LAYOUT_REVISION, MODEL_PERSONA_APPLICATION_OF_GUIDELINES
+from DVoice.prompt.model_persona_repo import MODEL_PERSONA_TEXT_VS_NOT_TEXT_CLASSIFICATION
 from DVoice.prompt.prompt_actions import compare_original_vs_revised_text
-from functools import partial
+from functools import partial, lru_cache
 from langchain.prompts import PromptTemplate
 from langchain.schema import Document
 from langchain.schema.prompt_template import format_document
 from langchain.schema.runnable import RunnableParallel, RunnablePassthrough
 # from langchain.schema import StrOutputParser
 from langchain_core.output_parsers import JsonOutputParser
+from langchain_core.callbacks import BaseCallbackHandler
+from utilities.instrumentation import record_span, with_current_context
+from utilities.token_budget import TokenBudgetExceeded
 
 from typing import Dict, List, Any, Tuple, Callable, Optional
 
+class ChunkProgressHandler(BaseCallbackHandler):
+    """
+    Counts the chunks completed by `.map()` chains and reports them as N/M through `progress_callback`.
+
+    The handler is shared by the chains of every file of a stage: each `invoke` of a `.map()` chain is a root run
+    and each of its direct child runs is one chunk.
+    """
+    def __init__(self, total: int, progress_callback: Callable[[int, int], None]) -> None:
+        self.total = total
+        self.completed = 0
+        self.progress_callback = progress_callback
+        self._root_run_ids = set()
+        self._lock = threading.Lock() # the chains of the files run in executor threads
+
+    def on_chain_start(self, serialized: Any, inputs: Any, *, run_id: Any, parent_run_id: Any = None, **kwargs: Any) -> None:
+        if parent_run_id is None:
+            with self._lock:
+                self._root_run_ids.add(run_id)
+
+    def on_chain_end(self, outputs: Any, *, run_id: Any, parent_run_id: Any = None, **kwargs: Any) -> None:
+        with self._lock:
+            if parent_run_id not in self._root_run_ids:
+                return
+            self.completed = min(self.completed + 1, self.total) # a retried file does not count its chunks twice
+            completed = self.completed
+        self.progress_callback(completed, self.total)
+
+
 def define_revise_chunk_layout_chain(TOKEN):
     """
     Defines a LangChain processing chain to revise the layout of document chunks using an LLM.
@@ -100,7 +137,7 @@ def define_revise_chunk_layout_chain(TOKEN):
     
     end_time = time.time()
     processing_time = end_time - start_time
-    print(f"Initialization of the revise chunk layout chain took {processing_time} second(s)")
+    record_span("layout.chain_init", processing_time, "Initialization of the revise chunk layout chain")
     
     ## please note we just defined the chain for now, nothing has been run, we need to `invoke` (how we activate the llm) 
     # it to run the revision
@@ -149,11 +186,13 @@ def process_chunks_for_layout_revision(file_chunks_doc: Dict[str, List[str]]) ->
     
     end_time = time.time()
     processing_time = end_time - start_time
-    print(f"Processing of the document chunks took {processing_time} second(s)")
+    record_span("layout.prepare_documents", processing_time, "Processing of the document chunks")
     
     return doc_repos
 
-async def apply_chunk_layout_revision(file_chunks_repo: Dict[str, List[str]], TOKEN) -> List[Any]:
+async def apply_chunk_layout_revision(file_chunks_repo: Dict[str, List[str]], 
+                                      TOKEN, 
+                                      progress_callback: Optional[Callable[[int, int], None]] = None) -> List[Any]:
     """
     Asynchronously applies chunk layout revision to a repository of document chunks.
     What we really do is that we focus on revising the layout into something "that make sense" and in markdown compliant
@@ -167,6 +206,8 @@ async def apply_chunk_layout_revision(file_chunks_repo: Dict[str, List[str]], TO
                                                  values are lists of text chunks (List[str]) 
                                                  representing document content.
         TOKEN (Azure Access Token): Authentication token or configuration object used to access the language model.
+        progress_callback (Optional[Callable[[int, int], None]]): Called with (completed chunks, total chunks) each
+                                                                  time a chunk layout is revised. Defaults to None.
  
     Returns:
         responses (List[Langchain Documents]): A list of Langchain Document responses from the layout revision process, containing the revised 
@@ -197,14 +238,17 @@ async def apply_chunk_layout_revision(file_chunks_repo: Dict[str, List[str]], TO
     number_files = len(list(doc_repos.keys()))
     # Define the layout revision chain
     map_revise_layout_chain = define_revise_chunk_layout_chain(TOKEN)
+    callbacks = [ChunkProgressHandler(sum(len(docs) for docs in doc_repos.values()), progress_callback)] \
+                                                                                        if progress_callback else None
     # Create an event loop and prepare tasks for asynchronous execution
     loop = asyncio.get_event_loop()
     tasks = []
     for file_path, docs in doc_repos.items():
         print(f"##File: {Path(file_path).stem} LAYOUT REVISION ASYNC ##")
-        tasks.append(loop.run_in_executor(None, apply_lcel_chain_to_single_doc, file_path, 
+        tasks.append(loop.run_in_executor(None, with_current_context(apply_lcel_chain_to_single_doc), file_path, 
                                                                                 map_revise_layout_chain,
-                                                                                docs
+                                                                                docs,
+                                                                                callbacks
                                                                                 ))
     # Run all tasks concurrently and collect responses
     responses = await asyncio.gather(*tasks)
@@ -221,8 +265,7 @@ async def apply_chunk_layout_revision(file_chunks_repo: Dict[str, List[str]], TO
     
     end_time = time.time()
     processing_time = end_time - start_time
-    print(f"Revision of the layout of the chunks has taken {processing_time} \
-            second(s) or {processing_time/number_files} second(s) per files")
+    record_span("layout.apply", processing_time, "Revision of the layout of the chunks", number_files=number_files)
     
     return responses
 
@@ -270,7 +313,7 @@ def reconstruct_revised_layout_chunk_into_file(chunk_revised_layout_output_raw:
     
     end_time = time.time()
     processing_time = end_time - start_time
-    print(f"Reconstruction of the file from the chunks with revised layout took {processing_time} second(s)")
+    record_span("layout.reconstruct", processing_time, "Reconstruction of the file from the chunks with revised layout")
     
     return reconstructed_revised_file_repo
 
@@ -301,7 +344,7 @@ def initialize_revision_parsers() -> List[JsonOutputParser]:
     
     end_time = time.time()
     processing_time = end_time - start_time
-    print(f"Initialization of the parsers took {processing_time} second(s)")
+    record_span("revise.parsers_init", processing_time, "Initialization of the parsers")
     
     return [parser_1, parser_2, parser_3, parser_4, parser_5] ## list of parsers
 
@@ -364,7 +407,7 @@ def generate_revision_prompts(additional_instructions: str) -> List[PromptTempla
     
     end_time = time.time()
     processing_time = end_time - start_time
-    print(f"Generation of the (style guide) revision prompts took {processing_time} second(s)")
+    record_span("revise.prompts_init", processing_time, "Generation of the (style guide) revision prompts")
         
     return [first_revision_prompt, second_revision_prompt, third_revision_prompt, \
             fourth_revision_prompt, fifth_revision_prompt]
@@ -421,7 +464,7 @@ def generate_transfer_docs_to_llm_prompt() -> Tuple[partial, List[PromptTemplate
     
     end_time = time.time()
     processing_time = end_time - start_time
-    print(f"Generation of the transfer docs to llm prompt took {processing_time} second(s)")
+    record_span("revise.transfer_prompts_init", processing_time, "Generation of the transfer docs to llm prompt")
     
     return partial_format_document, [first_transfer_docs_to_prompt, second_transfer_docs_to_prompt, \
                                     third_transfer_docs_to_prompt, fourth_transfer_docs_to_prompt, \
@@ -468,10 +511,32 @@ def generate_output_prompts() -> List[PromptTemplate]:
     
     end_time = time.time()
     processing_time = end_time - start_time
-    print(f"The generation of the output prompts took {processing_time} second(s)")
+    record_span("revise.output_prompts_init", processing_time, "The generation of the output prompts")
     
     return [first_output_prompt, second_output_prompt, third_output_prompt, fourth_output_prompt, fifth_output_prompt]
 
+def generate_fused_output_prompt(additional_instructions: str, style_modification: Dict[str, bool]) -> PromptTemplate:
+    """
+    Generates the output prompt of the fused revision, where all the guidelines are applied in one LLM call.
+ 
+    The fused revision is the degraded mode of a job over its token budget (utilities/token_budget.py): one call per
+    chunk instead of four (or five), at the cost of a less thorough application of each guideline.
+ 
+    Args:
+        additional_instructions (str): Additional instructions submitted by the user through the UX.
+        style_modification (Dict[str, bool]): A dictionary indicating whether style modifications should be applied.
+ 
+    Returns:
+        fused_output_prompt (PromptTemplate): The output prompt, asking for the same keys as the last step of the
+                                              sequential chain so `define_runnable_output` is unchanged.
+    """
+    if bool(additional_instructions) and style_modification["style_modification"]:
+        fused_output_query = "\n\n" + OUTPUT_AFTER_FUSED_REVISION_WITH_ADDITIONAL_INSTRUCTIONS_PROMPT
+    else:
+        fused_output_query = "\n\n" + OUTPUT_AFTER_FUSED_REVISION_PROMPT
+    
+    return PromptTemplate(template=f"{fused_output_query}")
+
 
 def define_chain(
     model, ## the actual llms used to apply the re revisions on the chunks
@@ -482,6 +547,7 @@ def define_chain(
     output_prompts_list: List[PromptTemplate],  # Prompts to support structured output
     additional_instructions: str,  # Additional user-provided instructions for revision
     style_modification: Dict[str, bool],  # Dictionary containing style modification flags: True or False is the user requesting style modification changes
+    fused_output_prompt: Optional[PromptTemplate] = None,  # Output prompt of the fused revision (job over its token budget)
 ):
     """
     Defines a sequential LLM-based rephrasing and revision chain.
@@ -499,6 +565,9 @@ def define_chain(
         output_prompts_list (List[PromptTemplate]): Prompts ensuring structured output.
         additional_instructions (str): User-provided instructions for additional style modifications.
         style_modification (Dict[str, bool]): A dictionary indicating True or False whether style modifications should be applied.
+        fused_output_prompt (Optional[PromptTemplate]): When given, all the revision prompts are applied in a single
+                                                        LLM call ending with this output prompt (fused revision).
+                                                        Defaults to None (sequential revision).
  
     Returns:
         sequential_rephraser_chain (A Sequential Chain) : A sequential chain that applies multiple revision steps to a given document.
@@ -531,7 +600,25 @@ def define_chain(
         fourth_output_prompt, fifth_output_prompt = output_prompts_list[0], output_prompts_list[1], \
         output_prompts_list[2], output_prompts_list[3], output_prompts_list[4]
     # Define the LLM processing chain
-    if bool(additional_instructions) and style_modification["style_modification"]:             
+    if fused_output_prompt is not None and bool(additional_instructions) and style_modification["style_modification"]:
+        sequential_rephraser_chain = (
+                                    # single fused chain: every guideline, then the additional instructions, in one call
+                                    {"context": partial_format_document}
+                                    | first_transfer_docs_to_prompt + first_revision_prompt + second_revision_prompt \
+                                      + third_revision_prompt + fourth_revision_prompt + fifth_revision_prompt + fused_output_prompt
+                                    | model
+                                    | parser_5 ## same keys as the last step of the sequential chain
+                                )
+    elif fused_output_prompt is not None:
+        sequential_rephraser_chain = (
+                                    # single fused chain: every guideline in one call
+                                    {"context": partial_format_document}
+                                    | first_transfer_docs_to_prompt + first_revision_prompt + second_revision_prompt \
+                                      + third_revision_prompt + fourth_revision_prompt + fused_output_prompt
+                                    | model
+                                    | parser_4 ## same keys as the last step of the sequential chain
+                                )
+    elif bool(additional_instructions) and style_modification["style_modification"]:             
         sequential_rephraser_chain = (
                                     # first chain
                                     {"context": partial_format_document} # capture the page_content and metadata from the Langchain Document
@@ -641,7 +728,8 @@ def define_runnable_output(
 def define_parallelized_sequential_chain(
     additional_instructions: str,
     style_modification: Dict[str, bool],
-    TOKEN
+    TOKEN,
+    fused: bool = False
 ) -> Any:
     """
     Initializes and defines a parallelized sequential processing chain for revising 
@@ -665,6 +753,8 @@ def define_parallelized_sequential_chain(
         style_modification (Dict[str, bool]): A dictionary indicating whether style 
                                               modifications should be applied.
         TOKEN (Azure Access token): API token required to instantiate the Azure Chat OpenAI model.
+        fused (bool): Applies all the guidelines in a single LLM call per chunk instead of one call per guideline,
+                      the degraded mode of a job over its token budget. Defaults to False.
  
     Returns:
         map_parallelized_sequential_chain_doc_rephrasing (LangChain Chain): A parallelized runnable chain for document revision that processes 
@@ -689,6 +779,8 @@ def define_parallelized_sequential_chain(
     partial_format_document, transfer_docs_to_prompts_list = generate_transfer_docs_to_llm_prompt()
     # Generate output prompts for parsing expected output
     output_prompts_list = generate_output_prompts()
+    # Generate the output prompt of the fused revision when the job is over its token budget
+    fused_output_prompt = generate_fused_output_prompt(additional_instructions, style_modification) if fused else None
     
     ## # Define sequential chain for applying Content guidelines thoroughly
     sequential_rephraser_chain = define_chain(model, 
@@ -698,7 +790,8 @@ def define_parallelized_sequential_chain(
                                               revision_prompts_list, 
                                               output_prompts_list,
                                               additional_instructions, 
-                                              style_modification)
+                                              style_modification,
+                                              fused_output_prompt)
     # Define a wrapper to retain original document metadata and structure
     runnable_output = define_runnable_output(additional_instructions, style_modification)
     # Create a parallelized chain that processes document chunks concurrently
@@ -718,7 +811,7 @@ def define_parallelized_sequential_chain(
 
     end_time = time.time()
     processing_time = end_time - start_time
-    print(f"Initialization of the parallelized sequential chain using Langchain LCEL took {processing_time} second(s)")
+    record_span("revise.chain_init", processing_time, "Initialization of the parallelized sequential chain using Langchain LCEL")
     
     return map_parallelized_sequential_chain_doc_rephrasing
 
@@ -761,14 +854,15 @@ def process_classified_chunks_for_revision(file_chunks_doc: Dict[str, List[Docum
         
     end_time = time.time()
     processing_time = end_time - start_time
-    print(f"Processing of the document chunks took {processing_time} second(s)")
+    record_span("revise.prepare_documents", processing_time, "Processing of the document chunks")
     
     return doc_repos
 
 def apply_lcel_chain_to_single_doc(
     file_path: str, 
     parallelized_sequential_chain_doc_rephrasing: Any, ## the Langchain Parallelized Sequential chain 
-    list_of_chunks_for_document: List[Any] ## List of Langchain Documents that really store each of the user uploaded file chunks 
+    list_of_chunks_for_document: List[Any], ## List of Langchain Documents that really store each of the user uploaded file chunks 
+    callbacks: Optional[List[Any]] = None ## Langchain callback handlers, ie the ChunkProgressHandler of the stage
 ) -> Tuple[str, Any]:
     """
     Applies the parallelized sequential LCEL chain to a single document.
@@ -777,6 +871,7 @@ def apply_lcel_chain_to_single_doc(
         file_path (str): The path of the document being processed.
         parallelized_sequential_chain_doc_rephrasing (Any): The LCEL-based parallelized sequential rephrasing chain.
         list_of_chunks_for_document (List[Any]): A list of document chunks to be processed.
+        callbacks (Optional[List[Any]]): Langchain callback handlers passed to the chain. Defaults to None.
  
     Returns:
         file_path, response (Tuple[str, Any]): A tuple containing the file path and the processed response.
@@ -786,23 +881,33 @@ def apply_lcel_chain_to_single_doc(
         - If all retries fail, an error message is printed, and the function exits without a valid response.
         - A 60-second delay is introduced between retries to handle rate// LLM TPM (Token per Minute) limits and
         other issues
+        - A job over its token budget (TokenBudgetExceeded) is not retried, the exception is propagated.
     """
     ## TODO need to check for documents with empty chunks
+    config = {"max_concurrency": 5}
+    if callbacks:
+        config["callbacks"] = callbacks
     try:
         response = parallelized_sequential_chain_doc_rephrasing.invoke(list_of_chunks_for_document,
-                                                                       config={"max_concurrency": 5})
+                                                                       config=config)
+    except TokenBudgetExceeded:
+        raise # retrying a job that is over its token budget would only spend more tokens
     except Exception as e:
         print(f"Error {e} at initial run of sequential chain to apply guidelines for file: {file_path}")
         time.sleep(60)
         try:
             response = parallelized_sequential_chain_doc_rephrasing.invoke(list_of_chunks_for_document,
-                                                                           config={"max_concurrency": 5})
+                                                                           config=config)
+        except TokenBudgetExceeded:
+            raise
         except Exception as e:
             print(f"Failure due to Exception {e} for file: {file_path}")
             time.sleep(60)
             try:
                 response = parallelized_sequential_chain_doc_rephrasing.invoke(list_of_chunks_for_document,
-                                                                           config={"max_concurrency": 5})
+                                                                           config=config)
+            except TokenBudgetExceeded:
+                raise
             except:
                 print(f"Failure due to Exception {e} for file: {file_path}")
             
@@ -812,7 +917,9 @@ async def apply_guideline_revisions_to_docs(
     file_chunks_doc: Dict[str, List[Document]], ## dictionary of Langchain Document that store the chunks and the associate metadata
     additional_instructions: Dict[str, Any], # dictionary of the additional instructions to be applied in case the user submitted additional instructions through the UX
     style_modification: Dict[str, bool], ## {'style_modification': True} or {'style_modification': False} --> indicates whether the user requested as intent an additional style modification to the document
-    TOKEN # Azure Access Token
+    TOKEN, # Azure Access Token
+    progress_callback: Optional[Callable[[int, int], None]] = None, # called with (completed chunks, total chunks)
+    fused: bool = False # all the guidelines in one LLM call per chunk (job over its token budget)
 ) -> List[Document]:
     """
     Asynchronously applies guideline revisions to the document chunks.
@@ -827,6 +934,10 @@ async def apply_guideline_revisions_to_docs(
         additional_instructions (Dict[str, Any]): Additional instructions that may modify the guideline revisions.
         style_modification (Dict[str, bool]): A dictionary indicating whether style modifications should be applied.
         TOKEN (str): The token used for authentication or model access.
+        progress_callback (Optional[Callable[[int, int], None]]): Called with (completed chunks, total chunks) each
+                                                                  time a chunk is revised. Defaults to None.
+        fused (bool): Applies all the guidelines in a single LLM call per chunk (see utilities/token_budget.py).
+                      Defaults to False.
  
     Returns:
         responses (List[Document]): A list of responses from processing each document chunk. Each response corresponds 
@@ -843,7 +954,10 @@ async def apply_guideline_revisions_to_docs(
     # Define the sequential chain for guideline revisions
     parallelized_sequential_chain_doc_rephrasing = define_parallelized_sequential_chain(additional_instructions, 
                                                                                         style_modification,
-                                                                                        TOKEN)
+                                                                                        TOKEN,
+                                                                                        fused)
+    callbacks = [ChunkProgressHandler(sum(len(docs) for docs in doc_repos.values()), progress_callback)] \
+                                                                                        if progress_callback else None
     # file_chunks_revised_layout_repo = {}
     # Initialize asyncio event loop for parallel processing
     loop = asyncio.get_event_loop()
@@ -851,9 +965,10 @@ async def apply_guideline_revisions_to_docs(
     tasks = []
     for file_path, docs in doc_repos.items():
         print(f"##File: {Path(file_path).stem} SEQUENTIAL CHAIN OF GUIDELINES APPLIED ON EACH CHUNK IN PARALLEL AND EACH FILE IS PROCESSED ASYNC ##")
-        tasks.append(loop.run_in_executor(None, apply_lcel_chain_to_single_doc, file_path, 
+        tasks.append(loop.run_in_executor(None, with_current_context(apply_lcel_chain_to_single_doc), file_path, 
                                                                                parallelized_sequential_chain_doc_rephrasing,
-                                                                               docs
+                                                                               docs,
+                                                                               callbacks
                                                                                 ))
     responses = await asyncio.gather(*tasks) # Wait for all tasks to complete
     ## below for debugging ###############
@@ -866,8 +981,8 @@ async def apply_guideline_revisions_to_docs(
     #     file_chunks_revised_layout_repo[file_path] = response
     end_time = time.time()
     processing_time = end_time - start_time
-    print(f"Application of the guidelines on the Chunks of the document(s) submitted took {processing_time} \
-            second(s) or {processing_time/number_files} second(s) per single file")
+    record_span("revise.apply", processing_time, "Application of the guidelines on the Chunks of the document(s) submitted",
+                number_files=number_files)
 
     return responses
 
@@ -933,7 +1048,7 @@ def reconstruct_revised_chunks_into_file(revised_chunks_list: List[List[Document
     
     end_time = time.time()
     processing_time = end_time - start_time
-    print(f"Reconstruction of the file from the chunks with revised layout took {processing_time} second(s)")
+    record_span("revise.reconstruct", processing_time, "Reconstruction of the file from the revised chunks")
 
     return reconstructed_revised_file_repo
 
@@ -980,10 +1095,110 @@ def capture_revision_explanation_for_doc(revised_document_chunks: List[Tuple[str
                         
     end_time = time.time()
     processing_time = end_time - start_time
-    print(f"Gathering of the file modification explanations took {processing_time} second(s)")
+    record_span("explain.gather", processing_time, "Gathering of the file modification explanations")
     
     return captured_modification_explanation_repo
 
+@lru_cache(maxsize=None)
+def _count_prompt_tokens(prompt: str) -> int:
+    """Counts the tokens of a (static) prompt once per process."""
+    return count_tokens(prompt, 0, AZURE_OPENAI_MODEL)[0]
+
+def estimate_revision_tokens(
+    file_chunks_repo: Dict[str, List[str]], ## the chunks before the layout revision, per file
+    additional_instructions: str,
+    style_modification: Dict[str, bool]
+) -> Tuple[List[int], List[int], int]:
+    """
+    Estimates up front the tokens a revision job will spend, for the token budget of the job (utilities/token_budget.py).
+ 
+    Each chunk of t tokens goes through the layout revision (the chunk in, the chunk out), the classification
+    (the chunk in, a boolean out) and the revision steps: the first step reads the chunk, the next ones read the
+    original and the previously revised text, and every step writes the original and the revised text back as
+    structured output. The prompts (personas, guidelines, output prompts) are counted once per call.
+ 
+    Args:
+        file_chunks_repo (Dict[str, List[str]]): The cohesive chunks of each file, before the layout revision.
+        additional_instructions (str): Additional instructions submitted by the user through the UX.
+        style_modification (Dict[str, bool]): A dictionary indicating whether style modifications should be applied.
+ 
+    Returns:
+        full_tokens_per_chunk, fused_tokens_per_chunk, fixed_tokens (Tuple[List[int], List[int], int]):
+            - The estimated tokens of each chunk (files in order) with the sequential revision (4 or 5 steps).
+            - The estimated tokens of each chunk with the fused revision (1 step).
+            - The estimated tokens of the revision explanation of each file, that do not depend on the chunks revised.
+ 
+    Notes:
+        - The layout revision keeps the length of a chunk roughly unchanged, so the chunks after layout are
+          estimated from the chunks before layout.
+        - Completions are capped at MAX_TOKEN_COMPLETION, as the LLM calls are.
+    """
+    start_time = time.time()
+    output_overhead = ESTIMATED_STRUCTURED_OUTPUT_OVERHEAD_TOKENS
+    layout_prompt_tokens = _count_prompt_tokens(MODEL_PERSONA_LAYOUT_REVISION + GUIDELINE_LAYOUT_REVISION_PROMPT
+                                                + OUTPUT_AFTER_LAYOUT_REVISION_PROMPT)
+    classification_prompt_tokens = _count_prompt_tokens(MODEL_PERSONA_TEXT_VS_NOT_TEXT_CLASSIFICATION + CHUNK_CLASSIFICATION_PROMPT)
+    guideline_prompts_tokens = [_count_prompt_tokens(MODEL_PERSONA_APPLICATION_OF_GUIDELINES + guideline_prompt + output_prompt)
+                                for guideline_prompt, output_prompt in ((GUIDELINE_WRITING_PRINCIPLES_PROMPT, OUTPUT_AFTER_FIRST_REVISION_PROMPT),
+                                                                        (GUIDELINE_REFERRING_TO_Content_PROMPT, OUTPUT_AFTER_SECOND_REVISION_PROMPT),
+                                                                        (GUIDELINE_REFERRING_TO_EFFECTIVE_WRITING_PROMPT, OUTPUT_AFTER_THIRD_REVISION_PROMPT),
+                                                                        (GUIDELINE_REFERRING_TO_EDITORIAL_STYLE_GUIDE_PROMPT, OUTPUT_AFTER_FOURTH_REVISION_PROMPT))]
+    fused_prompt_tokens = sum(_count_prompt_tokens(MODEL_PERSONA_APPLICATION_OF_GUIDELINES + guideline_prompt)
+                              for guideline_prompt in (GUIDELINE_WRITING_PRINCIPLES_PROMPT, GUIDELINE_REFERRING_TO_Content_PROMPT,
+                                                       GUIDELINE_REFERRING_TO_EFFECTIVE_WRITING_PROMPT,
+                                                       GUIDELINE_REFERRING_TO_EDITORIAL_STYLE_GUIDE_PROMPT)) \
+                          + _count_prompt_tokens(OUTPUT_AFTER_FUSED_REVISION_PROMPT)
+    if bool(additional_instructions) and style_modification["style_modification"]: # the optional fifth step
+        fifth_step_prompt_tokens = count_tokens(MODEL_PERSONA_APPLICATION_OF_GUIDELINES + additional_instructions
+                                                + OUTPUT_AFTER_FIFTH_REVISION_PROMPT, 0, AZURE_OPENAI_MODEL)[0]
+        guideline_prompts_tokens.append(fifth_step_prompt_tokens)
+        fused_prompt_tokens += fifth_step_prompt_tokens - _count_prompt_tokens(OUTPUT_AFTER_FIFTH_REVISION_PROMPT)
+    explanation_prompt_tokens = _count_prompt_tokens(COMPARE_ORIGINAL_VS_NEW_TEXT_PROMPT + MODEL_PERSONA_TEXT_VS_NOT_TEXT_CLASSIFICATION)
+
+    full_tokens_per_chunk, fused_tokens_per_chunk, fixed_tokens = [], [], 0
+    for _, chunks_list in file_chunks_repo.items():
+        chunk_tokens_list = [token_count for token_count, _ in asyncio.run(count_tokens_for_list_of_chunks(chunks_list))]
+        for chunk_tokens in chunk_tokens_list:
+            revised_output_tokens = min(2 * chunk_tokens + output_overhead, MAX_TOKEN_COMPLETION) # original + revised text
+            shared_tokens = (layout_prompt_tokens + chunk_tokens + min(chunk_tokens + output_overhead, MAX_TOKEN_COMPLETION)
+                             + classification_prompt_tokens + chunk_tokens + ESTIMATED_CLASSIFICATION_COMPLETION_TOKENS)
+            full_tokens_per_chunk.append(shared_tokens + guideline_prompts_tokens[0] + chunk_tokens + revised_output_tokens
+                                         + sum(prompt_tokens + 2 * chunk_tokens + revised_output_tokens
+                                               for prompt_tokens in guideline_prompts_tokens[1:]))
+            fused_tokens_per_chunk.append(shared_tokens + fused_prompt_tokens + chunk_tokens + revised_output_tokens)
+        if chunk_tokens_list: # the explanation compares the original and revised text of the first chunk of the file
+            fixed_tokens += explanation_prompt_tokens + 2 * chunk_tokens_list[0] + ESTIMATED_EXPLANATION_COMPLETION_TOKENS
+    
+    end_time = time.time()
+    processing_time = end_time - start_time
+    record_span("chunk.estimate_tokens", processing_time, "Estimation of the tokens of the revision")
+    
+    return full_tokens_per_chunk, fused_tokens_per_chunk, fixed_tokens
+
+def split_chunks_within_budget(file_chunks_repo: Dict[str, List[str]], 
+                               chunks_to_revise: int) -> Tuple[Dict[str, List[str]], Dict[str, List[str]]]:
+    """
+    Splits the chunks of the files, in document order, between the chunks a partial revision revises and the ones
+    it keeps unchanged.
+ 
+    Args:
+        file_chunks_repo (Dict[str, List[str]]): The cohesive chunks of each file, before the layout revision.
+        chunks_to_revise (int): The number of leading chunks that fit in the token budget.
+ 
+    Returns:
+        chunks_to_revise_repo, chunks_kept_repo (Tuple[Dict[str, List[str]], Dict[str, List[str]]]): The chunks to
+        revise and the chunks to append unchanged to the revised file, per file (files without any chunk left out).
+    """
+    chunks_to_revise_repo, chunks_kept_repo = {}, {}
+    for file_path, chunks_list in file_chunks_repo.items():
+        if chunks_to_revise > 0:
+            chunks_to_revise_repo[file_path] = chunks_list[:chunks_to_revise]
+        if len(chunks_list) > chunks_to_revise:
+            chunks_kept_repo[file_path] = chunks_list[max(chunks_to_revise, 0):]
+        chunks_to_revise -= len(chunks_list)
+    
+    return chunks_to_revise_repo, chunks_kept_repo
+
 def generate_additional_content(additional_instructions: str, TOKEN) -> Optional[str]:
     """
     Generates additional content based on provided instructions using Azure OpenAI.
@@ -1,29 +1,35 @@
 import os, sys
-import time
 import asyncio
 from collections import defaultdict
+from concurrent.futures import Executor, ThreadPoolExecutor
 
 from DVoice.utilities.chunking import chunk_classification, chunk_documents_cohesively, prepare_list_chunks_and_metadata
 from DVoice.content_revision.revision import apply_chunk_layout_revision, reconstruct_revised_layout_chunk_into_file
 from DVoice.content_revision.revision import apply_guideline_revisions_to_docs, reconstruct_revised_layout_chunk_into_file
 from DVoice.content_revision.revision import reconstruct_revised_chunks_into_file, capture_revision_explanation_for_doc
+from DVoice.content_revision.revision import estimate_revision_tokens, split_chunks_within_budget
+from DVoice.content_revision.incremental_revision import IncrementalReviser, broadcast_paragraphs
 from DVoice.content_creation.summarize import create_doc_summary
 from DVoice.content_creation.create_content import conduct_retrieval_based_content_generation
-from DVoice.conversion.file_conversion import convert_to_markdown_and_docx_document
 from utilities.blob_storage import save_blob_file
-from utilities.cosmos_process import update_file_thread_flag
+from utilities.status_reporter import report_status, report_progress
+from utilities.instrumentation import start_job, finish_job, stage
+from utilities.token_budget import plan_job_budget, close_job_budget
+from utilities.task_graph import TaskGraph
 from django.conf import settings
 from DVoice.prompt.prompt_actions import determine_input_language, translate_query_to_desired_language
 from DVoice.prompt.prompt_actions import rewrite_query, break_down_query_to_multiple_query_output, identify_number_output_files
 from DVoice.prompt.prompt_actions import identify_bill_96_compliance, determine_query_task_type_pairs
 from DVoice.prompt.prompt_actions import rewrite_query_core_action, determine_necessary_files, determine_file_output_user_friendly_name
-from DVoice.prompt.prompt_actions import process_parameter_translation
-from DVoice.utilities.settings import CONTEXT_WINDOW_LIMIT
+from DVoice.prompt.prompt_actions import process_parameter_translation, determine_query_intended_task, understand_query
+from DVoice.utilities.settings import CONTEXT_WINDOW_LIMIT, STREAMING_CREATION, STREAMING_REVISION_MAX_WORKERS
+from DVoice.utilities.settings import QUERY_UNDERSTANDING_SINGLE_CALL, LOCAL_LANGUAGE_IDENTIFICATION, LANGUAGE_IDENTIFICATION_MIN_CONFIDENCE
+from DVoice.utilities.language_identification import identify_output_language
 
 import shutil
 import logging
 
-from typing import Dict, Any, Tuple, Optional, List
+from typing import Callable, Dict, Any, Tuple, Optional, List
 
 ## LOGGING CAPABILITIES
 
@@ -63,6 +69,19 @@ class DVoiceReviser():
         if settings.DEBUG:
             logger.info("✅ INIT: Initialization of the DVoice Reviser is complete")
         
+    def _report_progress(self, stage: str, completed: Optional[int] = None, total: Optional[int] = None) -> None:
+        """
+        Queues a progress event of the task for the UI, without blocking the job (utilities/status_reporter.py).
+
+        Args:
+            stage (str): The stage reached, ie "parsed", "layout_revised", "revised", "converted", "uploaded".
+            completed (Optional[int]): The number of chunks done in the stage.
+            total (Optional[int]): The number of chunks of the stage.
+        """
+        report_progress(self.post_request_data["taskId"],
+                        self.post_request_data.get("fileName", self.post_request_data.get("referenceFiles", "manualInput")),
+                        stage, completed, total)
+
     def remove_local_output_folder(self, folder_path: str) -> None:
         """
         Removes the specified local output folder if it exists.
@@ -99,29 +118,57 @@ class DVoiceReviser():
             - Tuple[Dict[str, str], Dict[str, str]]: A tuple containing:
                 - The revised document chunks with applied modifications.
                 - The captured modification explanations for auditing.
+
+        Raises:
+            TokenBudgetExceeded: When the document does not fit in the token budget of the job and user, or when
+                                 the job goes over it while running (utilities/token_budget.py).
         """
         # Initial chunking before layout reconstruction
-        chuncked_documents_pre_layout = chunk_documents_cohesively(markdown_extract_repo)
+        with stage("chunk"):
+            chuncked_documents_pre_layout = chunk_documents_cohesively(markdown_extract_repo)
+            # Token budget of the job: full, fused or partial revision, or refused before any LLM call (utilities/token_budget.py)
+            budget_plan = plan_job_budget(self.post_request_data["userId"],
+                                          *estimate_revision_tokens(chuncked_documents_pre_layout,
+                                                                    additional_instructions,
+                                                                    style_modification))
+            chunks_kept_repo = {}
+            if budget_plan["mode"] == "partial": ## only the leading chunks are revised, the rest of the document is kept as is
+                chuncked_documents_pre_layout, chunks_kept_repo = split_chunks_within_budget(chuncked_documents_pre_layout,
+                                                                                             budget_plan["chunks_to_revise"])
         # Layout revision using LLM driven revision on layout (Langchain Expression Language: LCEL)
-        chunk_revised_layout_output_raw = asyncio.run(apply_chunk_layout_revision(chuncked_documents_pre_layout, 
-                                                                                  self.post_request_data["token"]))
+        with stage("layout"):
+            chunk_revised_layout_output_raw = asyncio.run(apply_chunk_layout_revision(chuncked_documents_pre_layout, 
+                                                                                      self.post_request_data["token"],
+                                                                                      lambda completed, total: \
+                                                                                        self._report_progress("layout_revised", completed, total)))
         # Reconstruct document from revised chunks
-        reconstructed_file_repo = reconstruct_revised_layout_chunk_into_file(chunk_revised_layout_output_raw) ## quick concatenation of the chunks
-        # Second chunking after layout reconstruction
-        chunked_documents_post_layout = chunk_documents_cohesively(reconstructed_file_repo) # second chunking after layout reconstruction
+        with stage("chunk"):
+            reconstructed_file_repo = reconstruct_revised_layout_chunk_into_file(chunk_revised_layout_output_raw) ## quick concatenation of the chunks
+            # Second chunking after layout reconstruction
+            chunked_documents_post_layout = chunk_documents_cohesively(reconstructed_file_repo) # second chunking after layout reconstruction
         # Classify chunks based on Content Voice guidelines
-        file_chunks_classification_repo = chunk_classification(chunked_documents_post_layout, self.post_request_data["token"]) # classify whether the input is to be considered for DVoice
+        with stage("classify"):
+            file_chunks_classification_repo = chunk_classification(chunked_documents_post_layout, self.post_request_data["token"]) # classify whether the input is to be considered for DVoice
         ## TODO: for next iteration load the checklist and grade whether the documents already comply with the checklist
         # HEART OF THE REVISION PROCESS: Apply guideline-based revisions
-        revised_document_chunks = asyncio.run(apply_guideline_revisions_to_docs(file_chunks_classification_repo, 
-                                                                                additional_instructions, 
-                                                                                style_modification,
-                                                                                self.post_request_data["token"]))
-        # Reconstruct final revised document
-        reconstructed_revised_file_repo = reconstruct_revised_chunks_into_file(revised_document_chunks)
+        with stage("revise"):
+            revised_document_chunks = asyncio.run(apply_guideline_revisions_to_docs(file_chunks_classification_repo, 
+                                                                                    additional_instructions, 
+                                                                                    style_modification,
+                                                                                    self.post_request_data["token"],
+                                                                                    lambda completed, total: \
+                                                                                        self._report_progress("revised", completed, total),
+                                                                                    fused=budget_plan["mode"] != "full"))
+            # Reconstruct final revised document
+            reconstructed_revised_file_repo = reconstruct_revised_chunks_into_file(revised_document_chunks)
+            # Append the chunks left out of a partial revision unchanged
+            for file_path, chunks_list in chunks_kept_repo.items():
+                reconstructed_revised_file_repo[file_path] = reconstructed_revised_file_repo.get(file_path, "") \
+                                                             + "\n\n" + "\n\n".join(chunks_list)
         # Capture modifications applied to the document
-        captured_modification_explanation_repo = capture_revision_explanation_for_doc(revised_document_chunks, 
-                                                                                      self.post_request_data["token"])
+        with stage("explain"):
+            captured_modification_explanation_repo = capture_revision_explanation_for_doc(revised_document_chunks, 
+                                                                                          self.post_request_data["token"])
         
         return reconstructed_revised_file_repo, captured_modification_explanation_repo
 
@@ -136,8 +183,8 @@ class DVoiceReviser():
         Raises:
             Exception: Propagates any error encountered during processing.
         """
+        start_job(self.post_request_data["taskId"], "revision") # stage spans and llm calls of this job (utilities/instrumentation.py)
         try:
-            start_time = time.time()
             additional_instructions = self.post_request_data["additionalInstructions"]
             
             # Determine style modifications
@@ -160,15 +207,16 @@ class DVoiceReviser():
                 if settings.DEBUG:
                     logger.info("✅ WE ARE GOING TO ENTER THE METHOD TO PARSE THE FILE")
                 ## parse files with Docling or Azure Document Intelligence
-                conv_results, number_of_files, unsupported_doc_repo = parse_files(input_document=input_document, 
-                                                            token=self.post_request_data["token"],
-                                                            default_credential= self.default_credential,
-                                                            file_extension=self.post_request_data["fileExtension"]) # with docling ## TODO: will have to adjust lofic in docling when multiple files
-                ## extract the parsed files into a markdown format
-                markdown_extract_repo = extract_markdown_from_parsed_output(conv_results, 
-                                                                            number_of_files, 
-                                                                            self.post_request_data["token"], 
-                                                                            unsupported_doc_repo) # with docling
+                with stage("parse"):
+                    conv_results, number_of_files, unsupported_doc_repo = parse_files(input_document=input_document, 
+                                                                token=self.post_request_data["token"],
+                                                                default_credential= self.default_credential,
+                                                                file_extension=self.post_request_data["fileExtension"]) # with docling ## TODO: will have to adjust lofic in docling when multiple files
+                    ## extract the parsed files into a markdown format
+                    markdown_extract_repo = extract_markdown_from_parsed_output(conv_results, 
+                                                                                number_of_files, 
+                                                                                self.post_request_data["token"], 
+                                                                                unsupported_doc_repo) # with docling
             # Manual input-based revision
             if "manualInput" in self.post_request_data: ## when 'manual_input' is present in the post call to the api, that means it is a manual input --> manual input revision
                 from DVoice.parsing.manual_input_parsing import parse_manual_input ## only needed for manual input revision
@@ -177,8 +225,10 @@ class DVoiceReviser():
                 manual_input_string = self.post_request_data["manualInput"]
                 ## note only one single file is always returned in these cases since the manual input only allows to submit one manual input in the UX
                 ## Parse manual input from user
-                markdown_extract_repo = parse_manual_input(manual_input_string, self.post_request_data["token"])
+                with stage("parse"):
+                    markdown_extract_repo = parse_manual_input(manual_input_string, self.post_request_data["token"])
                 number_of_files = 1 # TODO: hard coded value for now but in the future we could deal with more than 1 file
+            self._report_progress("parsed")
             
             # Perform the revision processing
             reconstructed_revised_file_repo, \
@@ -216,28 +266,29 @@ class DVoiceReviser():
                 
             # Save results and generate output paths
             saved_revision_path_repo = {}
-            for file_path, file_content in reconstructed_revised_file_repo.items():
+            from DVoice.conversion.file_conversion import convert_to_markdown_and_docx_document # python-docx, bs4, PIL only needed at output time
+            with stage("convert"):
+                for file_path, file_content in reconstructed_revised_file_repo.items():
 
-                final_md_file_path, final_docx_path, final_file_name, doc = convert_to_markdown_and_docx_document(file_path, 
-                                                                                                                  file_content)
-                saved_revision_path_repo[file_path] = {"docx":final_docx_path,
-                                                       "markdown":final_md_file_path}
+                    final_md_file_path, final_docx_path, final_file_name, doc = convert_to_markdown_and_docx_document(file_path, 
+                                                                                                                      file_content)
+                    saved_revision_path_repo[file_path] = {"docx":final_docx_path,
+                                                           "markdown":final_md_file_path}
+            self._report_progress("converted")
             
             print(f"Revised files and associated locations: {saved_revision_path_repo}")
-            end_time = time.time()
-            processing_time = end_time - start_time
-            print(f"Content Voice Revision of {number_of_files} files took {processing_time} seconds \
-                that is {processing_time/number_of_files} seconds")
-            ## if manual input save with a hard coded file name
-            if "manualInput" in self.post_request_data:
-                file_name, folder_name, container_name = save_blob_file(doc_to_save= doc, 
-                                                                        file_name=f"{self.post_request_data['userId'].split('@')[0]}/DVoice_Revised_Manual_Input.docx",
-                                                                        token= self.post_request_data["token"])
+            with stage("upload"):
+                ## if manual input save with a hard coded file name
+                if "manualInput" in self.post_request_data:
+                    file_name, folder_name, container_name = save_blob_file(doc_to_save= doc, 
+                                                                            file_name=f"{self.post_request_data['userId'].split('@')[0]}/DVoice_Revised_Manual_Input.docx",
+                                                                            token= self.post_request_data["token"])
 
-            else:
-                file_name, folder_name, container_name = save_blob_file(doc_to_save= doc, 
-                                                                        file_name= f"{self.post_request_data['userId'].split('@')[0]}/{final_file_name}",
-                                                                        token= self.post_request_data["token"])
+                else:
+                    file_name, folder_name, container_name = save_blob_file(doc_to_save= doc, 
+                                                                            file_name= f"{self.post_request_data['userId'].split('@')[0]}/{final_file_name}",
+                                                                            token= self.post_request_data["token"])
+            self._report_progress("uploaded")
             # save the results in the DVoiceReviser class attributes
             self.saved_revision_path_repo = saved_revision_path_repo
             self.captured_modification_explanation_repo = captured_modification_explanation_repo
@@ -256,14 +307,16 @@ class DVoiceReviser():
                                                "creation_explanation":captured_modification_explanation_repo,
                                                "blob_name": file_name,
                                                "blob_folder_name": folder_name,
-                                               "blob_container_name": container_name}}}
+                                               "blob_container_name": container_name,
+                                               "token_budget": close_job_budget()}}} # mode, estimated vs actual tokens
             
                             
-            update_file_thread_flag(task_id=self.post_request_data["taskId"],
-                                    file_name=source_name,
-                                    thread_status="Completed",
-                                    token= self.post_request_data["token"],
-                                    thread_output=thread_output)
+            report_status(task_id=self.post_request_data["taskId"],
+                          file_name=source_name,
+                          thread_status="Completed",
+                          token= self.post_request_data["token"],
+                          thread_output=thread_output)
+            finish_job("success")
         except Exception as e:
             
             if "fileName" in self.post_request_data:
@@ -271,11 +324,13 @@ class DVoiceReviser():
             elif "manualInput" in self.post_request_data:
                 source_name = self.post_request_data["manualInputFile"]["name"]
                 
-            update_file_thread_flag(task_id=self.post_request_data["taskId"],
-                                    file_name= source_name,
-                                    thread_status="Failed",
-                                    token= self.post_request_data["token"],
-                                    thread_output=str(e))
+            report_status(task_id=self.post_request_data["taskId"],
+                          file_name= source_name,
+                          thread_status="Failed",
+                          token= self.post_request_data["token"],
+                          thread_output=str(e))
+            close_job_budget()
+            finish_job("error")
             raise e
 
 
@@ -298,8 +353,7 @@ class DVoiceCreator(DVoiceReviser):
         """
         self.post_request_data = post_request_data
         self.default_credential = post_request_data["defaultCredential"]
-        self.chroma_db = post_request_data["chromaDB"]
-        logger.info("Initialized new chroma db vector db")
+        self.chroma_db = post_request_data.get("chromaDB") # built on first retrieval task only, see _get_chroma_db
         self.token = post_request_data["token"]
         self.user_id = post_request_data["userId"]
         self.task_id = post_request_data["taskId"]
@@ -310,6 +364,7 @@ class DVoiceCreator(DVoiceReviser):
         self.folder_name: Optional[str] = None
         self.container_name: Optional[str] = None
         self.dvoice_content_repo = {}
+        self.dvoice_content_revised = False # True once the content has been revised while being generated
         
         # post_request_data={"topicPrompt": "Please write one unique output that combines content about the Canadian economy outlook and the Oil and Gas Industry and include some key facts and tabular data.", ## another Generate a comprehensive output that integrates information on the Canadian economy, its economic outlook, and the Oil and Gas industry, incorporating key facts and tabular data.
         #                    "targetAudience": "Industry Professional", ## note, potential values can be: General Public, Industry Professional, Client, Student / Intern / Co-op, {Other}
@@ -345,7 +400,28 @@ class DVoiceCreator(DVoiceReviser):
                                 4. The structure of the content needs to be of a: {self.post_request_data['contentMedium']}
                                 
                                 """ + optional_param_1 + optional_param_2 + optional_param_3
-    
+
+    def _get_chroma_db(self) -> Any:
+        """
+        Returns the chroma db vector db of this creation task, building it on first use.
+
+        Only retrieval tasks need it, so chromadb is neither imported nor instantiated for summarization or
+        direct generation tasks. It is the persistent collection of the user (settings.VECTOR_STORE_PERSISTENT), so
+        the embeddings of the files the user already uploaded are reused.
+
+        Returns:
+            ChromaDBHandler | NumpyVectorIndex: The vector db handler of settings.VECTOR_STORE_BACKEND
+                                                (utilities/chromadb.py or utilities/vector_index.py).
+        """
+        if self.chroma_db is None:
+            if settings.VECTOR_STORE_BACKEND == "numpy":
+                from utilities.vector_index import NumpyVectorIndex as VectorStoreHandler
+            else:
+                from utilities.chromadb import ChromaDBHandler as VectorStoreHandler
+            self.chroma_db = VectorStoreHandler(user_id=self.user_id)
+            logger.info(f"Initialized new {settings.VECTOR_STORE_BACKEND} vector db")
+        return self.chroma_db
+
     def _create_summarization_query(self, query_new: str, 
                                     branding_requirements_message: str, 
                                     language_of_output: Dict[str, List[str]]) -> str:
@@ -448,6 +524,33 @@ class DVoiceCreator(DVoiceReviser):
 
         return combined_docs_repo
     
+    def _start_incremental_revision(self,
+                                    executor: Executor,
+                                    language_of_output: Dict[str, List[str]],
+                                    create_second_output_other_official_language: Optional[bool]) -> List[IncrementalReviser]:
+        """
+        Returns the revisers of a content about to be generated: the paragraphs handed to them (see
+        `broadcast_paragraphs`) are chunked, classified and revised while the rest of the content is generated.
+
+        Args:
+            executor (Executor): The executor the chunks are revised on.
+            language_of_output (Dict[str, List[str]]): The language(s) of the output.
+            create_second_output_other_official_language (Optional[bool]): Flag to also translate the content into
+                                                                           the other official language.
+
+        Returns:
+            revisers (List[IncrementalReviser]): The reviser of the content, followed by the reviser of its
+                                                 translation when a second official language is required.
+        """
+        output_file_name = f"{self.user_friendly_file_name_root}.docx"
+        progress_callback = lambda completed, total: self._report_progress("revised", completed, total)
+        revisers = [IncrementalReviser(self.token, output_file_name, executor, progress_callback=progress_callback)]
+        if create_second_output_other_official_language:
+            revisers.append(IncrementalReviser(self.token, output_file_name, executor,
+                                               target_language=language_of_output["language"][1],
+                                               progress_callback=progress_callback))
+        return revisers
+
     def _apply_revision(self, dvoice_content_repo: Dict[str, Any]) -> Dict[str, Any]:
         """
         Apply revisions to the documents in the repository based on guidelines.
@@ -460,16 +563,21 @@ class DVoiceCreator(DVoiceReviser):
             Dict[str, Any]: Repository with revised document content.
         """
         # Second chunking after layout reconstruction
-        chunked_documents_post_layout = chunk_documents_cohesively(dvoice_content_repo)
+        with stage("chunk"):
+            chunked_documents_post_layout = chunk_documents_cohesively(dvoice_content_repo)
         # Classify whether the input is to be considered for DVoice
-        file_chunks_classification_repo = chunk_classification(chunked_documents_post_layout, self.token)
+        with stage("classify"):
+            file_chunks_classification_repo = chunk_classification(chunked_documents_post_layout, self.token)
         ## TODO: for next iteration load the checklist and grade whether the documents already comply with the checklist
-        revised_document_chunks = asyncio.run(apply_guideline_revisions_to_docs(file_chunks_classification_repo, 
-                                                                                "",    # no additioal instructions to the application of the revision guideline
-                                                                                False, # no additional style modification
-                                                                                self.token))
-        # Reconstruct revised chunks into a file
-        reconstructed_revised_file_repo = reconstruct_revised_chunks_into_file(revised_document_chunks)
+        with stage("revise"):
+            revised_document_chunks = asyncio.run(apply_guideline_revisions_to_docs(file_chunks_classification_repo, 
+                                                                                    "",    # no additioal instructions to the application of the revision guideline
+                                                                                    False, # no additional style modification
+                                                                                    self.token,
+                                                                                    lambda completed, total: \
+                                                                                        self._report_progress("revised", completed, total)))
+            # Reconstruct revised chunks into a file
+            reconstructed_revised_file_repo = reconstruct_revised_chunks_into_file(revised_document_chunks)
 
         return reconstructed_revised_file_repo
     
@@ -486,6 +594,7 @@ class DVoiceCreator(DVoiceReviser):
             Tuple[str, Any, Dict[str, Dict[str, str]]]: Final file name, document object, and saved revision path repository.
         """
         saved_revision_path_repo = {}
+        from DVoice.conversion.file_conversion import convert_to_markdown_and_docx_document # python-docx, bs4, PIL only needed at output time
         for file_path, file_content in reconstructed_revised_file_repo.items():
             final_md_file_path, final_docx_path, final_file_name, doc = convert_to_markdown_and_docx_document(file_path, 
                                                                                                               file_content)
@@ -495,7 +604,7 @@ class DVoiceCreator(DVoiceReviser):
         return final_file_name, doc, saved_revision_path_repo
 
     def _conduct_dvoice_creation_from_files(self, 
-                                            markdown_extract_repo: Dict[str, Any], 
+                                            preflight: TaskGraph, 
                                             number_of_files: int, 
                                             rewritten_query: str, 
                                             language_of_output: Dict[str, Any], 
@@ -504,7 +613,8 @@ class DVoiceCreator(DVoiceReviser):
         Conduct DVoice creation from files in the context.
 
         Args:
-            markdown_extract_repo (Dict[str, Any]): Repository containing markdown extracted content.
+            preflight (TaskGraph): The pre-flight analyses of the job (see `_start_preflight_analyses`), with the
+                                   summaries of the files and the analyses of the query.
             number_of_files (int): Number of files to process.
             rewritten_query (str): Rewritten query for content generation.
             language_of_output (Dict[str, Any]): Language settings for the output.
@@ -514,24 +624,16 @@ class DVoiceCreator(DVoiceReviser):
             self.dvoice_content_repo: Dict[str, Any]: Repository containing generated DVoice content.
         """
         print("creation process -- with files in context")
-        ## chunk the document or several document cohesively
-        chuncked_documents_pre_layout = chunk_documents_cohesively(markdown_extract_repo)
-        ## prepare the chunks for processing for summarization
-        concatenated_data = prepare_list_chunks_and_metadata(chuncked_documents_pre_layout)
-        ## generate a very high level summary for each of the files, hard compression = True means it is a high level 
-        ## summary
-        final_data_chunk_level_summary = create_doc_summary(concatenated_data, 
-                                                            query = "Please summarize the document", 
-                                                            hard_compression=True)
+        ## the chunks of the files and their very high level summary, made concurrently with the query analyses
+        concatenated_data, final_data_chunk_level_summary = preflight.result("document_summaries")
 
         if number_of_files >= 1: # if there is at least one file for processing
-            ## break down the entire query submitted by the user to multiple granular queries that limits themsles
-            ## to one singular concern//output. In other words, we identify the list of sub queries
-            list_of_tasks_to_complete = break_down_query_to_multiple_query_output(self.token, rewritten_query)
-            ## identify whether the query aims to generate one output only
-            only_one_file_indicator = identify_number_output_files(self.token, rewritten_query)
-            ## identify whether each sub query is summarization, rewriting or retrieval type of task
-            query_task_pairs = determine_query_task_type_pairs(self.token, rewritten_query, list_of_tasks_to_complete)
+            ## the list of sub queries the entire query submitted by the user was broken down to
+            list_of_tasks_to_complete = preflight.result("query_breakdown")
+            ## whether the query aims to generate one output only
+            only_one_file_indicator = preflight.result("only_one_file")
+            ## whether each sub query is summarization, rewriting or retrieval type of task
+            query_task_pairs = preflight.result("query_task_pairs")
             ## initialize the generated content
             generated_content = ""
             ## if only one expected output as per the intent of the user:
@@ -556,11 +658,29 @@ class DVoiceCreator(DVoiceReviser):
                     # direct llm call
                     dvoice_content_repo = self._conduct_dvoice_creation_without_files(rewritten_query,
                                                                                       language_of_output,
-                                                                                      create_second_output_other_official_language) ## note translation is already covered inside
+                                                                                      create_second_output_other_official_language,
+                                                                                      list_of_tasks_to_complete=list_of_tasks_to_complete) ## note translation is already covered inside
                     ## generated/created content
                     return dvoice_content_repo
                 ## if the query is better answered through a retrieval process
-                if task_type[0] == "retrieval":
+                if task_type[0] == "retrieval" and STREAMING_CREATION:
+                    ## the answer is revised (and translated) while it is being generated
+                    with ThreadPoolExecutor(max_workers=STREAMING_REVISION_MAX_WORKERS) as revision_executor:
+                        revisers = self._start_incremental_revision(revision_executor,
+                                                                    language_of_output,
+                                                                    create_second_output_other_official_language)
+                        generated_content = conduct_retrieval_based_content_generation(self.token,
+                                                                                       concatenated_data,
+                                                                                       necessary_input_files,
+                                                                                       query_new,
+                                                                                       self.branding_requirements_message,
+                                                                                       language_of_output, 
+                                                                                       self._get_chroma_db(),
+                                                                                       broadcast_paragraphs(revisers))
+                        self.dvoice_content_repo[f"{self.user_friendly_file_name_root}.docx"] = \
+                            " \n\n ".join(reviser.result(generated_content) for reviser in revisers)
+                    self.dvoice_content_revised = True
+                elif task_type[0] == "retrieval":
                     ## conduct a RAG to get the content you need
                     generated_content = conduct_retrieval_based_content_generation(self.token,
                                                                                    concatenated_data,
@@ -568,7 +688,7 @@ class DVoiceCreator(DVoiceReviser):
                                                                                    query_new,
                                                                                    self.branding_requirements_message,
                                                                                    language_of_output, 
-                                                                                   self.chroma_db)
+                                                                                   self._get_chroma_db())
                     ## if it was determined that translation into the other canadian official language is required
                     if create_second_output_other_official_language:
                         from DVoice.prompt.prompt_actions import translate_identical_alternative_language
@@ -621,7 +741,8 @@ class DVoiceCreator(DVoiceReviser):
                     # direct llm call
                     dvoice_content_repo = self._conduct_dvoice_creation_without_files(rewritten_query,
                                                                                       language_of_output,
-                                                                                      create_second_output_other_official_language) ## note translation is already covered inside
+                                                                                      create_second_output_other_official_language,
+                                                                                      list_of_tasks_to_complete=list_of_tasks_to_complete) ## note translation is already covered inside
                     return dvoice_content_repo
             # if more than output is expected from the user intent
             elif only_one_file_indicator["only_one_file"] is False:
@@ -644,7 +765,8 @@ class DVoiceCreator(DVoiceReviser):
                             logger.info("Intead, we will answer the query through direct LLM generation")
                         alternative_generated_content = self._conduct_dvoice_creation_without_files(rewritten_query,
                                                                                           language_of_output,
-                                                                                          create_second_output_other_official_language
+                                                                                          create_second_output_other_official_language,
+                                                                                          list_of_tasks_to_complete=list_of_tasks_to_complete
                                                                                             )
                         ## the brought content from the direct llm call is then appended to the generated content variable
                         ## indeed product decided that for now we only generate one file only even when multiple
@@ -660,7 +782,8 @@ class DVoiceCreator(DVoiceReviser):
                                                                                        necessary_input_files,
                                                                                        query_new,
                                                                                        self.branding_requirements_message,
-                                                                                       language_of_output)
+                                                                                       language_of_output,
+                                                                                       self._get_chroma_db())
                         ## if the primary content needs to be translated into the other official language
                         if create_second_output_other_official_language:
                             from DVoice.prompt.prompt_actions import translate_identical_alternative_language
@@ -720,18 +843,20 @@ class DVoiceCreator(DVoiceReviser):
                                             "blob_folder_name": None,
                                             "blob_container_name": None}}}
                 # update the thread flag for async threading
-                update_file_thread_flag(task_id=self.task_id,
-                                    file_name= "attempted_dvoice_creation_output_failed.docx",
-                                    thread_status="Completed - could not generate any content",
-                                    token= self.token, 
-                                    thread_output=thread_output)
+                report_status(task_id=self.task_id,
+                          file_name= "attempted_dvoice_creation_output_failed.docx",
+                          thread_status="Completed - could not generate any content",
+                          token= self.token, 
+                          thread_output=thread_output)
 
         return self.dvoice_content_repo # final DVoice creation output for situation when user upload files
     
     def _conduct_dvoice_creation_without_files(self,
                                                rewritten_query: str,
                                                language_of_output: Dict[str, List[str]],
-                                               create_second_output_other_official_language: Optional[bool]
+                                               create_second_output_other_official_language: Optional[bool],
+                                               revise_incrementally: bool = False,
+                                               list_of_tasks_to_complete: Optional[Dict[str, List[str]]] = None
                                                ) -> Dict[str, str]:
         """
         Conducts the DVoice creation process without any reference files.
@@ -740,6 +865,11 @@ class DVoiceCreator(DVoiceReviser):
             rewritten_query (str): The rewritten query to be processed.
             language_of_output (Dict[str, List[str]]): The language(s) of the output.
             create_second_output_other_official_language (Optional[bool]): Flag to create output in a second official language.
+            revise_incrementally (bool): Streams the generation of each sub query and revises (and translates) its
+                                         paragraphs while the rest is generated, the content returned is then
+                                         already revised (self.dvoice_content_revised). Defaults to False.
+            list_of_tasks_to_complete (Optional[Dict[str, List[str]]]): The breakdown of the rewritten query into sub
+                                         queries when already known (pre-flight analyses). Defaults to None.
  
         Returns:
             Dict[str, str]: The repository containing the generated DVoice content.
@@ -747,28 +877,45 @@ class DVoiceCreator(DVoiceReviser):
         print("creation process -- no files in context")
         from DVoice.content_creation.create_content import generate_dvoice_response_no_context
         ## break down the user query into a list of subqueries
-        list_of_tasks_to_complete = break_down_query_to_multiple_query_output(self.token, rewritten_query)
+        if list_of_tasks_to_complete is None:
+            list_of_tasks_to_complete = break_down_query_to_multiple_query_output(self.token, rewritten_query)
         ## initialize the generated content
         generated_content = ""
-        ## iterate over the list of sub queries
-        for core_query in list_of_tasks_to_complete["query_breakdown"]:
-            ## that function should be in the creation folder
-            print(f"Processing the following query {core_query}")
-            ## initialize the translated content
-            translated_content = ""
-            ## make the direct api call for the sub query
-            generated_content_item = generate_dvoice_response_no_context(self.token, 
-                                                                         core_query, 
-                                                                         self.branding_requirements_message, 
-                                                                         language_of_output["language"][0])
-            # if the sub query also requested the output to be in the other official language
-            if create_second_output_other_official_language:
-                from DVoice.prompt.prompt_actions import translate_identical_alternative_language
-                ## translate to other official language
-                translated_content = translate_identical_alternative_language(self.token, generated_content_item, language_of_output["language"][1])
-                ## UNTIL WE ALLOW MULTI FILE OUTPUT, FOR NOW WE JUST CONCATENATE THE CONTENT FROM BOTH LANGUAGES IN THE SAME OUTPUT THAT WILL BE IN THE SAME DOCX
-            generated_content += " \n\n "+ generated_content_item + " \n\n " + translated_content
+        with ThreadPoolExecutor(max_workers=STREAMING_REVISION_MAX_WORKERS) as revision_executor:
+            ## the generated items whose revision is still going on, with their revisers
+            incrementally_revised_items = []
+            ## iterate over the list of sub queries
+            for core_query in list_of_tasks_to_complete["query_breakdown"]:
+                ## that function should be in the creation folder
+                print(f"Processing the following query {core_query}")
+                ## initialize the translated content
+                translated_content = ""
+                revisers = self._start_incremental_revision(revision_executor,
+                                                            language_of_output,
+                                                            create_second_output_other_official_language) \
+                           if revise_incrementally else []
+                ## make the direct api call for the sub query
+                generated_content_item = generate_dvoice_response_no_context(self.token, 
+                                                                             core_query, 
+                                                                             self.branding_requirements_message, 
+                                                                             language_of_output["language"][0],
+                                                                             broadcast_paragraphs(revisers) if revisers else None)
+                if revisers:
+                    ## the revision (and translation) of the item goes on while the next sub query is generated
+                    incrementally_revised_items.append((generated_content_item, revisers))
+                    continue
+                # if the sub query also requested the output to be in the other official language
+                if create_second_output_other_official_language:
+                    from DVoice.prompt.prompt_actions import translate_identical_alternative_language
+                    ## translate to other official language
+                    translated_content = translate_identical_alternative_language(self.token, generated_content_item, language_of_output["language"][1])
+                    ## UNTIL WE ALLOW MULTI FILE OUTPUT, FOR NOW WE JUST CONCATENATE THE CONTENT FROM BOTH LANGUAGES IN THE SAME OUTPUT THAT WILL BE IN THE SAME DOCX
+                generated_content += " \n\n "+ generated_content_item + " \n\n " + translated_content
+            ## collect the revised items (and their revised translation) in the order of the sub queries
+            for generated_content_item, revisers in incrementally_revised_items:
+                generated_content += " \n\n " + " \n\n ".join(reviser.result(generated_content_item) for reviser in revisers)
         self.dvoice_content_repo[f"{self.user_friendly_file_name_root}.docx"] = generated_content
+        self.dvoice_content_revised = revise_incrementally
 
         return self.dvoice_content_repo
     
@@ -781,15 +928,22 @@ class DVoiceCreator(DVoiceReviser):
         Args:
             dvoice_content_repo (Dict[str, str]): The repository containing the generated DVoice content.
         """
-        # conduct revsion
-        reconstructed_revised_file_repo = self._apply_revision(dvoice_content_repo)
+        # conduct revsion, unless the content was already revised while being generated (IncrementalReviser)
+        if self.dvoice_content_revised:
+            reconstructed_revised_file_repo = dvoice_content_repo
+        else:
+            reconstructed_revised_file_repo = self._apply_revision(dvoice_content_repo)
         ## save output into unique output file. For now it is just a unique output file and format docx but could be easily changed if need be.
-        final_file_name, doc, \
-            saved_revision_path_repo = self._create_single_output_file(reconstructed_revised_file_repo)
+        with stage("convert"):
+            final_file_name, doc, \
+                saved_revision_path_repo = self._create_single_output_file(reconstructed_revised_file_repo)
+        self._report_progress("converted")
         ## save to blob storage
-        file_name, folder_name, container_name = save_blob_file(doc_to_save= doc, 
-                                                            file_name= f"{self.user_id.split('@')[0]}/{final_file_name}",
-                                                            token= self.token)
+        with stage("upload"):
+            file_name, folder_name, container_name = save_blob_file(doc_to_save= doc, 
+                                                                file_name= f"{self.user_id.split('@')[0]}/{final_file_name}",
+                                                                token= self.token)
+        self._report_progress("uploaded")
         # save the results in the DVoiceReviser class attributes
         self.saved_revision_path_repo = saved_revision_path_repo
         self.captured_modification_explanation_repo = "No explanation are captured for DVoice creation but they can easily if need be :)"
@@ -806,12 +960,151 @@ class DVoiceCreator(DVoiceReviser):
                                             "blob_name": file_name,
                                             "blob_folder_name": folder_name,
                                             "blob_container_name": container_name}}}
-        update_file_thread_flag(task_id=self.task_id,
-                                file_name=file_name,
-                                thread_status="Completed",
-                                token= self.token,
-                                thread_output=thread_output)
+        report_status(task_id=self.task_id,
+                      file_name=file_name,
+                      thread_status="Completed",
+                      token= self.token,
+                      thread_output=thread_output)
         
+    def _summarize_reference_files(self, 
+                                   markdown_extract_repo: Dict[str, Any]) -> Tuple[Dict[str, List[Dict[str, Any]]], Any]:
+        """
+        Chunks the uploaded files and generates a very high level summary of each of them (hard compression).
+
+        Args:
+            markdown_extract_repo (Dict[str, Any]): Repository containing markdown extracted content.
+
+        Returns:
+            concatenated_data, final_data_chunk_level_summary:
+            Tuple[Dict[str, List[Dict[str, Any]]], Any]: The chunks of the files prepared for summarization and
+                                                         the summary of each file.
+        """
+        ## chunk the document or several document cohesively
+        chuncked_documents_pre_layout = chunk_documents_cohesively(markdown_extract_repo)
+        ## prepare the chunks for processing for summarization
+        concatenated_data = prepare_list_chunks_and_metadata(chuncked_documents_pre_layout)
+        ## generate a very high level summary for each of the files, hard compression = True means it is a high level 
+        ## summary
+        final_data_chunk_level_summary = create_doc_summary(concatenated_data, 
+                                                            query = "Please summarize the document", 
+                                                            hard_compression=True)
+
+        return concatenated_data, final_data_chunk_level_summary
+
+    def _start_preflight_analyses(self, query: str) -> TaskGraph:
+        """
+        Starts the analyses of the query that come before the generation, and the parsing and summary of the
+        uploaded files, as a dependency graph (utilities/task_graph.py): each analysis starts as soon as the ones it
+        needs are done, so they take the time of the longest path instead of the sum of their LLM round trips.
+
+            initial_language ─┬─> file_name
+                              └─> english_query ─┬─> language
+                                                 └─> rewritten_query ─┬─> query_breakdown ─┬─> query_task_pairs
+                                                                      ├─> query_intent ────┘   (files only)
+                                                                      └─> only_one_file        (files only)
+            bill_96_compliance
+            parsed_files ─> document_summaries                                                 (files only)
+
+        With QUERY_UNDERSTANDING_SINGLE_CALL, the analyses of the query all come from one `query_understanding` step
+        (one structured output call, see prompt_actions.understand_query) and the graph above is only followed, step
+        by step, when that call fails.
+
+        Args:
+            query (str): The topic prompt of the user.
+
+        Returns:
+            preflight (TaskGraph): The started graph, read its results with `preflight.result(<step>)` and close it
+                                   at the end of the job.
+        """
+        has_reference_files = bool(self.post_request_data["referenceFileListInput"])
+
+        def determine_file_name(initial_language: Dict[str, Any]) -> str:
+            try:
+                return determine_file_output_user_friendly_name(query, initial_language['language'][0], self.token)
+            except Exception as e:
+                logger.info(f"Could not determine the output file name ({e}), using the default one")
+                return "generated_output_creation_DVoice"
+
+        def is_french_only(language: Dict[str, Any]) -> bool:
+            return "FR" in language["language"] and len(language["language"]) == 1
+
+        def determine_output_language(initial_language: Dict[str, Any], english_query: str) -> Dict[str, Any]:
+            if is_french_only(initial_language):
+                return determine_input_language(english_query, self.token)
+            ## a copy: the languages are completed later on while the file name step may still read them
+            return {**initial_language, "language": list(initial_language["language"])}
+
+        def parse_reference_files() -> Tuple[Dict[str, Any], int]:
+            from DVoice.parsing.file_parsing import parse_files, extract_markdown_from_parsed_output # only needed when file upload
+            # source_file_name_list = [input_doc["name"] for input_doc in post_request_data["referenceFileListInput"]] ## TODO: should be self in the future
+            conv_results, number_of_files, unsupported_doc_repo = parse_files(input_document=self.post_request_data["referenceFileListInput"], 
+                                                                              token=self.token,
+                                                                              default_credential = self.default_credential,
+                                                                              file_extension= self.post_request_data["fileExtension"])
+            # extract the content into markdown
+            markdown_extract_repo = extract_markdown_from_parsed_output(conv_results, 
+                                                                        number_of_files, 
+                                                                        self.token,
+                                                                        unsupported_doc_repo)
+            self._report_progress("parsed")
+            return markdown_extract_repo, number_of_files
+
+        preflight = TaskGraph("preflight")
+        if QUERY_UNDERSTANDING_SINGLE_CALL:
+            ## all the analyses of the query in one LLM call, the steps below only read their part of it
+            preflight.add("query_understanding", lambda: understand_query(self.token, query))
+
+        def add_query_analysis(name: str, func: Callable[..., Any], depends_on: Optional[List[str]] = None) -> None:
+            depends_on = depends_on or []
+            if not QUERY_UNDERSTANDING_SINGLE_CALL:
+                preflight.add(name, func, depends_on=depends_on)
+                return
+
+            def from_query_understanding(query_understanding: Dict[str, Any], *arguments: Any) -> Any:
+                if query_understanding:
+                    return query_understanding[name]
+                return func(*arguments) # the single call failed, one call for this analysis
+            preflight.add(name, from_query_understanding, depends_on=["query_understanding", *depends_on])
+
+        # analyze the language in the query to determine the intended output language
+        # that is a business rule decided by product
+        language_identification, confidence = identify_output_language(query)
+        if LOCAL_LANGUAGE_IDENTIFICATION and confidence >= LANGUAGE_IDENTIFICATION_MIN_CONFIDENCE:
+            ## identified locally, the file name does not wait for any LLM call
+            preflight.add("initial_language", lambda: language_identification)
+        else:
+            add_query_analysis("initial_language", lambda: determine_input_language(query, self.token, local_identification=False))
+        preflight.add("file_name", determine_file_name, depends_on=["initial_language"])
+        add_query_analysis("bill_96_compliance", lambda: identify_bill_96_compliance(self.token, query))
+        ## if the query is in French we translate it to English because our prompts expect a query in English
+        add_query_analysis("english_query",
+                           lambda initial_language: translate_query_to_desired_language(self.token, query) \
+                                                    if is_french_only(initial_language) else query,
+                           depends_on=["initial_language"])
+        add_query_analysis("language", determine_output_language, depends_on=["initial_language", "english_query"])
+        add_query_analysis("rewritten_query", lambda english_query: rewrite_query(self.token, english_query),
+                           depends_on=["english_query"])
+        ## break down the entire query to multiple granular queries that limit themselves to one singular concern//output
+        add_query_analysis("query_breakdown",
+                           lambda rewritten_query: break_down_query_to_multiple_query_output(self.token, rewritten_query),
+                           depends_on=["rewritten_query"])
+        if has_reference_files:
+            preflight.add("parsed_files", parse_reference_files, stage_name="parse")
+            preflight.add("document_summaries",
+                          lambda parsed_files: self._summarize_reference_files(parsed_files[0]),
+                          depends_on=["parsed_files"])
+            ## whether the query aims to generate one output only
+            add_query_analysis("only_one_file", lambda rewritten_query: identify_number_output_files(self.token, rewritten_query),
+                               depends_on=["rewritten_query"])
+            ## whether the (rewritten) query is summarization, rewriting or retrieval type of task
+            add_query_analysis("query_intent", lambda rewritten_query: determine_query_intended_task(self.token, rewritten_query),
+                               depends_on=["rewritten_query"])
+            preflight.add("query_task_pairs",
+                          lambda rewritten_query, query_breakdown, query_intent: \
+                              determine_query_task_type_pairs(self.token, rewritten_query, query_breakdown, query_intent),
+                          depends_on=["rewritten_query", "query_breakdown", "query_intent"])
+        return preflight
+
     def run_DVoice_creation(self) -> None:
         """
         Initiates the DVoice creation process, which involves analyzing the input query,
@@ -826,28 +1119,18 @@ class DVoiceCreator(DVoiceReviser):
         
         ## test complex query: Create an executive summary from the attached Global article copy into 
         # a Canadianized article page abiding by Bill 96 compliance on a narrative for board directors
+        start_job(self.task_id, "creation")
+        preflight = None
         try:
-            start_time = time.time()
             query = self.post_request_data["topicPrompt"]
-            # analyze the language in the query to determine the intended output language
-            # that is a business rule decided by product            
-            language_of_output = determine_input_language(query, self.token)
-            # identify the initial language of output
-            initial_language_of_output = language_of_output
-            try:
-                # determine the user friendly name for the output file
-                self.user_friendly_file_name_root = determine_file_output_user_friendly_name(query, 
-                                                                                             initial_language_of_output['language'][0], 
-                                                                                             self.token)
-            except Exception as e:
-                self.user_friendly_file_name_root = "generated_output_creation_DVoice"
-            ## identify whether the query requires bill 96 compliance
-            bill_96_compliance_analysis = identify_bill_96_compliance(self.token, query)
-            ## if the query is in French we translate it to English because our prompts expect a query in English
-            if "FR" in language_of_output["language"] and len(language_of_output["language"]) == 1:
-                query = translate_query_to_desired_language(self.token, query)
-                language_of_output = determine_input_language(query, self.token)
-                ## translate {other} potential values where applicable from Fr to English
+            # run the analyses of the query (and the parsing of the uploaded files) concurrently
+            preflight = self._start_preflight_analyses(query)
+            # the user friendly name for the output file
+            self.user_friendly_file_name_root = preflight.result("file_name")
+            ## whether the query requires bill 96 compliance
+            bill_96_compliance_analysis = preflight.result("bill_96_compliance")
+            ## the intended output language(s), of the query translated to English when it was in French only
+            language_of_output = preflight.result("language")
             ## iitlialize the second language flag
             create_second_output_other_official_language = None
             ## if 2 languages are needed or bill 96 compliance is required
@@ -865,31 +1148,19 @@ class DVoiceCreator(DVoiceReviser):
                 ## make sure in case it has to be bilingual content that EN is first in the list
                 language_of_output["language"] = sorted(language_of_output["language"])
 
-            # rewrite query
-            rewritten_query = rewrite_query(self.token, query)
-            ## maybe putting the query break down action after the analysis
+            # rewritten query
+            rewritten_query = preflight.result("rewritten_query")
             # if files have been uploaded as references
             if bool(self.post_request_data["referenceFileListInput"]): # self.post_request_data['referenceFilesListInput']
-                from DVoice.parsing.file_parsing import parse_files, extract_markdown_from_parsed_output # only needed when file upload
-                
-                # source_file_name_list = [input_doc["name"] for input_doc in post_request_data["referenceFileListInput"]] ## TODO: should be self in the future
-                input_document_list = self.post_request_data["referenceFileListInput"]
-                # parse the files
-                conv_results, number_of_files, unsupported_doc_repo = parse_files(input_document=input_document_list, 
-                                                                                  token=self.token, #self.post_request_data["token"],
-                                                                                  default_credential = self.default_credential,
-                                                                                  file_extension= self.post_request_data["fileExtension"]) # self.post_request_data["fileExtension"])
-                # extract the content into markdown
-                markdown_extract_repo = extract_markdown_from_parsed_output(conv_results, 
-                                                                            number_of_files, 
-                                                                            self.token,
-                                                                            unsupported_doc_repo) 
+                # the files parsed while the query was analyzed
+                _, number_of_files = preflight.result("parsed_files")
                 # conduct the creation process
-                dvoice_content_repo = self._conduct_dvoice_creation_from_files(markdown_extract_repo, 
-                                                                               number_of_files,
-                                                                               rewritten_query,
-                                                                               language_of_output,
-                                                                               create_second_output_other_official_language)
+                with stage("generate"):
+                    dvoice_content_repo = self._conduct_dvoice_creation_from_files(preflight, 
+                                                                                   number_of_files,
+                                                                                   rewritten_query,
+                                                                                   language_of_output,
+                                                                                   create_second_output_other_official_language)
                 
                 if not dvoice_content_repo:
                     print("Please retry with a more precise prompt")
@@ -905,20 +1176,22 @@ class DVoiceCreator(DVoiceReviser):
                                             "blob_name": None,
                                             "blob_folder_name": None,
                                             "blob_container_name": None}}}
-                    update_file_thread_flag(task_id=self.task_id,
-                                    file_name= "attempted_dvoice_creation_output_failed.docx",
-                                    thread_status="Completed - could not generate any content",
-                                    token= self.token, 
-                                    thread_output=thread_output)
+                    report_status(task_id=self.task_id,
+                          file_name= "attempted_dvoice_creation_output_failed.docx",
+                          thread_status="Completed - could not generate any content",
+                          token= self.token, 
+                          thread_output=thread_output)
                 else:
                     ## conduct the revision process
                     self._revise_and_save_output(dvoice_content_repo)
                     
             else: # no files are uploaded, direct llm generation in this case
-                dvoice_content_repo = self._conduct_dvoice_creation_without_files(rewritten_query,
-                                                                                  language_of_output,
-                                                                                  create_second_output_other_official_language,
-                                                                                )
+                with stage("generate"):
+                    dvoice_content_repo = self._conduct_dvoice_creation_without_files(rewritten_query,
+                                                                                      language_of_output,
+                                                                                      create_second_output_other_official_language,
+                                                                                      revise_incrementally=STREAMING_CREATION,
+                                                                                      list_of_tasks_to_complete=preflight.result("query_breakdown"))
                 if not dvoice_content_repo:
                     if settings.DEBUG:
                         logger.error("Please retry with a more precise prompt and/or files that are more associated to your query") 
@@ -932,30 +1205,33 @@ class DVoiceCreator(DVoiceReviser):
                                             "blob_name": None,
                                             "blob_folder_name": None,
                                             "blob_container_name": None}}}
-                    update_file_thread_flag(task_id=self.task_id,
-                                    file_name= "attempted_dvoice_creation_output_failed.docx",
-                                    thread_status="Completed - could not generate any content",
-                                    token= self.token, 
-                                    thread_output=thread_output)
+                    report_status(task_id=self.task_id,
+                          file_name= "attempted_dvoice_creation_output_failed.docx",
+                          thread_status="Completed - could not generate any content",
+                          token= self.token, 
+                          thread_output=thread_output)
+                    preflight.close()
+                    finish_job("no_content")
                     return
                 else:
                     self._revise_and_save_output(dvoice_content_repo) ## conduct the revision process 
                 
             if not self.post_request_data['debug']: # if solution deployed in prod no need to save the file in the application here - save it in app directory for easier review of output
                 self.remove_local_output_folder(folder_path="Dvoice//") # remove the folder where the files are saved
-            end_time =  time.time()
-            process_time = end_time - start_time
-
-            logging.info(f"DVoice Creation took {process_time} seconds")
+            preflight.close()
+            finish_job("success")
 
         except Exception as e:
             logging.error(f"Error due to {e}")
+            if preflight is not None:
+                preflight.close() # the analyses not started yet are not needed anymore
                             
-            update_file_thread_flag(task_id=self.task_id,
-                                    file_name= "attempted_dvoice_creation_output_failed.docx",
-                                    thread_status="Failed",
-                                    token= self.token, 
-                                    thread_output=str(e))
+            report_status(task_id=self.task_id,
+                          file_name= "attempted_dvoice_creation_output_failed.docx",
+                          thread_status="Failed",
+                          token= self.token, 
+                          thread_output=str(e))
+            finish_job("error")
             raise e     
                
 if __name__ == "__main__":
@@ -0,0 +1,220 @@
+import io
+import time
+import logging
+from typing import IO, Any, Dict, Literal, Optional
+
+from DVoice.utilities.settings import PDF_DOCLING_NUMBER_PAGES_LIMIT, PDF_TEXT_LAYER_MIN_CHARS_PER_PAGE
+from DVoice.utilities.settings import PDF_SCANNED_PAGE_IMAGE_COVERAGE, PDF_SCANNED_DOCUMENT_PAGE_RATIO
+from DVoice.utilities.settings import PDF_TABLE_PAGE_MIN_PATH_OBJECTS, PDF_TABLE_HEAVY_DOCUMENT_DENSITY
+from DVoice.utilities.settings import PDF_DOCLING_TABLE_HEAVY_NUMBER_PAGES_LIMIT, DEBUG
+from utilities.instrumentation import record_span
+
+## LOGGING CAPABILITIES
+
+logger = logging.getLogger(__name__)
+
+
+class DocumentBuffer:
+    """
+    Holds one immutable bytes object per upload and hands out zero-copy views and streams over it.
+
+    Every consumer of an upload (pypdfium2 inspection, docling, Azure Document Intelligence) used to get its own
+    copy of the file through `BytesIO(byte_io.getvalue())` and `.read()`. Here the bytes are captured once and:
+        - `view` is a memoryview over the shared bytes (no copy)
+        - `stream()` returns a fresh BytesIO positioned at 0 that shares the bytes until somebody writes into it
+          (CPython BytesIO is copy-on-write when initialized from a bytes object), so each parser gets its own
+          file position without duplicating the payload
+    """
+    def __init__(self, data: bytes, name: Optional[str] = None) -> None:
+        """
+        Args:
+            data (bytes): The immutable content of the upload.
+            name (Optional[str]): The file name of the upload, for logging purposes.
+        """
+        self._data = data
+        self.name = name
+        self.view = memoryview(data)
+
+    @classmethod
+    def from_upload(cls, byte_io: IO[bytes], name: Optional[str] = None) -> "DocumentBuffer":
+        """
+        Captures the content of an uploaded BytesIO (or spooled download) without copying it when possible.
+
+        Args:
+            byte_io (IO[bytes]): The BytesIO or SpooledTemporaryFile coming from the blob storage download.
+            name (Optional[str]): The file name of the upload.
+
+        Returns:
+            DocumentBuffer: The shared buffer for the upload.
+
+        Notes:
+            - `getvalue()` returns the underlying bytes object itself (no copy) as long as the BytesIO has not been
+              written to after being created from bytes.
+            - Other file objects (the spooled blob storage downloads) are read once from the start and closed, which
+              releases their memory or temporary file: the buffer becomes the only copy.
+        """
+        if isinstance(byte_io, DocumentBuffer):
+            return byte_io
+        if isinstance(byte_io, (bytes, bytearray, memoryview)):
+            return cls(bytes(byte_io), name)
+        if isinstance(byte_io, io.BytesIO):
+            return cls(byte_io.getvalue(), name)
+        byte_io.seek(0)
+        data = byte_io.read()
+        byte_io.close()
+        return cls(data, name)
+
+    @property
+    def data(self) -> bytes:
+        """The shared immutable bytes of the upload."""
+        return self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stream(self) -> io.BytesIO:
+        """
+        Returns a new BytesIO at position 0 sharing the upload bytes (copy-on-write).
+        """
+        return io.BytesIO(self._data)
+
+
+def _inspect_pdf_page(page: Any) -> Dict[str, Any]:
+    """
+    Computes the cheap features of a single pypdfium2 page.
+
+    Args:
+        page (pypdfium2.PdfPage): The page to inspect.
+
+    Returns:
+        Dict[str, Any]: The page features:
+            - "char_count": number of characters in the text layer
+            - "has_text_layer": whether the text layer is usable
+            - "image_coverage": share of the page area covered by image objects (capped at 1)
+            - "path_objects": number of vector path objects (ruling lines, cell borders, charts)
+            - "scanned": whether the page looks like a scanned image without usable text
+            - "table_heavy": whether the page looks dominated by tables
+    """
+    import pypdfium2.raw as pdfium_c
+
+    textpage = page.get_textpage()
+    try:
+        char_count = textpage.count_chars()
+    finally:
+        textpage.close()
+
+    width, height = page.get_size()
+    page_area = max(width * height, 1.0)
+    image_area = 0.0
+    path_objects = 0
+    for page_object in page.get_objects(filter=(pdfium_c.FPDF_PAGEOBJ_IMAGE, pdfium_c.FPDF_PAGEOBJ_PATH), max_depth=2):
+        if page_object.type == pdfium_c.FPDF_PAGEOBJ_IMAGE:
+            left, bottom, right, top = page_object.get_pos()
+            image_area += max(right - left, 0) * max(top - bottom, 0)
+        else:
+            path_objects += 1
+
+    has_text_layer = char_count >= PDF_TEXT_LAYER_MIN_CHARS_PER_PAGE
+    image_coverage = min(image_area / page_area, 1.0)
+
+    return {"char_count"    : char_count,
+            "has_text_layer": has_text_layer,
+            "image_coverage": image_coverage,
+            "path_objects"  : path_objects,
+            "scanned"       : (not has_text_layer) and image_coverage >= PDF_SCANNED_PAGE_IMAGE_COVERAGE,
+            "table_heavy"   : path_objects >= PDF_TABLE_PAGE_MIN_PATH_OBJECTS}
+
+
+def inspect_pdf(document_buffer: DocumentBuffer) -> Dict[str, Any]:
+    """
+    Computes page count, text layer presence, scanned vs digital and table density of a PDF in one cheap pass.
+
+    pypdfium2 is given the shared bytes directly (it loads from memory without copying) and only the text layer
+    character count and the page object types/positions are read: no rendering, no text extraction, no layout model.
+
+    Args:
+        document_buffer (DocumentBuffer): The shared buffer of the uploaded PDF.
+
+    Returns:
+        Dict[str, Any]: The PDF profile:
+            - "page_count": number of pages
+            - "text_layer_ratio": share of pages with a usable text layer
+            - "scanned_ratio": share of pages that look scanned
+            - "table_density": share of pages that look table heavy
+            - "scanned": whether the document as a whole is considered scanned
+            - "table_heavy": whether the document as a whole is considered table heavy
+            - "pages": the list of per page features (see `_inspect_pdf_page`), in page order
+    Example:
+        {"page_count": 3, "text_layer_ratio": 1.0, "scanned_ratio": 0.0, "table_density": 0.33,
+         "scanned": False, "table_heavy": True, "pages": [{...}, {...}, {...}]}
+    """
+    import pypdfium2
+
+    start_time = time.time()
+    pdf = pypdfium2.PdfDocument(document_buffer.data)
+    try:
+        pages = []
+        for page_index in range(len(pdf)):
+            page = pdf[page_index]
+            try:
+                pages.append(_inspect_pdf_page(page))
+            finally:
+                page.close()
+    finally:
+        pdf.close()
+
+    page_count = len(pages)
+    denominator = max(page_count, 1)
+    text_layer_ratio = sum(page["has_text_layer"] for page in pages) / denominator
+    scanned_ratio = sum(page["scanned"] for page in pages) / denominator
+    table_density = sum(page["table_heavy"] for page in pages) / denominator
+
+    pdf_profile = {"page_count"      : page_count,
+                   "text_layer_ratio": text_layer_ratio,
+                   "scanned_ratio"   : scanned_ratio,
+                   "table_density"   : table_density,
+                   "scanned"         : scanned_ratio >= PDF_SCANNED_DOCUMENT_PAGE_RATIO,
+                   "table_heavy"     : table_density >= PDF_TABLE_HEAVY_DOCUMENT_DENSITY,
+                   "pages"           : pages}
+
+    end_time = time.time()
+    processing_time = end_time - start_time
+    record_span("parse.pdf_triage", processing_time, f"PDF triage of {document_buffer.name} ({page_count} pages)", page_count=page_count)
+
+    return pdf_profile
+
+
+def select_pdf_parsing_backend(pdf_profile: Dict[str, Any]) -> Literal["docling", "document_intelligence"]:
+    """
+    Picks the parsing backend of a PDF from its triage profile instead of its page count alone.
+
+    Rules:
+        - Scanned documents go to Azure Document Intelligence: its cloud OCR is much faster than docling's local
+          OCR models and docling's fast pipeline can produce blank output on image only pages.
+        - Digital documents up to PDF_DOCLING_NUMBER_PAGES_LIMIT pages go to docling (unchanged behaviour).
+        - Table heavy digital documents go to docling up to PDF_DOCLING_TABLE_HEAVY_NUMBER_PAGES_LIMIT pages
+          because the table structure model is worth the extra latency there.
+        - Everything else goes to Azure Document Intelligence.
+
+    Args:
+        pdf_profile (Dict[str, Any]): The profile returned by `inspect_pdf`.
+
+    Returns:
+        Literal["docling", "document_intelligence"]: The selected backend.
+    """
+    page_count = pdf_profile["page_count"]
+    if pdf_profile["scanned"]:
+        backend = "document_intelligence"
+    elif page_count <= PDF_DOCLING_NUMBER_PAGES_LIMIT:
+        backend = "docling"
+    elif pdf_profile["table_heavy"] and page_count <= PDF_DOCLING_TABLE_HEAVY_NUMBER_PAGES_LIMIT:
+        backend = "docling"
+    else:
+        backend = "document_intelligence"
+
+    if DEBUG:
+        logger.info(f"✅ PDF TRIAGE: {page_count} pages, text layer ratio {pdf_profile['text_layer_ratio']:.2f}, "
+                    f"scanned ratio {pdf_profile['scanned_ratio']:.2f}, table density {pdf_profile['table_density']:.2f} "
+                    f"--> {backend}")
+
+    return backend
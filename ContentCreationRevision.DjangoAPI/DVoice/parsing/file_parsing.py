@@ -1,25 +1,12 @@
-import os, sys
+import sys
 import time
-from docling.datamodel.base_models import InputFormat
-from docling.document_converter import (
-     DocumentConverter,
-     PdfFormatOption,
-     WordFormatOption,
- )
-from docling.pipeline.simple_pipeline import SimplePipeline
-from docling.pipeline.standard_pdf_pipeline import StandardPdfPipeline
-from docling.datamodel.pipeline_options import PdfPipelineOptions
-from docling.backend.pypdfium2_backend import PyPdfiumDocumentBackend
-from docling.datamodel.base_models import DocumentStream
-
-from utilities.blob_storage import get_blob_file
-from DVoice.utilities.llm_and_embeddings_utils import save_tensor_from_blob_to_directory, remove_any_previous_tensors_from_app_directory
 from DVoice.utilities.settings import IMAGE_RESOLUTION_SCALE, GENERATE_PAGE_IMAGES, GENERATE_PICTURE_IMAGES, DEBUG
 from DVoice.utilities.settings import GENERATE_TABLE_IMAGES, PDF_DOCUMENT_HIGH_QUALITY_PARSING
-from DVoice.utilities.settings import DOCLING_LLM_DICT, DOCLING_TRANSFORMER_MODEL_PATH_LOCAL, PDF_DOCLING_NUMBER_PAGES_LIMIT
-from DVoice.utilities.settings import DOCLING_TRANSFORMER_MODEL_PATH_DOCKER, DOCKER_MODE, REFRESH_DOCLING_TENSORS
+from DVoice.utilities.settings import DOCLING_TRANSFORMER_MODEL_PATH_LOCAL
+from DVoice.utilities.settings import DOCLING_TRANSFORMER_MODEL_PATH_DOCKER, DOCKER_MODE, REFRESH_DOCLING_TENSORS, PDF_PAGE_ROUTING
 
 from typing import Any, Dict, List, Optional, Tuple
+from utilities.instrumentation import record_span
 import logging
 
 ## LOGGING CAPABILITIES
@@ -33,6 +20,76 @@ handler.setFormatter(formatter)
 logger.addHandler(handler)
 
 
+def build_docling_converter(docling_transformer_model_path: str) -> Any:
+    """
+    Builds the docling document converter with the parsing configuration defined in DVoice settings.
+
+    Args:
+        docling_transformer_model_path (str): The directory holding the docling layout and tableformer safetensors
+                                              (docker or local path).
+
+    Returns:
+        DocumentConverter: The docling converter, ready for `convert` or `convert_all`.
+
+    Notes:
+        - docling (and torch behind it) is imported here rather than at module level: it takes seconds to import and
+          is only needed when a pdf/docx actually goes through docling (not for .txt or Document Intelligence files).
+    """
+    from docling.datamodel.base_models import InputFormat
+    from docling.document_converter import (
+         DocumentConverter,
+         PdfFormatOption,
+         WordFormatOption,
+     )
+    from docling.pipeline.simple_pipeline import SimplePipeline
+    from docling.pipeline.standard_pdf_pipeline import StandardPdfPipeline
+    from docling.datamodel.pipeline_options import PdfPipelineOptions
+    from docling.backend.pypdfium2_backend import PyPdfiumDocumentBackend
+
+    # baseline docling parsing configuration
+    pipeline_options = PdfPipelineOptions()
+    pipeline_options.artifacts_path = docling_transformer_model_path
+    
+    if PDF_DOCUMENT_HIGH_QUALITY_PARSING: ##please note that lower quality parsing for pdf may lead to having blank output
+        print("PDF_PARSING PARAMETER: COMPLEX DOCUMENT")
+        pipeline_options.images_scale = IMAGE_RESOLUTION_SCALE
+        pipeline_options.generate_page_images = GENERATE_PAGE_IMAGES
+        pipeline_options.generate_picture_images = GENERATE_PICTURE_IMAGES
+        pipeline_options.generate_table_images = GENERATE_TABLE_IMAGES
+        pdf_formatting = PdfFormatOption(pipeline_cls=StandardPdfPipeline, 
+                                         backend=PyPdfiumDocumentBackend,
+                                         pipeline_options=pipeline_options) # for more complex situations
+        doc_converter = (
+            DocumentConverter(  # all of the below is optional, has internal defaults.
+                allowed_formats=[
+                    InputFormat.PDF,
+                    InputFormat.IMAGE,
+                    InputFormat.DOCX,
+                    InputFormat.HTML,
+                    InputFormat.PPTX,
+                    InputFormat.ASCIIDOC,
+                    InputFormat.MD,
+                ],  # whitelist formats, non-matching files are ignored.
+                format_options={
+                    InputFormat.PDF: pdf_formatting,
+                    InputFormat.DOCX: WordFormatOption(
+                        pipeline_cls=SimplePipeline  # , backend=MsWordDocumentBackend
+                    ),
+                },
+            )
+        ) # higher quality but faster parsing
+    else:
+        print("PDF_PARSING PARAMETER: LESS COMPLEX DOCUMENT")
+        doc_converter = DocumentConverter(
+        format_options={
+            InputFormat.PDF: PdfFormatOption(pipeline_options=pipeline_options)
+        }) # lower quality but faster parsing
+    if DEBUG:
+        logger.info(f"✅ Initialize parameters for docling conversion")    
+    
+    return doc_converter
+
+
 def parse_files(input_document: List[Dict[str, Any]], 
                 token, 
                 default_credential: Any, 
@@ -47,6 +104,8 @@ def parse_files(input_document: List[Dict[str, Any]],
     The function returns the parsed results, the number of files processed, 
     and a list of unsupported documents.
     Unsupported documents (by Docling) are .txt and pdf files with number of pages > PDF_DOCLING_NUMBER_PAGES_LIMIT
+    When PDF_PAGE_ROUTING is on, those pdf files are parsed page by page (see `DVoice.parsing.page_routing`):
+    text layer pages are extracted directly and only scanned / table heavy pages go to docling or Document Intelligence.
     For now we only tested this solution with .txt, .pdf and .docx but it could support more like PPTX
  
     Args:
@@ -82,21 +141,16 @@ def parse_files(input_document: List[Dict[str, Any]],
     ## load tensor from blob storage
     if ".pdf" in file_extension:
         
+        from DVoice.utilities.artifact_manager import get_artifact_manager
+        artifact_manager = get_artifact_manager()
         ## only check correct downloading each and every time in debug mode
         if REFRESH_DOCLING_TENSORS:
-            remove_any_previous_tensors_from_app_directory() 
-        # from safetensors.torch import load_file, save_file
-        # import os
-        for tensor_name, llm_directory_path in DOCLING_LLM_DICT.items():
-            # Define input and output filenames
-            output_tensor_path = DOCLING_TRANSFORMER_MODEL_PATH + llm_directory_path + tensor_name
-            if not os.path.exists(output_tensor_path): # if no tensor exist
-                llm_layout_tensor = get_blob_file(token, tensor_name, api_type = "Content_voice_docling_transformers")
-                if DEBUG:
-                    logger.info(f"✅DOWNLOADING TENSORS: Tensor {tensor_name} has been downloaded succesfully")
-                save_tensor_from_blob_to_directory(llm_layout_tensor, output_tensor_path, tensor_name) # save tensor in directory
-                if DEBUG:
-                    logger.info(f"✅SAVING TENSORS IN APP DIRECTORY: Tensor {tensor_name} has been saved at {output_tensor_path}")
+            artifact_manager.remove_all()
+        ## no-op once the tensors are provisioned (at startup or by a previous request), otherwise streamed to disk,
+        ## verified and atomically renamed under a file lock so concurrent jobs never load a half-written tensor
+        artifact_manager.ensure_all(token)
+        if DEBUG:
+            logger.info(f"✅DOCLING TENSORS READY: {artifact_manager.status()}")
     
     unsupported_doc_repo = []
     file_idx_txt = [idx for idx, value in enumerate(file_extension) if value  == ".txt"] # identify the files with .txt ext if any
@@ -118,73 +172,47 @@ def parse_files(input_document: List[Dict[str, Any]],
             input_document = [doc for id, doc in enumerate(input_document) if id not in id_to_pop] # remove txt file from list of files
         
     file_idx_pdf = [idx for idx, value in enumerate(file_extension) if value  == ".pdf"]
-    ## IF VERY large PDF file it should be in unsupported documents
+    ## IF VERY large or scanned PDF file it should be in unsupported documents
     if bool(file_idx_pdf):
-        import io
-        import pypdfium2
-        file_idx_pdf = [idx for idx, value in enumerate(file_extension) if value == ".pdf"]
+        from DVoice.parsing.document_inspection import DocumentBuffer, inspect_pdf, select_pdf_parsing_backend
         id_to_pop = []
         # capturing files that cannot be parsed by docling
         for id in file_idx_pdf:
-            copy_pdf = io.BytesIO(input_document[id]["byte_io"].getvalue()) # take the copy of byte_io to not corrupt the original file for parsing
-            
-            pdf = pypdfium2.PdfDocument(copy_pdf)
-            ## count number of pages
-            if PDF_DOCLING_NUMBER_PAGES_LIMIT < len(pdf): ## if the pdf is too large we will not send it to processing by docling and process it with Azure Document intelligence
-                from utilities.doc_process import analyze_pdf
-                input_document[id]["raw_content"] = analyze_pdf(copy_pdf, default_credential) # azure document intelligence processing
+            ## one shared immutable bytes object per upload: triage, docling and document intelligence all read from it
+            document_buffer = DocumentBuffer.from_upload(input_document[id]["byte_io"], input_document[id]["name"])
+            input_document[id]["document_buffer"] = document_buffer
+            ## page count, text layer, scanned vs digital and table density in one cheap pass
+            input_document[id]["pdf_profile"] = inspect_pdf(document_buffer)
+            if select_pdf_parsing_backend(input_document[id]["pdf_profile"]) == "document_intelligence":
+                if PDF_PAGE_ROUTING:
+                    from DVoice.parsing.page_routing import parse_pdf_per_page
+                    ## text layer pages extracted directly, only the layout pages go to docling / document intelligence
+                    input_document[id]["raw_content"] = parse_pdf_per_page(document_buffer,
+                                                                           input_document[id]["pdf_profile"],
+                                                                           DOCLING_TRANSFORMER_MODEL_PATH,
+                                                                           default_credential)
+                else:
+                    from utilities.doc_process import analyze_pdf
+                    input_document[id]["raw_content"] = analyze_pdf(document_buffer.stream(), default_credential,
+                                                                   input_document[id]["pdf_profile"]["page_count"]) # azure document intelligence processing
                 unsupported_doc_repo.append(input_document[id])
                 id_to_pop.append(id)
+            else:
+                input_document[id]["byte_io"] = document_buffer.stream() # fresh stream at position 0 for docling, no copy
         if id_to_pop:
             file_extension = [ext for id, ext in enumerate(file_extension) if id not in id_to_pop]## remove from the list of extension
             input_document = [doc for id, doc in enumerate(input_document) if id not in id_to_pop]## remove from list of files
 
     overall_start_time = time.time()
-    # baseline docling parsing configuration
-    pipeline_options = PdfPipelineOptions()
-    pipeline_options.artifacts_path = DOCLING_TRANSFORMER_MODEL_PATH
-    
-    if PDF_DOCUMENT_HIGH_QUALITY_PARSING: ##please note that lower quality parsing for pdf may lead to having blank output
-        print("PDF_PARSING PARAMETER: COMPLEX DOCUMENT")
-        pipeline_options.images_scale = IMAGE_RESOLUTION_SCALE
-        pipeline_options.generate_page_images = GENERATE_PAGE_IMAGES
-        pipeline_options.generate_picture_images = GENERATE_PICTURE_IMAGES
-        pipeline_options.generate_table_images = GENERATE_TABLE_IMAGES
-        pdf_formatting = PdfFormatOption(pipeline_cls=StandardPdfPipeline, 
-                                         backend=PyPdfiumDocumentBackend,
-                                         pipeline_options=pipeline_options) # for more complex situations
-        doc_converter = (
-            DocumentConverter(  # all of the below is optional, has internal defaults.
-                allowed_formats=[
-                    InputFormat.PDF,
-                    InputFormat.IMAGE,
-                    InputFormat.DOCX,
-                    InputFormat.HTML,
-                    InputFormat.PPTX,
-                    InputFormat.ASCIIDOC,
-                    InputFormat.MD,
-                ],  # whitelist formats, non-matching files are ignored.
-                format_options={
-                    InputFormat.PDF: pdf_formatting,
-                    InputFormat.DOCX: WordFormatOption(
-                        pipeline_cls=SimplePipeline  # , backend=MsWordDocumentBackend
-                    ),
-                },
-            )
-        ) # higher quality but faster parsing
-    else:
-        print("PDF_PARSING PARAMETER: LESS COMPLEX DOCUMENT")
-        doc_converter = DocumentConverter(
-        format_options={
-            InputFormat.PDF: PdfFormatOption(pipeline_options=pipeline_options)
-        }) # lower quality but faster parsing
-    if DEBUG:
-        logger.info(f"✅ Initialize parameters for docling conversion")    
     
     # processing into a list of DocumentStream docling object to process the byteio output from blob
     if input_document:
-        # list of accepted documents to be processed by main docling parser
-        document_to_process_list = [DocumentStream(name=input_dict["name"],stream=input_dict["byte_io"]) \
+        from docling.datamodel.base_models import DocumentStream
+        from DVoice.parsing.document_inspection import DocumentBuffer
+        doc_converter = build_docling_converter(DOCLING_TRANSFORMER_MODEL_PATH) # docling only loaded when documents are left for it
+        # list of accepted documents to be processed by main docling parser (docling needs a BytesIO, spooled downloads are read once)
+        document_to_process_list = [DocumentStream(name=input_dict["name"],
+                                                   stream=DocumentBuffer.from_upload(input_dict["byte_io"], input_dict["name"]).stream()) \
                                                                                         for input_dict in input_document]
         conv_results = doc_converter.convert_all(document_to_process_list, raises_on_error=True) # docling conversion generator object
     else:
@@ -194,7 +222,7 @@ def parse_files(input_document: List[Dict[str, Any]],
     
     overall_end_time = time.time()
     overall_time = overall_end_time - overall_start_time
-    print(f"Parsing initialization took {overall_time} second(s)")
+    record_span("parse.init", overall_time, "Parsing initialization")
     
     if unsupported_doc_repo: ## to support dvoice creation of ingestion of .txt files
         return conv_results, number_of_files, unsupported_doc_repo
@@ -263,8 +291,7 @@ def extract_markdown_from_parsed_output(
      
     overall_end_time = time.time()
     overall_time = overall_end_time - overall_start_time
-    print(f"Overall Parsing and Markdown extraction took {overall_time} second(s) / Processing per File \
-        {overall_time / number_of_files} second(s)")
+    record_span("parse.extract_markdown", overall_time, "Overall Parsing and Markdown extraction", number_of_files=number_of_files)
     
     return markdown_extract_repo
 
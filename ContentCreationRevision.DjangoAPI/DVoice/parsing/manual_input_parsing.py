@@ -7,6 +7,7 @@ from DVoice.utilities.llm_structured_output import ManualInputParser
 import asyncio
 import ast
 from typing import Dict, List, Any
+from utilities.instrumentation import record_span
 import time
 
 async def generate_response_async(chunk: str, client: Any) -> str:
@@ -102,7 +103,7 @@ async def process_chunks_parallel(chuncked_documents_pre_layout: Dict[str, List[
     
     end = time.time()
     process_time = end - start
-    print(f"processing the chunks in parallel took {process_time}")
+    record_span("parse.manual_input", process_time, "processing the chunks in parallel")
  
     return markdown_output
 
@@ -0,0 +1,183 @@
+import io
+import time
+import logging
+from typing import Any, Dict, List, Literal
+
+from DVoice.parsing.document_inspection import DocumentBuffer
+from utilities.instrumentation import record_span
+from DVoice.utilities.settings import PDF_DIRECT_EXTRACTION_MAX_IMAGE_COVERAGE, PDF_DOCLING_NUMBER_PAGES_LIMIT, DEBUG
+
+## LOGGING CAPABILITIES
+
+logger = logging.getLogger(__name__)
+
+
+def route_pdf_pages(pdf_profile: Dict[str, Any]) -> Dict[str, List[int]]:
+    """
+    Splits the pages of a PDF between the direct text layer extraction path and the layout backend.
+
+    A page is extracted directly when it has a usable text layer, is not table heavy and is not dominated by images.
+    Every other page (scanned, image heavy or table heavy) needs docling's layout model or Document Intelligence.
+
+    Args:
+        pdf_profile (Dict[str, Any]): The profile returned by `DVoice.parsing.document_inspection.inspect_pdf`.
+
+    Returns:
+        Dict[str, List[int]]: The zero based page indices of each path, in page order.
+        Example: {"direct": [0, 1, 2, 4, 5], "layout": [3]}
+    """
+    routed_pages = {"direct": [], "layout": []}
+    for page_index, page in enumerate(pdf_profile["pages"]):
+        if page["has_text_layer"] and not page["table_heavy"] \
+                and page["image_coverage"] <= PDF_DIRECT_EXTRACTION_MAX_IMAGE_COVERAGE:
+            routed_pages["direct"].append(page_index)
+        else:
+            routed_pages["layout"].append(page_index)
+
+    return routed_pages
+
+
+def extract_text_layer_pages(document_buffer: DocumentBuffer, page_indices: List[int]) -> Dict[int, str]:
+    """
+    Extracts the text layer of the given pages with pypdfium2 (no layout model, no OCR).
+
+    Args:
+        document_buffer (DocumentBuffer): The shared buffer of the uploaded PDF.
+        page_indices (List[int]): The zero based indices of the pages to extract.
+
+    Returns:
+        Dict[int, str]: The extracted text of each page, keyed by page index. Lines are kept, paragraph breaks
+                        are normalized to a blank line so the cohesive chunking can split on them.
+    """
+    import pypdfium2
+
+    extracted_pages = {}
+    pdf = pypdfium2.PdfDocument(document_buffer.data)
+    try:
+        for page_index in page_indices:
+            page = pdf[page_index]
+            textpage = page.get_textpage()
+            try:
+                text = textpage.get_text_range()
+            finally:
+                textpage.close()
+                page.close()
+            text = text.replace("\r\n", "\n").replace("\r", "\n").replace("\x0c", "\n\n")
+            extracted_pages[page_index] = text.strip()
+    finally:
+        pdf.close()
+
+    return extracted_pages
+
+
+def build_sub_pdf(document_buffer: DocumentBuffer, page_indices: List[int]) -> DocumentBuffer:
+    """
+    Builds a new PDF that only holds the given pages of the upload, so the layout backend never sees text layer pages.
+
+    Args:
+        document_buffer (DocumentBuffer): The shared buffer of the uploaded PDF.
+        page_indices (List[int]): The zero based indices of the pages to keep, in page order.
+
+    Returns:
+        DocumentBuffer: The buffer of the sub PDF. Page k of the sub PDF is `page_indices[k]` of the upload.
+    """
+    import pypdfium2
+
+    source_pdf = pypdfium2.PdfDocument(document_buffer.data)
+    sub_pdf = pypdfium2.PdfDocument.new()
+    try:
+        sub_pdf.import_pages(source_pdf, pages=page_indices)
+        output_stream = io.BytesIO()
+        sub_pdf.save(output_stream)
+    finally:
+        sub_pdf.close()
+        source_pdf.close()
+
+    return DocumentBuffer.from_upload(output_stream, name=document_buffer.name)
+
+
+def parse_layout_pages(sub_pdf_buffer: DocumentBuffer,
+                       page_indices: List[int],
+                       backend: Literal["docling", "document_intelligence"],
+                       docling_transformer_model_path: str,
+                       default_credential: Any) -> Dict[int, str]:
+    """
+    Parses the sub PDF of layout pages with docling or Azure Document Intelligence and maps each page back
+    to its index in the original upload.
+
+    Args:
+        sub_pdf_buffer (DocumentBuffer): The sub PDF built by `build_sub_pdf`.
+        page_indices (List[int]): The original page index of each page of the sub PDF.
+        backend (Literal["docling", "document_intelligence"]): The layout backend to use.
+        docling_transformer_model_path (str): The directory holding the docling safetensors.
+        default_credential (Any): Default credentials for Azure Document Intelligence.
+
+    Returns:
+        Dict[int, str]: The parsed content of each layout page keyed by its original page index.
+    """
+    parsed_pages = {}
+    if backend == "docling":
+        from docling.datamodel.base_models import DocumentStream
+        from DVoice.parsing.file_parsing import build_docling_converter
+        doc_converter = build_docling_converter(docling_transformer_model_path)
+        conv_result = doc_converter.convert(DocumentStream(name=sub_pdf_buffer.name, stream=sub_pdf_buffer.stream()),
+                                            raises_on_error=True)
+        for sub_page_number, page_index in enumerate(page_indices, start=1): # docling page numbers start at 1
+            parsed_pages[page_index] = conv_result.document.export_to_markdown(page_no=sub_page_number)
+    else:
+        from utilities.doc_process import analyze_pdf_pages
+        for page_index, page_content in zip(page_indices, analyze_pdf_pages(sub_pdf_buffer.stream(), default_credential, len(page_indices))):
+            parsed_pages[page_index] = page_content
+
+    return parsed_pages
+
+
+def parse_pdf_per_page(document_buffer: DocumentBuffer,
+                       pdf_profile: Dict[str, Any],
+                       docling_transformer_model_path: str,
+                       default_credential: Any) -> str:
+    """
+    Parses a PDF page by page: text layer pages through pypdfium2 direct extraction, scanned, image heavy or
+    table heavy pages through docling (when few enough) or Azure Document Intelligence, merged back in page order.
+
+    For typical long, mostly text reports this removes the Document Intelligence upload/poll of the whole file
+    and keeps the expensive backend for the handful of pages that actually need it.
+
+    Args:
+        document_buffer (DocumentBuffer): The shared buffer of the uploaded PDF.
+        pdf_profile (Dict[str, Any]): The profile returned by `inspect_pdf`.
+        docling_transformer_model_path (str): The directory holding the docling safetensors.
+        default_credential (Any): Default credentials for Azure Document Intelligence.
+
+    Returns:
+        str: The raw content of the whole document, pages separated by a blank line, in page order.
+    """
+    start_time = time.time()
+    routed_pages = route_pdf_pages(pdf_profile)
+    parsed_pages = extract_text_layer_pages(document_buffer, routed_pages["direct"])
+
+    if routed_pages["layout"]:
+        ## scanned documents or too many layout pages for docling go to document intelligence
+        if pdf_profile["scanned"] or len(routed_pages["layout"]) > PDF_DOCLING_NUMBER_PAGES_LIMIT:
+            layout_backend = "document_intelligence"
+        else:
+            layout_backend = "docling"
+        sub_pdf_buffer = build_sub_pdf(document_buffer, routed_pages["layout"])
+        parsed_pages.update(parse_layout_pages(sub_pdf_buffer,
+                                               routed_pages["layout"],
+                                               layout_backend,
+                                               docling_transformer_model_path,
+                                               default_credential))
+    else:
+        layout_backend = None
+
+    raw_content = "\n\n".join([parsed_pages[page_index] for page_index in sorted(parsed_pages)])
+
+    end_time = time.time()
+    processing_time = end_time - start_time
+    if DEBUG:
+        logger.info(f"✅ PAGE ROUTING: {len(routed_pages['direct'])} page(s) extracted directly, "
+                    f"{len(routed_pages['layout'])} page(s) parsed with {layout_backend}")
+    record_span("parse.per_page", processing_time, f"Per page parsing of {document_buffer.name}")
+
+    return raw_content
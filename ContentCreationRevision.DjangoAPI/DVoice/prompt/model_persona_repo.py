@@ -89,6 +89,12 @@ MODEL_PERSONA_QUERY_BREAKDOWN = """
                                 into different broken down parts.
                                 """
 
+MODEL_PERSONA_QUERY_UNDERSTANDING = """
+                                    You are an exceptional analyst and translator who can easily understand queries of various \
+                                    complexity levels: their intended language, task, number of outputs and compliance requirements, \
+                                    and who can rephrase and break them down while keeping their original intent.
+                                    """
+
 MODEL_PERSONA_FILE_SELECTOR = """
                               You are an exceptional analyst that can easily identify the files that best respond to \
                               a user request.
@@ -1,21 +1,31 @@
 from DVoice.prompt.model_persona_repo import MODEL_PERSONA_ADDITIONAL_INSTRUCTION_CATEGORIZATION, MODEL_PERSONA_TEXT_REVISION
 from DVoice.prompt.model_persona_repo import MODEL_PERSONA_TRANSLATOR, MODEL_PERSONA_FILE_SELECTOR, MODEL_PERSONA_TEXT_VS_NOT_TEXT_CLASSIFICATION
 from DVoice.prompt.model_persona_repo import MODEL_PERSONA_LANGUAGE_IDENTIFIER, MODEL_PERSONA_QUERY_BREAKDOWN, MODEL_PERSONA_QUERY_CLASSIFIER
-from DVoice.prompt.model_persona_repo import MODEL_PERSONA_FILE_NAME_DETERMINATION
+from DVoice.prompt.model_persona_repo import MODEL_PERSONA_FILE_NAME_DETERMINATION, MODEL_PERSONA_QUERY_UNDERSTANDING
 from DVoice.prompt.prompt_repo import ADDITIONAL_INSTRUCTION_CATEGORIZATION_PROMPT, INPUT_LANGUAGE_CLASSIFICATION_PROMPT 
 from DVoice.prompt.prompt_repo import INPUT_TRANSLATION_PROMPT, INPUT_QUERY_BREAKDOWN_PROMPT, INPUT_QUERY_REWRITER_PROMPT 
 from DVoice.prompt.prompt_repo import INPUT_NUMBER_OF_OUTPUT_TO_GENERATE_PROMPT, INPUT_BILL_96_COMPLIANCE_IDENTIFIER_PROMPT
 from DVoice.prompt.prompt_repo import INPUT_QUERY_REWRITER_CORE_ACTION_PROMPT, COMPARE_ORIGINAL_VS_NEW_TEXT_PROMPT
 from DVoice.prompt.prompt_repo import INPUT_QUERY_FILE_NAME, INPUT_TRANSLATION_PARAMETER_PROMPT
 from DVoice.prompt.prompt_repo import INPUT_QUERY_INTENT_CLASSIFICATION_PROMPT, generate_prompt_files_identifier_for_retrieval_task
-from DVoice.utilities.settings import AZURE_OPENAI_MODEL_NAME
+from DVoice.prompt.prompt_repo import INPUT_QUERY_UNDERSTANDING_PROMPT
+from DVoice.utilities.settings import AZURE_OPENAI_MODEL_NAME, LOCAL_LANGUAGE_IDENTIFICATION, LANGUAGE_IDENTIFICATION_MIN_CONFIDENCE
+from DVoice.utilities.language_identification import identify_output_language
 from DVoice.utilities.llm_and_embeddings_utils import generate_response_from_text_input, instantiate_azure_openai_client
+from utilities.llm_router import LIGHT_TIER
 from DVoice.utilities.llm_structured_output import PromptCategorizationParser, LanguageCategorization 
 from DVoice.utilities.llm_structured_output import BrokenDownQueries, Bill96Compliance, NumberOfOutputFiles, QueryIntent, ListFiles
+from DVoice.utilities.llm_structured_output import QueryUnderstanding
 import ast, json # for structured output parsing into python memory
 import asyncio
 import time
+import logging
 from typing import Any, Dict, Optional, List
+from utilities.instrumentation import record_span
+
+## LOGGING CAPABILITIES
+
+logger = logging.getLogger(__name__)
 
 def determine_additional_insturctions_intent(manual_input_text: str, 
                                              TOKEN) -> dict:
@@ -40,7 +50,7 @@ def determine_additional_insturctions_intent(manual_input_text: str,
         - Implements a retry mechanism in case of failures.
     """
     
-    client = instantiate_azure_openai_client(TOKEN) # Initialize Azure OpenAI client
+    client = instantiate_azure_openai_client(TOKEN, tier=LIGHT_TIER) # Initialize Azure OpenAI client
     try:
         response = generate_response_from_text_input(ADDITIONAL_INSTRUCTION_CATEGORIZATION_PROMPT,
                                                      MODEL_PERSONA_ADDITIONAL_INSTRUCTION_CATEGORIZATION,
@@ -112,12 +122,15 @@ def determine_clean_intent(prompt_categorization: Dict[str, Any]) -> Dict[str, b
         return {"style_modification":style_modification}
     
 def determine_input_language(query: str, 
-                             TOKEN) -> Dict[str, str]:
+                             TOKEN,
+                             local_identification: bool = LOCAL_LANGUAGE_IDENTIFICATION) -> Dict[str, str]:
     """
     Determines the language of the given input text using an Azure OpenAI model.
  
     This function:
-      - Sends the input `query` to an Azure OpenAI model for language identification.
+      - Identifies the language locally first (`identify_output_language`), in microseconds, and returns it when the
+        identification is confident enough (LANGUAGE_IDENTIFICATION_MIN_CONFIDENCE).
+      - Otherwise sends the input `query` to an Azure OpenAI model for language identification.
       - Parses the model's response to extract the detected language.
       - Handles potential errors by retrying once if an initial failure occurs.
       - Returns a structured dictionary containing the language classification.
@@ -125,6 +138,8 @@ def determine_input_language(query: str,
     Args:
         query (str): The input text for which the language needs to be determined.
         TOKEN (Azur Access Token): Authentication token for accessing the Azure OpenAI API.
+        local_identification (bool): Whether to try the local identification before the LLM. Defaults to
+                                     LOCAL_LANGUAGE_IDENTIFICATION.
  
     Returns:
         Dict[str, str]: A dictionary containing the language classification result, the key is a string and the value is a string
@@ -141,8 +156,16 @@ def determine_input_language(query: str,
         - `generate_response_from_text_input(...)` is called with a predefined prompt for language classification.
         - If an error occurs in the first attempt, the function retries once before failing.
     """
+    if local_identification:
+        start_time = time.time()
+        language, confidence = identify_output_language(query)
+        record_span("language.local_identification", time.time() - start_time,
+                    "Identification of the output language without LLM call", confidence=confidence)
+        if confidence >= LANGUAGE_IDENTIFICATION_MIN_CONFIDENCE:
+            logger.info(f"Completed input language determination locally (confidence {confidence})")
+            return language
     # Instantiate the Azure OpenAI client 
-    client = instantiate_azure_openai_client(TOKEN)
+    client = instantiate_azure_openai_client(TOKEN, tier=LIGHT_TIER)
     try:
         # Attempt to classify the language of the input query
         response = generate_response_from_text_input(INPUT_LANGUAGE_CLASSIFICATION_PROMPT,
@@ -324,7 +347,7 @@ async def process_parameter_translation(list_parameters: List[str], TOKEN) -> Li
     
     end = time.time()
     process_time = end - start
-    print(f"Processing the translation in parallel of the different parameters took {process_time} seconds")
+    record_span("prompt.parameter_translation", process_time, "Processing the translation in parallel of the different parameters")
  
     return results
 
@@ -354,7 +377,7 @@ def break_down_query_to_multiple_query_output(TOKEN: Any, query: str) -> Dict[st
         - The function retries the request in case of an exception to ensure robustness.
         - `response_format=BrokenDownQueries` ensures the response is structured as expected for query breakdown.
     """
-    client = instantiate_azure_openai_client(TOKEN) # Initialize the Azure OpenAI client with the provided TOKEN
+    client = instantiate_azure_openai_client(TOKEN, tier=LIGHT_TIER) # Initialize the Azure OpenAI client with the provided TOKEN
     try:
         response = generate_response_from_text_input(INPUT_QUERY_BREAKDOWN_PROMPT,
                                                      MODEL_PERSONA_QUERY_BREAKDOWN,
@@ -504,7 +527,7 @@ def identify_bill_96_compliance(TOKEN: Any,
         - The function retries the request if the initial attempt fails to ensure reliability.
         - `response_format=Bill96Compliance` specifies that the response is expected to include compliance details in a structured format.
     """
-    client = instantiate_azure_openai_client(TOKEN)
+    client = instantiate_azure_openai_client(TOKEN, tier=LIGHT_TIER)
     try:
         response = generate_response_from_text_input(INPUT_BILL_96_COMPLIANCE_IDENTIFIER_PROMPT,
                                                      MODEL_PERSONA_TEXT_REVISION,
@@ -556,7 +579,7 @@ def identify_number_output_files(TOKEN,
         - The function retries the request if the initial attempt fails to ensure reliability.
         - `response_format=NumberOfOutputFiles` specifies that the response is expected to include the number of output files.
     """
-    client = instantiate_azure_openai_client(TOKEN)
+    client = instantiate_azure_openai_client(TOKEN, tier=LIGHT_TIER)
     try:
         response = generate_response_from_text_input(INPUT_NUMBER_OF_OUTPUT_TO_GENERATE_PROMPT,
                                                      MODEL_PERSONA_TEXT_REVISION,
@@ -608,7 +631,7 @@ def determine_query_intended_task(TOKEN: Any, query: str) -> Dict[str, bool]:
         - The response is parsed to identify the specific task intended by the query in a dictionary
  
     """
-    client = instantiate_azure_openai_client(TOKEN)
+    client = instantiate_azure_openai_client(TOKEN, tier=LIGHT_TIER)
     try:
         response = generate_response_from_text_input(INPUT_QUERY_INTENT_CLASSIFICATION_PROMPT,
                                                      MODEL_PERSONA_QUERY_CLASSIFIER,
@@ -636,6 +659,79 @@ def determine_query_intended_task(TOKEN: Any, query: str) -> Dict[str, bool]:
 
     return query_intent_determinaton
 
+def understand_query(TOKEN: Any, query: str) -> Dict[str, Any]:
+    """
+    Conducts all the analyses of a creation query in one structured output call: the language of the output, the
+    query translated to English, the rewritten query, its breakdown, the bill 96 compliance, the number of output
+    files and the intended task.
+
+    It replaces the calls to `determine_input_language` (twice when the query is in French only),
+    `translate_query_to_desired_language`, `rewrite_query`, `break_down_query_to_multiple_query_output`,
+    `identify_bill_96_compliance`, `identify_number_output_files` and `determine_query_intended_task`: the query
+    and the instructions are sent once instead of eight times and the job waits for one round trip instead of the
+    longest chain of them. The call is made on the default (heavy) tier since it also rewrites and translates the
+    query, like `rewrite_query` and `translate_query_to_desired_language`.
+
+    Args:
+        TOKEN (Azure Access Token): The authentication token to instantiate the Azure OpenAI client.
+        query (str): The topic prompt of the user.
+
+    Returns:
+        Dict[str, Any]: The analyses, each shaped like the output of the function it replaces:
+                        {'initial_language': {'language': [...]},           # determine_input_language on the query
+                         'english_query': str,                              # translate_query_to_desired_language
+                         'language': {'language': [...]},                   # determine_input_language on the english query
+                         'rewritten_query': str,                            # rewrite_query
+                         'query_breakdown': {'query_breakdown': [...]},     # break_down_query_to_multiple_query_output
+                         'bill_96_compliance': {'bill_96_compliance': bool},# identify_bill_96_compliance
+                         'only_one_file': {'only_one_file': bool},          # identify_number_output_files
+                         'query_intent': {'summarization': bool, 'rewriting': bool, 'retrieval': bool}} # determine_query_intended_task
+                        An empty dictionary in case of complete failure, the caller falls back to the separate calls.
+
+    Example:
+    >>> query_understanding = understand_query(TOKEN, "Create a LinkedIn post about the Trade negotiations in EN/FR")
+    >>> print(query_understanding["language"], query_understanding["query_intent"])
+        {'language': ['EN', 'FR']} {'summarization': False, 'rewriting': False, 'retrieval': True}
+
+    Notes:
+        - The function retries the request in case of an error to enhance reliability.
+        - `response_format=QueryUnderstanding` is the composite of the structured outputs of the replaced functions.
+        - The file list (`determine_necessary_files`) is not part of it: it needs the summaries of the uploaded files.
+    """
+    client = instantiate_azure_openai_client(TOKEN)
+    try:
+        response = generate_response_from_text_input(INPUT_QUERY_UNDERSTANDING_PROMPT,
+                                                     MODEL_PERSONA_QUERY_UNDERSTANDING,
+                                                     query, 
+                                                     client, 
+                                                     AZURE_OPENAI_MODEL_NAME,
+                                                     response_format=QueryUnderstanding)
+        query_understanding = json.loads(response[0].choices[0].message.content)
+    except Exception as e:
+        logger.warning(f"Initial error understanding the query {e}")
+        try:
+            response = generate_response_from_text_input(INPUT_QUERY_UNDERSTANDING_PROMPT,
+                                                         MODEL_PERSONA_QUERY_UNDERSTANDING,
+                                                         query, 
+                                                         client, 
+                                                         AZURE_OPENAI_MODEL_NAME,
+                                                         response_format=QueryUnderstanding)
+            query_understanding = json.loads(response[0].choices[0].message.content)
+        except Exception as e:
+            logger.warning(f"Complete failure understanding the query with error {e}")
+            return {} # the caller falls back to one call per analysis
+
+    logger.info("Completed query understanding")
+
+    return {"initial_language"  : {"language": query_understanding["language"]},
+            "english_query"     : query_understanding["english_query"],
+            "language"          : {"language": query_understanding["output_language"]},
+            "rewritten_query"   : query_understanding["rewritten_query"],
+            "query_breakdown"   : {"query_breakdown": query_understanding["query_breakdown"]},
+            "bill_96_compliance": {"bill_96_compliance": query_understanding["bill_96_compliance"]},
+            "only_one_file"     : {"only_one_file": query_understanding["only_one_file"]},
+            "query_intent"      : {task_type: query_understanding[task_type] for task_type in ("summarization", "rewriting", "retrieval")}}
+
 
 def determine_necessary_files(TOKEN: Any, 
                               file_summaries: List[Dict[str, str]], 
@@ -682,7 +778,7 @@ def determine_necessary_files(TOKEN: Any,
 
     prompt_message, query = generate_prompt_files_identifier_for_retrieval_task(file_summaries, user_query, task_type)
 
-    client = instantiate_azure_openai_client(TOKEN)
+    client = instantiate_azure_openai_client(TOKEN, tier=LIGHT_TIER)
     try:
         response = generate_response_from_text_input(prompt_message,
                                                      MODEL_PERSONA_FILE_SELECTOR,
@@ -777,7 +873,8 @@ def translate_identical_alternative_language(TOKEN,
 
 def determine_query_task_type_pairs(TOKEN, 
                                     rewritten_query: str, 
-                                    list_of_tasks_to_complete: Dict[str, List[str]]) -> Dict[str, List[str]]:
+                                    list_of_tasks_to_complete: Dict[str, List[str]],
+                                    intent_analysis: Optional[Dict[str, bool]] = None) -> Dict[str, List[str]]:
     """
     Determines the task type pairs for each query in the provided list based on the analysis of the rewritten query.
  
@@ -790,6 +887,9 @@ def determine_query_task_type_pairs(TOKEN,
         list_of_tasks_to_complete (Dict[str, List[str]]): A dictionary wherethe only and sole (always) key is `query_breakdown`
                                                         and the sole value is  
                                                         the list of sub queries coming from the broken down master query.
+        intent_analysis (Optional[Dict[str, bool]]): The result of `determine_query_intended_task` on the rewritten
+                                                     query when already known (ie computed concurrently with the query
+                                                     breakdown). Defaults to None: it is determined here.
  
     Returns:
         Dict[str, List[str]]: A dictionary where the keys are the sub queries and the values are lists of 1 unique task type
@@ -806,13 +906,15 @@ def determine_query_task_type_pairs(TOKEN,
  
     Notes:
         - The function relies on the `determine_query_intended_task` function to analyze the intent of the query.
+          The intent analysis is made on the rewritten query, so it is made once for all the sub queries.
     """
     query_task_pairs = {}
+    # Perform intent analysis for the rewritten query
+    if intent_analysis is None:
+        intent_analysis = determine_query_intended_task(TOKEN, rewritten_query)
     # Iterate over each task and its associated queries
     for _, tasks in list_of_tasks_to_complete.items():
         for query in tasks:
-            # Perform intent analysis for the rewritten query
-            intent_analysis = determine_query_intended_task(TOKEN, rewritten_query)
             # Determine the task type(s) from the intent analysis
             task_type = [key for key, value in intent_analysis.items() if value is True]
             # Map the query to its determined task type(s)
@@ -904,7 +1006,7 @@ def determine_file_output_user_friendly_name(query: str,
     language = "French" if language == "FR" else "English"
     # Prepare the query for generating the user-friendly file name
     query_to_find_file_name = f"The 'original' query is {query} and please create the file name in {language}"
-    client = instantiate_azure_openai_client(TOKEN)
+    client = instantiate_azure_openai_client(TOKEN, tier=LIGHT_TIER)
     try:
         # Generate the response from the model to determine the user-friendly file name
         response = generate_response_from_text_input(INPUT_QUERY_FILE_NAME,
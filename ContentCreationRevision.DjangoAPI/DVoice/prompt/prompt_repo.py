@@ -288,6 +288,30 @@ OUTPUT_AFTER_FIFTH_REVISION_PROMPT = """
                                     
                                      """
 
+## FUSED REVISION (ALL THE GUIDELINES IN ONE LLM CALL, USED WHEN A JOB IS OVER ITS TOKEN BUDGET - utilities/token_budget.py)
+OUTPUT_AFTER_FUSED_REVISION_PROMPT = """
+                                      
+                                      Given all the above provided guidelines: 
+                                      
+                                      Extract the content from 'page_content' and put it in 'X'. \
+                                      
+                                      - Apply the following logic:
+                                        - While keeping the same page content outline format provided and the 
+                                       same underlying facts and ideas \
+                                      , please rewrite and rephrase the content in 'X' \
+                                      following each of the above style guides one after the other, in the order they were given \
+                                      and assign the new content to 'Z'.
+                                      If there is no content in 'X' or 'X' == 'NOCONTENT', just assign 'NOCONTENT' to 'X' and 'Z'.
+                                        
+                                      As final output please provide the following output as valid JSON, without any code block formatting:
+                                      1. Please assign the content from 'X' as final output and put it in 'original_text' key (Do not add '- page_content:' at the beginning) \
+                                      2. Please assign the value of 'Z' to the 'revised_text_step_4' key. (Do not add '- page_content:' at the beginning)\
+                                     
+                                     """
+
+OUTPUT_AFTER_FUSED_REVISION_WITH_ADDITIONAL_INSTRUCTIONS_PROMPT = OUTPUT_AFTER_FUSED_REVISION_PROMPT.replace("'revised_text_step_4'",
+                                                                                                             "'revised_text_step_5'")
+
 COMPARE_ORIGINAL_VS_NEW_TEXT_PROMPT = """
                       Your responsibility is to compare the 'Original' text with the 'Revised' text and list in bullet points\
                       all the modifications applied to the 'Original' text to make it better.
@@ -501,6 +525,58 @@ INPUT_QUERY_INTENT_CLASSIFICATION_PROMPT = """
 
                                      """
 
+INPUT_QUERY_UNDERSTANDING_PROMPT = f"""
+                                    Your task is to analyze the input query of a user who wants to create content, and to provide \
+                                    all the analyses below at once. Follow the steps in order, each step may use the result of the previous ones:
+
+                                    1. language: analyze whether the user wants the output in French or English or both English and French \
+                                    when clearly specified (both French and English are required when the user asked for content in \
+                                    'English and French' or when the input query states 'the output must be in 'EN/FR' or 'EN/FR'). \
+                                    'FR' for French, 'EN' for English, 'EN/FR' should be ['EN', 'FR'] in the language key.
+
+                                    2. english_query: if the language key is ['FR'] only, translate the input query to its equivalent in English, \
+                                    otherwise keep the input query as is.
+
+                                    3. output_language: the same analysis as the language key, but made on the english_query.
+
+                                    4. rewritten_query: re-phrase the english_query while keeping its original underlying intent: \
+                                    remove any and all instructions regarding the specific desired language for the output (anything asking \
+                                    for the output to be in French or English or EN/FR, or EN, or FR should simply disappear) and remove any \
+                                    references regarding canadianizing the content or applying bill 96 for the purpose to have both English and French content.
+
+                                    5. query_breakdown: break down the rewritten_query into one or multiple queries that are each associated to a \
+                                    clear final file output only where applicable. Keep any requests that require the creation of tabular data/table \
+                                    in the same query. If the query requests to create information about more than 1 topic, keep these several topics \
+                                    in the same query. But, if the query intends to more than 1 output, break it down accordingly. \
+                                    For instance, Please create X>1 <output type> about <topic_1> and <topic_2> should be broken down as: \
+                                    1. Create 1 <output_type> about <topic_1>. 2. Create 1 <output_type> about <topic_2>. \
+                                    Do not break down into multiple queries a query that aims to do the same thing across multiple files. \
+                                    Try to minimize breaking down the query, keep the original intent and context in each broken down query, \
+                                    remove in each of them references to outside files, and keep the rewritten_query alone in the list when it cannot be broken down.
+
+                                    6. bill_96_compliance: whether the content to create should comply with the Canadian bill 96. \
+                                    Compliance is required whenever it is explicitly requested to comply with bill 96 or that it is explicitly \
+                                    requested to have the content in both English (EN) and French (FR). Otherwise, no compliance is requested.
+                                    Some key requirements of bill 96 are:
+                                    {get_bill_96_compliance_guideline()}
+
+                                    7. only_one_file: whether the rewritten_query intends to create only one file or several files as output.
+
+                                    8. summarization, rewriting and retrieval: whether the intent of the rewritten_query is to conduct rewriting \
+                                    of some input content, summarization of the input content, or conducting a retrieval to answer the question at hand. \
+                                    If the query requests to 're-write' some content, then it is rewriting. If the query explicitly requests \
+                                    condensed versions of content (ie summarize a paper, give the key takeaways or the main points of a document, \
+                                    an overview of a topic), then it is summarization. Otherwise, and for any query that requests a specific response \
+                                    output for a particular topic using a specific input file, it is retrieval. Only one of the three is True.
+
+                                    As final output please provide the following output as a valid JSON, without any code block formatting: \
+                                    the language, english_query, output_language, rewritten_query, query_breakdown, bill_96_compliance, \
+                                    only_one_file, summarization, rewriting and retrieval keys, with lists of strings for the language, \
+                                    output_language and query_breakdown keys and booleans True or False (not the string but the actual boolean) \
+                                    for the bill_96_compliance, only_one_file, summarization, rewriting and retrieval keys.
+
+                                    """
+
 def generate_prompt_files_identifier_for_retrieval_task(file_summaries, user_query, task_type):
     """
     """
@@ -0,0 +1,244 @@
+import os
+import json
+import mmap
+import time
+import struct
+import tempfile
+import threading
+import logging
+from typing import Any, Callable, Dict, Optional
+
+from DVoice.utilities.settings import DOCLING_LLM_DICT, DOCKER_MODE, DEBUG
+from DVoice.utilities.settings import DOCLING_TRANSFORMER_MODEL_PATH_DOCKER, DOCLING_TRANSFORMER_MODEL_PATH_LOCAL
+from DVoice.utilities.settings import DOCLING_TENSORS_SHA256, DOCLING_TENSORS_DOWNLOAD_CHUNK_SIZE, DOCLING_TENSORS_LOCK_TIMEOUT
+from DVoice.utilities.settings import DOCLING_TENSORS_RETRY_DELAY, DOCLING_TENSORS_RETRY_MAX_DELAY
+
+## LOGGING CAPABILITIES
+
+logger = logging.getLogger(__name__)
+
+
+def verify_safetensors_file(file_path: str) -> Dict[str, int]:
+    """
+    Checks that a file is a complete safetensors file without reading the tensors.
+
+    The file is memory-mapped and only the header is parsed: 8 bytes little endian header length, the JSON header,
+    then the tensor data whose furthest `data_offsets` end must match the file size. A truncated or half-written
+    download fails this check.
+
+    Args:
+        file_path (str): The path to the safetensors file.
+
+    Returns:
+        Dict[str, int]: {"tensors": <number of tensors>, "size": <file size in bytes>}
+
+    Raises:
+        ValueError: If the file is not a complete safetensors file.
+    """
+    file_size = os.path.getsize(file_path)
+    if file_size < 8:
+        raise ValueError(f"{file_path} is too small to be a safetensors file ({file_size} bytes)")
+
+    with open(file_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped_file:
+        (header_length,) = struct.unpack("<Q", mapped_file[:8])
+        if 8 + header_length > file_size:
+            raise ValueError(f"{file_path} has a header longer than the file, the file is truncated")
+        header = json.loads(mapped_file[8:8 + header_length])
+
+    tensors = {name: tensor for name, tensor in header.items() if name != "__metadata__"}
+    data_size = max([tensor["data_offsets"][1] for tensor in tensors.values()], default=0)
+    if 8 + header_length + data_size != file_size:
+        raise ValueError(f"{file_path} should be {8 + header_length + data_size} bytes but is {file_size} bytes")
+
+    return {"tensors": len(tensors), "size": file_size}
+
+
+class ArtifactManager:
+    """
+    Provisions the docling safetensors once per container and reports their readiness.
+
+    Every pdf request used to check `os.path.exists` for each tensor and, when missing, download it into a BytesIO
+    and write it in place. Two jobs could download the same tensor at the same time and a third could load a
+    half-written file. Here:
+        - provisioning runs at startup (background thread) or lazily, under a per-tensor file lock shared by
+          every worker process
+        - downloads stream to a temporary file in the target directory, are verified (safetensors structure,
+          sha256 when configured in DOCLING_TENSORS_SHA256) and atomically renamed into place
+        - the state of each tensor (missing, provisioning, ready, failed) is kept in memory for the readiness
+          endpoint and so that ready tensors are not checked again on every request
+    """
+    def __init__(self, model_path: str, artifacts: Dict[str, str], expected_sha256: Dict[str, Optional[str]]) -> None:
+        """
+        Args:
+            model_path (str): The docling models directory, ie DOCLING_TRANSFORMER_MODEL_PATH_DOCKER.
+            artifacts (Dict[str, str]): The tensor file names and their sub directory, ie DOCLING_LLM_DICT.
+            expected_sha256 (Dict[str, Optional[str]]): The expected sha256 of each tensor, None to skip the digest check.
+        """
+        self.model_path = model_path
+        self.artifacts = artifacts
+        self.expected_sha256 = expected_sha256
+        self._lock = threading.Lock()
+        self._status = {tensor_name: {"state": "missing", "path": self.artifact_path(tensor_name)}
+                        for tensor_name in artifacts}
+
+    def artifact_path(self, tensor_name: str) -> str:
+        return self.model_path + self.artifacts[tensor_name] + tensor_name
+
+    def _set_status(self, tensor_name: str, **status: Any) -> None:
+        with self._lock:
+            self._status[tensor_name] = {"path": self.artifact_path(tensor_name), **status}
+
+    def status(self) -> Dict[str, Any]:
+        """
+        Returns the readiness of the tensors.
+
+        Example:
+            {"ready": False, "artifacts": {"model.safetensors": {"state": "ready", "path": "...", "size": 171937064},
+                                           "tableformer_fast.safetensors": {"state": "provisioning", "path": "..."}, ...}}
+        """
+        with self._lock:
+            artifacts = {tensor_name: dict(status) for tensor_name, status in self._status.items()}
+        return {"ready": all(status["state"] == "ready" for status in artifacts.values()),
+                "artifacts": artifacts}
+
+    def is_ready(self) -> bool:
+        return self.status()["ready"]
+
+    def ensure_artifact(self, tensor_name: str, token: Any) -> str:
+        """
+        Makes sure one tensor is on disk and complete, downloading it if needed. Safe to call from concurrent
+        threads and processes: only one of them downloads, the others wait on the lock then find the file ready.
+
+        Args:
+            tensor_name (str): The tensor file name, a key of `artifacts`.
+            token (Azure Access Token): The token used to download from the blob storage API.
+
+        Returns:
+            str: The path of the tensor.
+        """
+        output_tensor_path = self.artifact_path(tensor_name)
+        with self._lock:
+            already_ready = self._status[tensor_name]["state"] == "ready"
+        if already_ready and os.path.exists(output_tensor_path):
+            return output_tensor_path
+
+        from filelock import FileLock
+
+        os.makedirs(os.path.dirname(output_tensor_path), exist_ok=True)
+        with FileLock(output_tensor_path + ".lock", timeout=DOCLING_TENSORS_LOCK_TIMEOUT):
+            if os.path.exists(output_tensor_path):
+                try:
+                    verification = verify_safetensors_file(output_tensor_path)
+                    self._set_status(tensor_name, state="ready", size=verification["size"])
+                    return output_tensor_path
+                except ValueError as e:
+                    logger.info(f"Tensor {tensor_name} on disk is not valid ({e}), downloading it again")
+
+            self._set_status(tensor_name, state="provisioning")
+            try:
+                verification = self._download(tensor_name, output_tensor_path, token)
+            except Exception as e:
+                self._set_status(tensor_name, state="failed", error=str(e))
+                raise e
+            self._set_status(tensor_name, state="ready", size=verification["size"])
+
+        return output_tensor_path
+
+    def _download(self, tensor_name: str, output_tensor_path: str, token: Any) -> Dict[str, int]:
+        """
+        Streams a tensor to a temporary file next to its destination, verifies it and renames it into place.
+        """
+        from utilities.blob_storage import stream_blob_file
+
+        start_time = time.time()
+        temporary_file = tempfile.NamedTemporaryFile(dir=os.path.dirname(output_tensor_path),
+                                                     prefix=tensor_name + ".", suffix=".part", delete=False)
+        try:
+            with temporary_file:
+                number_of_bytes, sha256 = stream_blob_file(token, tensor_name, temporary_file,
+                                                           api_type="Content_voice_docling_transformers",
+                                                           chunk_size=DOCLING_TENSORS_DOWNLOAD_CHUNK_SIZE)
+                temporary_file.flush()
+                os.fsync(temporary_file.fileno())
+
+            expected_sha256 = self.expected_sha256.get(tensor_name)
+            if expected_sha256 is not None and sha256 != expected_sha256.lower():
+                raise ValueError(f"Tensor {tensor_name} checksum mismatch: expected {expected_sha256}, got {sha256}")
+            verification = verify_safetensors_file(temporary_file.name)
+            os.replace(temporary_file.name, output_tensor_path) # atomic: readers see the old state or the full file
+        except Exception as e:
+            if os.path.exists(temporary_file.name):
+                os.remove(temporary_file.name)
+            raise e
+
+        end_time = time.time()
+        processing_time = end_time - start_time
+        if DEBUG:
+            logger.info(f"✅DOWNLOADING TENSORS: Tensor {tensor_name} ({number_of_bytes} bytes, sha256 {sha256}) "
+                        f"has been saved at {output_tensor_path}")
+        print(f"Provisioning of tensor {tensor_name} took {processing_time} second(s)")
+
+        return verification
+
+    def ensure_all(self, token: Any) -> Dict[str, Any]:
+        """
+        Makes sure every tensor is on disk and complete. Returns the readiness status.
+        """
+        for tensor_name in self.artifacts:
+            self.ensure_artifact(tensor_name, token)
+        return self.status()
+
+    def remove_all(self) -> None:
+        """
+        Removes the tensors from the app directory (REFRESH_DOCLING_TENSORS debugging).
+        """
+        for tensor_name in self.artifacts:
+            with self._lock:
+                self._status[tensor_name] = {"state": "missing", "path": self.artifact_path(tensor_name)}
+            if os.path.exists(self.artifact_path(tensor_name)):
+                os.remove(self.artifact_path(tensor_name))
+                print(f"{self.artifact_path(tensor_name)} deleted successfully.")
+
+    def provision_in_background(self, get_token: Callable[[], Any]) -> threading.Thread:
+        """
+        Provisions every tensor on a daemon thread so the app starts serving immediately.
+
+        A failure (blob storage or token error) is retried with an exponential backoff, from DOCLING_TENSORS_RETRY_DELAY
+        up to DOCLING_TENSORS_RETRY_MAX_DELAY seconds, until every tensor is ready: the readiness endpoint reports 503
+        meanwhile, and an instance is never left out of rotation by one transient error. A pdf request in between
+        still provisions lazily under the lock.
+
+        Args:
+            get_token (Callable[[], Any]): Returns the Azure access token used for the download.
+        """
+        def provision() -> None:
+            retry_delay = DOCLING_TENSORS_RETRY_DELAY
+            while True:
+                try:
+                    self.ensure_all(get_token())
+                    logger.info("✅ Docling tensors are ready")
+                    return
+                except Exception as e:
+                    logger.info(f"Docling tensors provisioning failed, retrying in {retry_delay} second(s): {e}")
+                time.sleep(retry_delay)
+                retry_delay = min(retry_delay * 2, DOCLING_TENSORS_RETRY_MAX_DELAY)
+
+        provisioning_thread = threading.Thread(target=provision, name="docling-tensors-provisioning", daemon=True)
+        provisioning_thread.start()
+        return provisioning_thread
+
+
+_artifact_manager = None
+_artifact_manager_lock = threading.Lock()
+
+
+def get_artifact_manager() -> ArtifactManager:
+    """
+    Returns the process wide artifact manager of the docling tensors (docker or local path).
+    """
+    global _artifact_manager
+    with _artifact_manager_lock:
+        if _artifact_manager is None:
+            model_path = DOCLING_TRANSFORMER_MODEL_PATH_DOCKER if DOCKER_MODE else DOCLING_TRANSFORMER_MODEL_PATH_LOCAL
+            _artifact_manager = ArtifactManager(model_path, DOCLING_LLM_DICT, DOCLING_TENSORS_SHA256)
+    return _artifact_manager
@@ -18,6 +18,9 @@ from langchain_core.output_parsers import JsonOutputParser
 from langchain.schema.runnable import RunnableParallel, RunnablePassthrough
 from tqdm import tqdm
 from typing import List, Tuple, Dict, Any
+from utilities.instrumentation import record_span
+from utilities.token_budget import TokenBudgetExceeded
+from utilities.llm_router import LIGHT_TIER
 
 
 def chunk_into_cohesive_paragraphs(
@@ -144,7 +147,7 @@ def chunk_classification(
     """
     start_time = time.time()
     # Initialize the model and JSON parser
-    model = instantiate_azure_chat_openai(TOKEN)
+    model = instantiate_azure_chat_openai(TOKEN, tier=LIGHT_TIER) # a cheap classification: smaller/faster deployment when configured
     parser = JsonOutputParser(pydantic_object=TextualClassificationOrNot)
     # Prepare classification prompt
     classification_query = "\n\n" + MODEL_PERSONA_TEXT_VS_NOT_TEXT_CLASSIFICATION + "\n\n" + CHUNK_CLASSIFICATION_PROMPT
@@ -195,6 +198,8 @@ def chunk_classification(
                 docs,
                 config={"max_concurrency": 5}
             )
+        except TokenBudgetExceeded:
+            raise # retrying a job that is over its token budget would only spend more tokens
         except Exception as e:
             print(f"Initial error with {e}")
             try:
@@ -263,7 +268,7 @@ def chunk_documents_cohesively(markdown_extract_repo: Dict[str, str]) -> Dict[st
     
     end_time = time.time()
     processing_time = end_time - start_time
-    print(f"Cohesive chunking of the document took {processing_time} second(s)")
+    record_span("chunk.cohesive", processing_time, "Cohesive chunking of the document")
     
     return cohesive_chunks_repo
 
@@ -0,0 +1,135 @@
+import re
+import logging
+import unicodedata
+
+from typing import Dict, List, Tuple
+
+## LOGGING CAPABILITIES
+
+logger = logging.getLogger(__name__)
+
+##################################################################################################################
+## Local identification of the output language(s) of a query: 'EN', 'FR' or both, as INPUT_LANGUAGE_CLASSIFICATION_PROMPT
+## asks the LLM for it, with a confidence. Two signals, in order:
+##  1. explicit requests of an output language ("in French", "en anglais", "EN/FR", "bilingual", ...),
+##  2. otherwise the language the query is written in, scored with frequent words (disjoint between the two
+##     languages) and the French diacritics and elisions.
+## A confidence below LANGUAGE_IDENTIFICATION_MIN_CONFIDENCE (DVoice/utilities/settings.py) means the query is too
+## short or too mixed to decide, the LLM decides instead.
+##################################################################################################################
+
+ENGLISH_WORDS = frozenset("""the and of to in is are for with that this be by from at an or it its was were will would
+                             should could can about into over than then these those which who whom whose what when where
+                             how why our your their my we you they he she them us please create write make draft
+                             generate give provide summarize summary post report using attached file
+                             based new all any some more most other such only also not no yes have has had do does
+                             between through during after before each both under while""".split())
+FRENCH_WORDS = frozenset("""le la les de des du et est sont pour avec que qui dans sur par une un au aux ce cette ces ses
+                            leur leurs notre nos votre vos mon ma mes il elle ils elles nous vous je tu ne pas plus
+                            moins très comme mais ou où donc car être avoir fait faire rédigez rédiger créez créer
+                            écrivez écrire veuillez résumé résumez rapport fichier joint ci-joint
+                            selon nouveau nouvelle tous toutes aussi entre pendant après avant chaque sous""".split())
+FRENCH_ELISION_PATTERN = re.compile(r"\b(?:l|d|qu|n|s|c|j|m|t|jusqu|lorsqu|puisqu)['’](?=\w)")
+FRENCH_DIACRITICS = frozenset("éèêëàâçùûüôîïœæ")
+WORD_PATTERN = re.compile(r"[a-zà-ÿœæ]+(?:-[a-zà-ÿœæ]+)*")
+
+## explicit requests of the output language (lowercase, accents kept)
+BILINGUAL_PATTERN = re.compile(r"\b(?:en\s*/\s*fr|fr\s*/\s*en|en\s+and\s+fr|fr\s+and\s+en|en\s+et\s+fr|fr\s+et\s+en"
+                               r"|english\s+and\s+french|french\s+and\s+english|anglais\s+et\s+(?:en\s+)?fran[cç]ais"
+                               r"|fran[cç]ais\s+et\s+(?:en\s+)?anglais|bilingual|bilingue|both\s+official\s+languages"
+                               r"|deux\s+langues\s+officielles)\b")
+FRENCH_OUTPUT_PATTERN = re.compile(r"\b(?:in|into|to|en)\s+(?:french|fran[cç]ais|fr)\b|\bversion\s+fran[cç]aise\b")
+ENGLISH_OUTPUT_PATTERN = re.compile(r"\b(?:in|into|to|en)\s+(?:english|anglais|en)\b|\bversion\s+anglaise\b")
+## "in French" closing a sentence or a clause is a request, "in French newspapers" may be a topic: the LLM decides
+REQUEST_END_PATTERN = re.compile(r"\s*(?:$|[,.;:!?)\]]|(?:for|and|please|with|only|pour|et|avec|seulement|svp|s'il)\b)")
+
+EXPLICIT_REQUEST_CONFIDENCE = 0.95 ## an explicit request is what the LLM follows too
+UNCLEAR_REQUEST_CONFIDENCE = 0.5 ## a language named in the query that may not be a request
+
+
+def _normalize(query: str) -> str:
+    return unicodedata.normalize("NFC", query).lower()
+
+
+def _find_request(pattern: re.Pattern, text: str) -> Tuple[bool, bool]:
+    """
+    Returns whether the pattern is found in the text, and whether one of its matches is clearly a request.
+    """
+    found = False
+    for match in pattern.finditer(text):
+        found = True
+        if REQUEST_END_PATTERN.match(text, match.end()):
+            return True, True
+    return found, False
+
+
+def score_query_language(query: str) -> Tuple[float, float]:
+    """
+    Scores the language a query is written in.
+
+    Args:
+        query (str): The query.
+
+    Returns:
+        Tuple[float, float]: The (English, French) evidence: one point per frequent word of the language, one per
+                             French elision and half a point per word with a French diacritic.
+    """
+    text = _normalize(query)
+    english_score, french_score = 0.0, float(len(FRENCH_ELISION_PATTERN.findall(text)))
+    for word in WORD_PATTERN.findall(FRENCH_ELISION_PATTERN.sub(" ", text)):
+        if word in ENGLISH_WORDS:
+            english_score += 1
+        elif word in FRENCH_WORDS:
+            french_score += 1
+        if any(character in FRENCH_DIACRITICS for character in word):
+            french_score += 0.5
+    return english_score, french_score
+
+
+def identify_output_language(query: str) -> Tuple[Dict[str, List[str]], float]:
+    """
+    Identifies the intended output language(s) of a query without any LLM call, in microseconds.
+
+    Args:
+        query (str): The query of the user.
+
+    Returns:
+        Tuple[Dict[str, List[str]], float]: The languages, shaped like the output of
+                                            prompt_actions.determine_input_language ({'language': ['EN', 'FR']},
+                                            'EN' first when both), and the confidence of the identification
+                                            between 0 and 1.
+
+    Example:
+        >>> identify_output_language("Create a LinkedIn post about the trade negotiations, the output must be in EN/FR")
+        ({'language': ['EN', 'FR']}, 0.95)
+        >>> identify_output_language("Rédigez un article de blogue sur les tendances de l'automatisation")
+        ({'language': ['FR']}, 0.88)
+        >>> identify_output_language("Trade negotiations")
+        ({'language': ['EN']}, 0.0)
+
+    Notes:
+        - An explicit request wins over the language the query is written in ("Write it in French." is FR). A
+          language named without closing a clause ("in French newspapers") is only conclusive when the query is
+          written in that language.
+        - The confidence of the written language is the margin between the two scores over their sum (plus one,
+          so a couple of words are never conclusive): 4 English words and nothing French give 0.8.
+    """
+    text = _normalize(query)
+    if BILINGUAL_PATTERN.search(text):
+        return {"language": ["EN", "FR"]}, EXPLICIT_REQUEST_CONFIDENCE
+    french_found, french_requested = _find_request(FRENCH_OUTPUT_PATTERN, text)
+    english_found, english_requested = _find_request(ENGLISH_OUTPUT_PATTERN, text)
+    if french_requested and english_requested:
+        return {"language": ["EN", "FR"]}, EXPLICIT_REQUEST_CONFIDENCE
+    if french_requested:
+        return {"language": ["FR"]}, EXPLICIT_REQUEST_CONFIDENCE
+    if english_requested:
+        return {"language": ["EN"]}, EXPLICIT_REQUEST_CONFIDENCE
+
+    english_score, french_score = score_query_language(query)
+    written_language = ["FR"] if french_score > english_score else ["EN"]
+    confidence = round(abs(english_score - french_score) / (english_score + french_score + 1), 2)
+    if (french_found and written_language != ["FR"]) or (english_found and written_language != ["EN"]):
+        ## ie "in French newspapers" in an English query: a request or a topic
+        return {"language": ["FR"] if french_found else ["EN"]}, UNCLEAR_REQUEST_CONFIDENCE
+    return {"language": written_language}, confidence
@@ -1,19 +1,25 @@
 import sys, os
-import io
 import asyncio
 import concurrent.futures
 import tiktoken
 import time
+import numpy as np
 from openai import AzureOpenAI
+from openai.types.chat import ChatCompletion, ChatCompletionMessage
+from openai.types.chat.chat_completion import Choice
 from DVoice.utilities.settings import API_VERSION, AZURE_OPENAI_ENDPOINT, AZURE_OPENAI_MODEL
 from DVoice.utilities.settings import AZURE_OPENAI_MODEL_NAME
 from DVoice.utilities.settings import MAX_TOKEN_COMPLETION, TEMPERATURE
 from django.conf               import settings
 from langchain_openai import AzureChatOpenAI
+from utilities.token_provider import as_token_callable
+from utilities.instrumentation import record_span, record_openai_response, llm_usage_callbacks, with_current_context
+from utilities.token_budget import check_job_budget, token_budget_callbacks
+from utilities.llm_router import get_routed_http_client, get_routed_http_async_client, HEAVY_TIER
 import json
 from pathlib import Path
 import logging
-from typing import List, Optional, Any, Dict, Tuple
+from typing import List, Optional, Any, Dict, Callable
 
 
 ## LOGGING CAPABILITIES
@@ -26,13 +32,15 @@ handler.setFormatter(formatter)
 # Attach handler to the logger
 logger.addHandler(handler)
 
-def instantiate_azure_openai_client(TOKEN) -> AzureOpenAI:
+def instantiate_azure_openai_client(TOKEN, tier: str = HEAVY_TIER) -> AzureOpenAI:
     """
     Instantiates and returns an Azure OpenAI client using the provided authentication token.
  
     Args:
         TOKEN (it is a TokenCredential): An Azure authentication token obtained using 
                                  `ChainedTokenCredential` or another authentication method.
+        tier (str): The tier of deployments the calls are routed to (utilities/llm_router.py): HEAVY_TIER, or
+                    LIGHT_TIER for the cheap classification calls. Defaults to HEAVY_TIER.
  
     Returns:
         AzureOpenAI: An instance of the Azure OpenAI client, configured with the 
@@ -51,9 +59,10 @@ def instantiate_azure_openai_client(TOKEN) -> AzureOpenAI:
     client = AzureOpenAI(
         api_version=API_VERSION,
         azure_endpoint=AZURE_OPENAI_ENDPOINT, 
-        azure_ad_token = TOKEN.token,
+        azure_ad_token_provider = as_token_callable(TOKEN), # re-read on every call, the client outlives the token in long jobs
         # api_key      =  os.environ["AZURE_OPENAI_API_KEY"],
-        azure_deployment = AZURE_OPENAI_MODEL_NAME
+        azure_deployment = AZURE_OPENAI_MODEL_NAME,
+        http_client = get_routed_http_client(tier) # spread over the deployments of the tier, failover on 429/5xx
     )
     
     print("✅Azure Open AI Client has been instantiated")
@@ -83,7 +92,7 @@ def instantiate_azure_openai_embedding_client(TOKEN) -> AzureOpenAI:
     client = AzureOpenAI(
         api_version= settings.EMBEDDING_DEPLOYMENT_API_VERSION_DICTIONARY[settings.EMBEDDING_DEPLOYMENT_NAME], 
         azure_endpoint=AZURE_OPENAI_ENDPOINT, 
-        azure_ad_token = TOKEN.token,
+        azure_ad_token_provider = as_token_callable(TOKEN),
         azure_deployment = settings.EMBEDDING_DEPLOYMENT_NAME
     )
     
@@ -93,13 +102,14 @@ def instantiate_azure_openai_embedding_client(TOKEN) -> AzureOpenAI:
 
 
 
-def instantiate_azure_chat_openai(TOKEN) -> AzureChatOpenAI:
+def instantiate_azure_chat_openai(TOKEN, tier: str = HEAVY_TIER) -> AzureChatOpenAI:
     """
     Instantiates and returns an Azure Chat OpenAI client for conversational AI tasks.
  
     Args:
         TOKEN (TokenCredential): An Azure authentication token obtained using 
                                  `ChainedTokenCredential` or another authentication method.
+        tier (str): The tier of deployments the calls are routed to (utilities/llm_router.py). Defaults to HEAVY_TIER.
  
     Returns:
         AzureChatOpenAI: An instance of the Azure Chat OpenAI client configured with the specified 
@@ -117,10 +127,14 @@ def instantiate_azure_chat_openai(TOKEN) -> AzureChatOpenAI:
             temperature        = TEMPERATURE,
             deployment_name    = AZURE_OPENAI_MODEL_NAME,
             azure_endpoint     = AZURE_OPENAI_ENDPOINT,
-            azure_ad_token     = TOKEN.token, 
+            azure_ad_token_provider = as_token_callable(TOKEN), 
             # api_key      =  os.environ["AZURE_OPENAI_API_KEY"], ## will be removed by azure_ad_token when we go to dev
             max_tokens         = MAX_TOKEN_COMPLETION,
-            model              = AZURE_OPENAI_MODEL
+            model              = AZURE_OPENAI_MODEL,
+            callbacks          = llm_usage_callbacks(AZURE_OPENAI_MODEL) # latency and usage tokens of every call
+                                 + token_budget_callbacks(), # aborts the job once it is over its token budget
+            http_client        = get_routed_http_client(tier), # spread over the deployments of the tier, failover on 429/5xx
+            http_async_client  = get_routed_http_async_client(tier) # same for the ainvoke calls
         )
     
     return model
@@ -184,11 +198,119 @@ async def count_tokens_for_list_of_chunks(input_list: List[str]) -> List[int]:
     end_time = time.time()
     process_time = end_time - start_time
     # Print how long the token counting process took
-    print(f"Counting Token on split markdown took {process_time} second(s)")
+    record_span("chunk.count_tokens", process_time, "Counting Token on split markdown")
 
     return ordered_responses
 
 
+class ParagraphAssembler:
+    """
+    Assembles the text deltas of a streamed completion into paragraphs and hands each paragraph to a callback as
+    soon as it is complete (the blank line after it has been generated), so the downstream stages can start on
+    the beginning of a long output while the rest is still being generated.
+
+    A paragraph is the markdown block between two blank lines, the same unit `chunk_documents_cohesively` splits
+    on. Blank lines inside a fenced code block do not end a paragraph.
+
+    Example:
+        ```python
+        assembler = ParagraphAssembler(print)
+        for delta in ["# Title\\n\\nFirst para", "graph.\\n\\nSecond"]:
+            assembler.feed(delta)   # prints "# Title" then "First paragraph."
+        assembler.close()           # prints "Second"
+        ```
+    """
+    def __init__(self, on_paragraph: Callable[[str], None]) -> None:
+        self.on_paragraph = on_paragraph
+        self.paragraph_count = 0
+        self._buffer = ""
+
+    def _emit(self, paragraph: str) -> None:
+        if paragraph.strip():
+            self.paragraph_count += 1
+            self.on_paragraph(paragraph.strip())
+
+    def feed(self, delta: str) -> None:
+        """
+        Adds a text delta and emits the paragraphs it completes.
+        """
+        self._buffer += delta
+        search_from = 0
+        while True:
+            boundary = self._buffer.find("\n\n", search_from)
+            if boundary == -1:
+                return
+            if self._buffer[:boundary].count("```") % 2:
+                ## the blank line is inside a code block: the paragraph goes on until the closing fence
+                search_from = boundary + 2
+                continue
+            paragraph, self._buffer, search_from = self._buffer[:boundary], self._buffer[boundary:].lstrip("\n"), 0
+            self._emit(paragraph)
+
+    def close(self) -> None:
+        """
+        Emits what is left once the stream has ended.
+        """
+        self._emit(self._buffer)
+        self._buffer = ""
+
+
+def stream_chat_completion(client: Any,
+                           azure_openai_model_name: str,
+                           messages: List[Dict[str, Any]],
+                           on_paragraph: Callable[[str], None]) -> ChatCompletion:
+    """
+    Streams a chat completion, hands the paragraphs to `on_paragraph` as they are completed and returns the
+    assembled completion, so the callers read `response.choices[0].message.content` as for a non streamed call.
+
+    Args:
+        client (Any): The Azure OpenAI client.
+        azure_openai_model_name (str): The name of the Azure OpenAI model to be used for text completion.
+        messages (List[Dict[str, Any]]): The messages of the completion.
+        on_paragraph (Callable[[str], None]): Called with each completed paragraph, from the calling thread.
+
+    Returns:
+        ChatCompletion: The completion assembled from the stream, with the `usage` of its last event.
+    """
+    start_time = time.time()
+    stream = client.chat.completions.create(
+        model=azure_openai_model_name,
+        messages=messages,
+        max_tokens=MAX_TOKEN_COMPLETION,
+        temperature=TEMPERATURE,
+        top_p=1,
+        n=1,
+        stream=True,
+        stream_options={"include_usage": True}) # the usage comes in a last event without choices
+    assembler = ParagraphAssembler(on_paragraph)
+    content_parts, finish_reason, usage, model, completion_id, created = [], None, None, None, None, None
+    with stream:
+        for chunk in stream:
+            completion_id, created, model = chunk.id, chunk.created, chunk.model or model
+            usage = chunk.usage or usage
+            ## Azure also sends events without choices (content filter results, usage)
+            for choice in chunk.choices:
+                finish_reason = choice.finish_reason or finish_reason
+                if choice.delta.content:
+                    content_parts.append(choice.delta.content)
+                    no_paragraph_yet = assembler.paragraph_count == 0
+                    assembler.feed(choice.delta.content)
+                    if no_paragraph_yet and assembler.paragraph_count:
+                        record_span("llm.first_paragraph", time.time() - start_time,
+                                    "Streaming of the first paragraph of the completion")
+    assembler.close()
+
+    return ChatCompletion(id=completion_id or "",
+                          object="chat.completion",
+                          created=created or int(start_time),
+                          model=model or azure_openai_model_name,
+                          choices=[Choice(index=0,
+                                          finish_reason=finish_reason or "stop",
+                                          message=ChatCompletionMessage(role="assistant",
+                                                                        content="".join(content_parts)))],
+                          usage=usage)
+
+
 def generate_response_from_text_input(
     prompt: str,
     model_persona: str,
@@ -196,7 +318,8 @@ def generate_response_from_text_input(
     client: Any,  # Assuming 'client' is an instance of a client for Azure OpenAI service
     azure_openai_model_name: str,
     response_format: Optional[str] = None, # note it should be a class if not None, not a str
-    idx: Optional[int] = None
+    idx: Optional[int] = None,
+    on_paragraph: Optional[Callable[[str], None]] = None # streams the completion, called with each completed paragraph
 ) -> tuple:
     """
     Call the Azure OpenAI service to extract insights from text based on a given prompt and model persona.
@@ -209,17 +332,38 @@ def generate_response_from_text_input(
         azure_openai_model_name (str): The name of the Azure OpenAI model to be used for text completion.
         response_format (Optional[str], optional): The class type used for parsing the response. Defaults to None.
         idx (Optional[int], optional): An optional index to associate with the response. Defaults to None.
+        on_paragraph (Optional[Callable[[str], None]], optional): When provided (free text completions only), the
+                                completion is streamed and each paragraph is handed to this callback as soon as it is
+                                generated (see `ParagraphAssembler`). Defaults to None.
  
     Returns:
         tuple: A tuple containing the generated response and execution time. If idx is provided, the tuple will also include the index.
     Notes:
         The function interacts with the Azure OpenAI service, using either a default completion request or a custom 
         response format parsing, depending on whether `response_format` is provided.
+        A streamed completion is returned assembled, the response reads the same as a non streamed one.
     """
     
+    check_job_budget() # a job over its token budget stops here (utilities/token_budget.py)
     start_time = time.time()
+    # If the caller consumes the paragraphs as they come, stream the completion
+    if response_format is None and on_paragraph is not None:
+        response = stream_chat_completion(
+            client,
+            azure_openai_model_name,
+            [{
+                "role": "system", 
+                "content": model_persona
+            }, {
+                "role": "user",
+                "content": [{
+                    "type": "text",
+                    "text": f"{prompt}\n\n Here is the input text:\n {text}"
+                }]
+            }],
+            on_paragraph)
     # If no response format is specified, generate a standard response using chat completion
-    if response_format is None:
+    elif response_format is None:
         response = client.chat.completions.create(
             model=azure_openai_model_name,
             messages=[{
@@ -258,13 +402,9 @@ def generate_response_from_text_input(
     end_time = time.time()
     execution_time = end_time - start_time
     
-    # Print generation result
-    print("Response has been generated")
+    # Record latency and the prompt/completion tokens of the `usage` field (job report and /metrics/)
+    record_openai_response(response, azure_openai_model_name, execution_time)
     # print(response)
-    
-    # Print time it takes to process extraction
-    print(f"Extraction of insights from text in slide is: \
-        Execution Time: {execution_time:.6f} seconds")
     # Return the response along with execution time, and optionally the index if provided
     if idx is not None:
         return response, execution_time, idx
@@ -272,33 +412,6 @@ def generate_response_from_text_input(
 
 
 
-def save_tensor_from_blob_to_directory(
-    bytesIO_input_file: io.BytesIO,  # Expecting a BytesIO object containing tensor data
-    output_path: str,                # Path where the tensor will be saved
-    tensor_name: str                 # Name of the tensor being saved, for logging purposes
-) -> None:
-    """
-    Saves the tensor data from a BytesIO object to a specified file in a directory.
- 
-    Args:
-        bytesIO_input_file (io.BytesIO): A BytesIO object containing the tensor data to be saved.
-        output_path (str): The path (including filename) where the tensor should be saved in the directory
-        tensor_name (str): The name of the tensor, used for logging purposes.
- 
-    Returns:
-        None: This function does not return any value; it saves the tensor to the file system.
-    Notes:
-        - The function writes the content of the BytesIO object to the specified file path.
-        - It uses a logger to indicate when the tensor is being saved successfully.
-    """
-    
-    with open(output_path, "wb") as f:
-        logger.info("✅Saving to file")
-        f.write(bytesIO_input_file.getvalue())  # Extract bytes and write to file
-    print(f"Saved tensor {tensor_name} at {output_path}")
-    
-
-
 def remove_any_previous_tensors_from_app_directory() -> None:
     """
     Removes previously stored tensor files from the application directory.
@@ -338,79 +451,126 @@ def remove_any_previous_tensors_from_app_directory() -> None:
             print(f"Error removing {file_path} tensor because of {e}")
             
  # TODO: Let us have the model as setting in settings from django.config or settings
+def _embedding_batches(texts: List[str]) -> List[List[int]]:
+    """
+    Groups the indices of the texts into requests of at most settings.EMBEDDING_BATCH_SIZE inputs and about
+    settings.EMBEDDING_BATCH_MAX_TOKENS tokens (estimated at 3 characters per token, to stay on the safe side).
+    """
+    batches, batch, batch_tokens = [], [], 0
+    for index, text in enumerate(texts):
+        text_tokens = len(text) // 3 + 1
+        if batch and (len(batch) >= settings.EMBEDDING_BATCH_SIZE or batch_tokens + text_tokens > settings.EMBEDDING_BATCH_MAX_TOKENS):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(index)
+        batch_tokens += text_tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _embed_batch(client: Any, texts: List[str], model: str) -> List[Optional[List[float]]]:
+    """
+    Sends one batched embedding request, retried twice after settings.EMBEDDING_RETRY_DELAY seconds (ie TPM limit).
+    Returns None for every text of the batch when all the attempts fail.
+    """
+    for attempt in range(3):
+        try:
+            start_time = time.time()
+            response = client.embeddings.create(input=texts, model=model)
+            record_span("embed.batch", time.time() - start_time, "One batched embedding request",
+                        inputs=len(texts), tokens=getattr(getattr(response, "usage", None), "prompt_tokens", None))
+            return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+        except Exception as e:
+            print(f"Error {e} identified - let us do it one more time")
+            if attempt < 2:
+                time.sleep(settings.EMBEDDING_RETRY_DELAY) ## in case of of TPM limit error
+    logger.error(f"Could not embed a batch of {len(texts)} text(s)")
+    return [None] * len(texts)
+
+
+def embed_texts(client: Any, 
+                texts: List[str], 
+                model: Optional[str] = None) -> List[Optional[List[float]]]:
+    """
+    Embeds a list of texts with as few requests to the embedding API as possible.
+
+    This function:
+      - dedupes the texts (the same chunk or query is embedded once),
+      - reads the vectors already known from the embedding cache (utilities/embedding_cache.py), keyed by the
+        sha256 of the deployment and the text,
+      - sends the others in batches of up to settings.EMBEDDING_BATCH_SIZE inputs, at most
+        settings.EMBEDDING_MAX_CONCURRENT_REQUESTS at a time,
+      - stores the new vectors in the cache.
+
+    Args:
+        client (Any): The Azure OpenAI embedding client (see `instantiate_azure_openai_embedding_client`).
+        texts (List[str]): The texts to embed.
+        model (Optional[str]): The embedding deployment. Defaults to settings.EMBEDDING_DEPLOYMENT_NAME.
+
+    Returns:
+        List[Optional[List[float]]]: The embedding of every text, in order (float32 precision), None for a text
+                                     that could not be embedded.
+
+    Example:
+        ```python
+        embedding_client = instantiate_azure_openai_embedding_client(TOKEN)
+        vectors = embed_texts(embedding_client, [chunk["text"] for chunk in chunks])
+        ```
+    """
+    from utilities.embedding_cache import get_embedding_cache, embedding_key
+
+    model = model or settings.EMBEDDING_DEPLOYMENT_NAME
+    hashes = [embedding_key(model, text) for text in texts]
+    unique_texts = dict(zip(hashes, texts)) # hash -> text, duplicates collapsed
+    embedding_cache = get_embedding_cache()
+    vectors = embedding_cache.get_many(unique_texts) if embedding_cache is not None else {}
+    missing_hashes = [hash_ for hash_ in unique_texts if hash_ not in vectors]
+    missing_texts = [unique_texts[hash_] for hash_ in missing_hashes]
+
+    if missing_texts:
+        batches = _embedding_batches(missing_texts)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=settings.EMBEDDING_MAX_CONCURRENT_REQUESTS) as executor:
+            futures = {executor.submit(with_current_context(_embed_batch), client, [missing_texts[index] for index in batch], model): batch
+                       for batch in batches}
+            new_vectors = {}
+            for future in concurrent.futures.as_completed(futures):
+                for index, embedding in zip(futures[future], future.result()):
+                    if embedding is not None:
+                        new_vectors[missing_hashes[index]] = np.asarray(embedding, dtype=np.float32)
+        vectors.update(new_vectors)
+        if embedding_cache is not None:
+            embedding_cache.put_many(new_vectors)
+        print(f"Embedded {len(new_vectors)} text(s) in {len(batches)} request(s), "
+              f"{len(unique_texts) - len(missing_texts)} found in the cache, {len(texts) - len(unique_texts)} duplicate(s)")
+
+    return [vectors[hash_].tolist() if hash_ in vectors else None for hash_ in hashes]
+
+
 def generate_embeddings(client: Any, 
                         text: str, 
-                        model: str = "text-embedding-3-small") -> Any: ## model = "deployment_name"
+                        model: Optional[str] = None) -> Any: ## model = "deployment_name"
     """
     Generates embeddings for the provided text using the specified model.
  
     This function communicates with an embedding service (e.g., OpenAI API) to generate embeddings 
-    from the given input text. If an error occurs due to a rate limit or other issue, the function 
-    will retry up to three times with a 60-second delay between attempts.
+    from the given input text, through `embed_texts`: the embedding of a text already embedded (ie the same query
+    asked again) comes from the embedding cache. If an error occurs due to a rate limit or other issue, the
+    request is retried twice with a delay between attempts.
  
     Args:
         client (Any): The client object used to interact with the embedding service.
                       It is assumed to have an `embeddings.create()` method for generating embeddings.
                       Note: The client is the client generated by AzureOpenAI class in the one of the methods above
         text (str): The input text for which embeddings are to be generated.
-        model (str, optional): The model name to be used for generating embeddings. 
-                               Defaults to "text-embedding-3-small". TODO: we will have to sync it with django settings since embeddings evolve over time
+        model (Optional[str]): The embedding deployment. Defaults to settings.EMBEDDING_DEPLOYMENT_NAME.
  
     Returns:
         Any: The embeddings generated from the input text. The return type depends on the client 
              and API, typically an array or a tensor. Note: Note an embedding is a tensor of floats
-    Notes:
-        - The function retries up to three times if it encounters an error during the embedding generation.
-        - A 60-second delay is applied between each retry in case of rate-limiting errors (e.g., TPM limits).
-    """
-    try:
-        # Try to generate embeddings using the provided model
-        embeddings = client.embeddings.create(input = [text], model=model).data[0].embedding
-    except Exception as e:
-        print(f"Error {e} identified - let us do it one more time")
-        time.sleep(60) ## in case of of TPM limit error
-        try:
-            # If an error occurs, retry after a 60-second wait (e.g., due to TPM limit)
-            embeddings = client.embeddings.create(input = [text], model=model).data[0].embedding
-        except Exception as e:
-            # Retry again after another 60-second delay if the error persists
-            print(f"Error {e} identified - let us do it one more time")
-            time.sleep(60) ## let us wait another one more final minute
-            try:
-               embeddings = client.embeddings.create(input = [text], model=model).data[0].embedding
-            except:
-                # If all retries fail, log the error and return None
-                print(f"Error {e} identified")
-                embeddings = None
-
-    return embeddings
-
-def process_split(client: Any, 
-                  split: Dict[str, str], 
-                  index: int) -> Tuple[int, Any]:
+             None if all the attempts failed.
     """
-    Processes a split of text and generates its embedding using the provided client.
- 
-    This function uses an external service (e.g., Azure OpenAI) to generate an embedding for a given
-    split of text. The function returns the index of the split along with the generated embedding.
- 
-    Args:
-        client (Any): The client object used to interact with the embedding service. 
-                      This client must have a method to generate embeddings (e.g., `generate_embeddings`).
-        split (Dict[str, str]): A dictionary containing the text split, where the key "text" holds 
-                                 the text that needs to be embedded.
-        index (int): The index of the split in a larger list of text splits.
- 
-    Returns:
-        Tuple[int, Any]: A tuple containing the index of the split and its corresponding embedding.
-                         The embedding can be any data structure returned by the external embedding service.
- 
-    Notes:
-        - This function calls `generate_embeddings` to generate the embedding for the split's text.
-    """
-    embedding = generate_embeddings(client, split["text"])
-    return index ,embedding
-
+    return embed_texts(client, [text], model)[0]
 
 
 def answer_query_from_retrieval_results(
@@ -419,6 +579,7 @@ def answer_query_from_retrieval_results(
     branding_requirements_message: str,
     language_of_output: str,
     TOKEN,
+    on_paragraph: Optional[Callable[[str], None]] = None,
 ) -> str:
     """
     Answers a query based on retrieved sections and other parameters using the Azure OpenAI API.
@@ -433,6 +594,8 @@ def answer_query_from_retrieval_results(
         branding_requirements_message (str): A string message specifying the branding requirements for the output.
         language_of_output (str): The desired language for the response. It can be "EN" for English or "FR" for French.
         TOKEN (Access token object generated by Azure - not a string): The token used for authentication when accessing the Azure OpenAI client.
+        on_paragraph (Optional[Callable[[str], None]]): Streams the answer and is called with each paragraph as soon as
+                                                        it is generated. Defaults to None.
  
     Returns:
         Any: The generated output (a string output for now, maybe JSON later), which contains the answer to the query.
@@ -465,7 +628,8 @@ def answer_query_from_retrieval_results(
                                                      query, 
                                                      client, 
                                                      AZURE_OPENAI_MODEL_NAME,
-                                                     response_format=None)
+                                                     response_format=None,
+                                                     on_paragraph=on_paragraph)
         generated_output = response[0].choices[0].message.content
     except Exception as e:
         # Handle the first exception and retry the response generation
@@ -476,7 +640,8 @@ def answer_query_from_retrieval_results(
                                                          query, 
                                                          client, 
                                                          AZURE_OPENAI_MODEL_NAME,
-                                                         response_format=None)
+                                                         response_format=None,
+                                                         on_paragraph=on_paragraph)
             generated_output = response[0].choices[0].message.content
         except Exception as e:
             # Handle the second exception if the error persists
@@ -493,13 +658,13 @@ def generate_embeddings_for_list_of_chunks(
     """
     Generates embeddings for a list of text chunks using a specified embedding client.
  
-    This function processes each chunk of text from the input list of chunks, computes embeddings 
-    for each chunk using the provided embedding client, and then stores the embeddings in the original 
-    list of chunks. It uses multithreading (via ThreadPoolExecutor) to process chunks concurrently.
+    The chunks of all the documents are embedded together by `embed_texts`: in batched requests sent
+    concurrently, identical chunks once, and the chunks already embedded (ie the same file uploaded again) from the
+    embedding cache.
  
     Args:
         embedding_client (Any): The client used to generate embeddings. It should have a method to 
-                                 generate embeddings, such as `generate_embeddings`.
+                                 generate embeddings, such as `embeddings.create`.
         lists_of_chunks (Dict[str, List[Dict[str, Any]]]): A dictionary where keys are document identifiers 
                                                            and values are lists of chunks of text. 
                                                            Each chunk is represented as a dictionary 
@@ -509,20 +674,13 @@ def generate_embeddings_for_list_of_chunks(
         Dict[str, List[Dict[str, Any]]]: The input dictionary with the embeddings added to each chunk.
  
     Notes:
-        - The function processes each document (list of chunks) sequentially.
-        - Multithreading is used to process each chunk concurrently (in each separate document) for faster embedding generation.
         - The embeddings are added directly to the `embedding` key in each chunk's dictionary.
     """
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        # Start processing each document (list of chunks) sequentially
-        for key, list_of_chunks in lists_of_chunks.items(): ## processing one document at a time for now
-            # Create a list of futures to process each chunk concurrently
-            futures = [executor.submit(process_split,embedding_client, split, index) for index, split in enumerate(list_of_chunks)]
-            # Wait for each future to complete and assign the embedding to the chunk
-            for future in concurrent.futures.as_completed(futures):
-                index, embedding = future.result()
-                lists_of_chunks[key][index]["embedding"] = embedding
-        print("All Embeddings for the necessary input files required for to cover the retrieval process are created")
+    chunks = [chunk for list_of_chunks in lists_of_chunks.values() for chunk in list_of_chunks]
+    embeddings = embed_texts(embedding_client, [chunk["text"] for chunk in chunks])
+    for chunk, embedding in zip(chunks, embeddings):
+        chunk["embedding"] = embedding
+    print("All Embeddings for the necessary input files required for to cover the retrieval process are created")
     
     # Return the updated lists of chunks (we just updated the original list of chunks by adding an additional key-value pair) with embeddings
-    return lists_of_chunks
\ No newline at end of file
+    return lists_of_chunks
@@ -58,6 +58,18 @@ class QueryIntent(BaseModel):
     rewriting: bool = Field(description="Describes True or False whether the intent is to rewrite the input content")
     retrieval: bool = Field(description="Describes True or False whether the intent is to retrieve particular content to answer the question")
 
+class QueryUnderstanding(BaseModel):
+    language: List[str] = Field(description="Identifies whether the input language (that determines the output language) is 'FR' or 'EN'")
+    english_query: str = Field(description="The query translated to English when it is in French only, the original query otherwise")
+    output_language: List[str] = Field(description="Identifies whether the output language requested in the english_query is 'FR' or 'EN'")
+    rewritten_query: str = Field(description="The english_query without any instruction about the output language or bill 96")
+    query_breakdown: List[str] = Field(description="Lists the broken down parts of the rewritten_query or the rewritten_query if it could not be broken down further")
+    bill_96_compliance: bool = Field(description="Describes True or False whether the query must comply with the bill 96 in Canada")
+    only_one_file: bool = Field(description="Describes True or False whether only one file is ot be generated as output")
+    summarization: bool = Field(description="Describes True or False whether the intent is to summarize")
+    rewriting: bool = Field(description="Describes True or False whether the intent is to rewrite the input content")
+    retrieval: bool = Field(description="Describes True or False whether the intent is to retrieve particular content to answer the question")
+
 class ListFiles(BaseModel):
     file_list: List[str] = Field(description="Lists the files that supports the query submitted by the user")
 
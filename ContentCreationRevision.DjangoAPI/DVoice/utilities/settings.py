@@ -14,6 +14,18 @@ GENERATE_TABLE_IMAGES = True
 PDF_DOCUMENT_HIGH_QUALITY_PARSING = False ## WE PUT IT TO FALSE TO HAVE THE FASTEST LATENCY WHILE ENSURING ACCURACY FROM DOCLING PARSING
 PDF_DOCLING_NUMBER_PAGES_LIMIT = 20 ## maximum number we agree docling can process before it takes too long
 
+## PDF TRIAGE PARAMETERS (CHEAP PYPDFIUM2 INSPECTION BEFORE CHOOSING THE PARSING BACKEND)
+PDF_TEXT_LAYER_MIN_CHARS_PER_PAGE = 50 ## a page with fewer extractable characters than this is considered to have no usable text layer
+PDF_SCANNED_PAGE_IMAGE_COVERAGE = 0.6 ## share of the page area covered by images above which a page without text layer is considered scanned
+PDF_SCANNED_DOCUMENT_PAGE_RATIO = 0.5 ## share of scanned pages above which the whole document is considered scanned
+PDF_TABLE_PAGE_MIN_PATH_OBJECTS = 25 ## number of vector path objects (ruling lines, cell borders) above which a page is considered table heavy
+PDF_TABLE_HEAVY_DOCUMENT_DENSITY = 0.3 ## share of table heavy pages above which the whole document is considered table heavy
+PDF_DOCLING_TABLE_HEAVY_NUMBER_PAGES_LIMIT = 40 ## table heavy digital documents are worth docling's table model up to this number of pages
+
+## PDF PAGE ROUTING PARAMETERS (PER PAGE BACKEND FOR PDFS THAT WOULD OTHERWISE GO ENTIRELY TO DOCUMENT INTELLIGENCE)
+PDF_PAGE_ROUTING = True ## text layer pages are extracted directly with pypdfium2, only layout pages go to docling / document intelligence
+PDF_DIRECT_EXTRACTION_MAX_IMAGE_COVERAGE = 0.3 ## a text layer page with more image coverage than this still goes to the layout backend
+
 ## EXTRACTED OUTPUT PATH
 WORD_DOCUMENT_FINAL_OUTPUT_PATH = '\\output_summary\\docx\\final\\' ## LOCAL PATH FOR WORD
 MARKDOWN_INDIVIDUAL_PAGES_FROM_PPTX_PAGES_OUTPUT_PATH = '\\output_summary\\markdown\\pptx_pages_converted_to_markdown\\' ## LOCAL PATH FOR MD OUTPUT PAGES
@@ -22,6 +34,22 @@ MARKDOWN_DOCUMENT_FINAL_OUTPUT_PATH = '\\output_summary\\markdown\\final\\' ## L
 ## CHUNKING (COHESIVE CHUNKING SIZE FOR DVOICE CREATION AND REVISION)
 CHUNK_SIZE = 1000 # more or less equivalent to 900 words. Through experiments and rule of thumbs it was determined to work best.
 
+## STREAMING CREATION (THE GENERATED CONTENT IS CHUNKED, TRANSLATED AND REVISED WHILE IT IS STILL BEING GENERATED)
+STREAMING_CREATION = True ## set it to False to generate the whole output before revising it, as before
+STREAMING_REVISION_MAX_WORKERS = 4 ## chunks of a creation job translated and revised at the same time while the generation goes on
+
+## QUERY UNDERSTANDING (THE PRE-FLIGHT ANALYSES OF A CREATION QUERY IN ONE STRUCTURED OUTPUT CALL, SEE prompt_actions.understand_query)
+QUERY_UNDERSTANDING_SINGLE_CALL = True ## set it to False to analyze the query with one LLM call per analysis, as before
+
+## LOCAL LANGUAGE IDENTIFICATION (EN/FR OUTPUT LANGUAGE OF A QUERY WITHOUT LLM CALL, SEE DVoice/utilities/language_identification.py)
+LOCAL_LANGUAGE_IDENTIFICATION = True ## set it to False to always ask the LLM, as before
+LANGUAGE_IDENTIFICATION_MIN_CONFIDENCE = 0.75 ## below it the query is too short or too mixed and the LLM decides
+
+## TOKEN BUDGET ESTIMATION (UP FRONT ESTIMATE OF THE TOKENS OF A REVISION JOB, ENFORCED BY utilities/token_budget.py)
+ESTIMATED_STRUCTURED_OUTPUT_OVERHEAD_TOKENS = 30 ## json keys, quotes and escaped characters around the texts of a structured output
+ESTIMATED_CLASSIFICATION_COMPLETION_TOKENS = 20 ## the {"textual": true} answer of the chunk classification
+ESTIMATED_EXPLANATION_COMPLETION_TOKENS = 400 ## the bullet point list of the modifications applied to a file
+
 ## AZURE OPEN AI CREDENTIALS
 SELECTED_MODEL = "MULTIMODAL_MODEL_GPT4O_128K_DVOICE" ## PSEUDO MODEL DEPLOYMENT NAME (THAT WE GIVE IN THE DJANGO CONFIG HERE) FOR THE GPT 4o MODEL THAT SUPPORTS STRUCTURED OUTPUT
 
@@ -66,5 +94,15 @@ if DOCKER_MODE is False:
 REFRESH_DOCLING_TENSORS = False # set to false because we do not want to refresh it. In theory, we should always have it as false;
 ## so you may wonder why we have this bool. We need it it just in case to debug the downloading of the docling llm objects
 
+## DOCLING TENSORS PROVISIONING (DVoice/utilities/artifact_manager.py)
+DOCLING_TENSORS_PROVISION_AT_STARTUP = True ## download missing tensors in the background when the app starts instead of on the first pdf request
+DOCLING_TENSORS_SHA256 = {DOCLING_LAYOUT_LLM: None, ## expected sha256 of each tensor, None = only the safetensors structure is verified
+                          DOCLING_ACCURATE_TABLE_LLM: None,
+                          DOCLING_FAST_TABLE_LLM: None}
+DOCLING_TENSORS_DOWNLOAD_CHUNK_SIZE = 8 * 1024 * 1024 ## bytes streamed to disk at a time, the tensor is never held in memory as a whole
+DOCLING_TENSORS_LOCK_TIMEOUT = 900 ## seconds a job waits for another process provisioning the same tensor
+DOCLING_TENSORS_RETRY_DELAY = 10 ## seconds before the startup provisioning is retried after a failure, doubled at every attempt
+DOCLING_TENSORS_RETRY_MAX_DELAY = 600 ## the longest wait between two provisioning attempts: the instance keeps retrying until ready
+
 DEBUG = settings.DEBUG
     
\ No newline at end of file
@@ -1,6 +1,35 @@
+import os, sys
 from django.apps import AppConfig
 
 
+def is_serving_process() -> bool:
+    """
+    Whether this process serves requests: False for management commands (migrate, shell, ...) and for the
+    autoreloader parent of `runserver`, so start-up work only runs once, in the process that needs it.
+    """
+    if os.path.basename(sys.argv[0]) == "manage.py":
+        if len(sys.argv) < 2 or sys.argv[1] != "runserver":
+            return False
+        return os.environ.get("RUN_MAIN") == "true" or "--noreload" in sys.argv
+    return True
+
+
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self) -> None:
+        if not is_serving_process():
+            return
+        from django.conf import settings
+        if settings.WARMUP_ENABLED:
+            ## preload the heavy modules the deployment needs so the first request latency is predictable
+            from api.warmup import warm_up_in_background
+            warm_up_in_background(settings.WARMUP_MODULES, settings.WARMUP_TIKTOKEN_ENCODING)
+        from DVoice.utilities.settings import DOCLING_TENSORS_PROVISION_AT_STARTUP
+        if DOCLING_TENSORS_PROVISION_AT_STARTUP:
+            ## download the docling tensors once, in the background, instead of on the first pdf request
+            from utilities.token_provider import get_token_provider
+            from DVoice.utilities.artifact_manager import get_artifact_manager
+
+            get_artifact_manager().provision_in_background(lambda: get_token_provider().live_token(settings.COGNITIVE_SERVICES_URL))
@@ -3,11 +3,7 @@ from django.conf import settings
 from rest_framework import authentication, exceptions
 # from msal import ConfidentialClientApplication
 import jwt
-import requests
-from cryptography.hazmat.primitives.asymmetric import rsa
-from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.backends import default_backend
-import base64
+from .jwks_cache import get_jwks_cache
 
 class AzureADAuthentication(authentication.BaseAuthentication):
     def authenticate(self, request):
@@ -42,15 +38,11 @@ class AzureADAuthentication(authentication.BaseAuthentication):
         TENANT_ID = settings.AZURE_AD["TENANT_ID"]
         API_AUDIENCE = settings.AZURE_AD["SCOPE"]
 
-        jsonurl = requests.get(f"https://login.microsoftonline.com/{TENANT_ID}/discovery/v2.0/keys")
-        jwks = jsonurl.json()
+        ## signing keys come from the in memory cache (prebuilt key objects, refreshed in the background)
         unverified_header = jwt.get_unverified_header(token)
-        rsa_key = {}
-        for key in jwks["keys"]:
-             if key["kid"] == unverified_header["kid"]:
-                rsa_key = self.construct_rsa_key(key)
+        rsa_key = get_jwks_cache().get_key(unverified_header.get("kid"))
 
-        if rsa_key:
+        if rsa_key is not None:
             try:
                 payload = jwt.decode(
                     token,
@@ -62,7 +54,7 @@ class AzureADAuthentication(authentication.BaseAuthentication):
                 return payload
             except jwt.ExpiredSignatureError:
                 raise exceptions.AuthenticationFailed("Token expired")
-            except jwt.JWTClaimsError:
+            except (jwt.InvalidAudienceError, jwt.InvalidIssuerError):
                 raise exceptions.AuthenticationFailed("Invalid claims")
             except Exception as e:
                 print("exceptions", e)
@@ -72,21 +64,6 @@ class AzureADAuthentication(authentication.BaseAuthentication):
 
 
 
-    def construct_rsa_key(self, key):
-        public_key = rsa.RSAPublicNumbers(
-            n=int.from_bytes(base64.urlsafe_b64decode(key["n"] + '=='), 'big'),
-            e=int.from_bytes(base64.urlsafe_b64decode(key["e"] + '=='), 'big')
-        ).public_key(default_backend())
-
-        pem = public_key.public_bytes(
-            encoding=serialization.Encoding.PEM,
-            format=serialization.PublicFormat.SubjectPublicKeyInfo
-        )
-        return pem
-
-
-
-
         # client_app = ConfidentialClientApplication(
         #     settings.AZURE_AD['CLIENT_ID'],
         #     authority=f"{settings.AZURE_AD['AUTHORITY']}/{settings.AZURE_AD['TENANT_ID']}",
@@ -0,0 +1,117 @@
+import json
+import time
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+import requests
+from django.conf import settings
+
+## LOGGING CAPABILITIES
+
+logger = logging.getLogger(__name__)
+
+
+class JWKSCache:
+    """
+    In memory cache of the Azure AD signing keys, keyed by `kid`, holding ready to use public key objects.
+
+    `AzureADAuthentication.validate_token` used to download the JWKS and rebuild a PEM for every request. Here:
+        - keys are downloaded once and converted to `RSAPublicKey` objects at download time
+        - after `ttl` seconds the cached keys keep being served while one background thread refreshes them
+        - an unknown `kid` (key rollover) forces a synchronous refresh, at most once every
+          `min_refresh_interval` seconds so forged kids cannot turn every request into a download
+    """
+    def __init__(self, jwks_url: str, ttl: float, min_refresh_interval: float, timeout: float) -> None:
+        """
+        Args:
+            jwks_url (str): The JWKS endpoint, ie https://login.microsoftonline.com/<tenant>/discovery/v2.0/keys
+            ttl (float): Seconds after which the keys are refreshed in the background.
+            min_refresh_interval (float): Minimum seconds between two refreshes forced by an unknown kid.
+            timeout (float): Seconds before a download is abandoned.
+        """
+        self.jwks_url = jwks_url
+        self.ttl = ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.timeout = timeout
+        self._keys: Dict[str, Any] = {}
+        self._fetched_at = 0.0
+        self._lock = threading.Lock()
+        self._refreshing = False
+
+    def _fetch(self) -> None:
+        from jwt.algorithms import RSAAlgorithm
+
+        start_time = time.time()
+        response = requests.get(self.jwks_url, timeout=self.timeout)
+        response.raise_for_status()
+        keys = {}
+        for key in response.json()["keys"]:
+            if key.get("kty") == "RSA" and "kid" in key:
+                keys[key["kid"]] = RSAAlgorithm.from_jwk(json.dumps(key)) # prebuilt public key object
+        with self._lock:
+            self._keys = keys
+            self._fetched_at = time.time()
+        if settings.DEBUG:
+            logger.info(f"✅ JWKS refreshed: {len(keys)} key(s) in {time.time() - start_time:.3f} second(s)")
+
+    def _refresh_in_background(self) -> None:
+        with self._lock:
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def refresh() -> None:
+            try:
+                self._fetch()
+            except Exception as e:
+                logger.info(f"JWKS background refresh failed, keeping the cached keys: {e}")
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        threading.Thread(target=refresh, name="jwks-refresh", daemon=True).start()
+
+    def get_key(self, kid: str) -> Optional[Any]:
+        """
+        Returns the public key of a kid, or None when the kid is unknown even after a refresh.
+
+        Args:
+            kid (str): The `kid` of the token header.
+
+        Returns:
+            Optional[RSAPublicKey]: The key to pass to `jwt.decode`.
+        """
+        with self._lock:
+            key = self._keys.get(kid)
+            age = time.time() - self._fetched_at
+            has_keys = bool(self._keys)
+
+        if key is not None:
+            if age > self.ttl:
+                self._refresh_in_background() # stale while revalidate: no request waits for the download
+            return key
+
+        if not has_keys or age > self.min_refresh_interval: # first use or key rollover
+            self._fetch()
+            with self._lock:
+                return self._keys.get(kid)
+        return None
+
+
+_jwks_cache = None
+_jwks_cache_lock = threading.Lock()
+
+
+def get_jwks_cache() -> JWKSCache:
+    """
+    Returns the process wide JWKS cache configured from the django settings.
+    """
+    global _jwks_cache
+    with _jwks_cache_lock:
+        if _jwks_cache is None:
+            _jwks_cache = JWKSCache(settings.AZURE_AD_JWKS_URL,
+                                    settings.AZURE_AD_JWKS_TTL,
+                                    settings.AZURE_AD_JWKS_MIN_REFRESH_INTERVAL,
+                                    settings.AZURE_AD_JWKS_TIMEOUT)
+    return _jwks_cache
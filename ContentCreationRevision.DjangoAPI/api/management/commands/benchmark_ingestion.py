@@ -0,0 +1,93 @@
+import time
+import importlib.util
+from typing import Any, Dict, List
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from api.management.commands.benchmark_vector_search import BACKENDS
+
+
+def synthetic_lists_of_chunks(chunks: int, dimension: int, documents: int, seed: int) -> Dict[str, List[Dict[str, Any]]]:
+    """
+    Returns chunks shaped like the output of `generate_embeddings_for_list_of_chunks`: per document title, the
+    chunks with their embedding as a list of floats.
+    """
+    generator = np.random.default_rng(seed)
+    embeddings = generator.standard_normal((chunks, dimension), dtype=np.float32)
+    lists_of_chunks: Dict[str, List[Dict[str, Any]]] = {}
+    for index, embedding in enumerate(embeddings):
+        title = f"document {index % documents}.pdf"
+        lists_of_chunks.setdefault(title, []).append({"title"    : title,
+                                                      "id"       : len(lists_of_chunks.get(title, [])),
+                                                      "text"     : f"chunk {index} " * 50,
+                                                      "n_tokens" : 100,
+                                                      "embedding": embedding.tolist()})
+    return lists_of_chunks
+
+
+class Command(BaseCommand):
+    help = ("Benchmarks the ingestion of the embedded chunks of a retrieval task in the vector store: the former "
+            "path (a dataframe grown one row at a time with df._append, then metadata rebuilt with a row-wise "
+            "df.apply) against the columnar path (chunk_columns, then add_chunks in batches).")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunks", type=int, default=5000)
+        parser.add_argument("--dimension", type=int, default=1536, help="embedding dimension (text-embedding-3-small: 1536)")
+        parser.add_argument("--documents", type=int, default=20, help="documents the chunks belong to")
+        parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=["numpy"])
+        parser.add_argument("--seed", type=int, default=7)
+
+    @staticmethod
+    def _handler(backend: str) -> Any:
+        ## user_id None: a collection of the handler only, nothing is written to settings.VECTOR_STORE_DIR
+        if backend == "numpy":
+            from utilities.vector_index import NumpyVectorIndex
+            return NumpyVectorIndex()
+        from utilities.chromadb import ChromaDBHandler
+        return ChromaDBHandler()
+
+    @staticmethod
+    def _dataframe_path(lists_of_chunks: Dict[str, List[Dict[str, Any]]], doc_hashes: Dict[str, str]) -> Dict[str, float]:
+        import pandas as pd
+
+        start_time = time.perf_counter()
+        df = pd.DataFrame()
+        for key, list_of_dicts in lists_of_chunks.items():
+            for record in list_of_dicts:
+                df = df._append({**record, "doc_hash": doc_hashes[key]}, ignore_index=True)
+        build_seconds = time.perf_counter() - start_time
+        ## the metadata, ids and embeddings as the former ChromaDBHandler.add_document built them
+        start_time = time.perf_counter()
+        df.apply(lambda row: {'title': row['title'], 'id': row['id'], 'n_tokens': row['n_tokens'],
+                              'doc_hash': row['doc_hash'], 'stored_at': 0.0}, axis=1).tolist()
+        [f"{row['doc_hash'][:32]}-{row['id']}" for _, row in df.iterrows()]
+        df['embedding'].tolist()
+        return {"build": build_seconds, "metadata": time.perf_counter() - start_time}
+
+    def handle(self, *args, **options):
+        from utilities.vector_index import chunk_columns, chunk_metadata, document_hash
+
+        if "chroma" in options["backends"] and importlib.util.find_spec("chromadb") is None:
+            raise CommandError("chromadb is not installed")
+        lists_of_chunks = synthetic_lists_of_chunks(options["chunks"], options["dimension"], options["documents"], options["seed"])
+        doc_hashes = {title: document_hash(chunks) for title, chunks in lists_of_chunks.items()}
+
+        self.stdout.write(self.style.MIGRATE_HEADING(f"{options['chunks']} chunks of dimension {options['dimension']}, {len(lists_of_chunks)} documents"))
+        dataframe = self._dataframe_path(lists_of_chunks, doc_hashes)
+        self.stdout.write(f"  dataframe (df._append) : build {dataframe['build']:8.3f} s, row-wise metadata {dataframe['metadata']:8.3f} s")
+        start_time = time.perf_counter()
+        columns = chunk_columns(lists_of_chunks, doc_hashes)
+        build_seconds = time.perf_counter() - start_time
+        start_time = time.perf_counter()
+        chunk_metadata(columns)
+        metadata_seconds = time.perf_counter() - start_time
+        self.stdout.write(f"  columns (chunk_columns): build {build_seconds:8.3f} s, metadata           {metadata_seconds:8.3f} s "
+                          f"({(dataframe['build'] + dataframe['metadata']) / max(build_seconds + metadata_seconds, 1e-9):.0f}x faster)")
+
+        for backend in options["backends"]:
+            handler = self._handler(backend)
+            start_time = time.perf_counter()
+            handler.add_chunks(columns)
+            self.stdout.write(f"  add_chunks ({backend:<6})  : {time.perf_counter() - start_time:8.3f} s")
+            handler.delete_collection()
@@ -0,0 +1,482 @@
+import io, os, sys
+import ast
+import json
+import time
+import tempfile
+import statistics
+import threading
+from collections import namedtuple
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+
+DEFAULT_CORPUS_DIR = Path(settings.BASE_DIR) / "utilities" / "stubs" / "corpus"
+BENCHMARK_USER_ID = "benchmark@example.com"
+
+StubAccessToken = namedtuple("StubAccessToken", ["token", "expires_on"])
+
+
+class StubCredential:
+    """
+    Stands in for the Azure credential chain: the stub servers do not check the token.
+    """
+    def get_token(self, *scopes: str, **kwargs: Any) -> StubAccessToken:
+        return StubAccessToken("benchmark-token", int(time.time()) + 3600)
+
+
+def markdown_to_docx_bytes(markdown_text: str) -> bytes:
+    """
+    Builds a docx from a simple markdown document (headings, bullets, paragraphs and pipe tables) so the corpus
+    stays reviewable text while the docx parsing path is exercised.
+    """
+    from docx import Document
+
+    document = Document()
+    lines = markdown_text.splitlines()
+    index = 0
+    while index < len(lines):
+        line = lines[index].strip()
+        if line.startswith("|"):
+            rows = []
+            while index < len(lines) and lines[index].strip().startswith("|"):
+                cells = [cell.strip() for cell in lines[index].strip().strip("|").split("|")]
+                if not all(set(cell) <= set("-: ") for cell in cells): # skip the header separator row
+                    rows.append(cells)
+                index += 1
+            table = document.add_table(rows=len(rows), cols=len(rows[0]))
+            for row_index, row in enumerate(rows):
+                for column_index, cell in enumerate(row):
+                    table.cell(row_index, column_index).text = cell
+            continue
+        if line.startswith("#"):
+            document.add_heading(line.lstrip("#").strip(), level=min(len(line) - len(line.lstrip("#")), 9))
+        elif line.startswith("- "):
+            document.add_paragraph(line[2:], style="List Bullet")
+        elif line:
+            document.add_paragraph(line)
+        index += 1
+    output = io.BytesIO()
+    document.save(output)
+    return output.getvalue()
+
+
+class MemorySampler:
+    """
+    Samples the memory of the process on a background thread so the peak of every stage can be read afterwards.
+
+    By default the resident set size (/proc/self/statm, what the container limit sees) is sampled. With
+    `use_tracemalloc` the Python heap is traced instead: its peak between two samples is exact but tracing slows
+    the pipeline down, so the wall times of such a run are not comparable with the others.
+    """
+    def __init__(self, interval: float = 0.05, use_tracemalloc: bool = False) -> None:
+        self.interval = interval
+        self.use_tracemalloc = use_tracemalloc
+        self.samples: List[Tuple[float, int]] = []
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._page_size = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+    def _read(self) -> int:
+        if self.use_tracemalloc:
+            import tracemalloc
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.reset_peak()
+            return peak
+        try:
+            with open("/proc/self/statm") as statm:
+                return int(statm.read().split()[1]) * self._page_size
+        except OSError:
+            import resource
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024 # peak of the process, in KB on linux
+
+    def _sample_loop(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            self.samples.append((time.time(), self._read()))
+
+    def start(self) -> None:
+        if self.use_tracemalloc:
+            import tracemalloc
+            tracemalloc.start()
+        self._thread = threading.Thread(target=self._sample_loop, name="benchmark-memory-sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.samples.append((time.time(), self._read()))
+        if self.use_tracemalloc:
+            import tracemalloc
+            tracemalloc.stop()
+
+    def peak_between(self, start: float, end: float) -> Optional[int]:
+        ## a sample taken within `interval` after the end still covers the end of the window
+        peaks = [value for at, value in self.samples if start <= at <= end + self.interval]
+        return max(peaks) if peaks else None
+
+
+def concurrency_in_window(requests_log: List[Dict[str, Any]], start: float, end: float) -> Tuple[float, int]:
+    """
+    Returns the average and the peak number of LLM requests in flight between `start` and `end`.
+    """
+    duration = max(end - start, 1e-9)
+    events = []
+    busy_time = 0.0
+    for entry in requests_log:
+        overlap_start, overlap_end = max(entry["start"], start), min(entry["end"], end)
+        if overlap_end <= overlap_start:
+            continue
+        busy_time += overlap_end - overlap_start
+        events.extend([(overlap_start, 1), (overlap_end, -1)])
+    peak = in_flight = 0
+    for _, change in sorted(events, key=lambda event: (event[0], event[1])): # ends before starts at equal times
+        in_flight += change
+        peak = max(peak, in_flight)
+    return busy_time / duration, peak
+
+
+class Command(BaseCommand):
+    help = ("Runs DVoiceReviser and DVoiceCreator end to end on a sample corpus against local stand-ins of Azure "
+            "OpenAI, the blob storage / thread flag API and Document Intelligence, and reports per case and per stage "
+            "the wall time, the LLM calls and tokens, the peak memory and the LLM concurrency.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("cases", nargs="*", help="names of the corpus cases to run (default: all)")
+        parser.add_argument("--corpus", default=str(DEFAULT_CORPUS_DIR), help="folder with cases.json and the documents")
+        parser.add_argument("--repeat", type=int, default=1, help="measured runs of every case")
+        parser.add_argument("--warmup", type=int, default=0, help="unmeasured runs of every case first (lazy imports, models)")
+        parser.add_argument("--latency", type=float, default=0.3, help="seconds the LLM stand-in adds to every response")
+        parser.add_argument("--latency-per-token", type=float, default=0.002, help="seconds added per completion token")
+        parser.add_argument("--rate-limit-ratio", type=float, default=0.0, help="share of the LLM requests answered with a 429")
+        parser.add_argument("--capacity", type=int, default=None, help="concurrent LLM requests above which a 429 is answered")
+        parser.add_argument("--completion-words", type=int, default=250, help="length of the free text LLM answers")
+        parser.add_argument("--blob-latency", type=float, default=0.05, help="seconds the blob / status stand-in adds per request")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--tracemalloc", action="store_true", help="peak of the Python heap instead of the RSS (slower)")
+        parser.add_argument("--output", default=None, help="write the results as JSON to this file")
+        parser.add_argument("--baseline", default=None, help="JSON results of a previous run to compare against")
+        parser.add_argument("--tolerance", type=float, default=0.2,
+                            help="relative increase of wall time, LLM calls or tokens over the baseline reported as a regression")
+        parser.add_argument("--set", action="append", default=[], metavar="NAME=VALUE",
+                            help="overrides a setting for the run, ie --set HYBRID_RETRIEVAL_ENABLED=False (repeatable)")
+
+    ## SET UP
+
+    def _start_stubs(self, options: Dict[str, Any], work_dir: str) -> Dict[str, Any]:
+        if "DVoice.utilities.settings" in sys.modules:
+            raise CommandError("DVoice was imported before the benchmark could point its settings to the stand-ins")
+        from utilities.stubs.openai_stub import start_openai_stub_server
+        from utilities.stubs.blob_status_stub import start_blob_status_stub_server
+        from utilities.stubs.doc_intelligence_stub import start_stub_server
+        from utilities import token_provider
+
+        stubs = {"openai": start_openai_stub_server(latency=options["latency"],
+                                                    latency_per_token=options["latency_per_token"],
+                                                    rate_limit_ratio=options["rate_limit_ratio"],
+                                                    capacity=options["capacity"],
+                                                    completion_words=options["completion_words"],
+                                                    seed=options["seed"]),
+                 "blob": start_blob_status_stub_server(latency=options["blob_latency"], seed=options["seed"]),
+                 "doc_intelligence": start_stub_server(latency=options["blob_latency"])}
+        overrides = {"API_BASE"                   : stubs["openai"].endpoint,
+                     "ENDPOINT"                   : stubs["doc_intelligence"].endpoint,
+                     "CERTIFICATE_VERIFY"         : False,
+                     "STATUS_OUTBOX_PATH"         : Path(work_dir) / "status_outbox.sqlite3",
+                     "VECTOR_STORE_DIR"           : Path(work_dir) / "vector_store",
+                     "EMBEDDING_CACHE_PATH"       : Path(work_dir) / "embedding_cache.sqlite3",
+                     "SUMMARY_CACHE_PATH"         : Path(work_dir) / "summary_cache.sqlite3",
+                     "INSTRUMENTATION_REPORT_DIR" : None,
+                     **stubs["blob"].settings_overrides(),
+                     **self._setting_overrides(options["set"])}
+        for name, value in overrides.items():
+            setattr(settings, name, value)
+        ## the jobs, the LLM clients and the status reporter get their tokens from the process wide provider
+        token_provider._token_provider = token_provider.TokenProvider(credential_factory=StubCredential)
+        return stubs
+
+    @staticmethod
+    def _setting_overrides(assignments: List[str]) -> Dict[str, Any]:
+        """
+        Parses the --set NAME=VALUE options, the values being Python literals (True, 8000, "numpy") or plain strings.
+        """
+        overrides = {}
+        for assignment in assignments:
+            name, separator, value = assignment.partition("=")
+            if not separator or not hasattr(settings, name.strip()):
+                raise CommandError(f"--set {assignment}: expected NAME=VALUE with NAME an existing setting")
+            try:
+                overrides[name.strip()] = ast.literal_eval(value.strip())
+            except (ValueError, SyntaxError):
+                overrides[name.strip()] = value.strip()
+        return overrides
+
+    def _load_cases(self, corpus_dir: Path, names: List[str]) -> List[Dict[str, Any]]:
+        with open(corpus_dir / "cases.json", encoding="utf-8") as cases_file:
+            cases = json.load(cases_file)
+        if names:
+            unknown = set(names) - {case["name"] for case in cases}
+            if unknown:
+                raise CommandError(f"Unknown case(s): {', '.join(sorted(unknown))}")
+            cases = [case for case in cases if case["name"] in names]
+        return cases
+
+    def _upload_corpus_file(self, blob_stub: Any, corpus_dir: Path, file_name: str, upload_as: Optional[str]) -> str:
+        """
+        Seeds the blob stand-in with a corpus document (converted to docx when `upload_as` is ".docx").
+        Returns the name the job downloads it with.
+        """
+        path = corpus_dir / file_name
+        if upload_as == ".docx" and path.suffix != ".docx":
+            content, blob_name = markdown_to_docx_bytes(path.read_text(encoding="utf-8")), path.stem + ".docx"
+        else:
+            content, blob_name = path.read_bytes(), path.name
+        blob_stub.put_blob(f"{BENCHMARK_USER_ID.split('@')[0]}/{settings.DVOICE_DOWNLOAD_FOLDER}", blob_name, content)
+        return blob_name
+
+    def _build_post_request_data(self, case: Dict[str, Any], task_id: str, corpus_dir: Path, blob_stub: Any) -> Dict[str, Any]:
+        """
+        Builds the job input the API views build (see api/views.py), downloading the files through the blob API.
+        """
+        from utilities.blob_storage import get_blob_file
+        from utilities.token_provider import get_token_provider
+
+        provider = get_token_provider()
+        token = provider.live_token(settings.COGNITIVE_SERVICES_URL)
+        post_request_data = {"userId": BENCHMARK_USER_ID, "taskId": task_id, "token": token,
+                             "defaultCredential": provider.credential, "debug": False}
+        user_folder = BENCHMARK_USER_ID.split("@")[0]
+
+        if case["type"] == "revision":
+            post_request_data["additionalInstructions"] = case.get("additional_instructions", "")
+            if "manual_input" in case:
+                post_request_data["manualInput"] = (corpus_dir / case["manual_input"]).read_text(encoding="utf-8")
+                post_request_data["manualInputFile"] = {"name": "manualInput"}
+            else:
+                file_name = self._upload_corpus_file(blob_stub, corpus_dir, case["file"], case.get("upload_as"))
+                post_request_data["fileName"] = file_name
+                post_request_data["fileExtension"] = [Path(file_name).suffix]
+                post_request_data["fileNameInput"] = [{"name": file_name,
+                                                       "byte_io": get_blob_file(token, f"{user_folder}/{file_name}",
+                                                                                api_type="Content_voice")}]
+            return post_request_data
+
+        upload_as = case.get("upload_as", {})
+        file_names = [self._upload_corpus_file(blob_stub, corpus_dir, file_name, upload_as.get(file_name))
+                      for file_name in case.get("files", [])]
+        post_request_data.update({"topicPrompt"     : case["topic_prompt"],
+                                  "targetAudience"  : case.get("target_audience", ""),
+                                  "overallStyle"    : case.get("overall_style", ""),
+                                  "contentLength"   : case.get("content_length", ""),
+                                  "contentMedium"   : case.get("content_medium", ""),
+                                  "title"           : case.get("title", ""),
+                                  "includeKeywords" : case.get("include_keywords", ""),
+                                  "excludeKeywords" : case.get("exclude_keywords", ""),
+                                  "chromaDB"        : None,
+                                  "referenceFiles"  : file_names,
+                                  "fileExtension"   : [Path(file_name).suffix for file_name in file_names],
+                                  "referenceFileListInput": [{"name": file_name,
+                                                              "byte_io": get_blob_file(token, f"{user_folder}/{file_name}",
+                                                                                       api_type="Content_voice")}
+                                                             for file_name in file_names]})
+        return post_request_data
+
+    ## RUN
+
+    def _run_case(self, case: Dict[str, Any], run_id: str, corpus_dir: Path, stubs: Dict[str, Any],
+                  memory_sampler: MemorySampler) -> Dict[str, Any]:
+        from DVoice.main import DVoiceReviser, DVoiceCreator
+        from utilities.stubs.openai_stub import DEFAULT_FIELD_VALUES
+        from utilities.instrumentation import get_recent_job_reports
+
+        task_id = f"benchmark-{case['name']}-{run_id}"
+        stubs["openai"].field_values = {**DEFAULT_FIELD_VALUES, **case.get("llm_answers", {})}
+        stubs["openai"].reset_log()
+
+        download_start = time.time()
+        post_request_data = self._build_post_request_data(case, task_id, corpus_dir, stubs["blob"])
+        download_time = time.time() - download_start
+
+        if case["type"] == "revision":
+            job = DVoiceReviser(post_request_data).run_DVoice_revision
+        else:
+            job = DVoiceCreator(post_request_data).run_DVoice_creation
+        errors = []
+
+        def run_job() -> None:
+            try:
+                job()
+            except Exception as e:
+                errors.append(repr(e))
+
+        ## like the API views, the job runs on its own thread
+        start = time.time()
+        job_thread = threading.Thread(target=run_job, name=f"benchmark-{case['name']}")
+        job_thread.start()
+        job_thread.join()
+        end = time.time()
+
+        report = next((job_report for job_report in reversed(get_recent_job_reports()) if job_report["job_id"] == task_id), None)
+        requests_log = list(stubs["openai"].request_log)
+        served = [entry for entry in requests_log if entry["status"] == 200]
+        avg_in_flight, peak_in_flight = concurrency_in_window(served, start, end)
+        stages = self._stage_metrics(report, served, memory_sampler, stubs["openai"].capacity)
+        stages["download"] = {"seconds": download_time, "count": 1, "llm_calls": 0, "prompt_tokens": 0,
+                              "completion_tokens": 0, "peak_memory_bytes": None, "avg_in_flight": 0.0,
+                              "peak_in_flight": 0, "utilization": None}
+        return {"case"              : case["name"],
+                "type"              : case["type"],
+                "task_id"           : task_id,
+                "status"            : "error" if errors else (report or {}).get("status", "unknown"),
+                "errors"            : errors,
+                "wall_time_seconds" : end - start,
+                "llm_calls"         : len(served),
+                "llm_rate_limited"  : sum(entry["status"] == 429 for entry in requests_log),
+                "prompt_tokens"     : sum(entry["prompt_tokens"] for entry in served),
+                "completion_tokens" : sum(entry["completion_tokens"] for entry in served),
+                "peak_memory_bytes" : memory_sampler.peak_between(start, end),
+                "avg_in_flight"     : avg_in_flight,
+                "peak_in_flight"    : peak_in_flight,
+                "uploads"           : [upload for upload in stubs["blob"].uploads if upload["at"] >= start],
+                "stages"            : stages}
+
+    def _stage_metrics(self, report: Optional[Dict[str, Any]], served: List[Dict[str, Any]],
+                       memory_sampler: MemorySampler, capacity: Optional[int]) -> Dict[str, Dict[str, Any]]:
+        """
+        Aggregates the top level stage spans of the job report (a stage can run several times, ie "chunk") with the
+        LLM requests the stand-in served and the memory samples taken while they ran.
+
+        The utilization is the average number of LLM requests in flight over the concurrency available: the
+        `--capacity` of the stand-in when set, the peak reached in the stage otherwise.
+        """
+        stages: Dict[str, Dict[str, Any]] = {}
+        if report is None:
+            return stages
+        llm_by_stage = report["llm"].get("by_stage", {})
+        for span in report["spans"]:
+            if span["parent"] is not None or "status" not in span: # sub-steps are already inside their stage
+                continue
+            start, end = span["start"], span["start"] + span["duration"]
+            busy_average, peak_in_flight = concurrency_in_window(served, start, end)
+            stage_metrics = stages.setdefault(span["name"], {"seconds": 0.0, "count": 0, "busy_seconds": 0.0,
+                                                             "peak_memory_bytes": None, "peak_in_flight": 0})
+            stage_metrics["seconds"] += span["duration"]
+            stage_metrics["count"] += 1
+            stage_metrics["busy_seconds"] += busy_average * span["duration"]
+            stage_metrics["peak_in_flight"] = max(stage_metrics["peak_in_flight"], peak_in_flight)
+            peak_memory = memory_sampler.peak_between(start, end)
+            if peak_memory is not None:
+                stage_metrics["peak_memory_bytes"] = max(stage_metrics["peak_memory_bytes"] or 0, peak_memory)
+        if "job" in llm_by_stage:
+            ## the LLM calls of the job outside of any stage (query understanding, file naming, ...)
+            stages["other"] = {"seconds": max(report["wall_time_seconds"] - sum(stage_metrics["seconds"] for stage_metrics in stages.values()), 0.0),
+                               "count": 1, "busy_seconds": 0.0, "peak_memory_bytes": None, "peak_in_flight": 0}
+            llm_by_stage = {**llm_by_stage, "other": llm_by_stage["job"]}
+        for name, stage_metrics in stages.items():
+            llm = llm_by_stage.get(name, {})
+            stage_metrics["llm_calls"] = llm.get("calls", 0)
+            stage_metrics["prompt_tokens"] = llm.get("prompt_tokens", 0)
+            stage_metrics["completion_tokens"] = llm.get("completion_tokens", 0)
+            stage_metrics["avg_in_flight"] = stage_metrics.pop("busy_seconds") / max(stage_metrics["seconds"], 1e-9)
+            available = capacity or stage_metrics["peak_in_flight"]
+            stage_metrics["utilization"] = stage_metrics["avg_in_flight"] / available if available else None
+        return stages
+
+    ## REPORT
+
+    @staticmethod
+    def _megabytes(value: Optional[int]) -> str:
+        return f"{value / 1024 / 1024:8.1f}" if value is not None else f"{'-':>8}"
+
+    def _write_result(self, result: Dict[str, Any]) -> None:
+        style = self.style.SUCCESS if result["status"] == "success" else self.style.ERROR
+        self.stdout.write(style(f"\n{result['case']} ({result['type']}): {result['status']} in {result['wall_time_seconds']:.2f} s, "
+                                f"{result['llm_calls']} LLM call(s) ({result['llm_rate_limited']} rate limited), "
+                                f"{result['prompt_tokens']} prompt / {result['completion_tokens']} completion token(s), "
+                                f"peak memory {self._megabytes(result['peak_memory_bytes']).strip()} MB, "
+                                f"{result['avg_in_flight']:.2f} avg / {result['peak_in_flight']} peak request(s) in flight"))
+        for error in result["errors"]:
+            self.stdout.write(self.style.ERROR(f"  {error}"))
+        self.stdout.write(f"  {'stage':<10} {'seconds':>9} {'runs':>5} {'llm calls':>10} {'prompt tk':>10} {'compl. tk':>10} "
+                          f"{'peak MB':>8} {'avg fly':>8} {'peak fly':>9} {'util.':>6}")
+        for name, stage_metrics in sorted(result["stages"].items(), key=lambda item: -item[1]["seconds"]):
+            utilization = f"{stage_metrics['utilization']:6.0%}" if stage_metrics["utilization"] is not None else f"{'-':>6}"
+            self.stdout.write(f"  {name:<10} {stage_metrics['seconds']:9.2f} {stage_metrics['count']:5d} "
+                              f"{stage_metrics['llm_calls']:10d} {stage_metrics['prompt_tokens']:10d} "
+                              f"{stage_metrics['completion_tokens']:10d} {self._megabytes(stage_metrics['peak_memory_bytes'])} "
+                              f"{stage_metrics['avg_in_flight']:8.2f} {stage_metrics['peak_in_flight']:9d} {utilization}")
+
+    @staticmethod
+    def _summarize(results: List[Dict[str, Any]]) -> Dict[str, Dict[str, float]]:
+        """
+        Returns the median of the headline metrics of every case over its runs.
+        """
+        summary = {}
+        for case_name in dict.fromkeys(result["case"] for result in results):
+            case_results = [result for result in results if result["case"] == case_name]
+            summary[case_name] = {metric: statistics.median(result[metric] for result in case_results)
+                                  for metric in ("wall_time_seconds", "llm_calls", "prompt_tokens", "completion_tokens")}
+        return summary
+
+    def _compare_with_baseline(self, summary: Dict[str, Dict[str, float]], baseline_path: str, tolerance: float) -> List[str]:
+        with open(baseline_path, encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)["summary"]
+        regressions = []
+        self.stdout.write(self.style.MIGRATE_HEADING(f"\nCompared with {baseline_path} (tolerance {tolerance:.0%})"))
+        for case_name, metrics in summary.items():
+            if case_name not in baseline:
+                continue
+            for metric, value in metrics.items():
+                baseline_value = baseline[case_name][metric]
+                change = (value - baseline_value) / baseline_value if baseline_value else 0.0
+                line = f"  {case_name:<32} {metric:<18} {baseline_value:12.2f} -> {value:12.2f} ({change:+.1%})"
+                if change > tolerance:
+                    regressions.append(line.strip())
+                    self.stdout.write(self.style.ERROR(line))
+                else:
+                    self.stdout.write(line)
+        return regressions
+
+    def handle(self, *args, **options):
+        corpus_dir = Path(options["corpus"])
+        cases = self._load_cases(corpus_dir, options["cases"])
+        with tempfile.TemporaryDirectory(prefix="dvoice-benchmark-") as work_dir:
+            stubs = self._start_stubs(options, work_dir)
+            memory_sampler = MemorySampler(use_tracemalloc=options["tracemalloc"])
+            results = []
+            try:
+                for warmup_index in range(options["warmup"]):
+                    for case in cases:
+                        self.stdout.write(f"warm-up {warmup_index + 1}: {case['name']}")
+                        self._run_case(case, f"warmup{warmup_index}", corpus_dir, stubs, memory_sampler)
+                memory_sampler.start()
+                for repeat_index in range(options["repeat"]):
+                    for case in cases:
+                        result = self._run_case(case, str(repeat_index), corpus_dir, stubs, memory_sampler)
+                        results.append(result)
+                        self._write_result(result)
+            finally:
+                memory_sampler.stop()
+                from utilities.status_reporter import get_status_reporter
+                if settings.STATUS_REPORTER_ENABLED:
+                    get_status_reporter().flush(settings.STATUS_SHUTDOWN_FLUSH_TIMEOUT)
+                for stub_server in stubs.values():
+                    stub_server.shutdown()
+
+        summary = self._summarize(results)
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as output_file:
+                json.dump({"options": {name: options[name] for name in ("latency", "latency_per_token", "rate_limit_ratio",
+                                                                        "capacity", "completion_words", "blob_latency",
+                                                                        "seed", "repeat", "tracemalloc", "set")},
+                           "summary": summary,
+                           "results": results}, output_file, indent=2, default=str)
+            self.stdout.write(f"\nResults written to {options['output']}")
+        if options["baseline"]:
+            regressions = self._compare_with_baseline(summary, options["baseline"], options["tolerance"])
+            if regressions:
+                raise CommandError(f"{len(regressions)} regression(s) over the baseline")
+        if any(result["status"] != "success" for result in results):
+            raise CommandError("Some benchmark cases failed, see above")
@@ -0,0 +1,252 @@
+import sys
+import json
+import time
+import statistics
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.management.commands.benchmark_pipeline import DEFAULT_CORPUS_DIR, StubCredential
+
+
+PATHS = ("multi_call", "single_call")
+SCORED_FIELDS = ("language", "bill_96_compliance", "only_one_file", "task", "number_of_queries")
+
+
+def multi_call_query_understanding(token: Any, query: str) -> Dict[str, Any]:
+    """
+    The analyses of a creation query with one LLM call per analysis, as the pre-flight graph of DVoiceCreator runs
+    them with files and QUERY_UNDERSTANDING_SINGLE_CALL off (see `_start_preflight_analyses` in DVoice/main.py).
+    """
+    from DVoice.prompt.prompt_actions import determine_input_language, translate_query_to_desired_language
+    from DVoice.prompt.prompt_actions import rewrite_query, break_down_query_to_multiple_query_output, identify_number_output_files
+    from DVoice.prompt.prompt_actions import identify_bill_96_compliance, determine_query_intended_task
+    from utilities.task_graph import TaskGraph
+
+    def is_french_only(language: Dict[str, Any]) -> bool:
+        return "FR" in language["language"] and len(language["language"]) == 1
+
+    graph = TaskGraph("query_understanding_benchmark")
+    graph.add("initial_language", lambda: determine_input_language(query, token))
+    graph.add("bill_96_compliance", lambda: identify_bill_96_compliance(token, query))
+    graph.add("english_query",
+              lambda initial_language: translate_query_to_desired_language(token, query) if is_french_only(initial_language) else query,
+              depends_on=["initial_language"])
+    graph.add("language",
+              lambda initial_language, english_query: determine_input_language(english_query, token) \
+                                                      if is_french_only(initial_language) else initial_language,
+              depends_on=["initial_language", "english_query"])
+    graph.add("rewritten_query", lambda english_query: rewrite_query(token, english_query), depends_on=["english_query"])
+    graph.add("query_breakdown", lambda rewritten_query: break_down_query_to_multiple_query_output(token, rewritten_query),
+              depends_on=["rewritten_query"])
+    graph.add("only_one_file", lambda rewritten_query: identify_number_output_files(token, rewritten_query),
+              depends_on=["rewritten_query"])
+    graph.add("query_intent", lambda rewritten_query: determine_query_intended_task(token, rewritten_query),
+              depends_on=["rewritten_query"])
+    try:
+        return {name: graph.result(name) for name in ("initial_language", "english_query", "language", "rewritten_query",
+                                                      "query_breakdown", "bill_96_compliance", "only_one_file", "query_intent")}
+    finally:
+        graph.close()
+
+
+def single_call_query_understanding(token: Any, query: str) -> Dict[str, Any]:
+    from DVoice.prompt.prompt_actions import understand_query
+
+    return understand_query(token, query)
+
+
+def score_fields(query_understanding: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Returns the fields of an analysis the benchmark compares with the labels of a case.
+    """
+    if not query_understanding:
+        return {field: None for field in SCORED_FIELDS}
+    true_tasks = [task for task, value in query_understanding["query_intent"].items() if value is True]
+    return {"language"          : sorted(query_understanding["language"]["language"]),
+            "bill_96_compliance": query_understanding["bill_96_compliance"]["bill_96_compliance"] in (True, "True", "TRUE"),
+            "only_one_file"     : query_understanding["only_one_file"]["only_one_file"] in (True, "True", "TRUE"),
+            "task"              : true_tasks[0] if len(true_tasks) == 1 else true_tasks,
+            "number_of_queries" : len(query_understanding["query_breakdown"]["query_breakdown"])}
+
+
+class Command(BaseCommand):
+    help = ("Compares the analyses of creation queries made with one LLM call per analysis (the multi call path) "
+            "with the single structured output call of prompt_actions.understand_query, on a labeled query corpus: "
+            "accuracy of every field against the labels, agreement of the two paths, wall time, LLM calls and tokens. "
+            "Runs against the local Azure OpenAI stand-in by default (it answers with the labels, so only the latency "
+            "and the tokens are meaningful there), or against the endpoint of config.json with --live.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("cases", nargs="*", help="names of the corpus cases to run (default: all)")
+        parser.add_argument("--corpus", default=str(DEFAULT_CORPUS_DIR / "query_understanding_cases.json"),
+                            help="JSON file with the labeled queries")
+        parser.add_argument("--live", action="store_true", help="call the Azure OpenAI endpoint of config.json instead of the stand-in")
+        parser.add_argument("--repeat", type=int, default=1, help="measured runs of every case and path")
+        parser.add_argument("--latency", type=float, default=0.3, help="seconds the LLM stand-in adds to every response")
+        parser.add_argument("--latency-per-token", type=float, default=0.002, help="seconds added per completion token")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", default=None, help="write the results as JSON to this file")
+
+    ## SET UP
+
+    def _start_stub(self, options: Dict[str, Any]) -> Optional[Any]:
+        if "DVoice.utilities.settings" in sys.modules:
+            raise CommandError("DVoice was imported before the benchmark could point its settings to the stand-in")
+        if options["live"]:
+            return None
+        from utilities.stubs.openai_stub import start_openai_stub_server
+        from utilities import token_provider
+
+        openai_stub = start_openai_stub_server(latency=options["latency"],
+                                               latency_per_token=options["latency_per_token"],
+                                               seed=options["seed"])
+        settings.API_BASE = openai_stub.endpoint
+        settings.CERTIFICATE_VERIFY = False
+        settings.INSTRUMENTATION_REPORT_DIR = None
+        token_provider._token_provider = token_provider.TokenProvider(credential_factory=StubCredential)
+        return openai_stub
+
+    def _load_cases(self, corpus_path: Path, names: List[str]) -> List[Dict[str, Any]]:
+        with open(corpus_path, encoding="utf-8") as cases_file:
+            cases = json.load(cases_file)
+        if names:
+            unknown = set(names) - {case["name"] for case in cases}
+            if unknown:
+                raise CommandError(f"Unknown case(s): {', '.join(sorted(unknown))}")
+            cases = [case for case in cases if case["name"] in names]
+        return cases
+
+    @staticmethod
+    def _stub_answers(case: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        The structured output values the stand-in answers a case with: its labels, for both paths.
+        """
+        from utilities.stubs.openai_stub import DEFAULT_FIELD_VALUES
+
+        expected = case["expected"]
+        return {**DEFAULT_FIELD_VALUES,
+                "language"          : expected["language"],
+                "output_language"   : expected["language"],
+                "bill_96_compliance": expected["bill_96_compliance"],
+                "only_one_file"     : expected["only_one_file"],
+                "query_breakdown"   : [case["query"]] * expected["number_of_queries"],
+                **{task: task == expected["task"] for task in ("summarization", "rewriting", "retrieval")}}
+
+    ## RUN
+
+    def _run_path(self, path: str, understand: Callable[[Any, str], Dict[str, Any]], case: Dict[str, Any],
+                  run_id: str, token: Any) -> Dict[str, Any]:
+        from utilities.instrumentation import start_job, finish_job
+
+        job_id = f"benchmark-query-understanding-{case['name']}-{path}-{run_id}"
+        outcome: Dict[str, Any] = {"errors": []}
+
+        def run_job() -> None:
+            ## like the jobs, on its own thread so the LLM calls are recorded in its own report
+            start_job(job_id, "benchmark")
+            try:
+                outcome["query_understanding"] = understand(token, case["query"])
+                if not outcome["query_understanding"]:
+                    outcome["errors"].append("the query could not be analyzed (empty analysis)")
+                outcome["report"] = finish_job("success")
+            except Exception as e:
+                outcome["errors"].append(repr(e))
+                outcome["report"] = finish_job("error")
+
+        start = time.time()
+        job_thread = threading.Thread(target=run_job, name=f"benchmark-{case['name']}-{path}")
+        job_thread.start()
+        job_thread.join()
+        wall_time = time.time() - start
+
+        llm = (outcome.get("report") or {}).get("llm", {})
+        fields = score_fields(outcome.get("query_understanding") or {})
+        return {"case"              : case["name"],
+                "path"              : path,
+                "errors"            : outcome["errors"],
+                "wall_time_seconds" : wall_time,
+                "llm_calls"         : llm.get("calls", 0),
+                "prompt_tokens"     : llm.get("prompt_tokens", 0),
+                "completion_tokens" : llm.get("completion_tokens", 0),
+                "fields"            : fields,
+                "correct"           : {field: fields[field] == (sorted(case["expected"][field]) if field == "language" else case["expected"][field])
+                                       for field in SCORED_FIELDS}}
+
+    ## REPORT
+
+    def _write_case(self, case: Dict[str, Any], results: Dict[str, Dict[str, Any]]) -> None:
+        agreement = sum(results["multi_call"]["fields"][field] == results["single_call"]["fields"][field] for field in SCORED_FIELDS)
+        self.stdout.write(self.style.MIGRATE_HEADING(f"\n{case['name']}: {case['query']}"))
+        self.stdout.write(f"  {'path':<12} {'seconds':>8} {'llm calls':>10} {'prompt tk':>10} {'compl. tk':>10}  fields (x: differs from the label)")
+        for path in PATHS:
+            result = results[path]
+            fields = " ".join(f"{field}={result['fields'][field]}{'' if result['correct'][field] else ' x'}" for field in SCORED_FIELDS)
+            style = self.style.ERROR if result["errors"] else (lambda text: text)
+            self.stdout.write(style(f"  {path:<12} {result['wall_time_seconds']:8.2f} {result['llm_calls']:10d} "
+                                    f"{result['prompt_tokens']:10d} {result['completion_tokens']:10d}  {fields}"))
+            for error in result["errors"]:
+                self.stdout.write(self.style.ERROR(f"    {error}"))
+        self.stdout.write(f"  the two paths agree on {agreement}/{len(SCORED_FIELDS)} fields")
+
+    @staticmethod
+    def _summarize(results: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """
+        Returns per path the median wall time of a query, the total LLM calls and tokens and the accuracy of every field.
+        """
+        summary = {}
+        for path in PATHS:
+            path_results = [result for result in results if result["path"] == path]
+            if not path_results:
+                continue
+            summary[path] = {"median_wall_time_seconds": statistics.median(result["wall_time_seconds"] for result in path_results),
+                             "llm_calls"               : sum(result["llm_calls"] for result in path_results),
+                             "prompt_tokens"           : sum(result["prompt_tokens"] for result in path_results),
+                             "completion_tokens"       : sum(result["completion_tokens"] for result in path_results),
+                             "accuracy"                : {field: sum(result["correct"][field] for result in path_results) / len(path_results)
+                                                          for field in SCORED_FIELDS}}
+        return summary
+
+    def _write_summary(self, summary: Dict[str, Dict[str, Any]]) -> None:
+        self.stdout.write(self.style.MIGRATE_HEADING("\nSummary"))
+        self.stdout.write(f"  {'path':<12} {'median s':>9} {'llm calls':>10} {'prompt tk':>10} {'compl. tk':>10}  "
+                          + " ".join(f"{field:>18}" for field in SCORED_FIELDS))
+        for path, metrics in summary.items():
+            self.stdout.write(f"  {path:<12} {metrics['median_wall_time_seconds']:9.2f} {metrics['llm_calls']:10d} "
+                              f"{metrics['prompt_tokens']:10d} {metrics['completion_tokens']:10d}  "
+                              + " ".join(f"{metrics['accuracy'][field]:18.0%}" for field in SCORED_FIELDS))
+
+    def handle(self, *args, **options):
+        cases = self._load_cases(Path(options["corpus"]), options["cases"])
+        openai_stub = self._start_stub(options)
+        from utilities.token_provider import get_token_provider
+
+        token = get_token_provider().live_token(settings.COGNITIVE_SERVICES_URL)
+        understand_by_path = {"multi_call": multi_call_query_understanding, "single_call": single_call_query_understanding}
+        results = []
+        try:
+            for repeat_index in range(options["repeat"]):
+                for case in cases:
+                    if openai_stub is not None:
+                        openai_stub.field_values = self._stub_answers(case)
+                    case_results = {path: self._run_path(path, understand_by_path[path], case, str(repeat_index), token)
+                                    for path in PATHS}
+                    results.extend(case_results.values())
+                    self._write_case(case, case_results)
+        finally:
+            if openai_stub is not None:
+                openai_stub.shutdown()
+
+        summary = self._summarize(results)
+        self._write_summary(summary)
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as output_file:
+                json.dump({"options": {name: options[name] for name in ("live", "latency", "latency_per_token", "seed", "repeat")},
+                           "summary": summary,
+                           "results": results}, output_file, indent=2, default=str)
+            self.stdout.write(f"\nResults written to {options['output']}")
+        if any(result["errors"] for result in results):
+            raise CommandError("Some queries could not be analyzed, see above")
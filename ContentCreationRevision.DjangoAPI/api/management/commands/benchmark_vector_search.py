@@ -0,0 +1,117 @@
+import time
+import importlib.util
+import statistics
+from typing import Any, Dict, List, Tuple
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+
+BACKENDS = ("numpy", "chroma")
+
+
+def synthetic_chunks(size: int, dimension: int, documents: int, seed: int) -> Tuple[np.ndarray, List[str], List[str]]:
+    """
+    Returns `size` unit embeddings clustered around one centroid per document (as the chunks of a file are close to
+    each other), with the title and doc_hash of each chunk.
+    """
+    generator = np.random.default_rng(seed)
+    centroids = generator.standard_normal((documents, dimension), dtype=np.float32)
+    owners = generator.integers(0, documents, size)
+    embeddings = centroids[owners] + 1.5 * generator.standard_normal((size, dimension), dtype=np.float32)
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    titles = [f"document {owner}.pdf" for owner in owners]
+    doc_hashes = [f"{owner:064x}" for owner in owners]
+    return embeddings, titles, doc_hashes
+
+
+class Command(BaseCommand):
+    help = ("Benchmarks the vector stores of the retrieval tasks on synthetic chunks: the in-process NumPy index "
+            "(utilities/vector_index.py) against chroma (utilities/chromadb.py). Reports the time to add the chunks, "
+            "the query latency without filter, filtered on the documents of a job and on titles, and the recall@20 "
+            "against the exact search.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="numbers of chunks")
+        parser.add_argument("--dimension", type=int, default=1536, help="embedding dimension (text-embedding-3-small: 1536)")
+        parser.add_argument("--documents", type=int, default=200, help="documents the chunks belong to")
+        parser.add_argument("--job-documents", type=int, default=5, help="documents of the job the filtered queries search")
+        parser.add_argument("--queries", type=int, default=50, help="queries per measure")
+        parser.add_argument("--backends", nargs="+", choices=BACKENDS, default=list(BACKENDS))
+        parser.add_argument("--seed", type=int, default=7)
+
+    def _handler(self, backend: str) -> Any:
+        ## user_id None: a collection of the handler only, nothing is written to settings.VECTOR_STORE_DIR
+        if backend == "numpy":
+            from utilities.vector_index import NumpyVectorIndex
+            return NumpyVectorIndex()
+        from utilities.chromadb import ChromaDBHandler
+        return ChromaDBHandler()
+
+    @staticmethod
+    def _add(handler: Any, embeddings: np.ndarray, titles: List[str], doc_hashes: List[str]) -> None:
+        handler.add_chunks({"title"    : titles,
+                            "id"       : list(range(len(embeddings))),
+                            "text"     : [f"chunk {index}" for index in range(len(embeddings))],
+                            "n_tokens" : [100] * len(embeddings),
+                            "embedding": embeddings,
+                            "doc_hash" : doc_hashes})
+
+    @staticmethod
+    def _exact_top(embeddings: np.ndarray, query: np.ndarray, rows: np.ndarray, k: int = 20) -> set:
+        similarities = embeddings[rows] @ query
+        return set(rows[np.argsort(-similarities)[:k]].tolist())
+
+    def _measure(self, backend: str, embeddings: np.ndarray, titles: List[str], doc_hashes: List[str],
+                 queries: np.ndarray, job_doc_hashes: List[str], job_titles: List[str]) -> Dict[str, Any]:
+        handler = self._handler(backend)
+        start_time = time.perf_counter()
+        self._add(handler, embeddings, titles, doc_hashes)
+        result: Dict[str, Any] = {"add_seconds": time.perf_counter() - start_time}
+
+        all_rows = np.arange(len(embeddings))
+        job_rows = np.flatnonzero(np.isin(np.array(doc_hashes), job_doc_hashes))
+        title_rows = np.flatnonzero(np.isin(np.array(titles), job_titles))
+        for name, filters, rows in (("query", {}, all_rows),
+                                    ("job_query", {"doc_hashes": job_doc_hashes}, job_rows),
+                                    ("title_query", {"titles": job_titles}, title_rows)):
+            latencies, recalls = [], []
+            for query in queries:
+                start_time = time.perf_counter()
+                found = handler.get_docs(query.tolist(), **filters)
+                latencies.append(time.perf_counter() - start_time)
+                found_rows = {int(metadata["id"]) for metadata in found["metadatas"][0]}
+                exact_rows = self._exact_top(embeddings, query, rows)
+                recalls.append(len(found_rows & exact_rows) / max(len(exact_rows), 1))
+            latencies.sort()
+            result[name] = {"p50_ms": statistics.median(latencies) * 1000,
+                            "p95_ms": latencies[int(0.95 * (len(latencies) - 1))] * 1000,
+                            "recall": statistics.mean(recalls)}
+        handler.delete_collection()
+        return result
+
+    def handle(self, *args, **options):
+        backends = list(options["backends"])
+        if "chroma" in backends and importlib.util.find_spec("chromadb") is None:
+            if backends == ["chroma"]:
+                raise CommandError("chromadb is not installed")
+            self.stderr.write(self.style.WARNING("chromadb is not installed, only the numpy index is measured"))
+            backends.remove("chroma")
+
+        self.stdout.write(f"  {'chunks':>7} {'backend':<7} {'add s':>8} "
+                          f"{'query p50/p95 ms':>17} {'recall':>6} {'job p50/p95 ms':>15} {'recall':>6} {'title p50/p95 ms':>17} {'recall':>6}")
+        for size in options["sizes"]:
+            embeddings, titles, doc_hashes = synthetic_chunks(size, options["dimension"], options["documents"], options["seed"])
+            generator = np.random.default_rng(options["seed"] + size)
+            ## the queries are close to some chunks, as a query is to the sections answering it
+            queries = embeddings[generator.integers(0, size, options["queries"])] \
+                      + 0.5 * generator.standard_normal((options["queries"], options["dimension"]), dtype=np.float32) / np.sqrt(options["dimension"])
+            queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+            unique_doc_hashes = list(dict.fromkeys(doc_hashes))
+            job_doc_hashes = unique_doc_hashes[:options["job_documents"]]
+            job_titles = list(dict.fromkeys(titles))[-options["job_documents"]:]
+            for backend in backends:
+                result = self._measure(backend, embeddings, titles, doc_hashes, queries, job_doc_hashes, job_titles)
+                columns = " ".join(f"{result[name]['p50_ms']:>8.2f}/{result[name]['p95_ms']:<8.2f} {result[name]['recall']:>6.2f}"
+                                   for name in ("query", "job_query", "title_query"))
+                self.stdout.write(f"  {size:>7} {backend:<7} {result['add_seconds']:>8.2f} {columns}")
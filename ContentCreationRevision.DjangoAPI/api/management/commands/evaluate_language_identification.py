@@ -0,0 +1,82 @@
+import json
+import time
+from pathlib import Path
+from typing import Any, Dict, List
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.management.commands.benchmark_pipeline import DEFAULT_CORPUS_DIR
+
+
+class Command(BaseCommand):
+    help = ("Evaluates the local EN/FR identification of the output language of a query "
+            "(DVoice/utilities/language_identification.py) against the classification of the LLM "
+            "(prompt_actions.determine_input_language): agreement, share of the queries decided locally and time per "
+            "query. The LLM classifications are the labels of the evaluation set, or fresh ones with --live.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--cases", default=str(DEFAULT_CORPUS_DIR / "language_identification_cases.json"),
+                            help="JSON file with the queries and their LLM classification ('llm_language')")
+        parser.add_argument("--min-confidence", type=float, default=None,
+                            help="confidence from which the local identification decides (default: LANGUAGE_IDENTIFICATION_MIN_CONFIDENCE)")
+        parser.add_argument("--live", action="store_true", help="classify the queries with the LLM of config.json instead of using the labels")
+        parser.add_argument("--write-labels", action="store_true", help="with --live, save the LLM classifications as the new labels")
+        parser.add_argument("--repeat", type=int, default=1000, help="local identifications of every query to time it")
+
+    def _llm_languages(self, cases: List[Dict[str, Any]]) -> List[List[str]]:
+        from DVoice.prompt.prompt_actions import determine_input_language
+        from utilities.token_provider import get_token_provider
+
+        token = get_token_provider().live_token(settings.COGNITIVE_SERVICES_URL)
+        return [sorted(determine_input_language(case["query"], token, local_identification=False).get("language", []))
+                for case in cases]
+
+    def handle(self, *args, **options):
+        from DVoice.utilities.language_identification import identify_output_language
+        from DVoice.utilities.settings import LANGUAGE_IDENTIFICATION_MIN_CONFIDENCE
+
+        if options["write_labels"] and not options["live"]:
+            raise CommandError("--write-labels needs --live")
+        cases_path = Path(options["cases"])
+        with open(cases_path, encoding="utf-8") as cases_file:
+            cases = json.load(cases_file)
+        min_confidence = options["min_confidence"] if options["min_confidence"] is not None else LANGUAGE_IDENTIFICATION_MIN_CONFIDENCE
+        llm_languages = self._llm_languages(cases) if options["live"] else [sorted(case["llm_language"]) for case in cases]
+
+        decided = agreed = agreed_when_decided = 0
+        total_seconds = 0.0
+        self.stdout.write(f"  {'local':<10} {'conf.':>5} {'llm':<10} query")
+        for case, llm_language in zip(cases, llm_languages):
+            start_time = time.perf_counter()
+            for _ in range(options["repeat"]):
+                language, confidence = identify_output_language(case["query"])
+            total_seconds += (time.perf_counter() - start_time) / max(options["repeat"], 1)
+            local_language = sorted(language["language"])
+            is_decided, agrees = confidence >= min_confidence, local_language == llm_language
+            decided += is_decided
+            agreed += agrees
+            agreed_when_decided += is_decided and agrees
+            line = f"  {'/'.join(local_language):<10} {confidence:5.2f} {'/'.join(llm_language):<10} {case['query']}"
+            if is_decided and not agrees:
+                self.stdout.write(self.style.ERROR(line))
+            elif not is_decided:
+                self.stdout.write(self.style.WARNING(line)) # the LLM decides
+            else:
+                self.stdout.write(line)
+
+        number_cases = max(len(cases), 1)
+        self.stdout.write(self.style.MIGRATE_HEADING(f"\n{len(cases)} queries, minimum confidence {min_confidence}"))
+        self.stdout.write(f"  decided locally          : {decided} ({decided / number_cases:.0%}), "
+                          f"{agreed_when_decided} agree with the LLM ({agreed_when_decided / max(decided, 1):.0%})")
+        self.stdout.write(f"  agreement on all queries : {agreed} ({agreed / number_cases:.0%}), the LLM decides the {len(cases) - decided} others")
+        self.stdout.write(f"  local identification     : {total_seconds / number_cases * 1e6:.1f} microseconds per query")
+
+        if options["write_labels"]:
+            for case, llm_language in zip(cases, llm_languages):
+                case["llm_language"] = llm_language
+            with open(cases_path, "w", encoding="utf-8") as cases_file:
+                json.dump(cases, cases_file, indent=4, ensure_ascii=False)
+            self.stdout.write(f"\nLabels written to {cases_path}")
+        if decided != agreed_when_decided:
+            raise CommandError(f"{decided - agreed_when_decided} local identification(s) disagree with the LLM")
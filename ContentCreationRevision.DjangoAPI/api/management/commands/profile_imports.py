@@ -0,0 +1,70 @@
+import os, sys
+import subprocess
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+from django.core.management.base import BaseCommand
+
+
+DEFAULT_MODULES = ["api.views", "DVoice.main", "DVoice.parsing.file_parsing", "utilities.chromadb", "utilities.vector_index"]
+
+
+def parse_importtime_output(stderr: str) -> List[Tuple[str, int, int]]:
+    """
+    Parses the `python -X importtime` report.
+
+    Returns:
+        List[Tuple[str, int, int]]: (module, self time in us, cumulative time in us) for every imported module.
+    """
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "[us]" in line:
+            continue
+        self_time, cumulative_time, module = line[len("import time:"):].split("|")
+        rows.append((module.strip(), int(self_time), int(cumulative_time)))
+    return rows
+
+
+class Command(BaseCommand):
+    help = ("Reports the import time of the DVoice stack, per module and per top level package, "
+            "each module being imported in a fresh interpreter after django.setup().")
+
+    def add_arguments(self, parser):
+        parser.add_argument("modules", nargs="*", default=DEFAULT_MODULES,
+                            help=f"modules to profile (default: {' '.join(DEFAULT_MODULES)})")
+        parser.add_argument("--top", type=int, default=15, help="number of most expensive modules / packages to list")
+
+    def _profile_module(self, module: str) -> List[Tuple[str, int, int]]:
+        code = f"import django; django.setup(); import {module}"
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get("DJANGO_SETTINGS_MODULE", "home.settings"))
+        completed = subprocess.run([sys.executable, "-X", "importtime", "-c", code],
+                                   capture_output=True, text=True, env=env)
+        if completed.returncode != 0:
+            raise RuntimeError(f"importing {module} failed: {completed.stderr.splitlines()[-1] if completed.stderr else ''}")
+        return parse_importtime_output(completed.stderr)
+
+    def handle(self, *args, **options):
+        baseline = {module for module, _, _ in self._profile_module("django")} # django.setup() cost is shared by every module
+
+        for module in options["modules"]:
+            try:
+                rows = self._profile_module(module)
+            except RuntimeError as e:
+                self.stderr.write(str(e))
+                continue
+
+            rows = [row for row in rows if row[0] not in baseline]
+            total_time = sum(self_time for _, self_time, _ in rows)
+            self.stdout.write(self.style.MIGRATE_HEADING(f"\n{module}: {total_time / 1e6:.2f} second(s) on top of django.setup(), "
+                                                         f"{len(rows)} module(s) imported"))
+
+            package_time: Dict[str, int] = defaultdict(int)
+            for imported_module, self_time, _ in rows:
+                package_time[imported_module.split(".")[0]] += self_time
+            self.stdout.write("  by package (self time):")
+            for package, self_time in sorted(package_time.items(), key=lambda item: -item[1])[:options["top"]]:
+                self.stdout.write(f"    {self_time / 1e3:10.1f} ms  {package}")
+
+            self.stdout.write("  by module (cumulative time):")
+            for imported_module, _, cumulative_time in sorted(rows, key=lambda row: -row[2])[:options["top"]]:
+                self.stdout.write(f"    {cumulative_time / 1e3:10.1f} ms  {imported_module}")
@@ -1,3 +1,329 @@
-from django.test import TestCase
+import io
+import time
+import asyncio
+import threading
 
-# Create your tests here.
+import numpy as np
+from django.conf import settings
+from django.test import SimpleTestCase, override_settings
+
+from api.jwks_cache import JWKSCache
+from utilities.task_graph import TaskGraph
+from utilities.openai_utils.context_packer import pack_sections
+from utilities.vector_index import NumpyVectorIndex, VectorCollection, chunk_columns, document_hash
+from utilities.stubs.doc_intelligence_stub import start_stub_server
+from utilities.stubs.jwks_stub import start_jwks_stub_server
+from utilities.stubs.openai_stub import start_openai_stub_server
+
+
+def make_chunks(title: str, texts, directions):
+    """
+    Returns the chunks of a file with one-hot embeddings (4 dimensions) pointing in `directions`.
+    """
+    return [{"title": title, "id": i, "text": text, "n_tokens": len(text.split()), "embedding": np.eye(4)[direction].tolist()}
+            for i, (text, direction) in enumerate(zip(texts, directions))]
+
+
+class VectorCollectionTests(SimpleTestCase):
+
+    def test_first_upsert_then_query(self):
+        collection = VectorCollection("test")
+        collection.upsert(["a", "b"], ["alpha", "beta"], [{"title": "x"}, {"title": "y"}], np.eye(4)[:2])
+        self.assertEqual(len(collection), 2)
+        results = collection.query(np.eye(4)[1], n_results=1)
+        self.assertEqual(results["ids"], [["b"]])
+        self.assertAlmostEqual(results["distances"][0][0], 0.0)
+
+    def test_upsert_replaces_a_stored_id(self):
+        collection = VectorCollection("test")
+        collection.upsert(["a"], ["alpha"], [{"title": "x"}], np.eye(4)[:1])
+        collection.upsert(["a"], ["alpha v2"], [{"title": "x"}], np.eye(4)[2:3])
+        self.assertEqual(len(collection), 1)
+        results = collection.query(np.eye(4)[2], n_results=5)
+        self.assertEqual(results["documents"], [["alpha v2"]])
+
+    def test_growth_keeps_the_stored_rows(self):
+        collection = VectorCollection("test")
+        for i in range(300): # above the initial capacity
+            collection.upsert([str(i)], [str(i)], [{"title": "x"}], np.eye(4)[i % 4:i % 4 + 1])
+        self.assertEqual(len(collection), 300)
+        self.assertEqual(collection.query(np.eye(4)[3], n_results=1)["documents"][0][0], "3")
+
+    def test_dimension_mismatch(self):
+        collection = VectorCollection("test")
+        collection.upsert(["a"], ["alpha"], [{"title": "x"}], np.eye(4)[:1])
+        with self.assertRaises(ValueError):
+            collection.upsert(["b"], ["beta"], [{"title": "x"}], np.ones((1, 3)))
+
+    def test_metadata_filters(self):
+        collection = VectorCollection("test")
+        collection.upsert(["a", "b", "c"], ["alpha", "beta", "gamma"],
+                          [{"title": "x", "doc_hash": "h1"}, {"title": "y", "doc_hash": "h2"}, {"title": "z", "doc_hash": "h2"}],
+                          np.eye(4)[:3])
+        self.assertEqual(set(collection.query(np.eye(4)[0], n_results=5, doc_hashes=["h2"])["ids"][0]), {"b", "c"})
+        self.assertEqual(collection.query(np.eye(4)[0], n_results=5, doc_hashes=["h2"], titles=["z"])["ids"], [["c"]])
+        self.assertEqual(collection.query(np.eye(4)[0], n_results=5, titles=["unknown"])["ids"], [[]])
+
+    def test_delete_compacts_the_rows(self):
+        collection = VectorCollection("test")
+        collection.upsert(["a", "b", "c"], ["alpha", "beta", "gamma"],
+                          [{"title": "x", "doc_hash": "h1"}, {"title": "y", "doc_hash": "h2"}, {"title": "z", "doc_hash": "h1"}],
+                          np.eye(4)[:3])
+        self.assertEqual(collection.delete(["h1"]), 2)
+        self.assertEqual(collection.stored_documents(["h1", "h2"]), {"h2"})
+        self.assertEqual(collection.query(np.eye(4)[2], n_results=5)["ids"], [["b"]])
+
+
+@override_settings(VECTOR_STORE_PERSISTENT=True, VECTOR_STORE_MAX_DOCUMENTS_PER_USER=2, VECTOR_STORE_INSERT_BATCH_SIZE=2)
+class NumpyVectorIndexTests(SimpleTestCase):
+
+    def add_file(self, store, title, direction):
+        chunks = {title: make_chunks(title, [f"{title} {i}" for i in range(3)], [direction] * 3)}
+        doc_hashes = {title: document_hash(chunks[title])}
+        store.add_chunks(chunk_columns(chunks, doc_hashes), keep_documents=doc_hashes.values())
+        return doc_hashes[title]
+
+    def test_upsert_and_query_the_documents_of_the_job(self):
+        store = NumpyVectorIndex("first.user@example.com")
+        store.delete_collection()
+        first, second = self.add_file(store, "first", 0), self.add_file(store, "second", 1)
+        self.assertEqual(store.stored_documents([first, second, "unknown"]), {first, second})
+        results = store.get_docs(np.eye(4)[1], doc_hashes=[first], n_results=2)
+        self.assertEqual([metadata["title"] for metadata in results["metadatas"][0]], ["first", "first"])
+        results = store.get_docs(np.eye(4)[1], n_results=1)
+        self.assertEqual(results["metadatas"][0][0]["title"], "second")
+
+    def test_per_user_eviction(self):
+        store = NumpyVectorIndex("second.user@example.com")
+        store.delete_collection()
+        other_user = NumpyVectorIndex("third.user@example.com")
+        other_user.delete_collection()
+        other = self.add_file(other_user, "other", 3)
+        first, second = self.add_file(store, "first", 0), self.add_file(store, "second", 1)
+        third = self.add_file(store, "third", 2) # above 2 documents: the least recently stored one is evicted
+        self.assertEqual(store.stored_documents([first, second, third]), {second, third})
+        self.assertEqual(other_user.stored_documents([other]), {other})
+        ## the same user in another job shares the collection
+        self.assertEqual(NumpyVectorIndex("SECOND.user@example.com").stored_documents([second, third]), {second, third})
+
+    def test_store_of_a_job_is_deleted_at_release(self):
+        store = NumpyVectorIndex()
+        self.assertFalse(store.persistent)
+        document = self.add_file(store, "file", 0)
+        self.assertEqual(store.stored_documents([document]), set()) # nothing reused without a user
+        self.assertEqual(len(store.get_docs(np.eye(4)[0])["ids"][0]), 3)
+        store.release()
+        self.assertEqual(store.get_docs(np.eye(4)[0])["ids"], [[]])
+
+
+def make_pdf(page_count: int) -> bytes:
+    import pypdfium2
+
+    pdf = pypdfium2.PdfDocument.new()
+    for _ in range(page_count):
+        pdf.new_page(612, 792)
+    buffer = io.BytesIO()
+    pdf.save(buffer)
+    pdf.close()
+    return buffer.getvalue()
+
+
+@override_settings(FORMRECOGNIZER_POLL_INITIAL_DELAY=0.01, FORMRECOGNIZER_POLL_MAX_DELAY=0.05,
+                   FORMRECOGNIZER_PAGE_RANGE_SIZE=10, FORMRECOGNIZER_MAX_CONCURRENT_REQUESTS=4)
+class AsyncDocumentIntelligenceClientTests(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = start_stub_server(polls=2)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        super().tearDownClass()
+
+    def analyze(self, coroutine_function):
+        from utilities.doc_intelligence_async import AsyncDocumentIntelligenceClient
+
+        async def run():
+            client = AsyncDocumentIntelligenceClient(self.server.endpoint, settings.FORMRECOGNIZER_API_VERSION)
+            try:
+                return await coroutine_function(client)
+            finally:
+                await client.close()
+        return asyncio.run(run())
+
+    def test_page_ranges_are_analyzed_concurrently_and_merged(self):
+        self.server.submissions.clear()
+        result = self.analyze(lambda client: client.analyze(make_pdf(25), "prebuilt-layout", page_count=25))
+        self.assertEqual(sorted(self.server.submissions), ["1-10", "11-20", "21-25"])
+        self.assertEqual([page["page_number"] for page in result["pages"]], list(range(1, 26)))
+        ## the table of each range is kept as markdown, its cells are not repeated as paragraphs
+        self.assertEqual(sum(len(page["tables"]) for page in result["pages"]), 3)
+        self.assertIn("| Metric | Value |", result["pages"][0]["markdown"])
+        self.assertNotIn("Metric", result["pages"][0]["paragraphs"])
+        self.assertTrue(result["content"].startswith("## Section 1"))
+
+    def test_polling_an_unknown_operation_raises_the_service_error(self):
+        location = f"{self.server.endpoint}formrecognizer/documentModels/prebuilt-read/analyzeResults/unknown"
+        with self.assertRaisesRegex(Exception, "status 404"):
+            self.analyze(lambda client: client._poll(location))
+
+
+class JWKSCacheTests(SimpleTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = start_jwks_stub_server()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        super().tearDownClass()
+
+    def test_keys_are_downloaded_once_and_validate_tokens(self):
+        import jwt
+
+        cache = JWKSCache(self.server.jwks_url, ttl=3600, min_refresh_interval=0, timeout=5)
+        fetch_count = self.server.fetch_count
+        token = self.server.issue_token({"aud": "scope", "sub": "user"})
+        for _ in range(3):
+            key = cache.get_key(jwt.get_unverified_header(token)["kid"])
+        self.assertEqual(self.server.fetch_count - fetch_count, 1)
+        self.assertEqual(jwt.decode(token, key, algorithms=["RS256"], audience="scope")["sub"], "user")
+
+    def test_unknown_kid_forces_one_refresh(self):
+        cache = JWKSCache(self.server.jwks_url, ttl=3600, min_refresh_interval=0, timeout=5)
+        cache.get_key(self.server.current_kid)
+        fetch_count = self.server.fetch_count
+        new_kid = self.server.rotate_key()
+        self.assertIsNotNone(cache.get_key(new_kid))
+        self.assertIsNotNone(cache.get_key(new_kid))
+        self.assertEqual(self.server.fetch_count - fetch_count, 1)
+
+    def test_forged_kids_do_not_trigger_downloads(self):
+        cache = JWKSCache(self.server.jwks_url, ttl=3600, min_refresh_interval=3600, timeout=5)
+        cache.get_key(self.server.current_kid)
+        fetch_count = self.server.fetch_count
+        self.assertIsNone(cache.get_key("forged"))
+        self.assertEqual(self.server.fetch_count, fetch_count)
+
+    def test_stale_keys_are_served_while_refreshed_in_background(self):
+        cache = JWKSCache(self.server.jwks_url, ttl=0, min_refresh_interval=0, timeout=5)
+        cache.get_key(self.server.current_kid)
+        fetch_count = self.server.fetch_count
+        self.assertIsNotNone(cache.get_key(self.server.current_kid))
+        deadline = time.time() + 5
+        while self.server.fetch_count == fetch_count and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.server.fetch_count - fetch_count, 1)
+
+
+class TaskGraphTests(SimpleTestCase):
+
+    def test_steps_run_concurrently_after_their_dependencies(self):
+        barrier = threading.Barrier(2, timeout=5) # only passed if both steps run at the same time
+
+        def meet(name):
+            barrier.wait()
+            return name
+
+        graph = TaskGraph("test", max_workers=4)
+        graph.add("left", lambda: meet("left"))
+        graph.add("right", lambda: meet("right"))
+        graph.add("both", lambda left, right: f"{left}+{right}", depends_on=["left", "right"])
+        self.assertEqual(graph.result("both"), "left+right")
+        graph.close()
+
+    def test_a_failed_dependency_fails_the_step(self):
+        def fail():
+            raise RuntimeError("step failed")
+
+        graph = TaskGraph("test", max_workers=1)
+        graph.add("failing", fail)
+        graph.add("dependent", lambda value: value, depends_on=["failing"])
+        with self.assertRaisesRegex(RuntimeError, "step failed"):
+            graph.result("dependent")
+        graph.close()
+
+    def test_unknown_or_repeated_steps_are_refused(self):
+        graph = TaskGraph("test", max_workers=1)
+        graph.add("first", lambda: 1)
+        with self.assertRaises(ValueError):
+            graph.add("first", lambda: 2)
+        with self.assertRaises(ValueError):
+            graph.add("second", lambda value: value, depends_on=["later"])
+        graph.close()
+
+
+class PackSectionsTests(SimpleTestCase):
+
+    def sections(self):
+        return [{"id": "report.pdf|2", "title": "report.pdf", "text": "long", "n_tokens": 947, "relevance": 0.9},
+                {"id": "report.pdf|0", "title": "report.pdf", "text": "short", "n_tokens": 497, "relevance": 0.6},
+                {"id": "notes.txt|1", "title": "notes.txt", "text": "short", "n_tokens": 497, "relevance": 0.5}]
+
+    def test_shorter_relevant_sections_beat_a_long_one(self):
+        packed = pack_sections(self.sections(), max_tokens=1000, token_unit=50)
+        self.assertEqual([section["id"] for section in packed], ["notes.txt|1", "report.pdf|0"]) # document order
+
+    def test_everything_fits(self):
+        packed = pack_sections(self.sections(), max_tokens=5000, token_unit=50)
+        self.assertEqual([section["id"] for section in packed], ["notes.txt|1", "report.pdf|0", "report.pdf|2"])
+
+    def test_the_budget_is_never_exceeded(self):
+        self.assertEqual(pack_sections(self.sections(), max_tokens=400, token_unit=50), [])
+        self.assertEqual(pack_sections([], max_tokens=1000), [])
+
+
+@override_settings(EMBEDDING_CACHE_ENABLED=False, VECTOR_STORE_PERSISTENT=False)
+class RetrievalWithStubEmbeddingsTests(SimpleTestCase):
+    """
+    Embeds the chunks of two files with the OpenAI stand-in and retrieves the closest ones from both vector stores.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = start_openai_stub_server(embedding_dimensions=256)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        super().tearDownClass()
+
+    def retrieve(self, store):
+        from openai import AzureOpenAI
+        from DVoice.utilities.llm_and_embeddings_utils import generate_embeddings, generate_embeddings_for_list_of_chunks
+
+        client = AzureOpenAI(api_key="stub", api_version=settings.API_VERSION, azure_endpoint=self.server.endpoint,
+                             azure_deployment=settings.EMBEDDING_DEPLOYMENT_NAME) # neither is checked by the stand-in
+        texts = {"budget.txt": ["the budget of the city grows with the taxes", "the deficit of the budget is reduced"],
+                 "garden.txt": ["roses and tulips bloom in the spring garden", "water the garden plants every morning"]}
+        lists_of_chunks = {title: [{"title": title, "id": f"{title}|{i}", "text": text, "n_tokens": len(text.split())}
+                                   for i, text in enumerate(chunk_texts)]
+                           for title, chunk_texts in texts.items()}
+        lists_of_chunks = generate_embeddings_for_list_of_chunks(client, lists_of_chunks)
+        doc_hashes = {title: document_hash(chunks) for title, chunks in lists_of_chunks.items()}
+        store.add_chunks(chunk_columns(lists_of_chunks, doc_hashes))
+        query_embedding = generate_embeddings(client, "tulips in the garden")
+        try:
+            return (store.get_docs(query_embedding, n_results=2),
+                    store.get_docs(query_embedding, doc_hashes=[doc_hashes["budget.txt"]], n_results=4))
+        finally:
+            store.release()
+
+    def check(self, results, budget_only):
+        self.assertEqual(results["metadatas"][0][0]["title"], "garden.txt")
+        self.assertEqual(results["documents"][0][0], "roses and tulips bloom in the spring garden")
+        self.assertEqual({metadata["title"] for metadata in budget_only["metadatas"][0]}, {"budget.txt"})
+        self.assertEqual(len(budget_only["ids"][0]), 2)
+
+    def test_numpy_vector_index(self):
+        self.check(*self.retrieve(NumpyVectorIndex()))
+
+    def test_chroma_handler(self):
+        from utilities.chromadb import ChromaDBHandler
+
+        self.check(*self.retrieve(ChromaDBHandler()))
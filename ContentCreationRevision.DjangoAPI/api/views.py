@@ -1,14 +1,12 @@
 import os, sys
 import traceback
 import threading
-import pandas as pd
 from rest_framework.views                     import APIView
 from rest_framework.response                  import Response
-from azure.identity                           import DefaultAzureCredential, ChainedTokenCredential, AzureCliCredential
 from django.conf                              import settings
 from utilities.blob_storage                   import get_blob_file
 from utilities.cosmos_process                import update_file_thread_flag
-from utilities.chromadb                      import ChromaDBHandler
+from utilities.token_provider                import get_token_provider
 from rest_framework                          import status
 from pathlib                                 import Path
 from typing                                  import Dict, Any
@@ -25,9 +23,12 @@ class DVoiceRevisionAPIView(APIView):
     def __init__(self) -> None:
         """
         Initializes the API view by setting up Azure authentication credentials.
+        The credential and token come from the process wide token provider: no `az` CLI call per request and the
+        token handed to the job stays valid for its whole duration.
         """
-        self.default_credential = ChainedTokenCredential(AzureCliCredential(), DefaultAzureCredential())
-        self.token         = self.default_credential.get_token(settings.COGNITIVE_SERVICES_URL)
+        token_provider = get_token_provider()
+        self.default_credential = token_provider.credential
+        self.token         = token_provider.live_token(settings.COGNITIVE_SERVICES_URL)
     
     def post(self, request: Any) -> Response:
         """
@@ -144,11 +145,12 @@ class DVoiceCreationAPIView(APIView):
         """
     def __init__(self) -> None:
         """
-        Initialize the API view by setting up authentication and database handlers.
+        Initialize the API view by setting up authentication.
+        The chroma db vector db is built by DVoiceCreator only when a retrieval task needs it.
         """
-        self.chroma_db = ChromaDBHandler()
-        self.default_credential = ChainedTokenCredential(AzureCliCredential(), DefaultAzureCredential())
-        self.token         = self.default_credential.get_token(settings.COGNITIVE_SERVICES_URL)
+        token_provider = get_token_provider()
+        self.default_credential = token_provider.credential
+        self.token         = token_provider.live_token(settings.COGNITIVE_SERVICES_URL)
     
     def post(self, request: Any) -> Response:
         """
@@ -165,7 +167,7 @@ class DVoiceCreationAPIView(APIView):
         self.user_id = self.post_message["userId"]
         self.task_id = self.post_message["taskId"]
         self.post_message["defaultCredential"] = self.default_credential
-        self.post_message["chromaDB"] = self.chroma_db
+        self.post_message["chromaDB"] = None # lazily built in DVoiceCreator._get_chroma_db
         
         self.post_message["token"] = self.token
         self.post_message["debug"] = settings.DEBUG
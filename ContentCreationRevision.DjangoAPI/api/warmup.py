@@ -0,0 +1,70 @@
+import time
+import logging
+import importlib
+import threading
+from typing import Any, Dict, List, Optional
+
+## LOGGING CAPABILITIES
+
+logger = logging.getLogger(__name__)
+
+
+_warmup_status = {"state": "pending", "modules": {}, "tiktoken_encoding": None}
+_warmup_lock = threading.Lock()
+
+
+def warmup_status() -> Dict[str, Any]:
+    """
+    Returns the state of the warm-up ("pending", "running", "done", "failed") and the import time of each module.
+    """
+    with _warmup_lock:
+        return {"state": _warmup_status["state"],
+                "modules": dict(_warmup_status["modules"]),
+                "tiktoken_encoding": _warmup_status["tiktoken_encoding"]}
+
+
+def warm_up(modules: List[str], tiktoken_encoding: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Imports the modules the deployment needs and loads the tiktoken encoding, so the first request does not pay
+    for them (langchain, openai, docling/torch imports and the BPE file load take seconds).
+
+    Args:
+        modules (List[str]): The dotted module paths to import, ie settings.WARMUP_MODULES.
+        tiktoken_encoding (Optional[str]): The tiktoken encoding to load, None to skip.
+
+    Returns:
+        Dict[str, Any]: The warm-up status (see `warmup_status`).
+    """
+    with _warmup_lock:
+        _warmup_status["state"] = "running"
+    try:
+        for module in modules:
+            start_time = time.time()
+            importlib.import_module(module)
+            processing_time = time.time() - start_time
+            with _warmup_lock:
+                _warmup_status["modules"][module] = processing_time
+            print(f"Warm-up import of {module} took {processing_time} second(s)")
+        if tiktoken_encoding:
+            import tiktoken
+            start_time = time.time()
+            tiktoken.get_encoding(tiktoken_encoding).encode("warm up")
+            with _warmup_lock:
+                _warmup_status["tiktoken_encoding"] = time.time() - start_time
+        with _warmup_lock:
+            _warmup_status["state"] = "done"
+    except Exception as e:
+        with _warmup_lock:
+            _warmup_status["state"] = "failed"
+        logger.info(f"Warm-up failed, the modules will be imported on first use: {e}")
+
+    return warmup_status()
+
+
+def warm_up_in_background(modules: List[str], tiktoken_encoding: Optional[str] = None) -> threading.Thread:
+    """
+    Runs `warm_up` on a daemon thread so the app starts serving (health checks) immediately.
+    """
+    warmup_thread = threading.Thread(target=warm_up, args=(modules, tiktoken_encoding), name="dvoice-warmup", daemon=True)
+    warmup_thread.start()
+    return warmup_thread
@@ -44,6 +44,10 @@ DEBUG = config["app_debug"]
 
 #Manage Identity URL
 COGNITIVE_SERVICES_URL = config["cognitive_services_url"]
+# Token provider (utilities/token_provider.py)
+TOKEN_REFRESH_MARGIN            = 300   ## a cached token expiring within this many seconds is refreshed synchronously on read
+TOKEN_PROACTIVE_REFRESH_WINDOW  = 900   ## the background thread refreshes tokens expiring within this many seconds
+TOKEN_REFRESH_CHECK_INTERVAL    = 60    ## seconds between two checks of the background refresh thread
 # All credentials for azure openai
 TEXT_MODEL_GPT3_5      = config["text_model_gpt3_5"] ## DEPRECATED
 TEXT_MODEL_GPT4_8K     = config["text_model_gpt4_8k"] ## DEPRECATED
@@ -102,6 +106,9 @@ MODEL_CONTEXT_WINDOW_SIZE = {"TEXT_MODEL_GPT3_5"                    : 16_000,
                             "MULTIMODAL_MODEL_GPT4O_128K_DVOICE"    : 128_000
                             }
 CONTEXT_WINDOW_SIZE_CUTOFF = 0.25 # DETERMINE THE UPPER LIMIT TO RAG INGESTION OF CHUNKS 
+CONTEXT_PACKER_MAX_TOKENS = None # TOKENS OF SECTIONS PACKED IN A PROMPT (utilities/openai_utils/context_packer.py). None: CONTEXT_WINDOW_SIZE_CUTOFF OF THE CONTEXT WINDOW
+CONTEXT_PACKER_TOKEN_UNIT = 50 # GRANULARITY IN TOKENS OF THE KNAPSACK SELECTION OF THE SECTIONS
+SUMMARIZATION_MAP_MAX_TOKENS = 3000 # CONSECUTIVE CHUNKS OF A DOCUMENT SUMMARIZED IN ONE MAP CALL UP TO THESE TOKENS. 0: ONE CHUNK PER MAP CALL
 MODEL_TEMPERATURE_BY_TASK = {"QA": 0,
                              "SUMMARIZATION": 0.5
                             }
@@ -111,7 +118,13 @@ NO_DOCS_FLAG           = "NODOCUMENTS"
 
 # Form Recognizer credentials and settings
 ENDPOINT = config["endpoint_ocr"]
-FORMRECOGNIZER_API_VERSION = "2023-07-31"  
+FORMRECOGNIZER_API_VERSION = "2023-07-31"
+FORMRECOGNIZER_ASYNC_CLIENT             = True  ## one shared async client, concurrent page ranges and backoff polling (utilities/doc_intelligence_async.py)
+FORMRECOGNIZER_PAGE_RANGE_SIZE          = 10    ## large documents are submitted as concurrent ranges of this many pages
+FORMRECOGNIZER_MAX_CONCURRENT_REQUESTS  = 4     ## maximum number of page ranges analyzed at the same time
+FORMRECOGNIZER_POLL_INITIAL_DELAY       = 0.5   ## seconds before the first poll of an analyze operation
+FORMRECOGNIZER_POLL_MAX_DELAY           = 5     ## upper bound of the exponential polling backoff, in seconds
+FORMRECOGNIZER_OPERATION_TIMEOUT        = 300   ## seconds after which an analyze operation is considered failed
 
 #credentials Host
 REDIS_LOCAL      = config["redis_local"] 
@@ -130,6 +143,40 @@ SEARCH_TYPE   = config['search_type']
 #ChromaDB Collection Name
 COLLECTION_NAME = "collection"
 
+# Persistent per user vector store of the reference files of the creation jobs (utilities/chromadb.py, utilities/vector_index.py)
+VECTOR_STORE_BACKEND                = "chroma" ## "numpy": exact in-process search, no chromadb (persistent = kept in memory for the process lifetime)
+VECTOR_STORE_PERSISTENT             = True  ## False: an in memory collection per job, deleted at its end (nothing reused)
+VECTOR_STORE_DIR                    = BASE_DIR / 'vector_store' ## on-disk chroma database, one collection per user
+VECTOR_STORE_MAX_DOCUMENTS_PER_USER = 200   ## documents kept per user, the least recently stored ones are evicted above
+VECTOR_STORE_INSERT_BATCH_SIZE      = 5000  ## chunks per upsert into the vector store
+VECTOR_STORE_MAX_RESIDENT_USERS     = 50    ## "numpy" backend: user collections kept in memory, the least recently used one is dropped above
+
+# Embedding cache and batched embedding requests (utilities/embedding_cache.py, DVoice/utilities/llm_and_embeddings_utils.py)
+EMBEDDING_CACHE_ENABLED             = True
+EMBEDDING_CACHE_PATH                = BASE_DIR / 'embedding_cache.sqlite3' ## float32 vectors keyed by (deployment, sha256 of the text)
+EMBEDDING_CACHE_MAX_ENTRIES         = 50_000 ## vectors kept (about 6 KB each), the least recently used ones are evicted above
+EMBEDDING_BATCH_SIZE                = 256   ## texts per embedding request (the API accepts up to 2048)
+EMBEDDING_BATCH_MAX_TOKENS          = 100_000 ## estimated tokens per embedding request
+EMBEDDING_MAX_CONCURRENT_REQUESTS   = 4     ## embedding requests of one job in flight at the same time
+EMBEDDING_RETRY_DELAY               = 60    ## seconds before retrying a failed embedding request (ie TPM limit)
+
+# Map reduce summaries of the documents (utilities/openai_utils/summarize.py, utilities/summary_cache.py)
+SUMMARIZATION_MAX_CONCURRENCY       = 5     ## map and collapse calls of one document in flight at the same time
+SUMMARIZATION_TOKEN_MAX             = 10_000 ## summaries are collapsed until they total at most these tokens for the final reduce
+SUMMARIZATION_REDUCE_FAN_IN         = 4     ## summaries collapsed together in one call of the tree reduce
+SUMMARIZATION_MAX_REDUCE_LEVELS     = 5     ## levels of collapses at most before the final reduce
+SUMMARY_CACHE_ENABLED               = True
+SUMMARY_CACHE_PATH                  = BASE_DIR / 'summary_cache.sqlite3' ## map summaries keyed by (deployment, map instruction, sha256 of the section)
+SUMMARY_CACHE_MAX_ENTRIES           = 20_000 ## summaries kept, the least recently used ones are evicted above
+
+# Hybrid BM25 + vector retrieval of the creation jobs (utilities/hybrid_retrieval.py)
+HYBRID_RETRIEVAL_ENABLED            = True  ## False: the 20 closest sections of the vector store only
+HYBRID_RETRIEVAL_CANDIDATES         = 50    ## sections taken from each of the vector and BM25 rankings before the fusion
+HYBRID_RETRIEVAL_RRF_K              = 60    ## reciprocal rank fusion constant, a section scores 1 / (k + rank) per ranking
+HYBRID_RETRIEVAL_MMR_LAMBDA         = 0.7   ## relevance vs diversity of the selection, 1: relevance only
+HYBRID_RETRIEVAL_MAX_CONTEXT_TOKENS = 8000  ## tokens of sections sent to the answer prompt (chunks are about 1000 tokens)
+HYBRID_RETRIEVAL_MAX_SECTIONS       = 20    ## sections sent to the answer prompt at most
+
 #Blob Storage API URLS
 LIST_ALL_BLOBS_URL                              = config["list_all_blobs_url"]
 DOWNLOAD_DOCUMENT_URL                           = config["download_document_url"]
@@ -150,6 +197,15 @@ DVOICE_DOWNLOAD_FOLDER = "dvoice_input"
 DVOICE_UPLOAD_FOLDER = "dvoice_output"
 DVOICE_DOWNLOAD_TRANSFORMERS_FOLDER = "doclingtransformers"
 
+# STARTUP WARM-UP (api/apps.py, api/warmup.py). Profile the import cost with: python manage.py profile_imports
+WARMUP_ENABLED           = True
+## docling + torch ("docling.document_converter") is opt-in: it keeps hundreds of MB resident in every worker, add it
+## to the list only on deployments that parse pdf/docx uploads with docling
+WARMUP_MODULES           = ["DVoice.main",                  ## langchain, openai, tiktoken, pydantic (every dvoice task)
+                            "DVoice.parsing.file_parsing",  ## pdf triage and parsing entry point
+                            ]
+WARMUP_TIKTOKEN_ENCODING = "o200k_base" ## loaded once so the first token count does not read the BPE file
+
 # Application definition
 
 INSTALLED_APPS = [
@@ -285,3 +341,56 @@ AZURE_AD = {
     'AUTHORITY'    : config["authority"],
     'SCOPE'        : config["scope"],
 }
+
+# JWKS key cache (api/jwks_cache.py)
+AZURE_AD_JWKS_URL                   = config.get("azure_ad_jwks_url", f"https://login.microsoftonline.com/{config['tenant_id']}/discovery/v2.0/keys") ## override with the local jwks stub for tests
+AZURE_AD_JWKS_TTL                   = 3600  ## seconds the signing keys are served from memory before a background refresh
+AZURE_AD_JWKS_MIN_REFRESH_INTERVAL  = 60    ## minimum seconds between two forced refreshes triggered by an unknown kid
+AZURE_AD_JWKS_TIMEOUT               = 5     ## seconds before a jwks download is abandoned
+
+# Pooled HTTP transport for the blob storage and status APIs (utilities/http_transport.py)
+HTTP_CONNECT_TIMEOUT    = 5     ## seconds to establish a connection
+HTTP_READ_TIMEOUT       = 120   ## seconds between two bytes received (not the whole download)
+HTTP_MAX_RETRIES        = 3     ## retries on connection errors and on 429/5xx for idempotent methods
+HTTP_BACKOFF_FACTOR     = 0.5   ## exponential backoff between retries: 0.5, 1, 2 ... second(s), Retry-After is honoured
+HTTP_POOL_CONNECTIONS   = 4     ## number of hosts kept in the pool of a session
+HTTP_POOL_MAXSIZE       = 20    ## keep-alive connections per host (concurrent jobs share them)
+BLOB_STREAM_CHUNK_SIZE  = 1024 * 1024       ## bytes read/sent at a time when streaming blob downloads and uploads
+BLOB_SPOOL_MAX_MEMORY   = 16 * 1024 * 1024  ## a downloaded/generated document above this size is spooled to a temporary file on disk
+
+# Job status reporting to the thread flag service (utilities/status_reporter.py)
+STATUS_REPORTER_ENABLED         = True  ## False: the job threads update the thread flag synchronously as before (no progress events)
+STATUS_OUTBOX_PATH              = BASE_DIR / 'status_outbox.sqlite3' ## local durable queue of the undelivered status updates
+STATUS_OUTBOX_POLL_INTERVAL     = 1     ## seconds between two checks of the outbox when nothing wakes the delivery thread
+STATUS_PROGRESS_MIN_INTERVAL    = 2     ## minimum seconds between two progress events of a task (the latest one wins)
+STATUS_RETRY_BACKOFF            = 1     ## seconds before the first retry of a failed delivery, doubled at each attempt
+STATUS_RETRY_MAX_BACKOFF        = 60    ## maximum seconds between two retries
+STATUS_MAX_ATTEMPTS             = 10    ## deliveries attempted before an update is given up (logged as an error)
+STATUS_TERMINAL_TASKS_MAX       = 10000 ## finished tasks remembered so a late progress event cannot reopen them (oldest forgotten first)
+STATUS_SHUTDOWN_FLUSH_TIMEOUT   = 5     ## seconds the process waits at exit for the outbox to drain (the rest is sent at next start)
+
+# Stage spans, LLM token accounting and metrics (utilities/instrumentation.py, scraped on /metrics/)
+INSTRUMENTATION_DURATION_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600) ## histogram buckets in seconds
+INSTRUMENTATION_REPORT_DIR       = BASE_DIR / 'job_reports' ## one <task id>.json report per job (stages, llm calls, tokens). None: not written
+INSTRUMENTATION_RECENT_JOBS      = 50    ## job reports kept in memory
+
+# Per job and per user token budget of the revision jobs (utilities/token_budget.py)
+TOKEN_BUDGET_ENABLED            = True
+TOKEN_BUDGET_JOB_MAX_TOKENS     = 1_500_000 ## prompt + completion tokens one revision job may spend. None: unlimited
+TOKEN_BUDGET_USER_MAX_TOKENS    = 3_000_000 ## tokens the jobs of one user may spend over the window. None: unlimited
+TOKEN_BUDGET_USER_WINDOW        = 3600  ## seconds of the rolling window of the per user ceiling
+TOKEN_BUDGET_DEGRADE            = True  ## over budget: fused then partial revision. False: the job is refused
+TOKEN_BUDGET_ABORT_MARGIN       = 1.25  ## a running job is aborted once it spends this many times its remaining budget
+
+# Routing of the DVoice Azure OpenAI calls over several deployments/regions (utilities/llm_router.py)
+LLM_ROUTER_ENABLED              = True
+LLM_DEPLOYMENTS                 = config.get("llm_deployments", []) ## [{"name", "endpoint", "deployment", "api_version", "tier": "heavy"|"light", "weight"}]. Empty: the DVoice deployment only
+LLM_ROUTER_QUOTA_WINDOW         = 60    ## seconds a x-ratelimit-remaining-tokens reading is trusted (Azure quotas are per minute)
+LLM_ROUTER_MIN_QUOTA_FRACTION   = 0.05  ## floor of the quota share in the weights, a nearly exhausted deployment is still tried
+LLM_ROUTER_FAILURE_THRESHOLD    = 3     ## consecutive 5xx/connection errors before a deployment is put aside
+LLM_ROUTER_COOLDOWN             = 30    ## seconds a failing deployment (or a 429 without retry-after) is put aside
+LLM_ROUTER_POOL_MAXSIZE         = 50    ## keep-alive connections of the routed client of each tier
+LLM_ROUTER_READ_TIMEOUT         = 600   ## seconds, used when the openai client does not set its own timeout
+
+# Concurrent pre-flight analyses of the creation jobs (utilities/task_graph.py)
+TASK_GRAPH_MAX_WORKERS          = 8     ## steps of a graph running at the same time (one graph per creation job)
@@ -1,7 +1,7 @@
 # Import necessary modules from Django
 from django.contrib import admin
 from django.urls import path, include 
-from .views import root_view, health_check_view
+from .views import root_view, health_check_view, readiness_check_view, metrics_view
 
 
 
@@ -11,6 +11,8 @@ urlpatterns = [
     # Map pings to the root view 
     path('', root_view, name='root_view'),
     path('healthcheck/', health_check_view, name='health_check_view'),
+    path('readiness/', readiness_check_view, name='readiness_check_view'), # docling tensors provisioning status
+    path('metrics/', metrics_view, name='metrics_view'), # stage durations, llm calls and tokens (prometheus format)
     # Include all the URL patterns defined in 'doc_compare.urls' and prefix them with 'doc_compare/'
     path('api/', include('api.urls')),
 
@@ -1,9 +1,24 @@
 # views.py
 
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse
 
 def root_view(request):
     return HttpResponse("Application is running", status=200)
 
 def health_check_view(request):
     return HttpResponse("Health check OK", status=200)
+
+def readiness_check_view(request):
+    ## 503 until the docling tensors are provisioned and the warm-up is over so traffic is only routed to instances
+    ## that can parse pdfs without paying the imports on the first request
+    from DVoice.utilities.artifact_manager import get_artifact_manager
+    from api.warmup import warmup_status
+    readiness_status = get_artifact_manager().status()
+    readiness_status["warmup"] = warmup_status()
+    readiness_status["ready"] = readiness_status["ready"] and readiness_status["warmup"]["state"] in ("done", "failed")
+    return JsonResponse(readiness_status, status=200 if readiness_status["ready"] else 503)
+
+def metrics_view(request):
+    ## prometheus text exposition of the stage durations, llm calls, tokens and jobs of this process
+    from utilities.instrumentation import render_prometheus_metrics
+    return HttpResponse(render_prometheus_metrics(), content_type="text/plain; version=0.0.4; charset=utf-8", status=200)
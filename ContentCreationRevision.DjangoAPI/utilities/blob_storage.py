@@ -1,10 +1,12 @@
-import requests
 import json
+import tempfile
 from io import BytesIO
-from typing import Literal
+from typing import IO, Literal
 from django.conf import settings
 from docx import Document
 
+from utilities.http_transport import http_request, MultipartFileStream
+
 import logging
 import sys
 
@@ -21,9 +23,9 @@ logger.addHandler(handler)
 
 def get_all_blob_names(token):
 
-    response = requests.get(settings.LIST_ALL_BLOBS_URL, params=None, headers= {
+    response = http_request("GET", settings.LIST_ALL_BLOBS_URL, service="blob", params=None, headers= {
         "Authorization": "Bearer " + token.token
-    }, verify=settings.CERTIFICATE_VERIFY)
+    })
     
     try:
         file_names = json.loads(response.text)["result"]
@@ -42,10 +44,10 @@ def get_onboarding_file(file_name, token):
     params = {
         "fileName"    : file_name,
     }
-    file_response = requests.get(settings.DOWNLOAD_ONBOARDING_URL, params=params, headers= {
+    file_response = http_request("GET", settings.DOWNLOAD_ONBOARDING_URL, service="blob", params=params, headers= {
         "Authorization": "Bearer " + token.token
         
-    }, verify=settings.CERTIFICATE_VERIFY)
+    })
 
     if settings.DEBUG:
         print("got file: ", file_name)
@@ -54,24 +56,9 @@ def get_onboarding_file(file_name, token):
         "name": file_name,
         "byte_io": BytesIO(file_response.content)
     }
-def get_blob_file(token: str, file_name: str, api_type: Literal["document_analyzer", 
-                                                                "Content_voice", 
-                                                                "Content_voice_docling_transformers"] = 
-                                                                "document_analyzer") -> BytesIO:
+def _get_blob_download_request(file_name: str, api_type: str) -> tuple:
     """
-    Retrieves a file from a blob storage based on the specified API type.
- 
-    Args:
-        token (str): The authorization token required for accessing the blob storage.
-        file_name (str): The name of the file to download.
-        api_type (Literal["document_analyzer", "Content_voice", "Content_voice_docling_transformers"]):
-            The type of API determining the URL and parameters for retrieval. Defaults to "document_analyzer".
- 
-    Returns:
-        BytesIO: A BytesIO object containing the file content.
- 
-    Raises:
-        Exception: If the file download fails, an error is raised with the status code.
+    Returns the download url and query parameters of a file for the given API type (see `get_blob_file`).
     """
     if api_type == "document_analyzer":
         url = settings.DOWNLOAD_DOCUMENT_URL
@@ -92,18 +79,95 @@ def get_blob_file(token: str, file_name: str, api_type: Literal["document_analyz
         "folderName"  : settings.DVOICE_DOWNLOAD_TRANSFORMERS_FOLDER,
         "fileName"    : file_name,
         }
+
+    return url, params
+
+def get_blob_file(token: str, file_name: str, api_type: Literal["document_analyzer", 
+                                                                "Content_voice", 
+                                                                "Content_voice_docling_transformers"] = 
+                                                                "document_analyzer") -> IO[bytes]:
+    """
+    Retrieves a file from a blob storage based on the specified API type.
+
+    The response is streamed in chunks of settings.BLOB_STREAM_CHUNK_SIZE into a spooled temporary file: it stays
+    in memory up to settings.BLOB_SPOOL_MAX_MEMORY bytes and rolls over to disk above, so a large upload no longer
+    costs `response.content` plus its BytesIO copy in RAM.
+ 
+    Args:
+        token (str): The authorization token required for accessing the blob storage.
+        file_name (str): The name of the file to download.
+        api_type (Literal["document_analyzer", "Content_voice", "Content_voice_docling_transformers"]):
+            The type of API determining the URL and parameters for retrieval. Defaults to "document_analyzer".
+ 
+    Returns:
+        IO[bytes]: A readable, seekable binary file (SpooledTemporaryFile) positioned at 0 containing the file content.
+ 
+    Raises:
+        Exception: If the file download fails, an error is raised with the status code.
+    """
+    spooled_file = tempfile.SpooledTemporaryFile(max_size=settings.BLOB_SPOOL_MAX_MEMORY)
+    try:
+        number_of_bytes, _ = stream_blob_file(token, file_name, spooled_file, api_type=api_type,
+                                              chunk_size=settings.BLOB_STREAM_CHUNK_SIZE)
+    except Exception as e:
+        spooled_file.close()
+        raise e
+    spooled_file.seek(0)
+
+    logger.info(f"✅ Donwloaded {file_name} ({number_of_bytes} bytes)")
     
-    response = requests.get(url, params=params, headers= {
+    return spooled_file
+
+
+def stream_blob_file(token, 
+                     file_name: str, 
+                     output_file, 
+                     api_type: Literal["document_analyzer", 
+                                       "Content_voice", 
+                                       "Content_voice_docling_transformers"] = "Content_voice_docling_transformers",
+                     chunk_size: int = 8 * 1024 * 1024) -> tuple:
+    """
+    Streams a file from the blob storage API into an open binary file, hashing it on the fly.
+
+    The content is never held in memory as a whole: it is written chunk by chunk, which is what the multi-hundred-MB
+    docling safetensors need (and what `get_blob_file` spools the uploads with).
+
+    Args:
+        token (Azure Access Token): The authorization token required for accessing the blob storage.
+        file_name (str): The name of the file to download.
+        output_file (BinaryIO): An open, writable binary file (ie a temporary file next to the final destination).
+        api_type (Literal["document_analyzer", "Content_voice", "Content_voice_docling_transformers"]):
+            The type of API determining the URL and parameters for retrieval. Defaults to "Content_voice_docling_transformers".
+        chunk_size (int): The number of bytes read from the response at a time.
+
+    Returns:
+        tuple: A tuple containing:
+            - number_of_bytes (int): The number of bytes written.
+            - sha256 (str): The hex sha256 digest of the downloaded content.
+
+    Raises:
+        Exception: If the file download fails, an error is raised with the status code.
+    """
+    import hashlib
+
+    url, params = _get_blob_download_request(file_name, api_type)
+    sha256 = hashlib.sha256()
+    number_of_bytes = 0
+    with http_request("GET", url, service="blob", params=params, headers= {
         "Authorization": "Bearer " + token.token
-    }, verify=settings.CERTIFICATE_VERIFY)
-    
-    logger.info(f"✅ Donwloaded {file_name} with response: {response.status_code}")
-    
-    if response.status_code != 200:
-        # Throw an error with the status code and error message
-        raise Exception(f'Failed to download file {file_name}: Status code {response.status_code}')
-    
-    return BytesIO(response.content)
+    }, stream=True) as response:
+
+        logger.info(f"✅ Streaming {file_name} with response: {response.status_code}")
+
+        if response.status_code != 200:
+            raise Exception(f'Failed to download file {file_name}: Status code {response.status_code}')
+
+        for chunk in response.iter_content(chunk_size=chunk_size):
+            output_file.write(chunk)
+            sha256.update(chunk)
+            number_of_bytes += len(chunk)
+
+    return number_of_bytes, sha256.hexdigest()
 
 def save_blob_file(doc_to_save: Document, file_name: str, token) -> tuple:
     """
@@ -141,34 +205,36 @@ def save_blob_file(doc_to_save: Document, file_name: str, token) -> tuple:
     formatted_time = time.strftime("%Y-%m-%d_%H-%M-%S", current_time)
     
     final_file_name = file_name_stem + "_" + formatted_time + extension
-    # Convert document to a byte stream for upload
-    output_stream = BytesIO()
+    # Serialize the document once into a spooled file (memory under the threshold, disk above), streamed to the API
+    output_stream = tempfile.SpooledTemporaryFile(max_size=settings.BLOB_SPOOL_MAX_MEMORY)
     doc_to_save.save(output_stream)
     output_stream.seek(0)
     
     try:
         # one file at a time for now
-        # Prepare the file data for the API request
-        files = {
-            'files': (
-                final_file_name,
-                output_stream.getvalue(),
-                'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
-            )
-        }
+        # Prepare the multipart body, read from the spooled file while it is sent
+        body = MultipartFileStream(
+            'files',
+            final_file_name,
+            output_stream,
+            'application/vnd.openxmlformats-officedocument.wordprocessingml.document',
+            chunk_size=settings.BLOB_STREAM_CHUNK_SIZE
+        )
         # Construct the Azure folder and blob storage details
         folder_name = user_folder + "/" + settings.DVOICE_UPLOAD_FOLDER
         blob_container_name = settings.DVOICE_CONTAINER_NAME
         # Make the API request to upload the document
-        response = requests.post(
+        response = http_request(
+            "POST",
             settings.DVOICE_UPLOAD_DOCUMENT_URL,
+            service="blob",
             params={
                 'container': blob_container_name,
                 'folderName': folder_name
             },
-            files=files,
-            headers= {"Authorization": "Bearer " + token.token},
-            verify= settings.CERTIFICATE_VERIFY
+            data=body,
+            headers= {"Authorization": "Bearer " + token.token,
+                      "Content-Type": body.content_type}
         )
         # Raise an error if the request was unsuccessful
         response.raise_for_status()
@@ -176,5 +242,7 @@ def save_blob_file(doc_to_save: Document, file_name: str, token) -> tuple:
             in blob folder path {folder_name}")
     except Exception as e:
         print(f"Error uploading corrected document to external API: {e}")
+    finally:
+        output_stream.close()
     
     return final_file_name, folder_name, blob_container_name
\ No newline at end of file
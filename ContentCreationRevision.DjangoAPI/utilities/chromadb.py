@@ -1,55 +1,175 @@
+import uuid
+import hashlib
+import logging
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Set
+
 import chromadb
 from django.conf import settings
+from utilities.vector_index import chunk_metadata, dataframe_columns
+
+## LOGGING CAPABILITIES
+
+logger = logging.getLogger(__name__)
+
+_persistent_client = None
+_persistent_client_lock = threading.Lock()
+_collection_locks: Dict[str, threading.RLock] = {}
+
+
+def get_persistent_client() -> Any:
+    """
+    Returns the process wide on-disk chroma client of settings.VECTOR_STORE_DIR.
+    """
+    global _persistent_client
+    with _persistent_client_lock:
+        if _persistent_client is None:
+            _persistent_client = chromadb.PersistentClient(path=str(settings.VECTOR_STORE_DIR))
+        return _persistent_client
+
+
+def _collection_lock(name: str) -> threading.RLock:
+    with _persistent_client_lock:
+        return _collection_locks.setdefault(name, threading.RLock())
+
 
 class ChromaDBHandler:
+    """
+    The vector store of the retrieval tasks of the creation jobs.
 
+    With settings.VECTOR_STORE_PERSISTENT, the chunks are stored on disk (settings.VECTOR_STORE_DIR) in one
+    collection per user, identified by the hash of their document (`document_hash`): a file the user already
+    uploaded is not embedded again, and each job only searches the documents it was given, so concurrent jobs of
+    the same user do not see each other's files. The least recently stored documents are evicted above
+    settings.VECTOR_STORE_MAX_DOCUMENTS_PER_USER.
 
-    def __init__(self):
+    Otherwise the collection is in memory, with a name of its own so concurrent jobs do not collide, and deleted
+    at the end of the job.
+
+    Hold `lock` from `stored_documents` to `get_docs` so another job of the user cannot evict a document in between.
+    """
+
+    def __init__(self, user_id: Optional[str] = None):
+        """
+        Args:
+            user_id (Optional[str]): The user whose collection is used when the store is persistent. Defaults to
+                                     None: an in memory collection of this handler only.
+        """
+        self.persistent = bool(settings.VECTOR_STORE_PERSISTENT and user_id)
+        if self.persistent:
+            ## chroma collection names: 3 to 63 characters, letters, digits, '_' and '-'
+            self.collection_name = f"{settings.COLLECTION_NAME}-{hashlib.sha256(user_id.lower().encode('utf-8')).hexdigest()[:32]}"
+            self._chroma_client = get_persistent_client()
+        else:
+            self.collection_name = f"{settings.COLLECTION_NAME}-{uuid.uuid4().hex}"
+            self._chroma_client = chromadb.Client()
+        self.collection = self._chroma_client.get_or_create_collection(name=self.collection_name)
+        self.lock = _collection_lock(self.collection_name) ## reentrant, shared by the handlers of the collection
+
+    @staticmethod
+    def _where_documents(doc_hashes: List[str]) -> Dict[str, Any]:
+        if len(doc_hashes) == 1:
+            return {"doc_hash": doc_hashes[0]}
+        return {"$or": [{"doc_hash": doc_hash} for doc_hash in doc_hashes]}
+
+    def stored_documents(self, doc_hashes: Iterable[str]) -> Set[str]:
+        """
+        Returns the documents (hashes) among `doc_hashes` whose chunks are already stored, those do not need to be
+        embedded again.
         """
-        Initialize the ChromaDB handler.
-         Create a new collection named 'collection' and add data from the provided dataframe.
+        doc_hashes = list(dict.fromkeys(doc_hashes))
+        if not self.persistent or not doc_hashes:
+            return set()
+        stored = self.collection.get(where=self._where_documents(doc_hashes), include=["metadatas"])
+        return {metadata["doc_hash"] for metadata in stored["metadatas"]}
+
+    def add_chunks(self, columns: Dict[str, Any], keep_documents: Optional[Iterable[str]] = None) -> None:
         """
-        self._chroma_client = chromadb.Client()
-        self.collection = self._chroma_client.get_or_create_collection(name=settings.COLLECTION_NAME)
+        Adds chunks collected in columns, upserted in batches of settings.VECTOR_STORE_INSERT_BATCH_SIZE (at most
+        the maximum batch size of the chroma client).
 
+        Args:
+            columns (Dict[str, Any]): The output of `chunk_columns` (utilities/vector_index.py): the lists 'title',
+                                      'id', 'text', 'n_tokens', 'doc_hash' (for the persistent store) and the
+                                      (chunks x dimension) float32 array 'embedding'.
+            keep_documents (Optional[Iterable[str]]): Documents (hashes) never evicted by this insertion, the
+                                                      stored documents the job reuses. Defaults to None.
+        """
+        index, metadata = chunk_metadata(columns)
+        batch_size = min(settings.VECTOR_STORE_INSERT_BATCH_SIZE, getattr(self._chroma_client, "max_batch_size", None) or settings.VECTOR_STORE_INSERT_BATCH_SIZE)
+        with self.lock:
+            for start in range(0, len(index), batch_size):
+                self.collection.upsert(
+                    documents=columns["text"][start:start + batch_size],
+                    metadatas=metadata[start:start + batch_size],
+                    ids=index[start:start + batch_size],
+                    embeddings=columns["embedding"][start:start + batch_size].tolist()
+                )
+            if self.persistent:
+                self._evict_old_documents(set(keep_documents or ()))
 
     def add_document(self, df):
         """
         Args:
             df (pd.DataFrame): Dataframe containing data to be added to the collection.
-                               The dataframe is expected to have columns 'Topic Body', 'Object', 
-                               and 'embeddings'.
-
-        Returns:
-            tuple: A tuple containing the chroma client and the created collection.
+                               The dataframe is expected to have columns 'title', 'id', 'text', 'n_tokens' and
+                               'embedding', and 'doc_hash' (see `document_hash`) for the persistent store. Prefer
+                               `add_chunks` with `chunk_columns`.
         """
-        content    = df['text'].tolist()
-        metadata   = df.apply(lambda row: {'title':row['title'],'id': row['id'], 'n_tokens': row['n_tokens']}, axis=1).tolist()
-        index      = [str(i) for i in  df.index.tolist()]
-        embeddings = df['embedding'].tolist()
-
+        self.add_chunks(dataframe_columns(df))
 
-        self.collection.add(
-            documents=content,
-            metadatas=metadata,
-            ids=index,
-            embeddings=embeddings
-        )
-    
+    def _evict_old_documents(self, keep_documents: Set[str]) -> None:
+        """
+        Deletes the least recently stored documents of the collection above settings.VECTOR_STORE_MAX_DOCUMENTS_PER_USER,
+        except `keep_documents`.
+        """
+        stored = self.collection.get(include=["metadatas"])
+        stored_at: Dict[str, float] = {}
+        for metadata in stored["metadatas"]:
+            if "doc_hash" in metadata:
+                stored_at[metadata["doc_hash"]] = max(stored_at.get(metadata["doc_hash"], 0.0), metadata.get("stored_at", 0.0))
+        excess = len(stored_at) - settings.VECTOR_STORE_MAX_DOCUMENTS_PER_USER
+        if excess > 0:
+            evicted = sorted((doc_hash for doc_hash in stored_at if doc_hash not in keep_documents), key=stored_at.get)[:excess]
+            if not evicted:
+                return
+            self.collection.delete(where=self._where_documents(evicted))
+            logger.info(f"Evicted {len(evicted)} document(s) from the vector store {self.collection_name}")
 
     def delete_collection(self):
         """
         Delete the collection.
         """
-        self._chroma_client.delete_collection(name=settings.COLLECTION_NAME)
-         
-    def get_docs(self, query_embedding):
+        self._chroma_client.delete_collection(name=self.collection_name)
 
+    def release(self) -> None:
+        """
+        Ends the use of the store by a job: the in memory collection is deleted, the persistent one is kept for the
+        next jobs of the user.
+        """
+        if not self.persistent:
+            self.delete_collection()
+
+    def get_docs(self, query_embedding, doc_hashes: Optional[List[str]] = None, titles: Optional[List[str]] = None,
+                 n_results: int = 20):
+        """
+        Args:
+            query_embedding: The embedding of the query.
+            doc_hashes (Optional[List[str]]): Restricts the search to these documents (the ones of the job).
+                                              Defaults to None: the whole collection.
+            titles (Optional[List[str]]): Restricts the search to the chunks of these files. Defaults to None.
+            n_results (int): The number of closest chunks returned. Defaults to 20.
+        """
+        filters = []
+        if doc_hashes:
+            filters.append(self._where_documents(list(dict.fromkeys(doc_hashes))))
+        if titles:
+            titles = list(dict.fromkeys(titles))
+            filters.append({"title": titles[0]} if len(titles) == 1 else {"$or": [{"title": title} for title in titles]})
+        where = (filters[0] if len(filters) == 1 else {"$and": filters}) if filters else None
         results = self.collection.query(
-            n_results=20,
-            query_embeddings = query_embedding
+            n_results=n_results,
+            query_embeddings = query_embedding,
+            where=where
         )
         return results
-
-
-
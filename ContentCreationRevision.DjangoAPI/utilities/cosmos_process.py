@@ -1,7 +1,8 @@
-import requests
 import json
 from django.conf import settings
 
+from utilities.http_transport import http_request
+
 import logging
 import sys
 
@@ -16,17 +17,59 @@ handler.setFormatter(formatter)
 logger.addHandler(handler)
 
 
+def build_thread_flag_request_body(thread_status, thread_output=None, progress=None):
+    """
+    Builds the body of a thread flag update.
+
+    Args:
+        thread_status (str): "inProgress", "Completed", "Failed" (or another terminal status, sent like "Completed").
+        thread_output (Any, optional): The final output (Completed) or the error message (Failed). Defaults to None.
+        progress (Dict[str, Any], optional): The current stage of an "inProgress" task, ie
+                                             {"stage": "revised", "completed": 3, "total": 12}. Defaults to None.
+
+    Returns:
+        Dict[str, Any]: The request body.
+    """
+    if thread_status == "Failed":
+        request_body = {"newStatus": thread_status,
+                        "errorMessage": thread_output}
+    elif thread_status == "inProgress":
+        request_body = {"newStatus": thread_status}
+        if progress:
+            request_body["progress"] = progress
+    else: # flag thread as "Completed"
+        request_body = thread_output # the final output sent to the cosmo db row once the thread is indeed complete --> that is why we flag it as "Completed"
+    return request_body
+
+
+def send_thread_flag_update(task_id, request_body, token):
+    """
+    Sends a thread flag update to the status service through the pooled "status" session.
+
+    Returns:
+        requests.Response: The response of the status service.
+    """
+    url = f"{settings.DVOICE_UPDATE_INPROGRESS_THREAD_FLAG_URL}/{task_id}"
+    logging.info(f"URL is {url}")
+    logging.info(f"taskid is {task_id}")
+    
+    return http_request("PUT", url, service="status", data = json.dumps(request_body), headers= {"Authorization": "Bearer " + token.token,
+                                                                                                  "Content-Type": "application/json"})
+
+
 def update_file_thread_flag(task_id,
                             file_name,
                             thread_status,
                             token,
-                            thread_output=None):
+                            thread_output=None,
+                            progress=None):
     """_summary_
 
     Args:
         file_name (_type_): _description_
         thread_status (_type_): _description_
         thread_output (_type_, optional): _description_. Defaults to None.
+        progress (Dict[str, Any], optional): The current stage of an "inProgress" task. Defaults to None.
 
     Raises:
         e: _description_
@@ -34,20 +77,8 @@ def update_file_thread_flag(task_id,
     Returns:
         _type_: _description_
     """
-    if thread_status == "Failed":
-        request_body = {"newStatus": thread_status,
-                        "errorMessage": thread_output}
-    elif thread_status == "Completed": # flag thread as "Completed"
-        request_body = thread_output # the final output sent to the cosmo db row once the thread is indeed complete --> that is why we flag it as "Completed"
-    elif thread_status == "inProgress":
-        request_body = {"newStatus": thread_status}
-        
-    url = f"{settings.DVOICE_UPDATE_INPROGRESS_THREAD_FLAG_URL}/{task_id}"
-    logging.info(f"URL is {url}")
-    logging.info(f"taskid is {task_id}")
-    
-    update_response = requests.put(url=url, data = json.dumps(request_body), headers= {"Authorization": "Bearer " + token.token,
-                                                                                      "Content-Type": "application/json"}, verify=settings.CERTIFICATE_VERIFY)
+    request_body = build_thread_flag_request_body(thread_status, thread_output, progress)
+    update_response = send_thread_flag_update(task_id, request_body, token)
     
     try:
         import sys
@@ -0,0 +1,356 @@
+import json
+import time
+import asyncio
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from django.conf import settings
+
+## LOGGING CAPABILITIES
+
+logger = logging.getLogger(__name__)
+
+
+## HTTP STATUS CODES ON WHICH A SUBMISSION IS RETRIED ONCE
+RETRYABLE_STATUS_CODES = (429, 500, 502, 503, 504)
+## PARAGRAPH ROLES RENDERED AS MARKDOWN HEADINGS
+HEADING_PREFIX_BY_ROLE = {"title": "# ", "sectionHeading": "## "}
+
+
+class _EventLoopThread:
+    """
+    A daemon thread running one asyncio event loop for the lifetime of the process.
+
+    The API runs the pipelines synchronously (one `asyncio.run` per step), and an aiohttp session is bound to the
+    loop it was created in. Running the Document Intelligence client on its own long lived loop is what lets every
+    call, from every request thread, reuse the same session and connection pool.
+    """
+    def __init__(self) -> None:
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="doc-intelligence-loop", daemon=True)
+        self._thread.start()
+
+    def run(self, coroutine: Any) -> Any:
+        """
+        Runs a coroutine on the background loop and blocks the calling thread until it returns.
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+
+class AsyncDocumentIntelligenceClient:
+    """
+    Asynchronous client of the Azure Document Intelligence (Form Recognizer) REST API.
+
+    Compared to building a `DocumentAnalysisClient` and blocking on `poller.result()` for every file:
+        - one aiohttp session (connection pool) and one cached bearer token are reused across documents
+        - large documents are split into page ranges (`pages=1-10`, `pages=11-20`, ...) analyzed concurrently
+        - analyze operations are polled with an exponential backoff (honouring `Retry-After`) on the event loop,
+          so no thread is held while the service works
+        - the result keeps paragraphs and tables, tables are rendered as markdown (see `analyze_result_to_pages`)
+
+    The endpoint can be pointed at the local stand-in server (`utilities/stubs/doc_intelligence_stub.py`),
+    in which case no credential is needed.
+    """
+    def __init__(self, endpoint: str, api_version: str, credential: Optional[Any] = None) -> None:
+        """
+        Args:
+            endpoint (str): The Document Intelligence endpoint, ie settings.ENDPOINT.
+            api_version (str): The REST api version, ie settings.FORMRECOGNIZER_API_VERSION.
+            credential (Optional[Any]): An Azure TokenCredential (DefaultAzureCredential). None for the stand-in server.
+        """
+        self.endpoint = endpoint.rstrip("/")
+        self.api_version = api_version
+        self.credential = credential
+        self._session = None
+        self._token = None
+        self._token_lock = None
+
+    async def _get_session(self) -> Any:
+        import aiohttp
+
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=settings.FORMRECOGNIZER_MAX_CONCURRENT_REQUESTS * 2,
+                                             ssl=None if settings.CERTIFICATE_VERIFY else False)
+            self._session = aiohttp.ClientSession(connector=connector)
+        return self._session
+
+    async def _get_headers(self) -> Dict[str, str]:
+        """
+        Returns the authorization header, requesting a new token only when the cached one is about to expire.
+        """
+        if self.credential is None:
+            return {}
+        if self._token_lock is None:
+            self._token_lock = asyncio.Lock()
+        async with self._token_lock:
+            if self._token is None or self._token.expires_on - settings.TOKEN_REFRESH_MARGIN < time.time():
+                ## azure-identity credentials are synchronous, keep the loop free while the token is fetched
+                self._token = await asyncio.to_thread(self.credential.get_token, settings.COGNITIVE_SERVICES_URL)
+        return {"Authorization": "Bearer " + self._token.token}
+
+    async def _submit(self, file_bytes: bytes, model_id: str, pages: Optional[str] = None) -> str:
+        """
+        Submits a document (or a page range of it) for analysis.
+
+        Args:
+            file_bytes (bytes): The content of the document.
+            model_id (str): The prebuilt model, ie "prebuilt-read", "prebuilt-layout", "prebuilt-document".
+            pages (Optional[str]): The 1-based page range to analyze, ie "11-20". None for the whole document.
+
+        Returns:
+            str: The operation location to poll.
+        """
+        session = await self._get_session()
+        url = f"{self.endpoint}/formrecognizer/documentModels/{model_id}:analyze"
+        params = {"api-version": self.api_version}
+        if pages is not None:
+            params["pages"] = pages
+        headers = await self._get_headers()
+        headers["Content-Type"] = "application/octet-stream"
+
+        for attempt in range(2): # one retry on throttling / transient errors
+            async with session.post(url, params=params, data=file_bytes, headers=headers) as response:
+                if response.status == 202:
+                    return response.headers["Operation-Location"]
+                response_text = await response.text()
+                if attempt == 0 and response.status in RETRYABLE_STATUS_CODES:
+                    retry_after = float(response.headers.get("Retry-After", settings.FORMRECOGNIZER_POLL_INITIAL_DELAY))
+                    logger.info(f"Document Intelligence submission returned {response.status}, retrying in {retry_after} second(s)")
+                    await asyncio.sleep(retry_after)
+                    continue
+                raise Exception(f"Document Intelligence submission failed with status {response.status}: {response_text}")
+
+    async def _poll(self, operation_location: str) -> Dict[str, Any]:
+        """
+        Polls an analyze operation with an exponential backoff until it succeeds, fails or times out.
+
+        Returns:
+            Dict[str, Any]: The `analyzeResult` of the operation.
+        """
+        session = await self._get_session()
+        delay = settings.FORMRECOGNIZER_POLL_INITIAL_DELAY
+        deadline = time.time() + settings.FORMRECOGNIZER_OPERATION_TIMEOUT
+        while True:
+            await asyncio.sleep(delay)
+            headers = await self._get_headers()
+            async with session.get(operation_location, headers=headers) as response:
+                if response.status in RETRYABLE_STATUS_CODES:
+                    operation = {"status": "running"}
+                elif response.status >= 400: # 401, 404...: polling again would get the same answer
+                    raise Exception(f"Document Intelligence polling failed with status {response.status}: {await response.text()}")
+                else:
+                    operation = json.loads(await response.text())
+                retry_after = response.headers.get("Retry-After")
+
+            if operation["status"] == "succeeded":
+                return operation["analyzeResult"]
+            if operation["status"] == "failed":
+                raise Exception(f"Document Intelligence analysis failed: {operation.get('error')}")
+            if time.time() > deadline:
+                raise TimeoutError(f"Document Intelligence analysis did not complete within "
+                                   f"{settings.FORMRECOGNIZER_OPERATION_TIMEOUT} second(s)")
+            delay = min(delay * 2, settings.FORMRECOGNIZER_POLL_MAX_DELAY)
+            if retry_after is not None:
+                delay = max(delay, float(retry_after))
+
+    async def analyze_range(self, file_bytes: bytes, model_id: str, pages: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Submits and polls one page range. Returns its `analyzeResult`.
+        """
+        operation_location = await self._submit(file_bytes, model_id, pages)
+        return await self._poll(operation_location)
+
+    async def analyze(self, file_bytes: bytes, model_id: str, page_count: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Analyzes a document, submitting its page ranges concurrently when it is longer than
+        settings.FORMRECOGNIZER_PAGE_RANGE_SIZE pages.
+
+        Args:
+            file_bytes (bytes): The content of the document.
+            model_id (str): The prebuilt model to use.
+            page_count (Optional[int]): The number of pages when known (pdf). None submits the document in one go.
+
+        Returns:
+            Dict[str, Any]: {"content": <markdown of the whole document>, "pages": <see analyze_result_to_pages>}
+        """
+        page_ranges = build_page_ranges(page_count, settings.FORMRECOGNIZER_PAGE_RANGE_SIZE)
+        semaphore = asyncio.Semaphore(settings.FORMRECOGNIZER_MAX_CONCURRENT_REQUESTS)
+
+        async def analyze_with_limit(pages: Optional[str]) -> Dict[str, Any]:
+            async with semaphore:
+                return await self.analyze_range(file_bytes, model_id, pages)
+
+        analyze_results = await asyncio.gather(*[analyze_with_limit(pages) for pages in page_ranges])
+
+        pages = []
+        for analyze_result in analyze_results:
+            pages.extend(analyze_result_to_pages(analyze_result))
+        pages.sort(key=lambda page: page["page_number"]) # ranges keep the page numbers of the full document
+
+        return {"content": "\n\n".join([page["markdown"] for page in pages]),
+                "pages": pages}
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+
+def build_page_ranges(page_count: Optional[int], page_range_size: int) -> List[Optional[str]]:
+    """
+    Splits a document into 1-based page range strings accepted by the `pages` query parameter.
+
+    Example:
+        build_page_ranges(25, 10) --> ["1-10", "11-20", "21-25"]
+        build_page_ranges(None, 10) --> [None] (whole document, page count unknown)
+    """
+    if not page_count or page_count <= page_range_size:
+        return [None]
+    return [f"{first_page}-{min(first_page + page_range_size - 1, page_count)}"
+            for first_page in range(1, page_count + 1, page_range_size)]
+
+
+def table_to_markdown(table: Dict[str, Any]) -> str:
+    """
+    Renders a Document Intelligence table as a markdown table.
+
+    Spanning cells keep their content in their top left position, the other positions they cover are left empty.
+    The first row is used as the markdown header row (markdown tables require one).
+
+    Args:
+        table (Dict[str, Any]): A table of the `analyzeResult` (rowCount, columnCount, cells).
+
+    Returns:
+        str: The markdown table.
+    """
+    grid = [["" for _ in range(table["columnCount"])] for _ in range(table["rowCount"])]
+    for cell in table["cells"]:
+        grid[cell["rowIndex"]][cell["columnIndex"]] = cell.get("content", "").replace("|", "\\|").replace("\n", " ")
+
+    markdown_rows = ["| " + " | ".join(grid[0]) + " |",
+                     "|" + "---|" * table["columnCount"]]
+    for row in grid[1:]:
+        markdown_rows.append("| " + " | ".join(row) + " |")
+
+    return "\n".join(markdown_rows)
+
+
+def _first_page_number(element: Dict[str, Any]) -> int:
+    return element["boundingRegions"][0]["pageNumber"]
+
+
+def _span_bounds(element: Dict[str, Any]) -> Tuple[int, int]:
+    spans = element.get("spans", [])
+    if not spans:
+        return (0, 0)
+    return (spans[0]["offset"], spans[-1]["offset"] + spans[-1]["length"])
+
+
+def analyze_result_to_pages(analyze_result: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """
+    Converts an `analyzeResult` into per page structures that keep lines, paragraphs and tables.
+
+    Paragraphs that belong to a table are not repeated as text: the table is rendered once as markdown, at its
+    position in the reading order. Titles and section headings become markdown headings.
+
+    Args:
+        analyze_result (Dict[str, Any]): The `analyzeResult` returned by the REST API.
+
+    Returns:
+        List[Dict[str, Any]]: One dictionary per page, in page order:
+            - "page_number": the 1-based page number in the full document
+            - "lines": the text lines of the page
+            - "paragraphs": the paragraphs of the page that are not part of a table
+            - "tables": the markdown tables of the page
+            - "markdown": the page content in reading order, tables preserved as markdown
+    """
+    pages = {}
+    for page in analyze_result.get("pages", []):
+        pages[page["pageNumber"]] = {"page_number": page["pageNumber"],
+                                     "lines": [line["content"] for line in page.get("lines", [])],
+                                     "paragraphs": [],
+                                     "tables": [],
+                                     "_blocks": []} # (offset, markdown block) pairs sorted later
+
+    table_bounds = []
+    for table in analyze_result.get("tables", []):
+        table_markdown = table_to_markdown(table)
+        bounds = _span_bounds(table)
+        table_bounds.append(bounds)
+        page = pages.get(_first_page_number(table))
+        if page is not None:
+            page["tables"].append(table_markdown)
+            page["_blocks"].append((bounds[0], "\n" + table_markdown + "\n"))
+
+    for paragraph in analyze_result.get("paragraphs", []):
+        start, end = _span_bounds(paragraph)
+        if any(table_start <= start and end <= table_end for table_start, table_end in table_bounds):
+            continue
+        page = pages.get(_first_page_number(paragraph))
+        if page is None:
+            continue
+        page["paragraphs"].append(paragraph["content"])
+        page["_blocks"].append((start, HEADING_PREFIX_BY_ROLE.get(paragraph.get("role"), "") + paragraph["content"]))
+
+    page_structures = []
+    for page_number in sorted(pages):
+        page = pages[page_number]
+        blocks = page.pop("_blocks")
+        if blocks:
+            page["markdown"] = "\n".join([block for _, block in sorted(blocks, key=lambda block: block[0])]).strip()
+        else: ## models without paragraphs: fall back on the lines
+            page["markdown"] = "\n".join(page["lines"])
+        page_structures.append(page)
+
+    return page_structures
+
+
+## ONE CLIENT AND ONE EVENT LOOP PER PROCESS
+
+_loop_thread = None
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_document_intelligence_client(default_credential: Optional[Any] = None) -> Tuple[AsyncDocumentIntelligenceClient, _EventLoopThread]:
+    """
+    Returns the process wide client and the background loop it runs on, creating them on first use.
+
+    Args:
+        default_credential (Optional[Any]): The credential of the current request. The client keeps the latest one,
+                                            the cached token is reused until it is about to expire.
+    """
+    global _loop_thread, _client
+    with _client_lock:
+        if _client is None:
+            _loop_thread = _EventLoopThread()
+            _client = AsyncDocumentIntelligenceClient(settings.ENDPOINT, settings.FORMRECOGNIZER_API_VERSION, default_credential)
+        elif default_credential is not None:
+            _client.credential = default_credential
+    return _client, _loop_thread
+
+
+def analyze_document(file_bytes: bytes,
+                     default_credential: Any,
+                     model_id: str,
+                     page_count: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Synchronous entry point used by `utilities/doc_process.py`.
+
+    Args:
+        file_bytes (bytes): The content of the document.
+        default_credential (Any): Credential for the Document Intelligence resource.
+        model_id (str): The prebuilt model to use.
+        page_count (Optional[int]): The number of pages when known, enables concurrent page range submission.
+
+    Returns:
+        Dict[str, Any]: {"content": <markdown of the whole document>, "pages": <per page structures>}
+    """
+    start_time = time.time()
+    client, loop_thread = get_document_intelligence_client(default_credential)
+    result = loop_thread.run(client.analyze(file_bytes, model_id, page_count))
+    end_time = time.time()
+    processing_time = end_time - start_time
+    print(f"Document Intelligence analysis ({model_id}, {len(result['pages'])} pages) took {processing_time} second(s)")
+
+    return result
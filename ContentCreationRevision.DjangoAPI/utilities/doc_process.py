@@ -3,12 +3,16 @@ from django.conf import settings
 from azure.ai.formrecognizer import DocumentAnalysisClient 
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_community.document_loaders import AzureAIDocumentIntelligenceLoader
+from utilities.doc_intelligence_async import analyze_document
 from io import BytesIO
 import tempfile
 
 
 def analyze_docx(file, default_credential):
 
+    if settings.FORMRECOGNIZER_ASYNC_CLIENT:
+        file.seek(0)
+        return analyze_document(file.read(), default_credential, "prebuilt-read")["content"]
     
     document_analysis_client = DocumentAnalysisClient(
         endpoint    = settings.ENDPOINT, 
@@ -34,6 +38,10 @@ def analyze_docx(file, default_credential):
 
 def analyze_pptx(file, default_credential):
 
+    if settings.FORMRECOGNIZER_ASYNC_CLIENT:
+        file.seek(0)
+        return analyze_document(file.read(), default_credential, "prebuilt-read")["content"]
+
     document_analysis_client = DocumentAnalysisClient(
         endpoint    = settings.ENDPOINT, 
         credential  = default_credential, 
@@ -74,9 +82,13 @@ def analyze_html(file, default_credential):
         file_data = file_stream.decode('iso-8859-1')
     if "<html>" not in file_data and "</html>" not in file_data:
         file_data = "<html>" + file_data + "</html>"
+        if settings.FORMRECOGNIZER_ASYNC_CLIENT:
+            return analyze_document(file_data.encode('utf-8'), default_credential, "prebuilt-read")["content"]
         poller = document_analysis_client.begin_analyze_document(
             "prebuilt-read", file_data.encode('utf-8'))
     else:
+        if settings.FORMRECOGNIZER_ASYNC_CLIENT:
+            return analyze_document(file_stream, default_credential, "prebuilt-read")["content"]
         poller = document_analysis_client.begin_analyze_document(
             "prebuilt-read", file_stream)
     
@@ -92,8 +104,31 @@ def analyze_html(file, default_credential):
     
 
 
-def analyze_pdf(file, default_credential):
-    # sample document
+def analyze_pdf_pages(file, default_credential, page_count=None):
+    """
+    Runs Azure Document Intelligence on a pdf and returns the text of each page separately, in page order.
+
+    Args:
+        file (BytesIO): The pdf stream.
+        default_credential (Azure TokenCredential): Credential for the Document Intelligence resource.
+        page_count (Optional[int]): The number of pages of the pdf when already known (the PDF profile of the triage),
+                                    so the file is not opened again to count them. Defaults to None.
+
+    Returns:
+        List[str]: One string per page. With the async client (settings.FORMRECOGNIZER_ASYNC_CLIENT) each page is its
+                   paragraphs in reading order with tables kept as markdown, otherwise the lines of the page joined
+                   with a new line.
+    """
+    if settings.FORMRECOGNIZER_ASYNC_CLIENT:
+        file.seek(0)
+        file_stream = file.read()
+        if page_count is None: # page ranges of large pdfs are analyzed concurrently
+            import pypdfium2
+            pdf = pypdfium2.PdfDocument(file_stream)
+            page_count = len(pdf)
+            pdf.close()
+        result = analyze_document(file_stream, default_credential, "prebuilt-document", page_count)
+        return [page["markdown"] for page in result["pages"]]
     
     document_analysis_client = DocumentAnalysisClient(
         endpoint    = settings.ENDPOINT, 
@@ -104,20 +139,25 @@ def analyze_pdf(file, default_credential):
     # Ensure the file pointer is at the start
     file.seek(0)
 
-    # Read the file stream as binary
+    # Read the file stream as binary (no copy when the stream wraps the shared upload bytes, see DocumentBuffer.stream)
     file_stream = file.read()
 
     poller = document_analysis_client.begin_analyze_document(
             "prebuilt-document", file_stream)
     result = poller.result()
         
-    data = []
+    pages = []
     
     for page in result.pages:
 
-        for line in page.lines:
-            data.append(line.content)
-    return "\n".join(data)
+        pages.append("\n".join([line.content for line in page.lines]))
+    return pages
+
+
+def analyze_pdf(file, default_credential, page_count=None):
+    # sample document
+    
+    return "\n".join(analyze_pdf_pages(file, default_credential, page_count))
     
 
 def analyze_txt(file):
@@ -165,6 +205,11 @@ def analyze_vtt(file):
     return text    
 
 def analyze_xls(file, default_credential):
+
+    if settings.FORMRECOGNIZER_ASYNC_CLIENT:
+        file.seek(0)
+        ## layout model so the sheets come back as markdown tables instead of flattened paragraphs
+        return analyze_document(file.read(), default_credential, "prebuilt-layout")["content"]
             
     document_analysis_client = DocumentAnalysisClient(
         endpoint    = settings.ENDPOINT, 
@@ -0,0 +1,38 @@
+import hashlib
+from typing import Optional
+
+import numpy as np
+from django.conf import settings
+
+from utilities.sqlite_cache import SqliteLRUCache, get_sqlite_cache
+
+
+def embedding_key(model: str, text: str) -> str:
+    """
+    Returns the key of the embedding of a text: the embedding deployment and the text.
+    """
+    digest = hashlib.sha256(model.encode("utf-8"))
+    digest.update(b"\x1f" + text.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _encode_vector(vector: np.ndarray) -> bytes:
+    return np.asarray(vector, dtype=np.float32).tobytes()
+
+
+def _decode_vector(blob: bytes) -> np.ndarray:
+    return np.frombuffer(blob, dtype=np.float32)
+
+
+def get_embedding_cache() -> Optional[SqliteLRUCache]:
+    """
+    Returns the process wide embedding cache, None when settings.EMBEDDING_CACHE_ENABLED is off.
+
+    The vectors are stored as float32 blobs (6 KB for 1536 dimensions), keyed by `embedding_key`, in a sqlite file
+    (settings.EMBEDDING_CACHE_PATH): a chunk uploaded again, by any job of any user, or a query asked again is not
+    sent to the embedding API. The least recently used vectors are evicted above settings.EMBEDDING_CACHE_MAX_ENTRIES.
+    """
+    if not settings.EMBEDDING_CACHE_ENABLED:
+        return None
+    return get_sqlite_cache(str(settings.EMBEDDING_CACHE_PATH), "embedding_vectors", settings.EMBEDDING_CACHE_MAX_ENTRIES,
+                            encode=_encode_vector, decode=_decode_vector, description="vector(s)")
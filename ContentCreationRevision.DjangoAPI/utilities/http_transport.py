@@ -0,0 +1,155 @@
+import threading
+from typing import Any, Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from django.conf import settings
+
+
+## HTTP STATUS CODES CONSIDERED TRANSIENT (RETRIED WITH BACKOFF)
+TRANSIENT_STATUS_CODES = (429, 500, 502, 503, 504)
+## METHODS RETRIED ON TRANSIENT STATUS CODES. POST (uploads) is only retried when the connection could not be made
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "PUT", "DELETE", "OPTIONS"})
+
+
+_sessions: Dict[str, requests.Session] = {}
+_sessions_lock = threading.Lock()
+
+
+def _build_session() -> requests.Session:
+    retry = Retry(total=settings.HTTP_MAX_RETRIES,
+                  connect=settings.HTTP_MAX_RETRIES,
+                  read=settings.HTTP_MAX_RETRIES,
+                  status=settings.HTTP_MAX_RETRIES,
+                  backoff_factor=settings.HTTP_BACKOFF_FACTOR,
+                  status_forcelist=TRANSIENT_STATUS_CODES,
+                  allowed_methods=IDEMPOTENT_METHODS,
+                  respect_retry_after_header=True,
+                  raise_on_status=False) # the caller gets the last response and handles the status as before
+    adapter = HTTPAdapter(pool_connections=settings.HTTP_POOL_CONNECTIONS,
+                          pool_maxsize=settings.HTTP_POOL_MAXSIZE,
+                          max_retries=retry)
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def get_session(service: str = "default") -> requests.Session:
+    """
+    Returns the pooled keep-alive session of a service, creating it on first use.
+
+    One session per backend (ie "blob", "status") keeps its connections alive between calls, so a job no longer pays
+    a new TCP + TLS handshake for every download, upload or status update.
+
+    Args:
+        service (str): The name of the backend the session talks to.
+
+    Returns:
+        requests.Session: The shared session (thread safe for concurrent requests through its connection pool).
+    """
+    with _sessions_lock:
+        if service not in _sessions:
+            _sessions[service] = _build_session()
+        return _sessions[service]
+
+
+def http_request(method: str,
+                 url: str,
+                 service: str = "default",
+                 timeout: Optional[Tuple[float, float]] = None,
+                 **kwargs: Any) -> requests.Response:
+    """
+    Sends a request through the pooled session of a service with a timeout and retries on transient failures.
+
+    Args:
+        method (str): The HTTP method, ie "GET", "PUT", "POST".
+        url (str): The url.
+        service (str): The name of the backend, selects the session.
+        timeout (Optional[Tuple[float, float]]): (connect, read) timeout in seconds.
+                                                 Defaults to (settings.HTTP_CONNECT_TIMEOUT, settings.HTTP_READ_TIMEOUT).
+        **kwargs: Passed to `requests.Session.request` (params, headers, data, files, stream, ...).
+                  `verify` defaults to settings.CERTIFICATE_VERIFY.
+
+    Returns:
+        requests.Response: The response (the status code is not raised, callers keep their own checks).
+    """
+    kwargs.setdefault("verify", settings.CERTIFICATE_VERIFY)
+    timeout = timeout or (settings.HTTP_CONNECT_TIMEOUT, settings.HTTP_READ_TIMEOUT)
+    return get_session(service).request(method, url, timeout=timeout, **kwargs)
+
+
+class MultipartFileStream:
+    """
+    A `multipart/form-data` body with a single file field, read lazily from an open binary file.
+
+    `requests` builds `files=` uploads entirely in memory (the payload plus the encoded body). Passed as `data=`,
+    this object is sent chunk by chunk with a Content-Length (`__len__`) so the upload never holds a second copy
+    of the document.
+
+    Example:
+        body = MultipartFileStream("files", "report.docx", spooled_file, DOCX_CONTENT_TYPE)
+        http_request("POST", url, data=body, headers={"Content-Type": body.content_type})
+    """
+    def __init__(self,
+                 field_name: str,
+                 file_name: str,
+                 file_obj: Any,
+                 file_content_type: str = "application/octet-stream",
+                 chunk_size: int = 1024 * 1024) -> None:
+        """
+        Args:
+            field_name (str): The form field of the file, ie "files".
+            file_name (str): The file name sent in the Content-Disposition.
+            file_obj (BinaryIO): An open, seekable binary file positioned anywhere (it is rewound).
+            file_content_type (str): The content type of the file part.
+            chunk_size (int): The number of bytes read from the file at a time when iterated.
+        """
+        import os
+        import uuid
+
+        self.boundary = uuid.uuid4().hex
+        self._file = file_obj
+        self._chunk_size = chunk_size
+        self._preamble = (f"--{self.boundary}\r\n"
+                          f'Content-Disposition: form-data; name="{field_name}"; filename="{file_name}"\r\n'
+                          f"Content-Type: {file_content_type}\r\n\r\n").encode("utf-8")
+        self._epilogue = f"\r\n--{self.boundary}--\r\n".encode("utf-8")
+        self._file_size = file_obj.seek(0, os.SEEK_END)
+        file_obj.seek(0)
+        self._parts = [self._preamble, None, self._epilogue] # None stands for the file content
+        self._part_index = 0
+        self._part_offset = 0
+
+    @property
+    def content_type(self) -> str:
+        return f"multipart/form-data; boundary={self.boundary}"
+
+    def __len__(self) -> int:
+        return len(self._preamble) + self._file_size + len(self._epilogue)
+
+    def read(self, size: int = -1) -> bytes:
+        output = []
+        remaining = size if size is not None and size >= 0 else len(self)
+        while remaining > 0 and self._part_index < len(self._parts):
+            part = self._parts[self._part_index]
+            if part is None:
+                data = self._file.read(remaining)
+            else:
+                data = part[self._part_offset:self._part_offset + remaining]
+                self._part_offset += len(data)
+            if not data:
+                self._part_index += 1
+                self._part_offset = 0
+                continue
+            output.append(data)
+            remaining -= len(data)
+        return b"".join(output)
+
+    def __iter__(self):
+        while True:
+            chunk = self.read(self._chunk_size)
+            if not chunk:
+                return
+            yield chunk
@@ -0,0 +1,214 @@
+import re
+import time
+import math
+import logging
+import unicodedata
+from collections import Counter
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+from django.conf import settings
+from utilities.instrumentation import record_span
+
+## LOGGING CAPABILITIES
+
+logger = logging.getLogger(__name__)
+
+##################################################################################################################
+## Hybrid retrieval of the sections of the reference files of a creation job:
+##  1. two rankings of the chunks of the job: the vector store (dense, settings.HYBRID_RETRIEVAL_CANDIDATES closest)
+##     and a BM25 index over the chunk texts (lexical: names, figures, acronyms the embeddings miss),
+##  2. fused by reciprocal rank fusion (a chunk scores 1 / (k + rank) in each ranking),
+##  3. selected by maximal marginal relevance (a section repeating an already selected one is passed over) until
+##     the token budget settings.HYBRID_RETRIEVAL_MAX_CONTEXT_TOKENS is spent.
+## The result is shaped like a vector store query so `_get_prompt_sections` takes it unchanged.
+##################################################################################################################
+
+TERM_PATTERN = re.compile(r"\w+(?:[.,'’-]\w+)*")
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Returns the lowercase terms of a text, accents removed so "économie" and "economie" match (EN and FR files).
+    """
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(character for character in text if not unicodedata.combining(character))
+    return TERM_PATTERN.findall(text)
+
+
+class BM25Index:
+    """
+    Okapi BM25 over the texts of the chunks of a job, built in a few milliseconds for a few thousand chunks.
+
+    The postings of every term are numpy arrays, so a query is scored with one vectorized update per query term.
+    The tf-idf vectors of the chunks are what `similarity` compares sections with (MMR).
+    """
+    def __init__(self, texts: Sequence[str], k1: float = 1.5, b: float = 0.75) -> None:
+        self.k1, self.b = k1, b
+        self.size = len(texts)
+        self.term_counts = [Counter(tokenize(text)) for text in texts]
+        self.lengths = np.array([sum(counts.values()) for counts in self.term_counts], dtype=np.float32)
+        self.average_length = float(self.lengths.mean()) if self.size else 0.0
+        postings: Dict[str, List[List[float]]] = {}
+        for row, counts in enumerate(self.term_counts):
+            for term, count in counts.items():
+                rows_counts = postings.setdefault(term, [[], []])
+                rows_counts[0].append(row)
+                rows_counts[1].append(count)
+        self.postings = {term: (np.array(rows, dtype=np.int64), np.array(counts, dtype=np.float32))
+                         for term, (rows, counts) in postings.items()}
+        self.idf = {term: math.log(1 + (self.size - len(rows) + 0.5) / (len(rows) + 0.5))
+                    for term, (rows, _) in self.postings.items()}
+        self._norms = [math.sqrt(sum((count * self.idf[term]) ** 2 for term, count in counts.items())) or 1.0
+                       for counts in self.term_counts]
+
+    def scores(self, query: str) -> np.ndarray:
+        """
+        Returns the BM25 score of every chunk for the query.
+        """
+        scores = np.zeros(self.size, dtype=np.float32)
+        length_norm = self.k1 * (1 - self.b + self.b * self.lengths / max(self.average_length, 1e-9))
+        for term in set(tokenize(query)):
+            if term not in self.postings:
+                continue
+            rows, counts = self.postings[term]
+            scores[rows] += self.idf[term] * counts * (self.k1 + 1) / (counts + length_norm[rows])
+        return scores
+
+    def top(self, query: str, n_results: int) -> List[int]:
+        """
+        Returns the rows of the n_results best chunks for the query with a score above 0, best first.
+        """
+        scores = self.scores(query)
+        matching = np.flatnonzero(scores > 0)
+        if len(matching) > n_results:
+            matching = matching[np.argpartition(-scores[matching], n_results - 1)[:n_results]]
+        return matching[np.argsort(-scores[matching], kind="stable")].tolist()
+
+    def similarity(self, row: int, other_row: int) -> float:
+        """
+        Returns the cosine similarity of the tf-idf vectors of two chunks (1: the same terms in the same proportions).
+        """
+        counts, other_counts = self.term_counts[row], self.term_counts[other_row]
+        if len(counts) > len(other_counts):
+            counts, other_counts = other_counts, counts
+        dot = sum(count * other_counts[term] * self.idf[term] ** 2 for term, count in counts.items() if term in other_counts)
+        return dot / (self._norms[row] * self._norms[other_row])
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[int]], k: int = 60) -> Dict[int, float]:
+    """
+    Fuses rankings of rows (best first): every row scores the sum of 1 / (k + rank) over the rankings it is in.
+
+    Returns:
+        Dict[int, float]: The fused score of every ranked row, best first.
+    """
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, row in enumerate(ranking, start=1):
+            fused[row] = fused.get(row, 0.0) + 1.0 / (k + rank)
+    return dict(sorted(fused.items(), key=lambda item: -item[1]))
+
+
+def select_sections(fused: Dict[int, float],
+                    index: BM25Index,
+                    n_tokens: Sequence[int],
+                    max_tokens: int,
+                    mmr_lambda: float,
+                    max_sections: int) -> List[int]:
+    """
+    Selects sections by maximal marginal relevance within a token budget.
+
+    At each step the candidate maximizing mmr_lambda x relevance - (1 - mmr_lambda) x its highest similarity to
+    the sections already selected is taken, when it still fits in the budget (a longer section is skipped for the
+    shorter ones after it).
+
+    Args:
+        fused (Dict[int, float]): The fused score of the candidate rows (`reciprocal_rank_fusion`).
+        index (BM25Index): The index the similarity of two sections is computed with.
+        n_tokens (Sequence[int]): The tokens of every row.
+        max_tokens (int): The tokens the selected sections may total.
+        mmr_lambda (float): Relevance vs diversity, 1 selects by relevance only.
+        max_sections (int): The number of sections selected at most.
+
+    Returns:
+        List[int]: The selected rows, in order of selection.
+    """
+    if not fused:
+        return []
+    best_score = max(fused.values())
+    relevance = {row: score / best_score for row, score in fused.items()}
+    redundancy = {row: 0.0 for row in fused}
+    selected: List[int] = []
+    spent_tokens = 0
+    while redundancy and len(selected) < max_sections:
+        row = max(redundancy, key=lambda candidate: mmr_lambda * relevance[candidate] - (1 - mmr_lambda) * redundancy[candidate])
+        del redundancy[row]
+        if spent_tokens + n_tokens[row] > max_tokens:
+            continue
+        selected.append(row)
+        spent_tokens += n_tokens[row]
+        for candidate in redundancy:
+            redundancy[candidate] = max(redundancy[candidate], index.similarity(row, candidate))
+    return selected
+
+
+def hybrid_retrieve(query: str,
+                    query_embedding: Any,
+                    lists_of_chunks: Dict[str, List[Dict[str, Any]]],
+                    vector_store: Any,
+                    doc_hashes: Optional[List[str]] = None) -> Dict[str, Any]:
+    """
+    Retrieves the sections of the files of a job answering a query, with both the vector store and BM25.
+
+    Args:
+        query (str): The query, as rewritten for the core action.
+        query_embedding (Any): The embedding of the query.
+        lists_of_chunks (Dict[str, List[Dict[str, Any]]]): The chunks of the files of the job ('title', 'id', 'text'
+                                                           and 'n_tokens'), see `prepare_list_chunks_and_metadata`.
+        vector_store (Any): The vector store of the job (ChromaDBHandler or NumpyVectorIndex).
+        doc_hashes (Optional[List[str]]): The documents of the job in the vector store. Defaults to None.
+
+    Returns:
+        Dict[str, Any]: 'documents', 'metadatas' and 'distances' of the selected sections, one list for the query,
+                        most relevant first, as the results of `vector_store.get_docs`. The distance of a section is
+                        1 - its fused score relative to the best one.
+
+    Example:
+        ```python
+        retrieval_results = hybrid_retrieve(core_query, query_embedding, filtered_concatenated_data, chroma_db, list(doc_hashes.values()))
+        chosen_sections, titles, context_sections = _get_prompt_sections(retrieval_results, SELECTED_MODEL)
+        ```
+    """
+    start_time = time.time()
+    chunks = [chunk for list_of_chunks in lists_of_chunks.values() for chunk in list_of_chunks]
+    rows = {chunk["id"]: row for row, chunk in enumerate(chunks)}
+    ## a file stored by an earlier job under another name has other ids, its chunks are found by their text
+    rows_by_text = {chunk["text"]: row for row, chunk in enumerate(chunks)}
+    dense = vector_store.get_docs(query_embedding, doc_hashes, n_results=settings.HYBRID_RETRIEVAL_CANDIDATES)
+    dense_ranking = list(dict.fromkeys(rows[metadata["id"]] if metadata["id"] in rows else rows_by_text[document]
+                                       for metadata, document in zip(dense["metadatas"][0], dense["documents"][0])
+                                       if metadata["id"] in rows or document in rows_by_text))
+
+    index = BM25Index([chunk["text"] for chunk in chunks])
+    lexical_ranking = index.top(query, settings.HYBRID_RETRIEVAL_CANDIDATES)
+    fused = reciprocal_rank_fusion([dense_ranking, lexical_ranking], k=settings.HYBRID_RETRIEVAL_RRF_K)
+    n_tokens = [chunk["n_tokens"] for chunk in chunks]
+    selected = select_sections(fused, index, n_tokens,
+                               max_tokens=settings.HYBRID_RETRIEVAL_MAX_CONTEXT_TOKENS,
+                               mmr_lambda=settings.HYBRID_RETRIEVAL_MMR_LAMBDA,
+                               max_sections=settings.HYBRID_RETRIEVAL_MAX_SECTIONS)
+    selected.sort(key=lambda row: -fused[row])
+
+    best_score = max(fused.values()) if fused else 1.0
+    ## the tokens the 20 closest sections of the vector store alone would have sent
+    dense_tokens = sum(n_tokens[row] for row in dense_ranking[:20])
+    context_tokens = sum(n_tokens[row] for row in selected)
+    record_span("retrieve.hybrid", time.time() - start_time, "Hybrid BM25 + vector retrieval of the sections",
+                chunks=len(chunks), dense_candidates=len(dense_ranking), lexical_candidates=len(lexical_ranking),
+                sections=len(selected), context_tokens=context_tokens, dense_context_tokens=dense_tokens)
+    logger.info(f"Hybrid retrieval: {len(selected)} section(s), {context_tokens} tokens (dense top 20: {dense_tokens} tokens)")
+    return {"ids"      : [[chunks[row]["id"] for row in selected]],
+            "documents": [[chunks[row]["text"] for row in selected]],
+            "metadatas": [[{"title": chunks[row]["title"], "id": chunks[row]["id"], "n_tokens": n_tokens[row]} for row in selected]],
+            "distances": [[1 - fused[row] / best_score for row in selected]]}
@@ -0,0 +1,367 @@
+import os
+import json
+import time
+import logging
+import threading
+import contextvars
+import functools
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+
+## LOGGING CAPABILITIES
+
+logger = logging.getLogger(__name__)
+
+
+class MetricsRegistry:
+    """
+    Process wide counters and histograms rendered in the Prometheus text exposition format.
+
+    Kept dependency free on purpose (no prometheus_client): a handful of metric families with labels, enough for
+    the /metrics/ endpoint scraped per instance.
+    """
+    def __init__(self, buckets: Tuple[float, ...]) -> None:
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[Tuple[Tuple[str, str], ...], float]] = {}
+        self._histograms: Dict[str, Dict[Tuple[Tuple[str, str], ...], Dict[str, Any]]] = {}
+        self._help: Dict[str, Tuple[str, str]] = {}
+
+    def describe(self, name: str, metric_type: str, help_text: str) -> None:
+        self._help[name] = (metric_type, help_text)
+
+    def inc(self, name: str, value: float = 1, **labels: Any) -> None:
+        key = tuple(sorted((label, str(label_value)) for label, label_value in labels.items()))
+        with self._lock:
+            family = self._counters.setdefault(name, {})
+            family[key] = family.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        key = tuple(sorted((label, str(label_value)) for label, label_value in labels.items()))
+        with self._lock:
+            family = self._histograms.setdefault(name, {})
+            histogram = family.setdefault(key, {"buckets": [0] * len(self.buckets), "sum": 0.0, "count": 0})
+            for bucket_idx, upper_bound in enumerate(self.buckets):
+                if value <= upper_bound:
+                    histogram["buckets"][bucket_idx] += 1
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+    @staticmethod
+    def _format_labels(key: Tuple[Tuple[str, str], ...], extra: Optional[Tuple[str, str]] = None) -> str:
+        pairs = list(key) + ([extra] if extra else [])
+        if not pairs:
+            return ""
+        escaped = [(label, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for label, value in pairs]
+        return "{" + ",".join(f'{label}="{value}"' for label, value in escaped) + "}"
+
+    def render(self) -> str:
+        """
+        Returns every metric in the Prometheus text exposition format (version 0.0.4).
+        """
+        lines = []
+        with self._lock:
+            for name, family in sorted(self._counters.items()):
+                metric_type, help_text = self._help.get(name, ("counter", ""))
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {metric_type}"]
+                lines += [f"{name}{self._format_labels(key)} {value}" for key, value in sorted(family.items())]
+            for name, family in sorted(self._histograms.items()):
+                _, help_text = self._help.get(name, ("histogram", ""))
+                lines += [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+                for key, histogram in sorted(family.items()):
+                    for upper_bound, bucket_count in zip(self.buckets, histogram["buckets"]):
+                        lines.append(f"{name}_bucket{self._format_labels(key, ('le', repr(float(upper_bound))))} {bucket_count}")
+                    lines.append(f"{name}_bucket{self._format_labels(key, ('le', '+Inf'))} {histogram['count']}")
+                    lines.append(f"{name}_sum{self._format_labels(key)} {histogram['sum']}")
+                    lines.append(f"{name}_count{self._format_labels(key)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+
+class JobReport:
+    """
+    The instrumentation of one job: its stage spans and its LLM calls, exported as a JSON report.
+    """
+    def __init__(self, job_id: str, job_type: str) -> None:
+        self.job_id = job_id
+        self.job_type = job_type
+        self.status = "running"
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.spans: List[Dict[str, Any]] = []
+        self.llm_calls: List[Dict[str, Any]] = []
+        self.total_tokens = 0 # running prompt + completion tokens, read before every call by utilities/token_budget.py
+        self.budget: Optional[Dict[str, Any]] = None # the token budget plan of the job, if any (utilities/token_budget.py)
+        self._lock = threading.Lock() # spans and llm calls are recorded from the executor threads of the job
+
+    def add_span(self, span: Dict[str, Any]) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def add_llm_call(self, llm_call: Dict[str, Any]) -> None:
+        with self._lock:
+            self.llm_calls.append(llm_call)
+            self.total_tokens += llm_call["prompt_tokens"] + llm_call["completion_tokens"]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Returns the JSON serializable report: wall time, per stage totals, LLM totals per model and per stage, the
+        token budget (estimated vs actual tokens) when the job has one and the raw spans.
+        """
+        with self._lock:
+            spans = list(self.spans)
+            llm_calls = list(self.llm_calls)
+            budget = dict(self.budget, actual_tokens=self.total_tokens) if self.budget else None
+        stages: Dict[str, Dict[str, Any]] = {}
+        for span in spans:
+            stage_totals = stages.setdefault(span["name"], {"count": 0, "total_seconds": 0.0, "max_seconds": 0.0})
+            stage_totals["count"] += 1
+            stage_totals["total_seconds"] += span["duration"]
+            stage_totals["max_seconds"] = max(stage_totals["max_seconds"], span["duration"])
+        models: Dict[str, Dict[str, Any]] = {}
+        llm_stages: Dict[str, Dict[str, Any]] = {}
+        for llm_call in llm_calls:
+            model_totals = models.setdefault(llm_call["model"], {"calls": 0, "errors": 0, "prompt_tokens": 0,
+                                                                 "completion_tokens": 0, "total_latency_seconds": 0.0})
+            ## calls made outside of any stage (ie query understanding before parsing) are grouped under "job"
+            stage_totals = llm_stages.setdefault(llm_call["stage"] or "job", {"calls": 0, "errors": 0, "prompt_tokens": 0,
+                                                                              "completion_tokens": 0, "total_latency_seconds": 0.0})
+            for totals in (model_totals, stage_totals):
+                totals["calls"] += 1
+                totals["errors"] += int(llm_call["status"] != "success")
+                totals["prompt_tokens"] += llm_call["prompt_tokens"]
+                totals["completion_tokens"] += llm_call["completion_tokens"]
+                totals["total_latency_seconds"] += llm_call["latency"]
+        finished_at = self.finished_at or time.time()
+        return {"job_id"           : self.job_id,
+                "job_type"         : self.job_type,
+                "status"           : self.status,
+                "started_at"       : self.started_at,
+                "wall_time_seconds": finished_at - self.started_at,
+                "stages"           : stages,
+                "llm"              : {"calls": len(llm_calls),
+                                      "prompt_tokens": sum(model["prompt_tokens"] for model in models.values()),
+                                      "completion_tokens": sum(model["completion_tokens"] for model in models.values()),
+                                      "by_model": models,
+                                      "by_stage": llm_stages},
+                "budget"           : budget,
+                "spans"            : spans}
+
+
+## REGISTRY, CURRENT JOB AND CURRENT STAGE
+
+_registry = MetricsRegistry(settings.INSTRUMENTATION_DURATION_BUCKETS)
+_registry.describe("dvoice_stage_duration_seconds", "histogram", "Duration of the pipeline stages and sub-steps.")
+_registry.describe("dvoice_llm_request_duration_seconds", "histogram", "Latency of the LLM and embedding calls.")
+_registry.describe("dvoice_llm_requests_total", "counter", "LLM and embedding calls by model and status.")
+_registry.describe("dvoice_llm_tokens_total", "counter", "Tokens reported by the API usage field, by model and type.")
+_registry.describe("dvoice_jobs_total", "counter", "Finished jobs by type and status.")
+_registry.describe("dvoice_job_duration_seconds", "histogram", "Wall time of the jobs.")
+
+## the job and the open stage follow the job thread and, through `copy_context`, its executor threads
+_current_job: contextvars.ContextVar[Optional[JobReport]] = contextvars.ContextVar("dvoice_current_job", default=None)
+_current_stage: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("dvoice_current_stage", default=None)
+_recent_jobs: deque = deque(maxlen=settings.INSTRUMENTATION_RECENT_JOBS)
+
+
+def get_metrics_registry() -> MetricsRegistry:
+    return _registry
+
+
+def current_job() -> Optional[JobReport]:
+    return _current_job.get()
+
+
+def start_job(job_id: str, job_type: str) -> JobReport:
+    """
+    Starts the instrumentation of a job in the current context (the job thread).
+
+    Args:
+        job_id (str): The task id of the job.
+        job_type (str): "revision" or "creation".
+
+    Returns:
+        JobReport: The report the spans and LLM calls of the job are recorded into.
+    """
+    job_report = JobReport(job_id, job_type)
+    _current_job.set(job_report)
+    return job_report
+
+
+def finish_job(status: str = "success") -> Optional[Dict[str, Any]]:
+    """
+    Closes the job of the current context, exports its report and returns it.
+
+    The report is kept in memory (`get_recent_job_reports`) and, when settings.INSTRUMENTATION_REPORT_DIR is set,
+    written as `<job_id>.json` in that directory.
+    """
+    job_report = _current_job.get()
+    if job_report is None:
+        return None
+    job_report.status = status
+    job_report.finished_at = time.time()
+    _current_job.set(None)
+    report = job_report.to_dict()
+    _registry.inc("dvoice_jobs_total", job_type=job_report.job_type, status=status)
+    _registry.observe("dvoice_job_duration_seconds", report["wall_time_seconds"], job_type=job_report.job_type)
+    _recent_jobs.append(report)
+    if settings.INSTRUMENTATION_REPORT_DIR:
+        try:
+            os.makedirs(settings.INSTRUMENTATION_REPORT_DIR, exist_ok=True)
+            with open(os.path.join(settings.INSTRUMENTATION_REPORT_DIR, f"{job_report.job_id}.json"), "w") as report_file:
+                json.dump(report, report_file, indent=2, default=str)
+        except OSError as e:
+            logger.info(f"Could not write the job report of {job_report.job_id}: {e}")
+    logger.info(f"Job {job_report.job_id} ({job_report.job_type}) {status} in {report['wall_time_seconds']:.3f} second(s), "
+                f"{report['llm']['calls']} LLM call(s), {report['llm']['prompt_tokens']} prompt / "
+                f"{report['llm']['completion_tokens']} completion token(s)")
+    return report
+
+
+def get_recent_job_reports() -> List[Dict[str, Any]]:
+    return list(_recent_jobs)
+
+
+def record_span(name: str, duration: float, description: Optional[str] = None, **attributes: Any) -> None:
+    """
+    Records a timed step: histogram observation, span of the current job (if any) and one log line.
+
+    This replaces the `print(f"... took {processing_time} second(s)")` lines: the log line is kept, the duration
+    also ends up in the job report and in /metrics/.
+
+    Args:
+        name (str): The span name, `<stage>.<step>` for the sub-steps, ie "layout.chain_init".
+        duration (float): The duration in seconds.
+        description (Optional[str]): Human readable label of the log line. Defaults to the name.
+        **attributes: Extra attributes stored with the span (ie number of files, pages).
+    """
+    _registry.observe("dvoice_stage_duration_seconds", duration, stage=name)
+    job_report = _current_job.get()
+    if job_report is not None:
+        job_report.add_span({"name": name, "parent": _current_stage.get(), "start": time.time() - duration,
+                             "duration": duration, **attributes})
+    logger.info(f"{description or name} took {duration:.3f} second(s)")
+
+
+@contextmanager
+def stage(name: str, **attributes: Any) -> Iterator[None]:
+    """
+    Times a block as a pipeline stage (parse, chunk, layout, classify, revise, explain, convert, upload).
+
+    Example:
+        with stage("layout"):
+            chunk_revised_layout_output_raw = asyncio.run(apply_chunk_layout_revision(...))
+    """
+    token = _current_stage.set(name)
+    start_time = time.time()
+    status = "success"
+    try:
+        yield
+    except BaseException:
+        status = "error"
+        raise
+    finally:
+        _current_stage.reset(token)
+        record_span(name, time.time() - start_time, status=status, **attributes)
+
+
+def record_llm_call(model: str,
+                    latency: float,
+                    prompt_tokens: int = 0,
+                    completion_tokens: int = 0,
+                    status: str = "success") -> None:
+    """
+    Records one LLM (or embedding) call with the token counts of the API `usage` field.
+    """
+    _registry.observe("dvoice_llm_request_duration_seconds", latency, model=model)
+    _registry.inc("dvoice_llm_requests_total", model=model, status=status)
+    if prompt_tokens:
+        _registry.inc("dvoice_llm_tokens_total", prompt_tokens, model=model, type="prompt")
+    if completion_tokens:
+        _registry.inc("dvoice_llm_tokens_total", completion_tokens, model=model, type="completion")
+    job_report = _current_job.get()
+    if job_report is not None:
+        job_report.add_llm_call({"model": model, "stage": _current_stage.get(), "latency": latency,
+                                 "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                                 "status": status, "at": time.time()})
+
+
+def record_openai_response(response: Any, model: str, latency: float) -> None:
+    """
+    Records a call made with the openai client from its `usage` field (chat completions and embeddings).
+    """
+    usage = getattr(response, "usage", None)
+    ## the model that answered, which may not be the one asked for once the call is routed (utilities/llm_router.py)
+    record_llm_call(getattr(response, "model", None) or model, latency,
+                    prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+                    completion_tokens=getattr(usage, "completion_tokens", 0) or 0)
+
+
+def with_current_context(func: Callable[..., Any]) -> Callable[..., Any]:
+    """
+    Wraps a callable so it runs in a copy of the caller context: `loop.run_in_executor` and
+    `ThreadPoolExecutor.submit` do not propagate contextvars, which would detach the executor threads from the job.
+
+    Example:
+        loop.run_in_executor(None, with_current_context(apply_lcel_chain_to_single_doc), file_path, chain, docs)
+    """
+    context = contextvars.copy_context()
+
+    @functools.wraps(func)
+    def wrapper(*args: Any, **kwargs: Any) -> Any:
+        return context.copy().run(func, *args, **kwargs)
+    return wrapper
+
+
+def render_prometheus_metrics() -> str:
+    return _registry.render()
+
+
+_llm_usage_handler_class = None
+
+
+def llm_usage_callbacks(model: str) -> List[Any]:
+    """
+    Returns the LangChain callbacks recording latency and `usage` tokens of every call of a chat model, to pass as
+    `callbacks=` when instantiating AzureChatOpenAI.
+
+    langchain_core is only imported here, so this module stays importable without it.
+    """
+    global _llm_usage_handler_class
+    if _llm_usage_handler_class is None:
+        from langchain_core.callbacks import BaseCallbackHandler
+
+        class LLMUsageCallbackHandler(BaseCallbackHandler):
+            """Records each chat model call of LangChain chains with the token counts reported by the API."""
+            def __init__(self, model: str) -> None:
+                self.model = model
+                self._start_times: Dict[Any, float] = {}
+
+            def on_chat_model_start(self, serialized: Any, messages: Any, *, run_id: Any, **kwargs: Any) -> None:
+                self._start_times[run_id] = time.time()
+
+            def on_llm_start(self, serialized: Any, prompts: Any, *, run_id: Any, **kwargs: Any) -> None:
+                self._start_times[run_id] = time.time()
+
+            def on_llm_end(self, response: Any, *, run_id: Any, **kwargs: Any) -> None:
+                latency = time.time() - self._start_times.pop(run_id, time.time())
+                token_usage = (response.llm_output or {}).get("token_usage") or {}
+                prompt_tokens = token_usage.get("prompt_tokens", 0)
+                completion_tokens = token_usage.get("completion_tokens", 0)
+                if not token_usage: # providers reporting the usage on the message only
+                    for generations in response.generations:
+                        for generation in generations:
+                            usage_metadata = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                            prompt_tokens += usage_metadata.get("input_tokens", 0)
+                            completion_tokens += usage_metadata.get("output_tokens", 0)
+                record_llm_call((response.llm_output or {}).get("model_name") or self.model, latency,
+                                prompt_tokens, completion_tokens)
+
+            def on_llm_error(self, error: BaseException, *, run_id: Any, **kwargs: Any) -> None:
+                latency = time.time() - self._start_times.pop(run_id, time.time())
+                record_llm_call(self.model, latency, status=type(error).__name__)
+
+        _llm_usage_handler_class = LLMUsageCallbackHandler
+    return [_llm_usage_handler_class(model)]
@@ -0,0 +1,331 @@
+import re
+import time
+import random
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+import httpx
+from django.conf import settings
+
+from utilities.instrumentation import get_metrics_registry
+
+## LOGGING CAPABILITIES
+
+logger = logging.getLogger(__name__)
+
+
+## TIERS OF DEPLOYMENTS
+##   - heavy: the GPT-4o deployments doing the revision, layout, generation and translation work
+##   - light: smaller/faster deployments for the cheap classification calls (language, intent, bill 96, file name...)
+##     they must support structured output; without any light deployment configured these calls use the heavy ones
+HEAVY_TIER = "heavy"
+LIGHT_TIER = "light"
+
+## STATUS CODES MOVED TO THE NEXT DEPLOYMENT (the other errors would be the same on any deployment)
+FAILOVER_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+
+_DEPLOYMENT_PATH_PATTERN = re.compile(r"^(?P<prefix>.*?/openai/deployments/)[^/]+(?P<suffix>/.*)$")
+
+_registry = get_metrics_registry()
+_registry.describe("dvoice_llm_routed_requests_total", "counter", "Azure OpenAI requests by deployment and status.")
+_registry.describe("dvoice_llm_failovers_total", "counter", "Requests moved to another deployment, by tier.")
+
+
+class Deployment:
+    """
+    One Azure OpenAI deployment of the pool and what the router knows of its quota and health.
+    """
+    def __init__(self, name: str, endpoint: str, deployment: str, api_version: Optional[str] = None,
+                 tier: str = HEAVY_TIER, weight: float = 1.0) -> None:
+        self.name = name
+        self.endpoint = endpoint.rstrip("/")
+        self.deployment = deployment
+        self.api_version = api_version
+        self.tier = tier
+        self.weight = weight
+        self.remaining_tokens: Optional[int] = None
+        self.max_remaining_tokens = 0 # highest remaining quota seen, stands for the TPM limit (not sent by Azure)
+        self.quota_observed_at = 0.0
+        self.cooldown_until = 0.0
+        self.consecutive_failures = 0
+
+    def quota_fraction(self, now: float) -> float:
+        """
+        Share of the token quota left, 1 when unknown or when the last observation is older than the quota window.
+        """
+        if self.remaining_tokens is None or not self.max_remaining_tokens \
+                or now - self.quota_observed_at > settings.LLM_ROUTER_QUOTA_WINDOW:
+            return 1.0
+        return max(self.remaining_tokens / self.max_remaining_tokens, settings.LLM_ROUTER_MIN_QUOTA_FRACTION)
+
+
+class LLMRouter:
+    """
+    Spreads the Azure OpenAI calls over several deployments (regions) and fails over between them.
+
+    - the deployments of a tier are tried in a weighted random order: configured weight times the share of the
+      token quota left, read from the `x-ratelimit-remaining-tokens` header of the previous responses
+    - a 429 puts a deployment aside for its `retry-after-ms`/`retry-after` delay and the call moves on to the next
+      deployment; settings.LLM_ROUTER_FAILURE_THRESHOLD consecutive 5xx or connection errors put it aside for
+      settings.LLM_ROUTER_COOLDOWN seconds
+    - deployments put aside are only tried last, the soonest available first, so a call is never refused by the
+      router itself: when every deployment is throttled the last response goes back to the client and its retries
+    """
+    def __init__(self, deployments: List[Deployment]) -> None:
+        self.deployments = deployments
+        self._lock = threading.Lock()
+        self._random = random.Random()
+
+    def candidates(self, tier: str) -> List[Deployment]:
+        """
+        Returns the deployments of a tier in the order they should be tried.
+        """
+        now = time.time()
+        with self._lock:
+            pool = [deployment for deployment in self.deployments if deployment.tier == tier] \
+                   or [deployment for deployment in self.deployments if deployment.tier == HEAVY_TIER]
+            available = [deployment for deployment in pool if deployment.cooldown_until <= now]
+            cooling_down = sorted((deployment for deployment in pool if deployment.cooldown_until > now),
+                                  key=lambda deployment: deployment.cooldown_until)
+            ## weighted sampling without replacement: sort by random() ** (1 / score)
+            available.sort(key=lambda deployment: self._random.random() ** (1 / max(deployment.weight
+                                                                                    * deployment.quota_fraction(now), 1e-6)),
+                           reverse=True)
+        return available + cooling_down
+
+    def record_response(self, deployment: Deployment, status_code: int, headers: Any) -> None:
+        """
+        Updates the quota and health of a deployment from a response.
+        """
+        now = time.time()
+        with self._lock:
+            remaining_tokens = headers.get("x-ratelimit-remaining-tokens")
+            if remaining_tokens is not None and remaining_tokens.isdigit():
+                deployment.remaining_tokens = int(remaining_tokens)
+                deployment.max_remaining_tokens = max(deployment.max_remaining_tokens, deployment.remaining_tokens)
+                deployment.quota_observed_at = now
+            if status_code == 429:
+                deployment.cooldown_until = now + _retry_after(headers)
+            elif status_code >= 500:
+                self._record_failure(deployment, now)
+            else:
+                deployment.consecutive_failures = 0
+        _registry.inc("dvoice_llm_routed_requests_total", deployment=deployment.name, status=status_code)
+
+    def record_error(self, deployment: Deployment, error: Exception) -> None:
+        """
+        Records a connection error or timeout of a deployment.
+        """
+        with self._lock:
+            self._record_failure(deployment, time.time())
+        _registry.inc("dvoice_llm_routed_requests_total", deployment=deployment.name, status=type(error).__name__)
+
+    def _record_failure(self, deployment: Deployment, now: float) -> None:
+        deployment.consecutive_failures += 1
+        if deployment.consecutive_failures >= settings.LLM_ROUTER_FAILURE_THRESHOLD:
+            deployment.cooldown_until = now + settings.LLM_ROUTER_COOLDOWN
+            logger.info(f"LLM deployment {deployment.name} put aside for {settings.LLM_ROUTER_COOLDOWN} second(s) "
+                        f"after {deployment.consecutive_failures} consecutive failure(s)")
+
+
+def _retry_after(headers: Any) -> float:
+    """
+    Returns the delay asked by a 429 response, in seconds.
+    """
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return settings.LLM_ROUTER_COOLDOWN
+
+
+def _route(request: httpx.Request, deployment: Deployment) -> httpx.Request:
+    """
+    Returns the request sent to a deployment: endpoint, deployment name and api-version of the URL rewritten.
+    The body must have been read.
+    """
+    url = httpx.URL(deployment.endpoint)
+    path_match = _DEPLOYMENT_PATH_PATTERN.match(request.url.path)
+    path = f"{url.path.rstrip('/')}/openai/deployments/{deployment.deployment}{path_match.group('suffix')}" \
+           if path_match else request.url.path
+    params = request.url.params
+    if deployment.api_version and "api-version" in params:
+        params = params.set("api-version", deployment.api_version)
+    headers = [(name, value) for name, value in request.headers.multi_items() if name.lower() != "host"]
+    return httpx.Request(request.method, url.copy_with(path=path, params=params), headers=headers,
+                         content=request.content, extensions=request.extensions)
+
+
+def _no_candidate_error(tier: str, request: httpx.Request) -> httpx.TransportError:
+    return httpx.TransportError(f"No Azure OpenAI deployment configured for the {tier} tier (settings.LLM_DEPLOYMENTS)",
+                                request=request)
+
+
+def _pool_limits() -> httpx.Limits:
+    return httpx.Limits(max_connections=settings.LLM_ROUTER_POOL_MAXSIZE,
+                        max_keepalive_connections=settings.LLM_ROUTER_POOL_MAXSIZE)
+
+
+class RoutedTransport(httpx.BaseTransport):
+    """
+    httpx transport handed to the openai and LangChain clients: each request is sent to a deployment of the tier
+    chosen by the router (endpoint, deployment name and api-version of the URL rewritten) and moved to the next
+    deployment on 429, 5xx and connection errors.
+
+    Routing under the clients keeps every call site unchanged: the clients still believe they talk to the
+    deployment of DVoice/utilities/settings.py.
+    """
+    def __init__(self, router: LLMRouter, tier: str) -> None:
+        self._router = router
+        self._tier = tier
+        self._transport = httpx.HTTPTransport(limits=_pool_limits())
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        candidates = self._router.candidates(self._tier)
+        if not candidates:
+            raise _no_candidate_error(self._tier, request)
+        request.read()
+        for attempt, deployment in enumerate(candidates):
+            is_last = attempt == len(candidates) - 1
+            try:
+                response = self._transport.handle_request(_route(request, deployment))
+            except httpx.TransportError as e:
+                self._router.record_error(deployment, e)
+                if is_last:
+                    raise
+                logger.info(f"LLM deployment {deployment.name} unreachable ({e}), moving to the next one")
+                _registry.inc("dvoice_llm_failovers_total", tier=self._tier)
+                continue
+            self._router.record_response(deployment, response.status_code, response.headers)
+            if response.status_code in FAILOVER_STATUS_CODES and not is_last:
+                response.close()
+                logger.info(f"LLM deployment {deployment.name} answered {response.status_code}, moving to the next one")
+                _registry.inc("dvoice_llm_failovers_total", tier=self._tier)
+                continue
+            return response
+
+    def close(self) -> None:
+        self._transport.close()
+
+
+class AsyncRoutedTransport(httpx.AsyncBaseTransport):
+    """
+    Asynchronous counterpart of `RoutedTransport`, handed to the clients as `http_async_client` so the `ainvoke`
+    and `AsyncAzureOpenAI` calls are routed and fail over the same way.
+    """
+    def __init__(self, router: LLMRouter, tier: str) -> None:
+        self._router = router
+        self._tier = tier
+        self._transport = httpx.AsyncHTTPTransport(limits=_pool_limits())
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        candidates = self._router.candidates(self._tier)
+        if not candidates:
+            raise _no_candidate_error(self._tier, request)
+        await request.aread()
+        for attempt, deployment in enumerate(candidates):
+            is_last = attempt == len(candidates) - 1
+            try:
+                response = await self._transport.handle_async_request(_route(request, deployment))
+            except httpx.TransportError as e:
+                self._router.record_error(deployment, e)
+                if is_last:
+                    raise
+                logger.info(f"LLM deployment {deployment.name} unreachable ({e}), moving to the next one")
+                _registry.inc("dvoice_llm_failovers_total", tier=self._tier)
+                continue
+            self._router.record_response(deployment, response.status_code, response.headers)
+            if response.status_code in FAILOVER_STATUS_CODES and not is_last:
+                await response.aclose()
+                logger.info(f"LLM deployment {deployment.name} answered {response.status_code}, moving to the next one")
+                _registry.inc("dvoice_llm_failovers_total", tier=self._tier)
+                continue
+            return response
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+
+def _configured_deployments() -> List[Deployment]:
+    """
+    Returns the deployments of settings.LLM_DEPLOYMENTS, or the DVoice deployment alone when none is configured.
+
+    Raises:
+        ValueError: If a deployment has an unknown tier, or no deployment is in the heavy tier (every tier falls
+                    back on it, a request of the tier would have nowhere to go).
+    """
+    from DVoice.utilities.settings import SELECTED_MODEL
+
+    if not settings.LLM_DEPLOYMENTS:
+        return [Deployment("primary", settings.API_BASE, settings.MODEL_DICTIONARY[SELECTED_MODEL])]
+    deployments = [Deployment(name=deployment_config.get("name", deployment_config["deployment"]),
+                              endpoint=deployment_config.get("endpoint") or settings.API_BASE,
+                              deployment=deployment_config["deployment"],
+                              api_version=deployment_config.get("api_version"),
+                              tier=deployment_config.get("tier", HEAVY_TIER),
+                              weight=deployment_config.get("weight", 1.0))
+                   for deployment_config in settings.LLM_DEPLOYMENTS]
+    unknown_tiers = {deployment.tier for deployment in deployments} - {HEAVY_TIER, LIGHT_TIER}
+    if unknown_tiers:
+        raise ValueError(f"LLM_DEPLOYMENTS has deployment(s) of unknown tier(s) {sorted(unknown_tiers)}, "
+                         f"expected '{HEAVY_TIER}' or '{LIGHT_TIER}'")
+    if not any(deployment.tier == HEAVY_TIER for deployment in deployments):
+        raise ValueError(f"LLM_DEPLOYMENTS needs at least one '{HEAVY_TIER}' deployment, the other tiers fall back on it")
+    return deployments
+
+
+_llm_router = None
+_routed_http_clients: Dict[str, httpx.Client] = {}
+_routed_http_async_clients: Dict[str, httpx.AsyncClient] = {}
+_llm_router_lock = threading.Lock()
+
+
+def get_llm_router() -> LLMRouter:
+    """
+    Returns the process wide router, created on first use from settings.LLM_DEPLOYMENTS.
+    """
+    global _llm_router
+    with _llm_router_lock:
+        if _llm_router is None:
+            _llm_router = LLMRouter(_configured_deployments())
+            logger.info(f"LLM router over {len(_llm_router.deployments)} deployment(s): "
+                        f"{', '.join(f'{deployment.name} ({deployment.tier})' for deployment in _llm_router.deployments)}")
+    return _llm_router
+
+
+def get_routed_http_client(tier: str = HEAVY_TIER) -> Optional[httpx.Client]:
+    """
+    Returns the shared httpx client routing the calls of a tier, to pass as `http_client=` to the openai and
+    LangChain clients. None when settings.LLM_ROUTER_ENABLED is False (the clients then use their own client).
+    """
+    if not settings.LLM_ROUTER_ENABLED:
+        return None
+    router = get_llm_router()
+    with _llm_router_lock:
+        if tier not in _routed_http_clients:
+            _routed_http_clients[tier] = httpx.Client(transport=RoutedTransport(router, tier),
+                                                      timeout=httpx.Timeout(settings.LLM_ROUTER_READ_TIMEOUT,
+                                                                            connect=settings.HTTP_CONNECT_TIMEOUT),
+                                                      follow_redirects=True)
+    return _routed_http_clients[tier]
+
+
+def get_routed_http_async_client(tier: str = HEAVY_TIER) -> Optional[httpx.AsyncClient]:
+    """
+    Returns the shared httpx async client routing the calls of a tier, to pass as `http_async_client=` to the
+    LangChain clients (`http_client=` of the openai async clients). None when settings.LLM_ROUTER_ENABLED is False.
+    """
+    if not settings.LLM_ROUTER_ENABLED:
+        return None
+    router = get_llm_router()
+    with _llm_router_lock:
+        if tier not in _routed_http_async_clients:
+            _routed_http_async_clients[tier] = httpx.AsyncClient(transport=AsyncRoutedTransport(router, tier),
+                                                                 timeout=httpx.Timeout(settings.LLM_ROUTER_READ_TIMEOUT,
+                                                                                       connect=settings.HTTP_CONNECT_TIMEOUT),
+                                                                 follow_redirects=True)
+    return _routed_http_async_clients[tier]
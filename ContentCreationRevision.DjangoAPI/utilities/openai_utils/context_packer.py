@@ -0,0 +1,104 @@
+import numpy as np
+from django.conf import settings
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+SEPARATOR_TOKENS = 3 ## tokens of settings.SEPARATOR between two sections of a prompt
+
+
+def context_budget(selected_model: str) -> int:
+    """
+    Returns the tokens the sections of a prompt may total: settings.CONTEXT_PACKER_MAX_TOKENS, or the
+    settings.CONTEXT_WINDOW_SIZE_CUTOFF share of the context window of the model.
+    """
+    if settings.CONTEXT_PACKER_MAX_TOKENS:
+        return settings.CONTEXT_PACKER_MAX_TOKENS
+    return int(settings.MODEL_CONTEXT_WINDOW_SIZE.get(selected_model, 128_000) * settings.CONTEXT_WINDOW_SIZE_CUTOFF)
+
+
+def section_position(section: Dict[str, Any]) -> Tuple[str, int]:
+    """
+    Returns the place of a section in its document: its title and the index of the chunk, from the id
+    "<file name>|<index>" given by `prepare_list_chunks_and_metadata` (a file name may itself contain "|").
+    """
+    title, _, index = str(section["id"]).rpartition("|")
+    return (section.get("title", title), int(index) if index.isdigit() else 0)
+
+
+def order_sections(sections: Sequence[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Returns the sections in document order, each position computed once.
+    """
+    positions = [section_position(section) for section in sections]
+    return [sections[row] for row in sorted(range(len(sections)), key=positions.__getitem__)]
+
+
+def pack_sections(sections: Sequence[Dict[str, Any]],
+                  max_tokens: int,
+                  token_unit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Selects the sections maximizing the total relevance within a token budget (0/1 knapsack), in document order.
+
+    Unlike filling the prompt with the closest sections until the budget is exceeded, a long section of middling
+    relevance gives way to several shorter relevant ones, and the budget is never overshot.
+
+    Args:
+        sections (Sequence[Dict[str, Any]]): The candidate sections, with their 'n_tokens' (precomputed at chunking)
+                                             and 'relevance' (positive, higher is better), and an 'id' and 'title'.
+        max_tokens (int): The tokens the selected sections (and their separators) may total.
+        token_unit (Optional[int]): Granularity of the budget in tokens, the section tokens are rounded up to it.
+                                    Defaults to settings.CONTEXT_PACKER_TOKEN_UNIT.
+
+    Returns:
+        List[Dict[str, Any]]: The selected sections, in document order (see `order_sections`).
+
+    Example:
+        ```python
+        sections = [{"id": "report.pdf|03", "title": "report.pdf", "text": "...", "n_tokens": 950, "relevance": 0.8}, ...]
+        packed = pack_sections(sections, context_budget(SELECTED_MODEL))
+        ```
+    """
+    if not sections or max_tokens <= 0:
+        return []
+    token_unit = token_unit or settings.CONTEXT_PACKER_TOKEN_UNIT
+    capacity = max_tokens // token_unit
+    weights = [-(-(int(section["n_tokens"]) + SEPARATOR_TOKENS) // token_unit) for section in sections] # rounded up
+    if sum(weights) <= capacity:
+        return order_sections(sections)
+
+    ## best[c]: the highest relevance within c units, keep[i, c]: section i is part of it
+    best = np.zeros(capacity + 1, dtype=np.float64)
+    keep = np.zeros((len(sections), capacity + 1), dtype=bool)
+    for row, (section, weight) in enumerate(zip(sections, weights)):
+        if weight > capacity:
+            continue
+        candidate = best[:capacity + 1 - weight] + float(section["relevance"]) # from the previous row: each section once
+        improved = candidate > best[weight:]
+        keep[row, weight:] = improved
+        best[weight:] = np.where(improved, candidate, best[weight:])
+
+    selected, remaining = [], capacity
+    for row in range(len(sections) - 1, -1, -1):
+        if keep[row, remaining]:
+            selected.append(sections[row])
+            remaining -= weights[row]
+    return order_sections(selected)
+
+
+def pack_consecutive(sections: Sequence[Dict[str, Any]], max_tokens: int) -> List[Dict[str, Any]]:
+    """
+    Merges consecutive sections of the same document (in document order) up to max_tokens each, so a map step of
+    the summaries reads a few chunks per call instead of one. A section longer than max_tokens stays alone.
+
+    Returns:
+        List[Dict[str, Any]]: The merged sections ('title', 'id' of their first chunk, 'text' and 'n_tokens').
+    """
+    packed: List[Dict[str, Any]] = []
+    for section in order_sections(sections):
+        previous = packed[-1] if packed else None
+        if previous is not None and previous["title"] == section["title"] \
+           and previous["n_tokens"] + int(section["n_tokens"]) + SEPARATOR_TOKENS <= max_tokens:
+            previous["text"] += "\n\n" + section["text"]
+            previous["n_tokens"] += int(section["n_tokens"]) + SEPARATOR_TOKENS
+        else:
+            packed.append({"title": section["title"], "id": section["id"], "text": section["text"], "n_tokens": int(section["n_tokens"])})
+    return packed
@@ -3,6 +3,9 @@ import requests
 import json
 # from langchain.chat_models import AzureChatOpenAI
 from langchain_openai import AzureChatOpenAI
+from utilities.token_provider import as_token_callable
+from utilities.instrumentation import llm_usage_callbacks
+from utilities.llm_router import get_routed_http_client, get_routed_http_async_client
 
 import os
 
@@ -17,10 +20,13 @@ def instantiate_llm_client(token,
             openai_api_version = settings.API_VERSION,
             temperature        = temperature_task, 
             deployment_name    = settings.MODEL_DICTIONARY[selected_model],
-            azure_ad_token     = token.token,
+            azure_ad_token_provider = as_token_callable(token), ## fresh token on every call for long summarizations
             azure_endpoint     = settings.API_BASE,
             max_tokens         = settings.MODEL_MAX_OUTPUT_SIZE[selected_model],
-            model              = settings.MODEL_NAME_DICTIONARY[selected_model]  
+            model              = settings.MODEL_NAME_DICTIONARY[selected_model],
+            callbacks          = llm_usage_callbacks(settings.MODEL_NAME_DICTIONARY[selected_model]),
+            http_client        = get_routed_http_client(), # spread over the heavy deployments, failover on 429/5xx
+            http_async_client  = get_routed_http_async_client() # the summaries are generated with ainvoke
         )
         
     return llm
@@ -1,10 +1,10 @@
 import tiktoken
 from django.conf import settings
-from transformers import GPT2Tokenizer
+# from transformers import GPT2Tokenizer ## only for the commented gpt2 token count below, importing transformers is slow
 from utilities.openai_utils.summarize import MapReduce
 from utilities.openai_utils.prompt import header, classfication_prompt, function_category, classfication_system_prompt
 from utilities.openai_utils.models import get_prompt_category, get_gpt4_32k_completion, get_gpt_completion
-# Define a custom sorting function
+from utilities.openai_utils.context_packer import context_budget, order_sections, pack_consecutive, pack_sections
 
 def answer_query_with_summarization(data, user_prompt, 
                                     selected_model, 
@@ -12,7 +12,10 @@ def answer_query_with_summarization(data, user_prompt,
                                     task_type="SUMMARIZATION",
                                     summarization_at_chunk_level=True):
     
-    sorted_sections = sorted(data, key=custom_sort)
+    sorted_sections = order_sections(data)
+    if summarization_at_chunk_level and settings.SUMMARIZATION_MAP_MAX_TOKENS:
+        ## consecutive chunks of the document summarized together, fewer map calls
+        sorted_sections = pack_consecutive(sorted_sections, settings.SUMMARIZATION_MAP_MAX_TOKENS)
     summarize = MapReduce(selected_model=selected_model,task_type=task_type, 
                           summarization_at_chunk_level=summarization_at_chunk_level)
     return summarize.use_mapreduce(user_prompt, sorted_sections, no_docs)
@@ -27,75 +30,32 @@ def get_token_count(text, selected_model):
 #      return len(tokenizer.encode(text))
 
 
-def _get_prompt_sections(most_relevant_document_sections, selected_model):
+def _get_prompt_sections(most_relevant_document_sections, selected_model, max_tokens=None):
 
     """
-    Keep track of the selected documents: text, length, and index
-    """
-    chosen_sections = []
-    position = 1
-    """
-    token length for SEPARATOR
-    """
-    separator_token_len = 3
+    Packs the retrieved sections in the prompt budget (utilities/openai_utils/context_packer.py): the sections
+    maximizing the total relevance within context_budget(selected_model) tokens (the CONTEXT_WINDOW_SIZE_CUTOFF
+    share of the context window), or max_tokens, kept in document order.
 
+    The tokens of a section are the n_tokens counted at chunking (see prepare_list_chunks_and_metadata), only
+    counted again when the metadata does not have them. The relevance of a section is 1 / (1 + its distance).
     """
-    retrive the most relevant documents to the user's question. 
-    We are reversing the array so heighest score section is at beginning of the array.
-    """
-    
     documents_found = most_relevant_document_sections["documents"][0]
     found_distance  = most_relevant_document_sections["distances"][0]
     found_metadata  = most_relevant_document_sections["metadatas"][0]
 
-    """
-    Track the score of the closest document. This score is located at location 0 of most_relevant_document_sections
-    """
-    
-    context_window_size = 128000 # settings.MODEL_CONTEXT_WINDOW_SIZE[selected_model] # TODO : to reinstate once in dev
-    total_token_count = 0
-    
-    if len(found_distance) > 0:
-        lowest_distance = found_distance[0]
-    
-
-    """
-    Loop through the documents and save the document if:
-        get document text from df based on section_index  
-        document combine length is less than MAX_PROMPT_LEN
-        current document score is greater than .75 and it is within .15 of top score.
-        append all documents together that satisfy the above criteria.
-    """
-    
-    for section_index, distance in enumerate(found_distance):
-        
-        if total_token_count > min(context_window_size, context_window_size * 0.25): #settings.CONTEXT_WINDOW_SIZE_CUTOFF): # TODO: to reinstate once in local dev
-            break
-        document_section = documents_found[section_index]
-        section_token_count = get_token_count(document_section, selected_model) + separator_token_len
-        
-        
-        """
-        Get docs that are greater than 50% probability and withing 15% range from top score.     
-        """  
-        ## TODO: need to inspect this and maybe apply re-ranker later on this     
-        # if settings.DEBUG:
-        #     print("BREAKCONDITION", distance, ">",.60, distance > .60, "or ABS(",lowest_distance, "-", distance, ")> .15", abs(lowest_distance - distance) > .15)
-        #     print( distance > .60 or abs(lowest_distance - distance) > .15)
-        # if distance > .60 or abs(lowest_distance - distance) > .15:
-        #     break
-        
-            
-        chosen_sections.append({
-            "text"  : "\n*" + document_section, # settings.SEPARATOR + document_section,
-            "id"    : found_metadata[section_index]["id"] ,
-            "score" : distance,
-            "title" : found_metadata[section_index]["title"]
+    candidate_sections = []
+    for document_section, distance, metadata in zip(documents_found, found_distance, found_metadata):
+        n_tokens = metadata.get("n_tokens")
+        candidate_sections.append({
+            "text"      : "\n*" + document_section, # settings.SEPARATOR + document_section,
+            "id"        : metadata["id"],
+            "score"     : distance,
+            "title"     : metadata["title"],
+            "n_tokens"  : int(n_tokens) if n_tokens is not None else get_token_count(document_section, selected_model),
+            "relevance" : 1 / (1 + max(float(distance), 0.0))
         })
-        total_token_count += section_token_count
-        position+=1
-    # Sort the chosen_sections array using the custom sorting function
-    sorted_sections = sorted(chosen_sections, key=custom_sort)
+    sorted_sections = pack_sections(candidate_sections, max_tokens or context_budget(selected_model))
     joined_text = " ".join([section["text"] for section in sorted_sections])
     titles = [x["title"] for x in sorted_sections ]
     titles_set = set(titles)
@@ -197,8 +157,3 @@ def get_classification(_token, prompt, selected_model):
              "token_count_prompt"     : token_count_prompt, 
              "token_count_completion" : token_count_completion
             }
-
-
-def custom_sort(item):
-    prefix, number = item["id"].split("|")
-    return (prefix, int(number))
\ No newline at end of file
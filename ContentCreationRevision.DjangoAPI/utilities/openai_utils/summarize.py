@@ -1,126 +1,151 @@
-from functools import partial
+import time
+import asyncio
 from django.conf import settings
-from azure.identity import DefaultAzureCredential, ChainedTokenCredential, AzureCliCredential
-from langchain.chains.combine_documents import collapse_docs, split_list_of_docs
-from langchain.prompts import PromptTemplate
-from langchain.schema import StrOutputParser
-from langchain_core.output_parsers import JsonOutputParser
-from langchain.schema.prompt_template import format_document
-from langchain.schema.runnable import RunnableParallel, RunnablePassthrough
-# from langchain.chat_models import AzureChatOpenAI
-from langchain.schema import Document
-import sys
+from typing import Any, Dict, List, Tuple
 
 from utilities.openai_utils.models import instantiate_llm_client
+from utilities.token_provider import get_token_provider
 from utilities.openai_utils.prompt import regeneration_prompt
+from utilities.instrumentation import record_span
+from utilities.summary_cache import get_summary_cache, summary_key
 
-# Prompt and method for converting Document -> str.
+SEPARATOR_TOKENS = 2 ## tokens of the blank line between two summaries of a collapse or reduce prompt
 
 
 class MapReduce:
+    """
+    Summarizes the sections of a document: a map call per section, then a tree reduce.
+
+    The map calls run concurrently (asyncio, at most settings.SUMMARIZATION_MAX_CONCURRENCY in flight), and the map
+    summary of a section already summarized with the same instruction comes from the summary cache
+    (utilities/summary_cache.py). As long as the summaries total more than settings.SUMMARIZATION_TOKEN_MAX
+    tokens, consecutive ones are collapsed by groups of settings.SUMMARIZATION_REDUCE_FAN_IN, all the groups of a
+    level at the same time. The final reduce call answers the prompt over what remains.
+
+    The token counts of the summaries are the completion tokens the API reports, the sections come with their
+    n_tokens from chunking: nothing is tokenized again locally.
+    """
 
     def __init__(self, selected_model, task_type, summarization_at_chunk_level):
-        default_credential = ChainedTokenCredential(AzureCliCredential(), DefaultAzureCredential())
-        token = default_credential.get_token(settings.COGNITIVE_SERVICES_URL) ## get the token to Access Azure resources
+        token = get_token_provider().live_token(settings.COGNITIVE_SERVICES_URL) ## cached token to Access Azure resources, refreshed before expiry
         temperature_task = settings.MODEL_TEMPERATURE_BY_TASK[task_type] ## set the temperature -- usually 0 - for the generative ai task
-        
+
         self.llm = instantiate_llm_client(token, selected_model, temperature_task)
+        self.model = settings.MODEL_DICTIONARY[selected_model]
         self.summarization_at_chunk_level = summarization_at_chunk_level ## determines to summarize at the chunk level or document level. Chunk level means that the document chunk are first summarized and then use to create the final summary
 
         self.total_request_tokens  = 0
         self.total_response_tokens = 0
-        
+
     def use_mapreduce(self, prompt, data, no_docs=False):
+        """
+        Args:
+            prompt (str): The task or question the final summary answers.
+            data (List[Dict[str, Any]]): The sections, in document order, with their 'text', 'title' and 'n_tokens'.
+            no_docs (bool): Asks the model to say so when the context does not answer the question. Defaults to False.
+
+        Returns:
+            Dict[str, Any]: The summary ('text') and the prompt and completion tokens of all the calls.
+        """
+        ## the sync entry point of the thread of a document (see create_doc_summary), its own event loop
+        response = asyncio.run(self._amapreduce(prompt, data, no_docs))
+        return  {
+                    "text":response,
+                    "token_count_prompt": self.total_request_tokens,
+                    "token_count_completion":  self.total_response_tokens
+                }
 
-        # The chain we'll apply to each individual document.
-        # Returns a summary of the document.
-        document_prompt = PromptTemplate.from_template("{page_content}")
-        self.partial_format_document = partial(format_document, prompt=document_prompt)
-
-        docs = []
-        for elm in data:
-            docs.append(
-                Document(
-                page_content=elm["text"],
-                metadata={"source": elm["title"]},
-            ))
-        if self.summarization_at_chunk_level:
-            map_chain_prompt = "Summarize this content"
-        else:
-            # if we choose not to summarize at the chunk level, we then just preserve the chunk and
-            # rephrase it a bit to ensure it does not trigger a content management filtering policy bug
-            map_chain_prompt = regeneration_prompt 
-        map_chain = (
-            {"context":self. partial_format_document}
-            | PromptTemplate.from_template(map_chain_prompt + ":\n\n{context}")
-            | (lambda prompt: self._custom_llm_invoke(prompt))
-            | StrOutputParser()
-        )
-
-        # A wrapper chain to keep the original Document metadata
-        map_as_doc_chain = (
-            RunnableParallel({"doc": RunnablePassthrough(), "content": map_chain})
-            | (lambda x: Document(page_content=x["content"], metadata=x["doc"].metadata))
-        ).with_config(run_name="Summarize (return doc)")
+    async def _amapreduce(self, prompt: str, data: List[Dict[str, Any]], no_docs: bool) -> str:
+        self._semaphore = asyncio.Semaphore(settings.SUMMARIZATION_MAX_CONCURRENCY)
+        summaries = await self._map(data)
+
+        level = 1
+        while len(summaries) > 1 and self._total_tokens(summaries) > settings.SUMMARIZATION_TOKEN_MAX \
+              and level <= settings.SUMMARIZATION_MAX_REDUCE_LEVELS:
+            start_time = time.time()
+            groups = self._group(summaries)
+            ## a summary alone in its group is kept as is, unless no summaries could be grouped: then each is shortened
+            shorten = len(groups) == len(summaries)
+            summaries = list(await asyncio.gather(*(self._collapse(group, shorten) for group in groups)))
+            record_span("summarize.collapse", time.time() - start_time, "One level of the tree reduce of the summaries",
+                        level=level, groups=len(groups))
+            level += 1
 
         end_prompt = ""
         if no_docs:
             if settings.DEBUG:
                 print("No documents found, summary is being processed with added prompt")
             end_prompt = """ If the question clearly demands information not present or implied in the context, respond with 'The content provided does not contain the answer to your question.'"""
-
-
-        reduce_chain = (
-            {"context": self._format_docs}
-            | PromptTemplate.from_template("{context}" + f"""\n\nBased on the above context, complete the following task or question '{prompt}'.{end_prompt}""")
-            | (lambda prompt: self._custom_llm_invoke(prompt))
-            | StrOutputParser()
-        ).with_config(run_name="Reduce")
-        # The final full chain
-        map_reduce = (map_as_doc_chain.map() | self._collapse | reduce_chain).with_config(
-            run_name="Map reduce"
-        )
-
-        response = map_reduce.invoke(docs, config={"max_concurrency": 5})
-
-
-
-        return  {
-                    "text":response, 
-                    "token_count_prompt": self.total_request_tokens,
-                    "token_count_completion":  self.total_response_tokens
-                }
-
-    def _custom_llm_invoke(self, prompt):
-        response = self.llm.invoke(prompt)
-        request_tokens = self.llm.get_num_tokens(prompt.to_string())
-        response_tokens = self.llm.get_num_tokens(response.content)
+        context = self._format_docs(summaries)
+        summary, _ = await self._custom_llm_ainvoke(f"{context}\n\nBased on the above context, complete the following task or question '{prompt}'.{end_prompt}")
+        return summary
+
+    async def _map(self, data: List[Dict[str, Any]]) -> List[Tuple[str, int]]:
+        """
+        Returns the (summary, tokens) of every section, in order: from the summary cache, or a map call.
+        """
+        start_time = time.time()
+        if self.summarization_at_chunk_level:
+            map_chain_prompt = "Summarize this content"
+        else:
+            # if we choose not to summarize at the chunk level, we then just preserve the chunk and
+            # rephrase it a bit to ensure it does not trigger a content management filtering policy bug
+            map_chain_prompt = regeneration_prompt
+        keys = [summary_key(self.model, map_chain_prompt, section["text"]) for section in data]
+        summary_cache = get_summary_cache()
+        cached = summary_cache.get_many(keys) if summary_cache is not None else {}
+
+        ## identical sections are summarized once
+        missing = {key: section for key, section in zip(keys, data) if key not in cached}
+        new_summaries = dict(zip(missing, await asyncio.gather(*(self._custom_llm_ainvoke(f"{map_chain_prompt}:\n\n{section['text']}")
+                                                                 for section in missing.values()))))
+        if summary_cache is not None:
+            summary_cache.put_many(new_summaries)
+        summaries = [cached[key] if key in cached else new_summaries[key] for key in keys]
+        record_span("summarize.map", time.time() - start_time, "Map summaries of the sections of a document",
+                    sections=len(data), cached=len(set(keys)) - len(missing))
+        return summaries
+
+    def _group(self, summaries: List[Tuple[str, int]]) -> List[List[Tuple[str, int]]]:
+        """
+        Splits the summaries (in order) in groups of at most settings.SUMMARIZATION_REDUCE_FAN_IN summaries and
+        settings.SUMMARIZATION_TOKEN_MAX tokens, a summary longer than that alone in its group.
+        """
+        groups: List[List[Tuple[str, int]]] = [[]]
+        for summary in summaries:
+            group = groups[-1]
+            if group and (len(group) >= settings.SUMMARIZATION_REDUCE_FAN_IN
+                          or self._total_tokens(group) + summary[1] + SEPARATOR_TOKENS > settings.SUMMARIZATION_TOKEN_MAX):
+                groups.append([])
+            groups[-1].append(summary)
+        return groups
+
+    async def _collapse(self, group: List[Tuple[str, int]], shorten: bool = False) -> Tuple[str, int]:
+        if len(group) == 1 and not shorten:
+            return group[0]
+        return await self._custom_llm_ainvoke(f"Collapse this content:\n\n{self._format_docs(group)}")
+
+    async def _custom_llm_ainvoke(self, prompt: str) -> Tuple[str, int]:
+        """
+        Returns the completion of the prompt and its tokens, as reported by the API.
+        """
+        async with self._semaphore:
+            response = await self.llm.ainvoke(prompt)
+        usage_metadata = getattr(response, "usage_metadata", None)
+        if usage_metadata: # token counts of the API `usage` field, no local re-tokenization
+            request_tokens = usage_metadata["input_tokens"]
+            response_tokens = usage_metadata["output_tokens"]
+        else:
+            request_tokens = self.llm.get_num_tokens(prompt)
+            response_tokens = self.llm.get_num_tokens(response.content)
         self.total_request_tokens += request_tokens
         self.total_response_tokens += response_tokens
-        return response
-    
-
-    def _format_docs(self, docs):
-        return "\n\n".join(self.partial_format_document(doc) for doc in docs)
-    
-    def _collapse(self, docs, config, token_max=10_000,):
-
-        collapse_chain = (
-            {"context": self._format_docs}
-            | PromptTemplate.from_template("Collapse this content:\n\n{context}")
-            | (lambda prompt: self._custom_llm_invoke(prompt))
-            | StrOutputParser()
-        )
-
-        collapse_ct = 1
-        while self._get_num_tokens(docs) > token_max:
-            config["run_name"] = f"Collapse {collapse_ct}"
-            invoke = partial(collapse_chain.invoke, config=config)
-            split_docs = split_list_of_docs(docs, self._get_num_tokens, token_max)
-            docs = [collapse_docs(_docs, invoke) for _docs in split_docs]
-            collapse_ct += 1
-        return docs
-    
-
-    def _get_num_tokens(self, docs):
-        return self.llm.get_num_tokens(self._format_docs(docs))
\ No newline at end of file
+        return response.content, response_tokens
+
+    @staticmethod
+    def _format_docs(summaries: List[Tuple[str, int]]) -> str:
+        return "\n\n".join(summary for summary, _ in summaries)
+
+    @staticmethod
+    def _total_tokens(summaries: List[Tuple[str, int]]) -> int:
+        return sum(tokens + SEPARATOR_TOKENS for _, tokens in summaries)
@@ -0,0 +1,113 @@
+import time
+import sqlite3
+import logging
+import threading
+from typing import Any, Callable, Dict, Iterable, Tuple
+
+## LOGGING CAPABILITIES
+
+logger = logging.getLogger(__name__)
+
+SQLITE_MAX_PARAMETERS = 500 ## keys per query, sqlite limits the number of parameters of a statement
+
+
+class SqliteLRUCache:
+    """
+    Local key-value cache in a table of a sqlite file, the least recently used entries evicted above a maximum
+    number of entries. The embedding cache (utilities/embedding_cache.py) and the summary cache
+    (utilities/summary_cache.py) are tables of this kind.
+
+    The file is opened once per process in WAL mode (readers of other processes are not blocked by a write), and
+    a lock serializes the statements of the threads of the process. The values go through `encode` before being
+    stored and `decode` when read, so the table only holds what sqlite stores natively (bytes, text, numbers).
+    """
+    def __init__(self,
+                 path: str,
+                 table: str,
+                 max_entries: int,
+                 encode: Callable[[Any], Any] = lambda value: value,
+                 decode: Callable[[Any], Any] = lambda value: value,
+                 description: str = "entry(ies)") -> None:
+        """
+        Args:
+            path (str): The sqlite file of the cache.
+            table (str): The table of the cache in the file.
+            max_entries (int): The number of entries kept.
+            encode (Callable[[Any], Any]): Turns a value into what is stored (bytes, str, int, float).
+            decode (Callable[[Any], Any]): Turns what is stored back into a value.
+            description (str): What the entries are, for logging purposes, ie "vector(s)".
+        """
+        self.table = table
+        self.max_entries = max_entries
+        self.description = description
+        self._encode = encode
+        self._decode = decode
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(f"""CREATE TABLE IF NOT EXISTS {table} (
+                                         key         TEXT PRIMARY KEY,
+                                         value,
+                                         last_used   REAL)""")
+        self._connection.execute(f"CREATE INDEX IF NOT EXISTS {table}_last_used ON {table} (last_used)")
+        self._lock = threading.Lock()
+        self._entries = self._connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """
+        Returns the values of the keys found and marks them as recently used.
+        """
+        keys = list(dict.fromkeys(keys))
+        found: Dict[str, Any] = {}
+        with self._lock:
+            for start in range(0, len(keys), SQLITE_MAX_PARAMETERS):
+                batch = keys[start:start + SQLITE_MAX_PARAMETERS]
+                rows = self._connection.execute(f"SELECT key, value FROM {self.table} WHERE key IN ({','.join('?' * len(batch))})",
+                                                batch).fetchall()
+                for key, value in rows:
+                    found[key] = self._decode(value)
+            if found:
+                found_keys = list(found)
+                now = time.time()
+                for start in range(0, len(found_keys), SQLITE_MAX_PARAMETERS):
+                    batch = found_keys[start:start + SQLITE_MAX_PARAMETERS]
+                    self._connection.execute(f"UPDATE {self.table} SET last_used = ? WHERE key IN ({','.join('?' * len(batch))})",
+                                             (now, *batch))
+        return found
+
+    def put_many(self, values: Dict[str, Any]) -> None:
+        """
+        Stores values by key, then evicts the least recently used entries above the maximum number of entries.
+        """
+        if not values:
+            return
+        now = time.time()
+        rows = [(key, self._encode(value), now) for key, value in values.items()]
+        with self._lock:
+            self._connection.execute("BEGIN")
+            self._connection.executemany(f"INSERT OR REPLACE INTO {self.table} VALUES (?, ?, ?)", rows)
+            self._connection.execute("COMMIT")
+            self._entries += len(rows)
+            if self._entries > self.max_entries:
+                ## the counter overestimates (replaced keys), count again before evicting
+                self._entries = self._connection.execute(f"SELECT COUNT(*) FROM {self.table}").fetchone()[0]
+                excess = self._entries - self.max_entries
+                if excess > 0:
+                    self._connection.execute(f"DELETE FROM {self.table} WHERE rowid IN "
+                                             f"(SELECT rowid FROM {self.table} ORDER BY last_used LIMIT ?)", (excess,))
+                    self._entries -= excess
+                    logger.info(f"Evicted {excess} {self.description} from the {self.table} cache")
+
+
+_caches: Dict[Tuple[str, str], SqliteLRUCache] = {}
+_caches_lock = threading.Lock()
+
+
+def get_sqlite_cache(path: str, table: str, max_entries: int, **options: Any) -> SqliteLRUCache:
+    """
+    Returns the process wide cache of a table of a sqlite file, created on first use with `options` (`encode`,
+    `decode`, `description`, see `SqliteLRUCache`).
+    """
+    with _caches_lock:
+        if (path, table) not in _caches:
+            _caches[(path, table)] = SqliteLRUCache(path, table, max_entries, **options)
+        return _caches[(path, table)]
@@ -0,0 +1,241 @@
+import json
+import time
+import atexit
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+
+from utilities.cosmos_process import build_thread_flag_request_body, send_thread_flag_update, update_file_thread_flag
+
+## LOGGING CAPABILITIES
+
+logger = logging.getLogger(__name__)
+
+
+## STATUS CODES OF THE STATUS SERVICE WORTH RETRYING (the other 4xx are dropped: retrying would not change the answer)
+RETRYABLE_STATUS_CODES = (408, 429, 500, 502, 503, 504)
+
+
+class StatusReporter:
+    """
+    Non blocking, durable and coalescing reporter of the job status to the thread flag service.
+
+    The job threads used to PUT every status update synchronously: a slow status backend stalled the pipeline and
+    nothing was reported between "inProgress" and the end of the job. Here:
+        - `report` / `report_progress` only write the update into a local sqlite outbox (settings.STATUS_OUTBOX_PATH)
+          and return, a daemon thread delivers it
+        - the outbox holds at most one pending update per task: a newer update replaces an undelivered one
+          (coalescing), a terminal status ("Completed", "Failed", ...) is never replaced by a progress event
+        - progress events of a task are sent at most every settings.STATUS_PROGRESS_MIN_INTERVAL seconds,
+          terminal statuses are sent right away
+        - failed deliveries are retried with exponential backoff up to settings.STATUS_MAX_ATTEMPTS times
+        - the outbox survives a restart: updates left undelivered are sent by the next process
+        - the per task bookkeeping is bounded: the last send time of a task is dropped once its terminal status is
+          delivered, and only the settings.STATUS_TERMINAL_TASKS_MAX latest finished tasks are remembered
+    """
+    def __init__(self, outbox_path: str) -> None:
+        """
+        Args:
+            outbox_path (str): The sqlite file of the outbox.
+        """
+        self._connection = sqlite3.connect(outbox_path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("""CREATE TABLE IF NOT EXISTS outbox (
+                                        task_id         TEXT PRIMARY KEY,
+                                        file_name       TEXT,
+                                        thread_status   TEXT,
+                                        thread_output   TEXT,
+                                        progress        TEXT,
+                                        terminal        INTEGER,
+                                        version         INTEGER,
+                                        attempts        INTEGER,
+                                        next_attempt_at REAL)""")
+        self._lock = threading.Lock()
+        self._wake_event = threading.Event()
+        self._idle_event = threading.Event()
+        self._stop_event = threading.Event()
+        self._last_sent_at: Dict[str, float] = {}
+        self._terminal_tasks: "OrderedDict[str, None]" = OrderedDict() ## finished tasks, oldest first
+        self._worker = threading.Thread(target=self._delivery_loop, name="status-reporter", daemon=True)
+        self._worker.start()
+
+    def report(self,
+               task_id: str,
+               file_name: Any,
+               thread_status: str,
+               thread_output: Any = None,
+               progress: Optional[Dict[str, Any]] = None) -> None:
+        """
+        Queues a status update of a task and returns immediately.
+
+        Args:
+            task_id (str): The task id of the thread flag row.
+            file_name (Any): The file name(s) of the task, for logging purposes.
+            thread_status (str): "inProgress" or a terminal status ("Completed", "Failed", ...).
+            thread_output (Any): The final output (Completed) or the error message (Failed).
+            progress (Optional[Dict[str, Any]]): The current stage of an "inProgress" task.
+        """
+        terminal = thread_status != "inProgress"
+        now = time.time()
+        with self._lock:
+            if not terminal and task_id in self._terminal_tasks:
+                return # a late progress event must not reopen a finished task
+            pending = self._connection.execute("SELECT terminal, version FROM outbox WHERE task_id = ?", (task_id,)).fetchone()
+            if pending is not None and pending[0] and not terminal:
+                return # the pending terminal status wins over the progress event
+            if terminal:
+                self._terminal_tasks[task_id] = None
+                self._terminal_tasks.move_to_end(task_id)
+                if len(self._terminal_tasks) > settings.STATUS_TERMINAL_TASKS_MAX:
+                    self._terminal_tasks.popitem(last=False)
+                next_attempt_at = now
+            else:
+                next_attempt_at = max(now, self._last_sent_at.get(task_id, 0) + settings.STATUS_PROGRESS_MIN_INTERVAL)
+            version = pending[1] + 1 if pending is not None else 0
+            self._connection.execute("INSERT OR REPLACE INTO outbox VALUES (?, ?, ?, ?, ?, ?, ?, 0, ?)",
+                                     (task_id, json.dumps(file_name), thread_status, json.dumps(thread_output),
+                                      json.dumps(progress), int(terminal), version, next_attempt_at))
+            self._idle_event.clear()
+        self._wake_event.set()
+
+    def report_progress(self,
+                        task_id: str,
+                        file_name: Any,
+                        stage: str,
+                        completed: Optional[int] = None,
+                        total: Optional[int] = None) -> None:
+        """
+        Queues a progress event ("inProgress" with the current stage) of a task.
+
+        Args:
+            task_id (str): The task id of the thread flag row.
+            file_name (Any): The file name(s) of the task, for logging purposes.
+            stage (str): The stage reached, ie "parsed", "layout_revised", "revised", "converted", "uploaded".
+            completed (Optional[int]): The number of units (chunks) done in the stage.
+            total (Optional[int]): The number of units (chunks) of the stage.
+        """
+        progress = {"stage": stage, "updatedAt": time.time()}
+        if total is not None:
+            progress["completed"] = completed
+            progress["total"] = total
+        self.report(task_id, file_name, "inProgress", progress=progress)
+
+    def pending(self) -> int:
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def flush(self, timeout: float = 30) -> bool:
+        """
+        Waits until the outbox is empty (every update delivered or given up), at most `timeout` seconds.
+
+        Returns:
+            bool: Whether the outbox is empty.
+        """
+        self._wake_event.set()
+        deadline = time.time() + timeout
+        while self.pending() and time.time() < deadline:
+            self._idle_event.wait(min(0.1, max(deadline - time.time(), 0)))
+            self._wake_event.set()
+        return not self.pending()
+
+    def _deliver(self, row: tuple) -> bool:
+        """
+        Sends one outbox row. Returns whether the row is done with (delivered or not worth retrying).
+        """
+        from utilities.token_provider import get_token_provider
+
+        task_id, file_name, thread_status, thread_output, progress, terminal, version, attempts, _ = row
+        request_body = build_thread_flag_request_body(thread_status, json.loads(thread_output), json.loads(progress))
+        try:
+            token = get_token_provider().get_token(settings.COGNITIVE_SERVICES_URL)
+            response = send_thread_flag_update(task_id, request_body, token)
+            if response.status_code < 400:
+                if settings.DEBUG:
+                    logger.info(f"✅ Thread flag of {json.loads(file_name)} updated to {thread_status} "
+                                f"{json.loads(progress) or ''}")
+                return True
+            if response.status_code not in RETRYABLE_STATUS_CODES:
+                logger.error(f"Thread flag update {thread_status} of task {task_id} rejected "
+                             f"with status code {response.status_code}: {response.text}")
+                return True
+            error = f"status code {response.status_code}"
+        except Exception as e:
+            error = repr(e)
+        if attempts + 1 >= settings.STATUS_MAX_ATTEMPTS:
+            logger.error(f"Giving up thread flag update {thread_status} of task {task_id} after {attempts + 1} attempts: {error}")
+            return True
+        logger.info(f"Thread flag update {thread_status} of task {task_id} failed ({error}), will retry")
+        return False
+
+    def _delivery_loop(self) -> None:
+        while not self._stop_event.is_set():
+            with self._lock:
+                rows = self._connection.execute("SELECT * FROM outbox WHERE next_attempt_at <= ? ORDER BY next_attempt_at",
+                                                (time.time(),)).fetchall()
+                next_due = self._connection.execute("SELECT MIN(next_attempt_at) FROM outbox").fetchone()[0]
+            if not rows:
+                if next_due is None:
+                    self._idle_event.set()
+                wait_time = settings.STATUS_OUTBOX_POLL_INTERVAL if next_due is None else max(next_due - time.time(), 0.01)
+                self._wake_event.wait(min(wait_time, settings.STATUS_OUTBOX_POLL_INTERVAL))
+                self._wake_event.clear()
+                continue
+            for row in rows:
+                task_id, terminal, version, attempts = row[0], row[5], row[6], row[7]
+                done = self._deliver(row)
+                with self._lock:
+                    if done:
+                        ## only remove the row if no newer update replaced it in the meantime
+                        self._connection.execute("DELETE FROM outbox WHERE task_id = ? AND version = ?", (task_id, version))
+                        if terminal:
+                            self._last_sent_at.pop(task_id, None) # no progress event follows a terminal status
+                        else:
+                            self._last_sent_at[task_id] = time.time()
+                    else:
+                        delay = min(settings.STATUS_RETRY_BACKOFF * (2 ** attempts), settings.STATUS_RETRY_MAX_BACKOFF)
+                        self._connection.execute("UPDATE outbox SET attempts = ?, next_attempt_at = ? WHERE task_id = ? AND version = ?",
+                                                 (attempts + 1, time.time() + delay, task_id, version))
+
+    def stop(self) -> None:
+        self._stop_event.set()
+        self._wake_event.set()
+
+
+_status_reporter = None
+_status_reporter_lock = threading.Lock()
+
+
+def get_status_reporter() -> StatusReporter:
+    """
+    Returns the process wide status reporter, delivering what a previous process left in the outbox.
+    """
+    global _status_reporter
+    with _status_reporter_lock:
+        if _status_reporter is None:
+            _status_reporter = StatusReporter(str(settings.STATUS_OUTBOX_PATH))
+            atexit.register(_status_reporter.flush, settings.STATUS_SHUTDOWN_FLUSH_TIMEOUT)
+    return _status_reporter
+
+
+def report_status(task_id: str, file_name: Any, thread_status: str, token: Any, thread_output: Any = None) -> None:
+    """
+    Drop-in replacement of `update_file_thread_flag` for the job threads: queued in the outbox when
+    settings.STATUS_REPORTER_ENABLED, sent synchronously as before otherwise.
+    """
+    if settings.STATUS_REPORTER_ENABLED:
+        get_status_reporter().report(task_id, file_name, thread_status, thread_output)
+    else:
+        update_file_thread_flag(task_id=task_id, file_name=file_name, thread_status=thread_status,
+                                token=token, thread_output=thread_output)
+
+
+def report_progress(task_id: str, file_name: Any, stage: str, completed: Optional[int] = None, total: Optional[int] = None) -> None:
+    """
+    Queues a progress event of a task (no-op when settings.STATUS_REPORTER_ENABLED is off).
+    """
+    if settings.STATUS_REPORTER_ENABLED:
+        get_status_reporter().report_progress(task_id, file_name, stage, completed, total)
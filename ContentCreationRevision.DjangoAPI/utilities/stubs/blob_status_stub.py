@@ -0,0 +1,178 @@
+"""
+Local stand-in for the blob storage API and the thread flag (job status) API the jobs talk to.
+
+It implements what `utilities/blob_storage.py` and `utilities/cosmos_process.py` call:
+    - GET  /blobs/list                                            --> {"result": [file names]}
+    - GET  /blobs/download?fileName=...                           --> the file (document analyzer / onboarding)
+    - GET  /dvoice/download?container=...&folderName=...&fileName=... --> the file
+    - POST /dvoice/upload?container=...&folderName=...            --> multipart/form-data upload, stored in `uploads`
+    - PUT  /threads/{task id}                                     --> the status update, stored in `status_updates`
+
+Files are seeded with `put_blob`. Every response is delayed by `latency` seconds and a seeded share of the requests
+(`error_ratio`) is answered with a 503 to exercise the retries of the pooled transport.
+
+Usage:
+    server = start_blob_status_stub_server()
+    server.put_blob("user/dvoice_input", "report.docx", docx_bytes)
+    # config.json: "dvoice_download_document_url": server.url("dvoice/download"), ... (see `settings_overrides`)
+"""
+import re
+import json
+import time
+import random
+import threading
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from typing import Any, Dict, List, Optional, Tuple
+
+THREAD_PATH = re.compile(r"^/threads/(?P<task_id>[^/]+)$")
+
+
+class BlobStatusStubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, server_address: Tuple[str, int], latency: float = 0.0, error_ratio: float = 0.0, seed: int = 0) -> None:
+        super().__init__(server_address, BlobStatusStubHandler)
+        self.latency = latency
+        self.error_ratio = error_ratio
+        self.random = random.Random(seed)
+        self.blobs: Dict[Tuple[str, str], bytes] = {}
+        self.uploads: List[Dict[str, Any]] = []
+        self.status_updates: Dict[str, List[Dict[str, Any]]] = {}
+        self.request_count = 0
+        self.lock = threading.Lock()
+
+    def url(self, path: str) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/{path}"
+
+    def settings_overrides(self) -> Dict[str, str]:
+        """
+        Returns the django settings pointing the blob and status calls to this server.
+        """
+        return {"LIST_ALL_BLOBS_URL"                       : self.url("blobs/list"),
+                "DOWNLOAD_DOCUMENT_URL"                    : self.url("blobs/download"),
+                "DOWNLOAD_ONBOARDING_URL"                  : self.url("blobs/download"),
+                "DVOICE_DOWNLOAD_DOCUMENT_URL"             : self.url("dvoice/download"),
+                "DVOICE_UPLOAD_DOCUMENT_URL"               : self.url("dvoice/upload"),
+                "DVOICE_UPDATE_INPROGRESS_THREAD_FLAG_URL" : self.url("threads")}
+
+    def put_blob(self, folder_name: str, file_name: str, content: bytes) -> None:
+        with self.lock:
+            self.blobs[(folder_name, file_name)] = content
+
+    def get_blob(self, folder_name: Optional[str], file_name: str) -> Optional[bytes]:
+        with self.lock:
+            if (folder_name or "", file_name) in self.blobs:
+                return self.blobs[(folder_name or "", file_name)]
+            for (_, blob_name), content in self.blobs.items():
+                if blob_name == file_name: # the document analyzer API only sends the file name
+                    return content
+        return None
+
+    def fail_next(self) -> bool:
+        with self.lock:
+            self.request_count += 1
+            return self.random.random() < self.error_ratio
+
+
+class BlobStatusStubHandler(BaseHTTPRequestHandler):
+
+    def _send(self, status: int, payload: bytes, content_type: str = "application/json") -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_json(self, status: int, body: Any) -> None:
+        self._send(status, json.dumps(body).encode("utf-8"))
+
+    def _read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+    def _begin(self) -> bool:
+        """
+        Applies the latency and the injected errors. Returns whether the request should be served.
+        """
+        time.sleep(self.server.latency)
+        if self.server.fail_next():
+            self._read_body()
+            self._send_json(503, {"error": "Service unavailable (stand-in)"})
+            return False
+        return True
+
+    def do_GET(self) -> None:
+        if not self._begin():
+            return
+        url = urlparse(self.path)
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        if url.path == "/blobs/list":
+            with self.server.lock:
+                file_names = sorted({file_name for _, file_name in self.server.blobs})
+            self._send_json(200, {"result": file_names})
+            return
+        if url.path in ("/blobs/download", "/dvoice/download"):
+            content = self.server.get_blob(query.get("folderName"), query.get("fileName", ""))
+            if content is None:
+                self._send_json(404, {"error": f"{query.get('folderName')}/{query.get('fileName')} not found"})
+                return
+            self._send(200, content, "application/octet-stream")
+            return
+        self._send_json(404, {"error": url.path})
+
+    def do_POST(self) -> None:
+        if not self._begin():
+            return
+        url = urlparse(self.path)
+        if url.path != "/dvoice/upload":
+            self._send_json(404, {"error": url.path})
+            return
+        query = {name: values[0] for name, values in parse_qs(url.query).items()}
+        body = self._read_body()
+        ## parse the multipart/form-data body with the email parser (the cgi module is deprecated)
+        message = BytesParser(policy=HTTP).parsebytes(f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode("utf-8") + body)
+        uploaded = []
+        for part in message.iter_parts():
+            file_name = part.get_filename()
+            if file_name is None:
+                continue
+            content = part.get_payload(decode=True)
+            self.server.put_blob(query.get("folderName", ""), file_name, content)
+            uploaded.append({"container": query.get("container"), "folder_name": query.get("folderName"),
+                             "file_name": file_name, "size": len(content), "at": time.time()})
+        with self.server.lock:
+            self.server.uploads.extend(uploaded)
+        self._send_json(200, {"result": [upload["file_name"] for upload in uploaded]})
+
+    def do_PUT(self) -> None:
+        if not self._begin():
+            return
+        match = THREAD_PATH.match(urlparse(self.path).path)
+        if match is None:
+            self._send_json(404, {"error": self.path})
+            return
+        update = json.loads(self._read_body() or b"{}")
+        with self.server.lock:
+            self.server.status_updates.setdefault(match["task_id"], []).append({"at": time.time(), **update})
+        self._send_json(200, {"result": "updated"})
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+def start_blob_status_stub_server(port: int = 0, latency: float = 0.0, error_ratio: float = 0.0, seed: int = 0) -> BlobStatusStubServer:
+    """
+    Starts the stand-in on a background thread. Port 0 picks a free port. Stop it with `server.shutdown()`.
+    """
+    server = BlobStatusStubServer(("127.0.0.1", port), latency=latency, error_ratio=error_ratio, seed=seed)
+    threading.Thread(target=server.serve_forever, name="blob-status-stub", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    stub_server = BlobStatusStubServer(("127.0.0.1", 8768))
+    print(f"Blob storage and thread flag stand-in listening on {stub_server.url('')}")
+    stub_server.serve_forever()
@@ -0,0 +1,193 @@
+"""
+Local stand-in for the Azure Document Intelligence (Form Recognizer) analyze REST API.
+
+It implements just enough of the 2023-07-31 API for `utilities/doc_intelligence_async.py`:
+    - POST {endpoint}/formrecognizer/documentModels/{model_id}:analyze?pages=1-10  --> 202 + Operation-Location
+    - GET  {operation location}                                                    --> running ... then succeeded
+
+The analyze result is synthetic but shaped like the real one (pages/lines, paragraphs with roles and spans, tables
+with cells and spans). When the payload is a pdf and pypdfium2 is installed, the real page count is used.
+
+Usage:
+    python -m utilities.stubs.doc_intelligence_stub --port 8765 --polls 2 --latency 0.2
+    then set "endpoint_ocr" to "http://127.0.0.1:8765/" in config.json (no credential is needed)
+"""
+import re
+import sys
+import json
+import time
+import uuid
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from typing import Any, Dict, List, Optional, Tuple
+
+ANALYZE_PATH = re.compile(r"^/formrecognizer/documentModels/(?P<model_id>[^/:]+):analyze$")
+RESULT_PATH = re.compile(r"^/formrecognizer/documentModels/(?P<model_id>[^/]+)/analyzeResults/(?P<operation_id>[^/]+)$")
+
+
+def _count_pages(payload: bytes) -> int:
+    if not payload.startswith(b"%PDF"):
+        return 1
+    try:
+        import pypdfium2
+    except ImportError:
+        return 1
+    pdf = pypdfium2.PdfDocument(payload)
+    page_count = len(pdf)
+    pdf.close()
+    return page_count
+
+
+def _parse_pages(pages: Optional[str], page_count: int) -> List[int]:
+    if not pages:
+        return list(range(1, page_count + 1))
+    page_numbers = []
+    for page_range in pages.split(","):
+        first_page, _, last_page = page_range.partition("-")
+        page_numbers.extend(range(int(first_page), int(last_page or first_page) + 1))
+    return [page_number for page_number in page_numbers if page_number <= page_count]
+
+
+def build_analyze_result(model_id: str, page_numbers: List[int]) -> Dict[str, Any]:
+    """
+    Builds a synthetic `analyzeResult`: every page has a section heading and a paragraph, the first page of the
+    result also has a 2 x 2 table (its cell paragraphs are part of the table span, like in the real service).
+    """
+    content = ""
+    pages, paragraphs, tables = [], [], []
+
+    def add_text(text: str, page_number: int, role: Optional[str] = None) -> Tuple[int, int]:
+        nonlocal content
+        offset = len(content)
+        content += text + "\n"
+        paragraph = {"content": text,
+                     "boundingRegions": [{"pageNumber": page_number, "polygon": []}],
+                     "spans": [{"offset": offset, "length": len(text)}]}
+        if role is not None:
+            paragraph["role"] = role
+        paragraphs.append(paragraph)
+        return offset, len(text)
+
+    for index, page_number in enumerate(page_numbers):
+        heading = f"Section {page_number}"
+        body = f"This is the stand-in content of page {page_number}."
+        add_text(heading, page_number, role="sectionHeading")
+        add_text(body, page_number)
+        lines = [heading, body]
+
+        if index == 0 and model_id != "prebuilt-read":
+            cells, table_start = [], len(content)
+            for row_index, row in enumerate([["Metric", "Value"], ["Pages", str(len(page_numbers))]]):
+                for column_index, cell_content in enumerate(row):
+                    offset, length = add_text(cell_content, page_number)
+                    cells.append({"kind": "columnHeader" if row_index == 0 else "content",
+                                  "rowIndex": row_index, "columnIndex": column_index,
+                                  "content": cell_content,
+                                  "spans": [{"offset": offset, "length": length}]})
+                    lines.append(cell_content)
+            tables.append({"rowCount": 2, "columnCount": 2, "cells": cells,
+                           "boundingRegions": [{"pageNumber": page_number, "polygon": []}],
+                           "spans": [{"offset": table_start, "length": len(content) - table_start}]})
+
+        pages.append({"pageNumber": page_number,
+                      "lines": [{"content": line} for line in lines]})
+
+    return {"apiVersion": "2023-07-31", "modelId": model_id, "content": content,
+            "pages": pages, "paragraphs": paragraphs, "tables": tables}
+
+
+class DocIntelligenceStubServer(ThreadingHTTPServer):
+    """
+    The stand-in server. Operations report "running" for `polls` GETs before succeeding, each response is delayed
+    by `latency` seconds to mimic the network, `submissions` records the page ranges received.
+    """
+    daemon_threads = True
+
+    def __init__(self, server_address: Tuple[str, int], polls: int = 1, latency: float = 0.0) -> None:
+        super().__init__(server_address, DocIntelligenceStubHandler)
+        self.polls = polls
+        self.latency = latency
+        self.operations = {}
+        self.submissions = []
+        self.lock = threading.Lock()
+
+    @property
+    def endpoint(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/"
+
+
+class DocIntelligenceStubHandler(BaseHTTPRequestHandler):
+
+    def _send_json(self, status: int, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self) -> None:
+        time.sleep(self.server.latency)
+        url = urlparse(self.path)
+        match = ANALYZE_PATH.match(url.path)
+        if match is None:
+            self._send_json(404, {"error": {"code": "NotFound", "message": url.path}})
+            return
+        payload = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        pages = parse_qs(url.query).get("pages", [None])[0]
+        operation_id = uuid.uuid4().hex
+        with self.server.lock:
+            self.server.submissions.append(pages)
+            self.server.operations[operation_id] = {"model_id": match["model_id"],
+                                                    "page_numbers": _parse_pages(pages, _count_pages(payload)),
+                                                    "polls_left": self.server.polls}
+        operation_location = (f"{self.server.endpoint}formrecognizer/documentModels/{match['model_id']}"
+                              f"/analyzeResults/{operation_id}?api-version=2023-07-31")
+        self._send_json(202, {}, headers={"Operation-Location": operation_location})
+
+    def do_GET(self) -> None:
+        time.sleep(self.server.latency)
+        match = RESULT_PATH.match(urlparse(self.path).path)
+        operation = self.server.operations.get(match["operation_id"]) if match else None
+        if operation is None:
+            self._send_json(404, {"error": {"code": "NotFound", "message": self.path}})
+            return
+        with self.server.lock:
+            operation["polls_left"] -= 1
+            polls_left = operation["polls_left"]
+        if polls_left >= 0:
+            self._send_json(200, {"status": "running"}, headers={"Retry-After": "0"})
+            return
+        self._send_json(200, {"status": "succeeded",
+                              "analyzeResult": build_analyze_result(operation["model_id"], operation["page_numbers"])})
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass # keep the test / benchmark output readable
+
+
+def start_stub_server(port: int = 0, polls: int = 1, latency: float = 0.0) -> DocIntelligenceStubServer:
+    """
+    Starts the stand-in server on a background thread. Port 0 picks a free port, read it back from `server.endpoint`.
+    Stop it with `server.shutdown()`.
+    """
+    server = DocIntelligenceStubServer(("127.0.0.1", port), polls=polls, latency=latency)
+    threading.Thread(target=server.serve_forever, name="doc-intelligence-stub", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the Azure Document Intelligence analyze API")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--polls", type=int, default=1, help="number of 'running' answers before an operation succeeds")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    arguments = parser.parse_args()
+
+    stub_server = DocIntelligenceStubServer(("127.0.0.1", arguments.port), polls=arguments.polls, latency=arguments.latency)
+    print(f"Document Intelligence stand-in listening on {stub_server.endpoint}")
+    sys.stdout.flush()
+    stub_server.serve_forever()
@@ -0,0 +1,107 @@
+"""
+Local stand-in for the Azure AD JWKS endpoint (`/<tenant>/discovery/v2.0/keys`) that can also sign tokens.
+
+It generates RSA signing keys in memory, serves them as a JWKS document and issues RS256 tokens carrying the
+audience/issuer `AzureADAuthentication` expects, so the JWKS cache (api/jwks_cache.py) and the authentication
+can be exercised without Azure AD. `fetch_count` tells how many times the keys were downloaded.
+
+Usage:
+    server = start_jwks_stub_server()
+    # config.json: "azure_ad_jwks_url": server.jwks_url
+    token = server.issue_token({"aud": "<scope>", "iss": "https://sts.windows.net/<tenant>/", "sub": "user"})
+    server.rotate_key() # new kid, the cache must refresh once on the first token signed with it
+"""
+import json
+import time
+import uuid
+import base64
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Optional, Tuple
+
+
+def _base64url_uint(value: int) -> str:
+    return base64.urlsafe_b64encode(value.to_bytes((value.bit_length() + 7) // 8, "big")).rstrip(b"=").decode("ascii")
+
+
+class JWKSStubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, server_address: Tuple[str, int]) -> None:
+        super().__init__(server_address, JWKSStubHandler)
+        self.signing_keys: Dict[str, Any] = {}
+        self.current_kid: Optional[str] = None
+        self.fetch_count = 0
+        self.lock = threading.Lock()
+        self.rotate_key()
+
+    @property
+    def jwks_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/stub-tenant/discovery/v2.0/keys"
+
+    def rotate_key(self) -> str:
+        """
+        Adds a new signing key (previous keys stay published, like during an Azure AD rollover). Returns its kid.
+        """
+        from cryptography.hazmat.primitives.asymmetric import rsa
+
+        kid = uuid.uuid4().hex
+        with self.lock:
+            self.signing_keys[kid] = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+            self.current_kid = kid
+        return kid
+
+    def jwks(self) -> Dict[str, Any]:
+        with self.lock:
+            keys = []
+            for kid, private_key in self.signing_keys.items():
+                public_numbers = private_key.public_key().public_numbers()
+                keys.append({"kty": "RSA", "use": "sig", "kid": kid,
+                             "n": _base64url_uint(public_numbers.n), "e": _base64url_uint(public_numbers.e)})
+        return {"keys": keys}
+
+    def issue_token(self, claims: Dict[str, Any], kid: Optional[str] = None, expires_in: int = 3600) -> str:
+        """
+        Signs an RS256 token with the current (or given) key.
+        """
+        import jwt
+
+        kid = kid or self.current_kid
+        payload = {"iat": int(time.time()), "exp": int(time.time()) + expires_in, **claims}
+        return jwt.encode(payload, self.signing_keys[kid], algorithm="RS256", headers={"kid": kid})
+
+
+class JWKSStubHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self) -> None:
+        if not self.path.endswith("/discovery/v2.0/keys"):
+            self.send_response(404)
+            self.end_headers()
+            return
+        with self.server.lock:
+            self.server.fetch_count += 1
+        payload = json.dumps(self.server.jwks()).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass
+
+
+def start_jwks_stub_server(port: int = 0) -> JWKSStubServer:
+    """
+    Starts the stand-in on a background thread. Port 0 picks a free port. Stop it with `server.shutdown()`.
+    """
+    server = JWKSStubServer(("127.0.0.1", port))
+    threading.Thread(target=server.serve_forever, name="jwks-stub", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    stub_server = JWKSStubServer(("127.0.0.1", 8766))
+    print(f"JWKS stand-in listening on {stub_server.jwks_url}")
+    stub_server.serve_forever()
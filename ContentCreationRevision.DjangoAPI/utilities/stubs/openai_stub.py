@@ -0,0 +1,451 @@
+"""
+Local stand-in for the Azure OpenAI chat completions and embeddings REST API.
+
+It implements what the openai client and LangChain's AzureChatOpenAI call:
+    - POST {endpoint}/openai/deployments/{deployment}/chat/completions?api-version=...
+    - POST {endpoint}/openai/deployments/{deployment}/embeddings?api-version=...
+    (and the plain OpenAI /v1/chat/completions and /v1/embeddings paths)
+
+The answers are deterministic and shaped for the pipeline:
+    - `response_format={"type": "json_schema", ...}` (openai `beta.chat.completions.parse`) is answered with an
+      instance of the requested schema
+    - the LangChain chains of the revision (JsonOutputParser driven by the prompt) are answered with an instance of
+      the `DVoice.utilities.llm_structured_output` class whose keys the prompt asks for: the chunk travels through the
+      layout and the 5 guideline steps unchanged, so the output document has the size of the input
+    - booleans / lists take the values of `DEFAULT_FIELD_VALUES` (the main path of the pipeline), which a benchmark
+      case can override (`server.field_values`)
+    - free text prompts get a markdown document of `completion_words` words built from the prompt vocabulary,
+      seeded by the prompt hash
+    - embeddings are hashed bag of words vectors (similar texts get similar vectors), float or base64 encoded
+
+Every response carries a `usage` field (about 4 characters per token) and is delayed by
+`latency + latency_per_token * completion_tokens`. A chat completion asked with `"stream": true` is sent as
+server-sent events of a few words each: `latency` before the first event, then `latency_per_token` per token of
+each event, and the `usage` in a last event when `stream_options.include_usage` is set. Rate limiting is simulated twice: a seeded share of the requests
+(`rate_limit_ratio`) and every request above `capacity` concurrent requests get a 429 with retry-after headers.
+`request_log` records every request (kind, deployment, start, end, status, tokens, in flight count).
+
+Usage:
+    python -m utilities.stubs.openai_stub --port 8767 --latency 0.3 --rate-limit-ratio 0.05
+    then set "api_base" to "http://127.0.0.1:8767/" in config.json (the token is not checked)
+"""
+import re
+import sys
+import json
+import math
+import time
+import random
+import struct
+import base64
+import hashlib
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+from typing import Any, Dict, List, Optional, Tuple
+
+DEPLOYMENT_PATH = re.compile(r"^/openai/deployments/(?P<deployment>[^/]+)/(?P<operation>chat/completions|embeddings)$")
+OPENAI_PATH = re.compile(r"^/v1/(?P<operation>chat/completions|embeddings)$")
+
+## ANSWERS TAKING THE MAIN PATH OF THE PIPELINE (the chunks are textual, EN query, one output file, summarization)
+DEFAULT_FIELD_VALUES = {"textual"            : True,
+                        "style_modification" : "False",
+                        "language"           : ["EN"],
+                        "output_language"    : ["EN"],
+                        "bill_96_compliance" : False,
+                        "only_one_file"      : True,
+                        "summarization"      : True,
+                        "rewriting"          : False,
+                        "retrieval"          : False}
+
+## FREE TEXT PROMPTS WITH A SHORT ANSWER: (marker in the prompt, kind of answer)
+FREE_TEXT_RULES = [("concise name for the intended output", "file_name"),
+                   ("rewritten query in string format", "echo"),
+                   ("translat", "echo")]
+
+## the chunk travels in these parts of the revision chain prompts (see DVoice/content_revision/revision.py)
+PAGE_CONTENT_PATTERN = re.compile(r"page_content:\s*'(?P<text>.*?)'\s*,\s*please", re.DOTALL)
+REVISION_STEP_PATTERN = re.compile(r"original[_ ]text:\s*'(?P<original>.*?)',\s*-\s*revised[_ ]text[_ ]step[_ ]\d:\s*'(?P<revised>.*?)',\s*please",
+                                   re.DOTALL)
+INPUT_TEXT_MARKER = "Here is the input text:"
+WORD_PATTERN = re.compile(r"[A-Za-zÀ-ÿ']{3,}")
+
+
+def count_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+def load_structured_output_schemas() -> Dict[str, Dict[str, Any]]:
+    """
+    Returns the JSON schema of every structured output class of `DVoice.utilities.llm_structured_output`.
+    """
+    from pydantic import BaseModel
+    from DVoice.utilities import llm_structured_output
+
+    schemas = {}
+    for name, value in vars(llm_structured_output).items():
+        if isinstance(value, type) and issubclass(value, BaseModel) and value is not BaseModel:
+            schemas[name] = value.model_json_schema()
+    return schemas
+
+
+def _message_text(messages: List[Dict[str, Any]]) -> str:
+    parts = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+        elif isinstance(content, list):
+            parts.extend(part.get("text", "") for part in content if isinstance(part, dict))
+    return "\n".join(parts)
+
+
+def extract_texts(prompt: str) -> Tuple[str, str]:
+    """
+    Returns the (original, latest) text a prompt works on: the chunk of a revision chain step (and its previous
+    revision), the input text of `generate_response_from_text_input`, or the prompt itself.
+    """
+    match = REVISION_STEP_PATTERN.search(prompt)
+    if match:
+        return match["original"], match["revised"]
+    match = PAGE_CONTENT_PATTERN.search(prompt)
+    if match:
+        return match["text"], match["text"]
+    if INPUT_TEXT_MARKER in prompt:
+        text = prompt.split(INPUT_TEXT_MARKER, 1)[1].strip()
+        return text, text
+    return prompt, prompt
+
+
+def infer_structured_output(prompt: str, schemas: Dict[str, Dict[str, Any]]) -> Optional[Tuple[str, Dict[str, Any]]]:
+    """
+    Finds the structured output class a prompt asks for: every key of the class must be referenced as a key
+    (`'key' key`, `key =`, `key:`) and, between candidates, the class whose keys are all referenced the latest wins
+    (the revision step 2 prompt also shows the `revised_text_step_1` of step 1 in its input).
+    """
+    best, best_score = None, (-1, 0)
+    for name, schema in schemas.items():
+        properties = list(schema.get("properties", {}))
+        if not properties:
+            continue
+        last_positions = []
+        for field in properties:
+            positions = [match.start() for match in re.finditer(rf"\b{re.escape(field)}\b['\"]?\s*(?:key\b|=|:)", prompt)]
+            if not positions:
+                break
+            last_positions.append(positions[-1])
+        else:
+            score = (min(last_positions), len(properties))
+            if score > best_score:
+                best, best_score = (name, schema), score
+    return best
+
+
+def build_instance(schema: Dict[str, Any],
+                   prompt: str,
+                   field_values: Dict[str, Any],
+                   definitions: Optional[Dict[str, Any]] = None) -> Any:
+    """
+    Builds a deterministic instance of a JSON schema for a prompt.
+    """
+    definitions = definitions if definitions is not None else schema.get("$defs", schema.get("definitions", {}))
+    if "$ref" in schema:
+        return build_instance(definitions[schema["$ref"].split("/")[-1]], prompt, field_values, definitions)
+    original_text, latest_text = extract_texts(prompt)
+    instance = {}
+    for field, field_schema in schema.get("properties", {}).items():
+        field_type = field_schema.get("type")
+        if field in field_values:
+            instance[field] = field_values[field]
+        elif field_type == "boolean":
+            instance[field] = True
+        elif field_type in ("integer", "number"):
+            instance[field] = 0
+        elif field_type == "array":
+            if field == "file_list":
+                instance[field] = re.findall(r"- '([^']+)':'", prompt) # every file listed in the prompt
+            else:
+                instance[field] = [latest_text]
+        elif field_type == "object" or "$ref" in field_schema:
+            instance[field] = build_instance(field_schema, prompt, field_values, definitions)
+        elif field == "original_text":
+            instance[field] = original_text
+        else:
+            instance[field] = latest_text
+    return instance
+
+
+def build_free_text(prompt: str, completion_words: int, max_tokens: Optional[int] = None) -> str:
+    """
+    Answers a free text prompt: short answers for the rules of `FREE_TEXT_RULES`, otherwise a markdown document
+    of `completion_words` words drawn from the prompt vocabulary (deterministic for a given prompt).
+    """
+    _, latest_text = extract_texts(prompt)
+    lowered_prompt = prompt.lower()
+    for marker, answer_kind in FREE_TEXT_RULES:
+        if marker in lowered_prompt:
+            if answer_kind == "file_name":
+                return "benchmark_output_" + hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8]
+            return latest_text.strip()
+
+    seed = int(hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16], 16)
+    generator = random.Random(seed)
+    vocabulary = WORD_PATTERN.findall(latest_text) or ["content", "economy", "outlook", "growth", "report"]
+    if max_tokens:
+        completion_words = min(completion_words, int(max_tokens * 0.75))
+    paragraphs, words_left, section = [], completion_words, 1
+    while words_left > 0:
+        paragraph_length = min(words_left, generator.randint(40, 90))
+        sentences, sentence = [], []
+        for _ in range(paragraph_length):
+            sentence.append(generator.choice(vocabulary).lower())
+            if len(sentence) >= generator.randint(8, 18):
+                sentences.append(" ".join(sentence).capitalize() + ".")
+                sentence = []
+        if sentence:
+            sentences.append(" ".join(sentence).capitalize() + ".")
+        if len(paragraphs) % 3 == 0:
+            paragraphs.append(f"## Section {section}")
+            section += 1
+        paragraphs.append(" ".join(sentences))
+        words_left -= paragraph_length
+    return "\n\n".join(paragraphs)
+
+
+def embed_text(text: str, dimensions: int) -> List[float]:
+    """
+    Hashed bag of words embedding, L2 normalized.
+    """
+    vector = [0.0] * dimensions
+    for word in WORD_PATTERN.findall(text.lower()) or [text]:
+        digest = hashlib.md5(word.encode("utf-8")).digest()
+        index = int.from_bytes(digest[:4], "little") % dimensions
+        vector[index] += 1.0 if digest[4] & 1 else -1.0
+    norm = math.sqrt(sum(value * value for value in vector)) or 1.0
+    return [value / norm for value in vector]
+
+
+class OpenAIStubServer(ThreadingHTTPServer):
+    """
+    The stand-in server. See the module docstring for the behaviour, every attribute can be changed between runs.
+    """
+    daemon_threads = True
+
+    def __init__(self,
+                 server_address: Tuple[str, int],
+                 latency: float = 0.0,
+                 latency_per_token: float = 0.0,
+                 rate_limit_ratio: float = 0.0,
+                 capacity: Optional[int] = None,
+                 retry_after: float = 0.1,
+                 completion_words: int = 250,
+                 embedding_dimensions: int = 1536,
+                 seed: int = 0) -> None:
+        super().__init__(server_address, OpenAIStubHandler)
+        self.latency = latency
+        self.latency_per_token = latency_per_token
+        self.rate_limit_ratio = rate_limit_ratio
+        self.capacity = capacity
+        self.retry_after = retry_after
+        self.completion_words = completion_words
+        self.embedding_dimensions = embedding_dimensions
+        self.field_values = dict(DEFAULT_FIELD_VALUES)
+        self.random = random.Random(seed)
+        self.request_log: List[Dict[str, Any]] = []
+        self.in_flight = 0
+        self.lock = threading.Lock()
+        self._schemas: Optional[Dict[str, Dict[str, Any]]] = None
+
+    @property
+    def endpoint(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/"
+
+    @property
+    def schemas(self) -> Dict[str, Dict[str, Any]]:
+        if self._schemas is None:
+            self._schemas = load_structured_output_schemas()
+        return self._schemas
+
+    def reset_log(self) -> None:
+        with self.lock:
+            self.request_log = []
+
+    def admit(self) -> Tuple[bool, int]:
+        """
+        Counts a new request in flight. Returns whether it is rate limited and the number of requests in flight.
+        """
+        with self.lock:
+            self.in_flight += 1
+            rate_limited = self.random.random() < self.rate_limit_ratio
+            if self.capacity is not None and self.in_flight > self.capacity:
+                rate_limited = True
+            return rate_limited, self.in_flight
+
+    def release(self, entry: Dict[str, Any]) -> None:
+        with self.lock:
+            self.in_flight -= 1
+            self.request_log.append(entry)
+
+
+class OpenAIStubHandler(BaseHTTPRequestHandler):
+
+    def _send_json(self, status: int, body: Dict[str, Any], headers: Optional[Dict[str, str]] = None) -> None:
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self) -> None:
+        path = urlparse(self.path).path
+        match = DEPLOYMENT_PATH.match(path) or OPENAI_PATH.match(path)
+        if match is None:
+            self._send_json(404, {"error": {"code": "404", "message": f"Resource not found: {path}"}})
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        deployment = match.groupdict().get("deployment") or request.get("model", "stub")
+        operation = match["operation"]
+
+        start = time.time()
+        rate_limited, in_flight = self.server.admit()
+        entry = {"kind": "chat" if operation == "chat/completions" else "embeddings", "deployment": deployment,
+                 "start": start, "in_flight": in_flight, "prompt_tokens": 0, "completion_tokens": 0, "schema": None}
+        try:
+            if rate_limited:
+                time.sleep(min(self.server.latency, 0.05))
+                entry["status"] = 429
+                self._send_json(429, {"error": {"code": "429", "message": "Requests to the deployment have exceeded "
+                                                                          "the rate limit (stand-in)."}},
+                                headers={"retry-after-ms": str(int(self.server.retry_after * 1000)),
+                                         "retry-after": str(max(1, math.ceil(self.server.retry_after)))})
+                return
+            if operation == "chat/completions":
+                body = self._chat_completion(request, deployment, entry)
+            else:
+                body = self._embeddings(request, deployment, entry)
+            entry["status"] = 200
+            if request.get("stream"):
+                entry["kind"] = "chat_stream"
+                self._send_stream(body, (request.get("stream_options") or {}).get("include_usage", False))
+                return
+            time.sleep(self.server.latency + self.server.latency_per_token * entry["completion_tokens"])
+            self._send_json(200, body)
+        finally:
+            entry["end"] = time.time()
+            self.server.release(entry)
+
+    def _chat_completion(self, request: Dict[str, Any], deployment: str, entry: Dict[str, Any]) -> Dict[str, Any]:
+        prompt = _message_text(request.get("messages", []))
+        response_format = request.get("response_format") or {}
+        if response_format.get("type") == "json_schema":
+            json_schema = response_format["json_schema"]
+            entry["schema"] = json_schema.get("name")
+            content = json.dumps(build_instance(json_schema["schema"], prompt, self.server.field_values))
+        elif response_format.get("type") == "json_object":
+            entry["schema"] = "json_object"
+            content = json.dumps({"output": extract_texts(prompt)[1]})
+        else:
+            inferred = infer_structured_output(prompt, self.server.schemas)
+            if inferred is not None:
+                entry["schema"] = inferred[0]
+                content = json.dumps(build_instance(inferred[1], prompt, self.server.field_values))
+            else:
+                content = build_free_text(prompt, self.server.completion_words, request.get("max_tokens"))
+        entry["prompt_tokens"] = count_tokens(prompt)
+        entry["completion_tokens"] = count_tokens(content)
+        return {"id": f"chatcmpl-stub-{int(entry['start'] * 1e6)}",
+                "object": "chat.completion",
+                "created": int(entry["start"]),
+                "model": deployment,
+                "system_fingerprint": "stub",
+                "choices": [{"index": 0, "finish_reason": "stop", "logprobs": None,
+                             "message": {"role": "assistant", "content": content, "refusal": None}}],
+                "usage": {"prompt_tokens": entry["prompt_tokens"], "completion_tokens": entry["completion_tokens"],
+                          "total_tokens": entry["prompt_tokens"] + entry["completion_tokens"]}}
+
+    def _send_stream(self, body: Dict[str, Any], include_usage: bool, words_per_event: int = 5) -> None:
+        """
+        Sends a chat completion as the `chat.completion.chunk` server-sent events of a streamed completion.
+        """
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close") # the end of the connection ends the body (HTTP/1.0 handler)
+        self.end_headers()
+        chunk_fields = {"id": body["id"], "object": "chat.completion.chunk", "created": body["created"],
+                        "model": body["model"], "system_fingerprint": body["system_fingerprint"]}
+
+        def send_event(payload: Dict[str, Any]) -> None:
+            self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        time.sleep(self.server.latency)
+        ## Azure starts with an event without choices (prompt filter results)
+        send_event({**chunk_fields, "choices": [], "prompt_filter_results": []})
+        pieces = re.split(r"(?<=\s)(?=\S)", body["choices"][0]["message"]["content"])
+        for start in range(0, len(pieces), words_per_event):
+            delta = "".join(pieces[start:start + words_per_event])
+            time.sleep(self.server.latency_per_token * count_tokens(delta))
+            send_event({**chunk_fields, "choices": [{"index": 0, "finish_reason": None, "logprobs": None,
+                                                     "delta": {"content": delta, **({"role": "assistant"} if start == 0 else {})}}]})
+        send_event({**chunk_fields, "choices": [{"index": 0, "finish_reason": "stop", "logprobs": None, "delta": {}}]})
+        if include_usage:
+            send_event({**chunk_fields, "choices": [], "usage": body["usage"]})
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def _embeddings(self, request: Dict[str, Any], deployment: str, entry: Dict[str, Any]) -> Dict[str, Any]:
+        inputs = request.get("input", [])
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        dimensions = request.get("dimensions") or self.server.embedding_dimensions
+        data = []
+        for index, text in enumerate(inputs):
+            text = text if isinstance(text, str) else " ".join(str(token) for token in text) # token ids
+            vector = embed_text(text, dimensions)
+            if request.get("encoding_format") == "base64":
+                vector = base64.b64encode(struct.pack(f"<{dimensions}f", *vector)).decode("ascii")
+            data.append({"object": "embedding", "index": index, "embedding": vector})
+            entry["prompt_tokens"] += count_tokens(text)
+        return {"object": "list", "model": deployment, "data": data,
+                "usage": {"prompt_tokens": entry["prompt_tokens"], "total_tokens": entry["prompt_tokens"]}}
+
+    def log_message(self, format: str, *args: Any) -> None:
+        pass # keep the benchmark output readable
+
+
+def start_openai_stub_server(port: int = 0, **options: Any) -> OpenAIStubServer:
+    """
+    Starts the stand-in server on a background thread. Port 0 picks a free port, read it back from `server.endpoint`.
+    `options` are the `OpenAIStubServer` parameters. Stop it with `server.shutdown()`.
+    """
+    server = OpenAIStubServer(("127.0.0.1", port), **options)
+    threading.Thread(target=server.serve_forever, name="openai-stub", daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the Azure OpenAI chat completions and embeddings API")
+    parser.add_argument("--port", type=int, default=8767)
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--latency-per-token", type=float, default=0.0, help="seconds added per completion token")
+    parser.add_argument("--rate-limit-ratio", type=float, default=0.0, help="share of the requests answered with a 429")
+    parser.add_argument("--capacity", type=int, default=None, help="concurrent requests above which a 429 is answered")
+    parser.add_argument("--completion-words", type=int, default=250, help="length of the free text answers")
+    parser.add_argument("--seed", type=int, default=0)
+    arguments = parser.parse_args()
+
+    stub_server = OpenAIStubServer(("127.0.0.1", arguments.port),
+                                   latency=arguments.latency,
+                                   latency_per_token=arguments.latency_per_token,
+                                   rate_limit_ratio=arguments.rate_limit_ratio,
+                                   capacity=arguments.capacity,
+                                   completion_words=arguments.completion_words,
+                                   seed=arguments.seed)
+    print(f"Azure OpenAI stand-in listening on {stub_server.endpoint}")
+    sys.stdout.flush()
+    stub_server.serve_forever()
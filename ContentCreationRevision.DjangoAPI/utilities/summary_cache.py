@@ -0,0 +1,41 @@
+import json
+import hashlib
+from typing import Optional, Tuple
+
+from django.conf import settings
+
+from utilities.sqlite_cache import SqliteLRUCache, get_sqlite_cache
+
+
+def summary_key(model: str, instruction: str, text: str) -> str:
+    """
+    Returns the key of the map summary of a chunk: the deployment, the map instruction and the chunk text.
+    """
+    digest = hashlib.sha256(model.encode("utf-8"))
+    for part in (instruction, text):
+        digest.update(b"\x1f" + part.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def _encode_summary(summary: Tuple[str, int]) -> str:
+    return json.dumps(list(summary))
+
+
+def _decode_summary(stored: str) -> Tuple[str, int]:
+    summary, tokens = json.loads(stored)
+    return summary, tokens
+
+
+def get_summary_cache() -> Optional[SqliteLRUCache]:
+    """
+    Returns the process wide summary cache, None when settings.SUMMARY_CACHE_ENABLED is off.
+
+    The map summaries of the chunks (utilities/openai_utils/summarize.py) are stored with their completion tokens,
+    as (summary, tokens), keyed by `summary_key`, in a sqlite file (settings.SUMMARY_CACHE_PATH): a file summarized
+    again, by any job of any user, only costs the collapse and reduce calls. The least recently used summaries are
+    evicted above settings.SUMMARY_CACHE_MAX_ENTRIES.
+    """
+    if not settings.SUMMARY_CACHE_ENABLED:
+        return None
+    return get_sqlite_cache(str(settings.SUMMARY_CACHE_PATH), "map_summaries", settings.SUMMARY_CACHE_MAX_ENTRIES,
+                            encode=_encode_summary, decode=_decode_summary, description="summary(ies)")
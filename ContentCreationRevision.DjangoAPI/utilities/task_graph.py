@@ -0,0 +1,102 @@
+import time
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Sequence
+
+from django.conf import settings
+
+from utilities.instrumentation import record_span, stage, with_current_context
+
+## LOGGING CAPABILITIES
+
+logger = logging.getLogger(__name__)
+
+
+class TaskGraph:
+    """
+    Runs a small graph of dependent steps (ie the LLM analyses of a query before the real work of a job)
+    concurrently: every step starts as soon as the steps it depends on are done, so the whole graph takes the time
+    of its longest dependency path instead of the sum of its steps.
+
+    A step is a callable receiving the results of its dependencies as positional arguments, in the order they are
+    declared. Steps run on the graph's own threads, in a copy of the caller context (job report of
+    utilities/instrumentation.py), and each of them is recorded as a `<graph name>.<step name>` span.
+
+    Steps are submitted as they are added and wait for their dependencies on their thread. Since a step can only
+    depend on steps added before it and the executor takes them in order, the oldest unfinished step is always
+    running and the graph cannot deadlock, whatever the number of workers.
+
+    Example:
+        ```python
+        graph = TaskGraph("preflight")
+        graph.add("language", lambda: determine_input_language(query, TOKEN))
+        graph.add("rewritten_query", lambda: rewrite_query(TOKEN, query))
+        graph.add("file_name", lambda language: determine_file_output_user_friendly_name(query, language["language"][0], TOKEN),
+                  depends_on=["language"])
+        rewritten_query = graph.result("rewritten_query") # the other steps go on in the background
+        graph.close()
+        ```
+    """
+    def __init__(self, name: str, max_workers: Optional[int] = None) -> None:
+        """
+        Args:
+            name (str): The name of the graph, prefix of the spans of its steps.
+            max_workers (Optional[int]): The number of steps running at the same time. Defaults to
+                                         settings.TASK_GRAPH_MAX_WORKERS.
+        """
+        self.name = name
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or settings.TASK_GRAPH_MAX_WORKERS,
+                                            thread_name_prefix=f"task-graph-{name}")
+        self._futures: Dict[str, Future] = {}
+
+    def add(self,
+            name: str,
+            func: Callable[..., Any],
+            depends_on: Sequence[str] = (),
+            stage_name: Optional[str] = None) -> None:
+        """
+        Adds a step to the graph, it starts as soon as its dependencies are done.
+
+        Args:
+            name (str): The name of the step, the key of its result.
+            func (Callable[..., Any]): The step, called with the results of `depends_on` as positional arguments.
+            depends_on (Sequence[str]): The steps whose results the step needs, added before it. Defaults to ().
+            stage_name (Optional[str]): Runs the step as this pipeline stage (utilities/instrumentation.py `stage`),
+                                        ie "parse". Defaults to None.
+
+        Raises:
+            ValueError: When the step already exists or depends on a step not added yet.
+        """
+        if name in self._futures:
+            raise ValueError(f"Step '{name}' is already in the {self.name} graph")
+        missing_steps = [dependency for dependency in depends_on if dependency not in self._futures]
+        if missing_steps:
+            raise ValueError(f"Step '{name}' of the {self.name} graph depends on unknown step(s) {missing_steps}")
+        dependencies = [self._futures[dependency] for dependency in depends_on]
+
+        def run_step() -> Any:
+            ## a failed dependency fails the step with the same exception
+            arguments = [dependency.result() for dependency in dependencies]
+            start_time = time.time()
+            if stage_name is None:
+                result = func(*arguments)
+            else:
+                with stage(stage_name):
+                    result = func(*arguments)
+            record_span(f"{self.name}.{name}", time.time() - start_time)
+            return result
+
+        self._futures[name] = self._executor.submit(with_current_context(run_step))
+
+    def result(self, name: str) -> Any:
+        """
+        Waits for a step and returns its result, or raises the exception of the step (or of one of its dependencies).
+        """
+        return self._futures[name].result()
+
+    def close(self) -> None:
+        """
+        Drops the steps not started yet and releases the threads once the running steps are done, without waiting
+        for them. Call it when the job ends, or fails, so unneeded steps do not spend tokens.
+        """
+        self._executor.shutdown(wait=False, cancel_futures=True)
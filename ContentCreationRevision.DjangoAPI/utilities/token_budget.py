@@ -0,0 +1,232 @@
+import time
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+from django.conf import settings
+
+from utilities.instrumentation import current_job
+
+## LOGGING CAPABILITIES
+
+logger = logging.getLogger(__name__)
+
+
+## BUDGET MODES, FROM THE CHEAPEST DEGRADATION TO THE MOST SEVERE ONE
+##   - full: every chunk goes through the sequential chain of guideline revisions (one LLM call per guideline)
+##   - fused: every chunk is revised in a single LLM call applying all the guidelines at once
+##   - partial: fused revision of the first chunks of the document(s), the remaining chunks are kept as they are
+BUDGET_MODES = ("full", "fused", "partial")
+
+
+class TokenBudgetExceeded(Exception):
+    """
+    Raised when a job cannot fit in its token budget (before any LLM call) or goes over it while running.
+    """
+
+
+class TokenBudgetLedger:
+    """
+    Tokens spent by the jobs of each user over a rolling window (settings.TOKEN_BUDGET_USER_WINDOW seconds).
+
+    A job reserves its estimate when it is planned and the reservation is replaced by the actual tokens when the
+    job is closed, so concurrent jobs of a user cannot all plan against the same remaining budget. The ledger is
+    per process: each instance enforces the ceiling on the jobs it runs.
+    """
+    def __init__(self, window_seconds: float) -> None:
+        self.window_seconds = window_seconds
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Dict[str, Any]] = {} # job id -> {"user_id", "tokens", "at"}
+
+    def _prune(self) -> None:
+        oldest = time.time() - self.window_seconds
+        for job_id in [job_id for job_id, entry in self._entries.items() if entry["at"] < oldest]:
+            del self._entries[job_id]
+
+    def usage(self, user_id: str, exclude_job_id: Optional[str] = None) -> int:
+        """
+        Returns the tokens reserved or spent by the jobs of a user in the window, optionally without one job.
+        """
+        with self._lock:
+            self._prune()
+            return sum(entry["tokens"] for job_id, entry in self._entries.items()
+                       if entry["user_id"] == user_id and job_id != exclude_job_id)
+
+    def reserve(self, user_id: str, job_id: str, tokens: int) -> None:
+        with self._lock:
+            entry = self._entries.setdefault(job_id, {"user_id": user_id, "tokens": 0, "at": time.time()})
+            entry["tokens"] += tokens
+
+    def settle(self, job_id: str, actual_tokens: int) -> None:
+        with self._lock:
+            if job_id in self._entries:
+                self._entries[job_id]["tokens"] = actual_tokens
+
+
+_token_budget_ledger = None
+_token_budget_ledger_lock = threading.Lock()
+
+
+def get_token_budget_ledger() -> TokenBudgetLedger:
+    """
+    Returns the process wide ledger, created on first use.
+    """
+    global _token_budget_ledger
+    with _token_budget_ledger_lock:
+        if _token_budget_ledger is None:
+            _token_budget_ledger = TokenBudgetLedger(settings.TOKEN_BUDGET_USER_WINDOW)
+    return _token_budget_ledger
+
+
+def _available_tokens(user_id: str, job_id: Optional[str], consumed_tokens: int) -> Optional[int]:
+    """
+    Returns the tokens the job may still spend under the per job and per user ceilings, None when unlimited.
+    """
+    ceilings = []
+    if settings.TOKEN_BUDGET_JOB_MAX_TOKENS:
+        ceilings.append(settings.TOKEN_BUDGET_JOB_MAX_TOKENS - consumed_tokens)
+    if settings.TOKEN_BUDGET_USER_MAX_TOKENS:
+        other_jobs_usage = get_token_budget_ledger().usage(user_id, exclude_job_id=job_id)
+        ceilings.append(settings.TOKEN_BUDGET_USER_MAX_TOKENS - other_jobs_usage - consumed_tokens)
+    return max(min(ceilings), 0) if ceilings else None
+
+
+def plan_job_budget(user_id: str,
+                    full_tokens_per_chunk: List[int],
+                    fused_tokens_per_chunk: List[int],
+                    fixed_tokens: int = 0) -> Dict[str, Any]:
+    """
+    Chooses how much of a revision the current job can afford and reserves its estimate.
+
+    The cheapest degradation that fits is chosen: full revision, else fused revision of every chunk, else fused
+    revision of as many leading chunks as the budget allows (partial). A job that cannot revise a single chunk is
+    refused before any LLM call. When a job is planned twice (ie revision of the additional content generated
+    after the main revision) the estimates add up.
+
+    Args:
+        user_id (str): The user the per user ceiling applies to.
+        full_tokens_per_chunk (List[int]): The estimated tokens of each chunk in full mode, in document order.
+        fused_tokens_per_chunk (List[int]): The estimated tokens of each chunk in fused mode, in document order.
+        fixed_tokens (int): The estimated tokens that do not depend on the number of chunks revised (ie the
+                            revision explanation of each file).
+
+    Returns:
+        plan (Dict[str, Any]): {"mode": "full" | "fused" | "partial", "chunks_to_revise": int, "total_chunks": int,
+                                "estimated_tokens": int, "estimated_full_tokens": int, "available_tokens": int | None}
+
+    Raises:
+        TokenBudgetExceeded: When not even one chunk fits in the budget, or when the full revision does not fit and
+                             settings.TOKEN_BUDGET_DEGRADE is False.
+    """
+    total_chunks = len(full_tokens_per_chunk)
+    estimated_full_tokens = fixed_tokens + sum(full_tokens_per_chunk)
+    estimated_fused_tokens = fixed_tokens + sum(fused_tokens_per_chunk)
+    job_report = current_job()
+    job_id = job_report.job_id if job_report is not None else None
+    consumed_tokens = job_report.total_tokens if job_report is not None else 0
+    available_tokens = _available_tokens(user_id, job_id, consumed_tokens) if settings.TOKEN_BUDGET_ENABLED else None
+
+    mode, chunks_to_revise, estimated_tokens = "full", total_chunks, estimated_full_tokens
+    if available_tokens is not None and estimated_full_tokens > available_tokens:
+        if not settings.TOKEN_BUDGET_DEGRADE:
+            raise TokenBudgetExceeded(f"The revision needs an estimated {estimated_full_tokens} tokens but only "
+                                      f"{available_tokens} are left in the budget")
+        if estimated_fused_tokens <= available_tokens:
+            mode, estimated_tokens = "fused", estimated_fused_tokens
+        else:
+            ## keep the leading chunks that fit: the beginning of a document is revised, the rest is kept as is
+            mode, chunks_to_revise, estimated_tokens = "partial", 0, fixed_tokens
+            for chunk_tokens in fused_tokens_per_chunk:
+                if estimated_tokens + chunk_tokens > available_tokens:
+                    break
+                chunks_to_revise += 1
+                estimated_tokens += chunk_tokens
+            if chunks_to_revise == 0:
+                raise TokenBudgetExceeded(f"The document is too large for the token budget: {estimated_fused_tokens} "
+                                          f"tokens estimated in the cheapest mode, {available_tokens} left")
+
+    plan = {"mode": mode,
+            "chunks_to_revise": chunks_to_revise,
+            "total_chunks": total_chunks,
+            "estimated_tokens": estimated_tokens,
+            "estimated_full_tokens": estimated_full_tokens,
+            "available_tokens": available_tokens}
+    logger.info(f"Token budget of job {job_id}: {mode} mode, {chunks_to_revise}/{total_chunks} chunk(s), "
+                f"{estimated_tokens} token(s) estimated ({estimated_full_tokens} in full mode), "
+                f"{available_tokens if available_tokens is not None else 'unlimited'} available")
+    if job_report is None:
+        return plan
+
+    if available_tokens is not None:
+        get_token_budget_ledger().reserve(user_id, job_id, estimated_tokens)
+    budget = job_report.budget or {"mode": "full", "chunks_to_revise": 0, "total_chunks": 0,
+                                   "estimated_tokens": 0, "estimated_full_tokens": 0, "abort_at_tokens": None}
+    budget["mode"] = max(budget["mode"], mode, key=BUDGET_MODES.index) # the most degraded plan of the job
+    for key in ("chunks_to_revise", "total_chunks", "estimated_tokens", "estimated_full_tokens"):
+        budget[key] += plan[key]
+    ## the estimate is a rough one: the job is only aborted when it goes over the ceiling by the margin
+    budget["abort_at_tokens"] = int(consumed_tokens + available_tokens * settings.TOKEN_BUDGET_ABORT_MARGIN) \
+                                if available_tokens is not None else None
+    budget["user_id"] = user_id
+    job_report.budget = budget
+    return plan
+
+
+def check_job_budget() -> None:
+    """
+    Raises TokenBudgetExceeded when the job of the current context has spent more tokens than it is allowed to.
+    Called before every LLM call: the job stops early instead of starving the deployment for the other users.
+    """
+    job_report = current_job()
+    if job_report is None or not job_report.budget or job_report.budget["abort_at_tokens"] is None:
+        return
+    if job_report.total_tokens > job_report.budget["abort_at_tokens"]:
+        raise TokenBudgetExceeded(f"Job {job_report.job_id} aborted: {job_report.total_tokens} tokens spent, "
+                                  f"over its budget of {job_report.budget['abort_at_tokens']} tokens")
+
+
+def close_job_budget() -> Optional[Dict[str, Any]]:
+    """
+    Replaces the reservation of the current job by its actual tokens in the ledger and returns the estimated vs
+    actual consumption of the job (None when the job had no budget plan).
+    """
+    job_report = current_job()
+    if job_report is None or not job_report.budget:
+        return None
+    get_token_budget_ledger().settle(job_report.job_id, job_report.total_tokens)
+    summary = {"mode": job_report.budget["mode"],
+               "chunks_revised": job_report.budget["chunks_to_revise"],
+               "total_chunks": job_report.budget["total_chunks"],
+               "estimated_tokens": job_report.budget["estimated_tokens"],
+               "actual_tokens": job_report.total_tokens}
+    logger.info(f"Token budget of job {job_report.job_id}: {summary['estimated_tokens']} token(s) estimated, "
+                f"{summary['actual_tokens']} spent ({summary['mode']} mode)")
+    return summary
+
+
+_budget_guard_handler_class = None
+
+
+def token_budget_callbacks() -> List[Any]:
+    """
+    Returns the LangChain callbacks calling `check_job_budget` before every call of a chat model, to pass as
+    `callbacks=` when instantiating AzureChatOpenAI.
+
+    langchain_core is only imported here, so this module stays importable without it.
+    """
+    global _budget_guard_handler_class
+    if _budget_guard_handler_class is None:
+        from langchain_core.callbacks import BaseCallbackHandler
+
+        class TokenBudgetGuardHandler(BaseCallbackHandler):
+            """Aborts the chains of a job that went over its token budget."""
+            raise_error = True # let TokenBudgetExceeded propagate instead of being logged and ignored by LangChain
+
+            def on_chat_model_start(self, serialized: Any, messages: Any, **kwargs: Any) -> None:
+                check_job_budget()
+
+            def on_llm_start(self, serialized: Any, prompts: Any, **kwargs: Any) -> None:
+                check_job_budget()
+
+        _budget_guard_handler_class = TokenBudgetGuardHandler
+    return [_budget_guard_handler_class()]
@@ -0,0 +1,211 @@
+import time
+import logging
+import threading
+from typing import Any, Callable, Dict, Optional
+
+from django.conf import settings
+
+## LOGGING CAPABILITIES
+
+logger = logging.getLogger(__name__)
+
+
+class LiveToken:
+    """
+    A drop-in replacement for the `AccessToken` passed around in `post_message["token"]`.
+
+    Every read of `.token` goes through the provider cache, so a job that keeps the object for twenty minutes
+    (blob storage, cosmos status updates, openai clients) always sends a valid token instead of the one
+    fetched when the request came in.
+    """
+    def __init__(self, provider: "TokenProvider", scope: str) -> None:
+        self._provider = provider
+        self.scope = scope
+
+    @property
+    def token(self) -> str:
+        return self._provider.get_token(self.scope).token
+
+    @property
+    def expires_on(self) -> int:
+        return self._provider.get_token(self.scope).expires_on
+
+    def __call__(self) -> str:
+        """Lets the object itself be used as an `azure_ad_token_provider`."""
+        return self.token
+
+
+class CachedCredential:
+    """
+    A TokenCredential whose `get_token` is served from the provider cache. Handed to the azure SDK clients
+    (Document Intelligence) in place of the raw ChainedTokenCredential.
+    """
+    def __init__(self, provider: "TokenProvider") -> None:
+        self._provider = provider
+
+    def get_token(self, *scopes: str, **kwargs: Any) -> Any:
+        return self._provider.get_token(scopes[0])
+
+
+class TokenProvider:
+    """
+    Process wide cache of Azure AD tokens, one per scope, refreshed before they expire.
+
+    Previously each API view built a `ChainedTokenCredential(AzureCliCredential(), DefaultAzureCredential())` and
+    called `get_token` in `__init__` (an `az` CLI subprocess per request), and long jobs kept that single token
+    until it expired mid-way. Here:
+        - the credential chain is built once and tokens are cached per scope
+        - a token expiring within settings.TOKEN_REFRESH_MARGIN seconds is refreshed synchronously on read
+        - a daemon thread refreshes tokens entering settings.TOKEN_PROACTIVE_REFRESH_WINDOW so requests
+          normally never wait for the credential
+        - `live_token(scope)` / `token_callable(scope)` hand out always fresh tokens to the jobs and to the
+          OpenAI / LangChain clients (`azure_ad_token_provider`)
+        - acquisition latency is recorded per scope (`stats()`)
+    """
+    def __init__(self, credential_factory: Optional[Callable[[], Any]] = None) -> None:
+        """
+        Args:
+            credential_factory (Optional[Callable[[], Any]]): Builds the underlying TokenCredential. Defaults to the
+                                                              ChainedTokenCredential used by the API views.
+        """
+        self._credential_factory = credential_factory or _default_credential_factory
+        self._credential = None
+        self._tokens: Dict[str, Any] = {}
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+        self._scope_locks: Dict[str, threading.Lock] = {}
+        self._refresh_thread = None
+        self._stop_event = threading.Event()
+
+    @property
+    def raw_credential(self) -> Any:
+        with self._lock:
+            if self._credential is None:
+                self._credential = self._credential_factory()
+            return self._credential
+
+    @property
+    def credential(self) -> CachedCredential:
+        """A TokenCredential backed by this cache, for the azure SDK clients."""
+        return CachedCredential(self)
+
+    def _scope_lock(self, scope: str) -> threading.Lock:
+        with self._lock:
+            return self._scope_locks.setdefault(scope, threading.Lock())
+
+    def _acquire(self, scope: str) -> Any:
+        start_time = time.time()
+        token = self.raw_credential.get_token(scope)
+        acquisition_time = time.time() - start_time
+        with self._lock:
+            self._tokens[scope] = token
+            scope_stats = self._stats.setdefault(scope, {"acquisitions": 0, "total_latency": 0.0, "last_latency": 0.0})
+            scope_stats["acquisitions"] += 1
+            scope_stats["total_latency"] += acquisition_time
+            scope_stats["last_latency"] = acquisition_time
+        if settings.DEBUG:
+            logger.info(f"✅ Token acquired for {scope} in {acquisition_time:.3f} second(s), "
+                        f"expires in {int(token.expires_on - time.time())} second(s)")
+        return token
+
+    def get_token(self, scope: Optional[str] = None) -> Any:
+        """
+        Returns a valid AccessToken for the scope, from the cache when it is not about to expire.
+
+        Args:
+            scope (Optional[str]): The token scope. Defaults to settings.COGNITIVE_SERVICES_URL.
+
+        Returns:
+            AccessToken: The token (`.token`, `.expires_on`).
+        """
+        scope = scope or settings.COGNITIVE_SERVICES_URL
+        token = self._tokens.get(scope)
+        if token is not None and token.expires_on - settings.TOKEN_REFRESH_MARGIN > time.time():
+            return token
+        with self._scope_lock(scope): # one acquisition per scope, the other threads wait for it
+            token = self._tokens.get(scope)
+            if token is None or token.expires_on - settings.TOKEN_REFRESH_MARGIN <= time.time():
+                token = self._acquire(scope)
+        self._start_refresh_thread()
+        return token
+
+    def live_token(self, scope: Optional[str] = None) -> LiveToken:
+        """
+        Returns a token object whose `.token` is always fresh, to pass to long running jobs.
+        """
+        scope = scope or settings.COGNITIVE_SERVICES_URL
+        self.get_token(scope) # fail fast at request time if the credential does not work
+        return LiveToken(self, scope)
+
+    def token_callable(self, scope: Optional[str] = None) -> Callable[[], str]:
+        """
+        Returns a callable giving a fresh token string, for `azure_ad_token_provider` of the OpenAI/LangChain clients.
+        """
+        return self.live_token(scope)
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        Returns per scope acquisition statistics: number of acquisitions, last and mean latency, seconds left.
+        """
+        with self._lock:
+            return {scope: {"acquisitions": scope_stats["acquisitions"],
+                            "last_latency": scope_stats["last_latency"],
+                            "mean_latency": scope_stats["total_latency"] / max(scope_stats["acquisitions"], 1),
+                            "expires_in": self._tokens[scope].expires_on - time.time()}
+                    for scope, scope_stats in self._stats.items()}
+
+    def _start_refresh_thread(self) -> None:
+        with self._lock:
+            if self._refresh_thread is not None:
+                return
+            self._refresh_thread = threading.Thread(target=self._refresh_loop, name="token-refresh", daemon=True)
+        self._refresh_thread.start()
+
+    def _refresh_loop(self) -> None:
+        """
+        Refreshes, in the background, every cached token that enters the proactive refresh window.
+        """
+        while not self._stop_event.wait(settings.TOKEN_REFRESH_CHECK_INTERVAL):
+            with self._lock:
+                scopes = [scope for scope, token in self._tokens.items()
+                          if token.expires_on - settings.TOKEN_PROACTIVE_REFRESH_WINDOW <= time.time()]
+            for scope in scopes:
+                try:
+                    with self._scope_lock(scope):
+                        self._acquire(scope)
+                except Exception as e:
+                    ## the cached token is still valid for a while, the next read retries synchronously if needed
+                    logger.info(f"Background token refresh for {scope} failed: {e}")
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+
+def _default_credential_factory() -> Any:
+    from azure.identity import DefaultAzureCredential, ChainedTokenCredential, AzureCliCredential
+    return ChainedTokenCredential(AzureCliCredential(), DefaultAzureCredential())
+
+
+def as_token_callable(token: Any) -> Callable[[], str]:
+    """
+    Turns whatever token object a caller holds into an `azure_ad_token_provider` callable: a `LiveToken` stays live,
+    a plain `AccessToken` keeps returning its (static) value as before.
+    """
+    if callable(token):
+        return token
+    return lambda: token.token
+
+
+_token_provider = None
+_token_provider_lock = threading.Lock()
+
+
+def get_token_provider() -> TokenProvider:
+    """
+    Returns the process wide token provider.
+    """
+    global _token_provider
+    with _token_provider_lock:
+        if _token_provider is None:
+            _token_provider = TokenProvider()
+    return _token_provider
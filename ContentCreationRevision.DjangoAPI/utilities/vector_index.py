@@ -0,0 +1,396 @@
+import time
+import uuid
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+from django.conf import settings
+
+## LOGGING CAPABILITIES
+
+logger = logging.getLogger(__name__)
+
+N_RESULTS = 20 ## sections returned by get_docs, as ChromaDBHandler
+
+
+def document_hash(chunks: List[Dict[str, Any]]) -> str:
+    """
+    Returns the hash identifying the chunks of a document in the vector store: the same file uploaded again (by
+    any job of the user) has the same hash and its stored embeddings are reused. The embedding deployment is part
+    of it since the vectors of two models cannot be compared.
+    """
+    digest = hashlib.sha256(settings.EMBEDDING_DEPLOYMENT_NAME.encode("utf-8"))
+    for chunk in chunks:
+        digest.update(b"\x1f" + str(chunk["text"]).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def chunk_columns(lists_of_chunks: Dict[str, List[Dict[str, Any]]], doc_hashes: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+    """
+    Collects the chunks of the documents in columns, the input of the `add_chunks` of the vector stores.
+
+    Args:
+        lists_of_chunks (Dict[str, List[Dict[str, Any]]]): The chunks of each document ('title', 'id', 'text',
+                                                           'n_tokens' and 'embedding'), see
+                                                           `generate_embeddings_for_list_of_chunks`.
+        doc_hashes (Optional[Dict[str, str]]): The hash of each document (`document_hash`), for the persistent
+                                               store. Defaults to None.
+
+    Returns:
+        Dict[str, Any]: The lists 'title', 'id', 'text', 'n_tokens' (and 'doc_hash'), and 'embedding' as one
+                        (chunks x dimension) float32 array. The chunks without an embedding are left out.
+    """
+    keys, chunks = [], []
+    for key, list_of_chunks in lists_of_chunks.items():
+        for chunk in list_of_chunks:
+            if chunk.get("embedding") is not None:
+                keys.append(key)
+                chunks.append(chunk)
+    columns = {"title"    : [chunk["title"] for chunk in chunks],
+               "id"       : [chunk["id"] for chunk in chunks],
+               "text"     : [chunk["text"] for chunk in chunks],
+               "n_tokens" : [chunk["n_tokens"] for chunk in chunks],
+               "embedding": np.array([chunk["embedding"] for chunk in chunks], dtype=np.float32) if chunks else np.empty((0, 0), dtype=np.float32)}
+    if doc_hashes is not None:
+        columns["doc_hash"] = [doc_hashes[key] for key in keys]
+    return columns
+
+
+def dataframe_columns(df) -> Dict[str, Any]:
+    """
+    Returns the columns of a chunks dataframe ('title', 'id', 'text', 'n_tokens', 'embedding' and optionally
+    'doc_hash'), shaped like the output of `chunk_columns`, with its index (the ids of the chunks without doc_hash).
+    """
+    df = df[df['embedding'].notna()]
+    columns = {name: df[name].tolist() for name in ("title", "id", "text", "n_tokens", "doc_hash") if name in df.columns}
+    columns["embedding"] = np.array(df['embedding'].tolist(), dtype=np.float32) if len(df) else np.empty((0, 0), dtype=np.float32)
+    columns["index"] = [str(i) for i in df.index.tolist()]
+    return columns
+
+
+def chunk_metadata(columns: Dict[str, Any]) -> Tuple[List[str], List[Dict[str, Any]]]:
+    """
+    Returns the ids and the metadata of the chunks of `columns` (see `chunk_columns`) in the vector stores.
+    """
+    if "doc_hash" in columns:
+        stored_at = time.time()
+        metadata  = [{'title': title, 'id': chunk_id, 'n_tokens': tokens, 'doc_hash': doc_hash, 'stored_at': stored_at}
+                     for title, chunk_id, tokens, doc_hash in zip(columns["title"], columns["id"], columns["n_tokens"], columns["doc_hash"])]
+        ## the same chunk of the same document always gets the same id, storing it twice is harmless
+        index     = [f"{doc_hash[:32]}-{chunk_id}" for doc_hash, chunk_id in zip(columns["doc_hash"], columns["id"])]
+    else:
+        metadata  = [{'title': title, 'id': chunk_id, 'n_tokens': tokens}
+                     for title, chunk_id, tokens in zip(columns["title"], columns["id"], columns["n_tokens"])]
+        index     = columns.get("index") or [str(i) for i in range(len(metadata))]
+    return index, metadata
+
+
+class _Codes:
+    """
+    Integer codes of the values of a metadata field (title, doc_hash): the filters are vectorized on the codes.
+    """
+    def __init__(self) -> None:
+        self.codes: Dict[str, int] = {}
+
+    def encode(self, value: str) -> int:
+        return self.codes.setdefault(value, len(self.codes))
+
+    def lookup(self, values: Iterable[str]) -> np.ndarray:
+        return np.array([self.codes[value] for value in values if value in self.codes], dtype=np.int32)
+
+
+class VectorCollection:
+    """
+    An in-process collection of chunks: their normalized embeddings in one contiguous float32 matrix (grown by
+    doubling), the texts and metadata in lists of the same order, and the title and doc_hash of every row as integer
+    codes so the filters are vectorized.
+
+    The search is exact: one matrix-vector product (the cosine similarities, the vectors being normalized) and an
+    argpartition for the top k, no index to build. A few thousand chunks are searched in well under a millisecond.
+    """
+    def __init__(self, name: str) -> None:
+        self.name = name
+        self.lock = threading.RLock()
+        self._matrix = np.empty((0, 0), dtype=np.float32)
+        self._size = 0
+        self._ids: List[str] = []
+        self._documents: List[str] = []
+        self._metadatas: List[Dict[str, Any]] = []
+        self._rows: Dict[str, int] = {} # id -> row
+        self._title_codes = np.empty(0, dtype=np.int32)
+        self._doc_hash_codes = np.empty(0, dtype=np.int32)
+        self._titles = _Codes()
+        self._doc_hashes = _Codes()
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _reserve(self, size: int, dimension: int) -> None:
+        if self._matrix.shape[1] not in (0, dimension):
+            raise ValueError(f"Embeddings of dimension {dimension} added to the collection {self.name} of dimension {self._matrix.shape[1]}")
+        if size <= self._matrix.shape[0]:
+            return
+        capacity = max(size, 2 * self._matrix.shape[0], 256)
+        matrix = np.empty((capacity, dimension), dtype=np.float32)
+        if self._size: # the empty matrix of a new collection has no dimension yet
+            matrix[:self._size] = self._matrix[:self._size]
+        self._matrix = matrix
+        for codes_name in ("_title_codes", "_doc_hash_codes"):
+            codes = np.empty(capacity, dtype=np.int32)
+            codes[:self._size] = getattr(self, codes_name)[:self._size]
+            setattr(self, codes_name, codes)
+
+    def upsert(self, ids: List[str], documents: List[str], metadatas: List[Dict[str, Any]], embeddings: np.ndarray) -> None:
+        """
+        Adds the chunks, or replaces the ones whose id is already stored.
+        """
+        embeddings = np.asarray(embeddings, dtype=np.float32).reshape(len(ids), -1)
+        norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+        embeddings = embeddings / np.where(norms == 0, 1, norms)
+        self._reserve(self._size + len(ids), embeddings.shape[1])
+        rows = np.empty(len(ids), dtype=np.int64)
+        for position, (chunk_id, document, metadata) in enumerate(zip(ids, documents, metadatas)):
+            row = self._rows.get(chunk_id)
+            if row is None:
+                row = self._rows[chunk_id] = self._size
+                self._size += 1
+                self._ids.append(chunk_id)
+                self._documents.append(document)
+                self._metadatas.append(metadata)
+            else:
+                self._documents[row], self._metadatas[row] = document, metadata
+            rows[position] = row
+        ## one copy of the whole batch into the matrix
+        self._matrix[rows] = embeddings
+        self._title_codes[rows] = [self._titles.encode(str(metadata.get("title", ""))) for metadata in metadatas]
+        self._doc_hash_codes[rows] = [self._doc_hashes.encode(str(metadata.get("doc_hash", ""))) for metadata in metadatas]
+
+    def delete(self, doc_hashes: Iterable[str]) -> int:
+        """
+        Deletes the chunks of the documents, the remaining rows are compacted. Returns the number of chunks deleted.
+        """
+        keep = ~np.isin(self._doc_hash_codes[:self._size], self._doc_hashes.lookup(doc_hashes))
+        deleted = self._size - int(keep.sum())
+        if deleted:
+            rows = np.flatnonzero(keep)
+            self._matrix[:len(rows)] = self._matrix[rows]
+            self._title_codes[:len(rows)] = self._title_codes[rows]
+            self._doc_hash_codes[:len(rows)] = self._doc_hash_codes[rows]
+            self._ids = [self._ids[row] for row in rows]
+            self._documents = [self._documents[row] for row in rows]
+            self._metadatas = [self._metadatas[row] for row in rows]
+            self._rows = {chunk_id: row for row, chunk_id in enumerate(self._ids)}
+            self._size = len(rows)
+        return deleted
+
+    def stored_documents(self, doc_hashes: Iterable[str]) -> Set[str]:
+        """
+        Returns the documents (hashes) among `doc_hashes` with chunks in the collection.
+        """
+        present = set(np.unique(self._doc_hash_codes[:self._size]).tolist())
+        return {doc_hash for doc_hash in doc_hashes if self._doc_hashes.codes.get(doc_hash, -1) in present}
+
+    def document_stored_at(self) -> Dict[str, float]:
+        """
+        Returns when each document (hash) of the collection was last stored.
+        """
+        stored_at: Dict[str, float] = {}
+        for metadata in self._metadatas:
+            if "doc_hash" in metadata:
+                stored_at[metadata["doc_hash"]] = max(stored_at.get(metadata["doc_hash"], 0.0), metadata.get("stored_at", 0.0))
+        return stored_at
+
+    def query(self,
+              query_embeddings: Any,
+              n_results: int = N_RESULTS,
+              doc_hashes: Optional[Iterable[str]] = None,
+              titles: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+        """
+        Returns the n_results chunks closest to each query embedding, shaped like the results of a chroma query.
+
+        Args:
+            query_embeddings (Any): One embedding, or a list of embeddings.
+            n_results (int): The number of chunks returned per query.
+            doc_hashes (Optional[Iterable[str]]): Restricts the search to these documents. Defaults to None: no filter.
+            titles (Optional[Iterable[str]]): Restricts the search to the chunks of these titles. Defaults to None: no filter.
+
+        Returns:
+            Dict[str, Any]: 'ids', 'documents', 'metadatas' and 'distances', one list per query, closest first. The
+                            distances are the squared L2 distances of the normalized vectors (2 - 2 x cosine), the
+                            default distance of a chroma collection.
+        """
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        queries = queries.reshape(1, -1) if queries.ndim == 1 else queries
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        queries = queries / np.where(norms == 0, 1, norms)
+
+        mask = None
+        if doc_hashes:
+            mask = np.isin(self._doc_hash_codes[:self._size], self._doc_hashes.lookup(doc_hashes))
+        if titles:
+            title_mask = np.isin(self._title_codes[:self._size], self._titles.lookup(titles))
+            mask = title_mask if mask is None else mask & title_mask
+        rows = np.arange(self._size) if mask is None else np.flatnonzero(mask)
+
+        results: Dict[str, Any] = {"ids": [], "documents": [], "metadatas": [], "distances": [], "embeddings": None}
+        k = min(n_results, len(rows))
+        if k == 0:
+            for name in ("ids", "documents", "metadatas", "distances"):
+                results[name] = [[] for _ in queries]
+            return results
+        ## one product for all the queries: (queries x dimension) . (dimension x candidates)
+        similarities = queries @ (self._matrix[:self._size] if mask is None else self._matrix[rows]).T
+        for query_similarities in similarities:
+            top = np.argpartition(-query_similarities, k - 1)[:k] if k < len(rows) else np.arange(k)
+            top = top[np.argsort(-query_similarities[top], kind="stable")]
+            results["ids"].append([self._ids[rows[index]] for index in top])
+            results["documents"].append([self._documents[rows[index]] for index in top])
+            results["metadatas"].append([self._metadatas[rows[index]] for index in top])
+            results["distances"].append((2 - 2 * query_similarities[top]).clip(min=0).tolist())
+        return results
+
+
+_collections: "OrderedDict[str, VectorCollection]" = OrderedDict() ## least recently used first
+_collections_lock = threading.Lock()
+
+
+def get_collection(name: str) -> VectorCollection:
+    """
+    Returns the process wide collection of this name, created on first use.
+
+    At most settings.VECTOR_STORE_MAX_RESIDENT_USERS collections are kept: above, the least recently used one is
+    dropped (its user's files are embedded again at their next job, mostly from the embedding cache). A job still
+    holding a dropped collection keeps using it until its end.
+    """
+    with _collections_lock:
+        if name not in _collections:
+            _collections[name] = VectorCollection(name)
+            while len(_collections) > settings.VECTOR_STORE_MAX_RESIDENT_USERS:
+                evicted_name, _ = _collections.popitem(last=False)
+                logger.info(f"Dropped the vector store {evicted_name} from memory (least recently used)")
+        _collections.move_to_end(name)
+        return _collections[name]
+
+
+class NumpyVectorIndex:
+    """
+    The in-process vector store of the retrieval tasks, with the interface of ChromaDBHandler
+    (utilities/chromadb.py): selected with settings.VECTOR_STORE_BACKEND = "numpy".
+
+    It needs neither chromadb nor hnswlib, and the search is exact. With settings.VECTOR_STORE_PERSISTENT, the
+    chunks are kept in one collection per user for the lifetime of the process (in memory, not on disk), identified
+    by the hash of their document (`document_hash`) as in the chroma store: a file the user already uploaded is not
+    embedded again, each job only searches its own documents, and the least recently stored documents are evicted
+    above settings.VECTOR_STORE_MAX_DOCUMENTS_PER_USER. Only the collections of the
+    settings.VECTOR_STORE_MAX_RESIDENT_USERS most recent users stay in memory (see `get_collection`). Otherwise the collection belongs to the handler and is
+    deleted at the end of the job.
+    """
+
+    def __init__(self, user_id: Optional[str] = None):
+        """
+        Args:
+            user_id (Optional[str]): The user whose collection is used when the store is persistent. Defaults to
+                                     None: a collection of this handler only.
+        """
+        self.persistent = bool(settings.VECTOR_STORE_PERSISTENT and user_id)
+        if self.persistent:
+            self.collection_name = f"{settings.COLLECTION_NAME}-{hashlib.sha256(user_id.lower().encode('utf-8')).hexdigest()[:32]}"
+            self.collection = get_collection(self.collection_name)
+        else:
+            self.collection_name = f"{settings.COLLECTION_NAME}-{uuid.uuid4().hex}"
+            self.collection = VectorCollection(self.collection_name)
+
+    @property
+    def lock(self) -> threading.RLock:
+        """
+        The reentrant lock of the collection: hold it from `stored_documents` to `get_docs` so another job of the
+        user cannot evict a document in between.
+        """
+        return self.collection.lock
+
+    def stored_documents(self, doc_hashes: Iterable[str]) -> Set[str]:
+        """
+        Returns the documents (hashes) among `doc_hashes` whose chunks are already stored, those do not need to be
+        embedded again.
+        """
+        if not self.persistent:
+            return set()
+        with self.collection.lock:
+            return self.collection.stored_documents(doc_hashes)
+
+    def add_chunks(self, columns: Dict[str, Any], keep_documents: Optional[Iterable[str]] = None) -> None:
+        """
+        Adds chunks collected in columns, in batches of settings.VECTOR_STORE_INSERT_BATCH_SIZE.
+
+        Args:
+            columns (Dict[str, Any]): The output of `chunk_columns`: the lists 'title', 'id', 'text', 'n_tokens',
+                                      'doc_hash' (for the persistent store) and the (chunks x dimension) float32 array
+                                      'embedding'.
+            keep_documents (Optional[Iterable[str]]): Documents (hashes) never evicted by this insertion, the
+                                                      stored documents the job reuses. Defaults to None.
+        """
+        index, metadata = chunk_metadata(columns)
+        batch_size = settings.VECTOR_STORE_INSERT_BATCH_SIZE
+        with self.collection.lock:
+            for start in range(0, len(index), batch_size):
+                self.collection.upsert(index[start:start + batch_size], columns["text"][start:start + batch_size],
+                                       metadata[start:start + batch_size], columns["embedding"][start:start + batch_size])
+            if self.persistent:
+                self._evict_old_documents(set(keep_documents or ()))
+
+    def add_document(self, df):
+        """
+        Args:
+            df (pd.DataFrame): Dataframe containing data to be added to the collection.
+                               The dataframe is expected to have columns 'title', 'id', 'text', 'n_tokens' and
+                               'embedding', and 'doc_hash' (see `document_hash`) for the persistent store. The
+                               chunks without an embedding are left out. Prefer `add_chunks` with `chunk_columns`.
+        """
+        self.add_chunks(dataframe_columns(df))
+
+    def _evict_old_documents(self, keep_documents: Set[str]) -> None:
+        """
+        Deletes the least recently stored documents of the collection above settings.VECTOR_STORE_MAX_DOCUMENTS_PER_USER,
+        except `keep_documents`.
+        """
+        stored_at = self.collection.document_stored_at()
+        excess = len(stored_at) - settings.VECTOR_STORE_MAX_DOCUMENTS_PER_USER
+        if excess > 0:
+            evicted = sorted((doc_hash for doc_hash in stored_at if doc_hash not in keep_documents), key=stored_at.get)[:excess]
+            if not evicted:
+                return
+            self.collection.delete(evicted)
+            logger.info(f"Evicted {len(evicted)} document(s) from the vector store {self.collection_name}")
+
+    def delete_collection(self):
+        """
+        Delete the collection.
+        """
+        with _collections_lock:
+            _collections.pop(self.collection_name, None)
+        ## the next jobs of the user share the new, empty collection
+        self.collection = get_collection(self.collection_name) if self.persistent else VectorCollection(self.collection_name)
+
+    def release(self) -> None:
+        """
+        Ends the use of the store by a job: the collection of the handler is deleted, the persistent one is kept for
+        the next jobs of the user.
+        """
+        if not self.persistent:
+            self.delete_collection()
+
+    def get_docs(self, query_embedding, doc_hashes: Optional[List[str]] = None, titles: Optional[List[str]] = None,
+                 n_results: int = 20):
+        """
+        Args:
+            query_embedding: The embedding of the query.
+            doc_hashes (Optional[List[str]]): Restricts the search to these documents (the ones of the job).
+                                              Defaults to None: the whole collection.
+            titles (Optional[List[str]]): Restricts the search to the chunks of these files. Defaults to None.
+            n_results (int): The number of closest chunks returned. Defaults to 20.
+        """
+        with self.collection.lock:
+            return self.collection.query(query_embedding, n_results=n_results, doc_hashes=doc_hashes, titles=titles)